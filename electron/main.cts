@@ -9,6 +9,7 @@ import { getJsonFilePath } from './services/FileService.cjs';
 import { getImageSize } from './services/mediaService.cjs';
 import { logger } from './services/logService.cjs';
 import watchService from './services/watchService.cjs';
+import { stopTaggerWorker } from '../script/script.cjs';
 import http from 'http';
 
 // 获取设置文件路径
@@ -428,6 +429,8 @@ app.on('before-quit', () => {
   }
   // 关闭图片服务器
   stopImageServerByRequest();
+  // 关闭常驻的 AI 标注进程
+  stopTaggerWorker();
 });
 
 export async function noticeDataChanged() {
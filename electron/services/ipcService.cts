@@ -18,7 +18,7 @@ import {
   generateVideoThumbnail,
   processDirectoryFiles 
 } from './mediaService.cjs';
-import { tagImage, getMainColor, checkEnvironment, installEnvironment, readImageMetadata } from '../../script/script.cjs';
+import { tagImage, getMainColor, checkEnvironment, installEnvironment, readImageMetadata, analyzeImage } from '../../script/script.cjs';
 import { tagQueue, colorQueue } from './queueService.cjs';
 import { logger } from './logService.cjs';
 import { MAX_IMAGE_COUNT } from '../services/checkImageCount.cjs';
@@ -205,6 +205,21 @@ const init = (): void => {
     }
   });
 
+  // 一次解码同时得到标签、主色和生成参数
+  ipcMain.handle('analyze-image', async (event, imagePath: string, modelName: string) => {
+    const taskId = `analyze-${Date.now()}`;
+    try {
+      return await tagQueue.addTask(async () => {
+        imagePath = decodeURIComponent(imagePath);
+        imagePath = imagePath.replace('local-image://', '');
+        return await analyzeImage(imagePath, modelName);
+      }, taskId);
+    } catch (error) {
+      logger.error('图片分析失败:', { error } as LogMeta);
+      throw error;
+    }
+  });
+
   ipcMain.handle("read-image-metadata", async (event, imagePath: string) => {
     try {
       imagePath = decodeURIComponent(imagePath);
@@ -3,35 +3,344 @@ import csv
 import numpy as np
 import sys
 import io
+import json
+import argparse
+import threading
+import contextlib
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from PIL import Image
-from typing import List, Tuple
+from collections import OrderedDict
+from typing import List, Tuple, NamedTuple, Optional, Iterable, Iterator
+from tag_cache import TagResultCache, DEFAULT_MAX_BYTES
+from batch_common import chunks, error_payload, iter_image_files, process_chunks
+import stage_timing
 
-# Safe import for onnxruntime with actionable error message
-try:
-    import onnxruntime as ort
-except Exception as import_error:  # noqa: F401
-    ort = None
+def _onnxruntime():
+    """
+    首次创建推理会话时才导入 onnxruntime (约 200 ms), 导入本模块、--help 和参数错误时不加载
+
+    导入失败时抛出带安装提示的 RuntimeError。
+    """
+    try:
+        import onnxruntime
+    except Exception as e:
+        raise RuntimeError(
+            "Failed to import onnxruntime. Ensure your Python (64-bit) matches the installed onnxruntime, "
+            "and that the Microsoft Visual C++ Redistributable is installed. On Windows, prefer 'onnxruntime' "
+            f"for CPU or 'onnxruntime-gpu' for CUDA builds. ({e})"
+        ) from e
+    return onnxruntime
+
+
+class LabelTable(NamedTuple):
+    """
+    模型标签表: 标签名 (原始/下划线替换为空格) 及普通、角色标签的起始下标
+
+    general_ids / character_ids 为普通、角色标签在概率向量中的下标,
+    exclude_masks 缓存每组 exclude_tags 对应的排除掩码。
+    """
+    names: List[str]
+    names_spaced: List[str]
+    general_index: int
+    character_index: int
+    general_ids: np.ndarray
+    character_ids: np.ndarray
+    exclude_masks: dict
+
+    @classmethod
+    def create(cls, names: List[str], general_index: int, character_index: int) -> "LabelTable":
+        ids = np.arange(len(names))
+        return cls(
+            names=names,
+            names_spaced=[name.replace("_", " ") for name in names],
+            general_index=general_index,
+            character_index=character_index,
+            general_ids=ids[general_index:character_index],
+            character_ids=ids[character_index:],
+            exclude_masks={},
+        )
+
+    def get_names(self, replace_underscore: bool) -> List[str]:
+        return self.names_spaced if replace_underscore else self.names
+
+    def exclude_mask(self, exclude_tags: str, replace_underscore: bool) -> np.ndarray:
+        """返回 exclude_tags 对应的布尔掩码, True 表示该标签需要排除"""
+        key = (exclude_tags, replace_underscore)
+        mask = self.exclude_masks.get(key)
+        if mask is None:
+            remove = {s.strip() for s in exclude_tags.lower().split(",")}
+            names = self.get_names(replace_underscore)
+            mask = np.fromiter((name in remove for name in names), dtype=bool, count=len(names))
+            if len(self.exclude_masks) >= 64:
+                self.exclude_masks.clear()
+            self.exclude_masks[key] = mask
+        return mask
+
+
+class LoadedModel(NamedTuple):
+    session: object
+    labels: LabelTable
+    onnx_mtime: int
+    csv_mtime: int
+    size_bytes: int
+
+
+class ModelCache:
+    """
+    按模型名称缓存推理会话和标签表 (LRU)
+
+    超过 max_models 个模型或模型文件总大小超过 max_bytes 时淘汰最久未使用的模型;
+    .onnx 或 .csv 文件的修改时间变化时缓存失效并重新加载。
+    """
+
+    def __init__(self, max_models: int = 2, max_bytes: Optional[int] = None):
+        self.max_models = max(1, max_models)
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        # 正在加载的模型: (名称, onnx 修改时间, csv 修改时间) -> Future
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, model_name: str, onnx_mtime: int, csv_mtime: int, loader) -> LoadedModel:
+        """
+        返回缓存的模型, 未命中时调用 loader() 加载
+
+        加载在锁外进行, 其他模型的请求不必等待; 同一模型同时被请求时只加载一次,
+        其余请求等待同一个结果 (加载失败时抛出同样的异常)。
+        """
+        key = (model_name, onnx_mtime, csv_mtime)
+        with self._lock:
+            entry = self._entries.get(model_name)
+            if entry is not None:
+                if entry.onnx_mtime == onnx_mtime and entry.csv_mtime == csv_mtime:
+                    self._entries.move_to_end(model_name)
+                    self.hits += 1
+                    return entry
+                del self._entries[model_name]
+                self.invalidations += 1
+
+            future = self._loading.get(key)
+            loading = future is None
+            if loading:
+                future = self._loading[key] = Future()
+                self.misses += 1
+            else:
+                self.hits += 1
+        if not loading:
+            return future.result()
+
+        try:
+            entry = loader()
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[key]
+            self._entries[model_name] = entry
+            self._entries.move_to_end(model_name)
+            self._evict()
+        future.set_result(entry)
+        return entry
+
+    def _evict(self):
+        # 至少保留刚加载的模型
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_models
+            or (self.max_bytes is not None and self.total_bytes() > self.max_bytes)
+        ):
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def total_bytes(self) -> int:
+        return sum(entry.size_bytes for entry in self._entries.values())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "models": list(self._entries.keys()),
+                "bytes": self.total_bytes(),
+            }
+
+
+class TagResult(NamedTuple):
+    """
+    批量打标签时单张图片的结果, 失败时 error 为对应的异常; 指定 return_probs 时 probs 为完整概率向量
+
+    级联模式下 model 为最终采用的模型名称。
+    """
+    image_path: str
+    tags: List[Tuple[str, float]]
+    tags_text: str
+    error: Optional[Exception] = None
+    probs: Optional[np.ndarray] = None
+    model: Optional[str] = None
+
+
+class CascadeStats:
+    """级联打标签的累计统计: 升级到大模型的比例, 两个模型各自的推理耗时"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.escalated = 0
+        self.uncertain = 0
+        self.character_candidates = 0
+        self.fast_seconds = 0.0
+        self.heavy_seconds = 0.0
+
+    def record(self, images: int, escalated: int, uncertain: int, character_candidates: int,
+               fast_seconds: float, heavy_seconds: float):
+        with self._lock:
+            self.images += images
+            self.escalated += escalated
+            self.uncertain += uncertain
+            self.character_candidates += character_candidates
+            self.fast_seconds += fast_seconds
+            self.heavy_seconds += heavy_seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "images": self.images,
+                "escalated": self.escalated,
+                "escalation_rate": round(self.escalated / self.images, 4) if self.images else 0.0,
+                "uncertain": self.uncertain,
+                "character_candidates": self.character_candidates,
+                "fast_seconds": round(self.fast_seconds, 3),
+                "heavy_seconds": round(self.heavy_seconds, 3),
+            }
+
+
+PRECISIONS = ("fp32", "int8", "fp16")
+
+
+def split_precision(model_name: str) -> Tuple[str, Optional[str]]:
+    """拆分模型名称中的精度后缀: "xxx.int8" -> ("xxx", "int8"), 没有后缀时精度为 None"""
+    base_name, _, suffix = model_name.rpartition(".")
+    if base_name and suffix in PRECISIONS[1:]:
+        return base_name, suffix
+    return model_name, None
+
+
+def variant_name(base_name: str, precision: str) -> str:
+    """对应精度的模型名称, fp32 即原模型"""
+    return base_name if precision == "fp32" else f"{base_name}.{precision}"
+
+
+class SessionProfile(NamedTuple):
+    """
+    ONNX Runtime 会话参数
+
+    - intra_op_threads / inter_op_threads: 线程数, 0 表示由 onnxruntime 决定 (占满所有核心)。
+      同时运行多个打标签进程时应按核心数分配, 避免互相争抢
+    - execution_mode: "sequential" 或 "parallel"
+    - graph_optimization: "disable" / "basic" / "extended" / "all"
+    - enable_cpu_mem_arena / enable_mem_pattern: 内存池与内存复用, 关闭可降低常驻内存
+    - cache_optimized_model: 首次加载时把优化后的图保存到模型旁边, 之后直接加载, 跳过图优化
+    - shared_weights: 权重以只读内存映射加载, 同时运行的多个进程共用一份 (见 shared_weights.py, 仅 CPU)
+    """
+    intra_op_threads: int = 0
+    inter_op_threads: int = 0
+    execution_mode: str = "sequential"
+    graph_optimization: str = "all"
+    enable_cpu_mem_arena: bool = True
+    enable_mem_pattern: bool = True
+    cache_optimized_model: bool = True
+    shared_weights: bool = False
+
+    EXECUTION_MODES = ("sequential", "parallel")
+    OPTIMIZATION_LEVELS = ("disable", "basic", "extended", "all")
+
+    def session_options(self, optimized: bool = False, level: str = None):
+        """
+        生成 SessionOptions
+
+        optimized 为 True 表示加载的是已保存的优化图: 只再执行 "all" 级别中与硬件相关的布局优化。
+        level 可覆盖 graph_optimization。
+        """
+        if self.execution_mode not in self.EXECUTION_MODES:
+            raise ValueError(f"未知的 execution_mode: {self.execution_mode}")
+        if self.graph_optimization not in self.OPTIMIZATION_LEVELS:
+            raise ValueError(f"未知的 graph_optimization: {self.graph_optimization}")
+
+        ort = _onnxruntime()
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.intra_op_threads
+        options.inter_op_num_threads = self.inter_op_threads
+        options.execution_mode = {
+            "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+            "parallel": ort.ExecutionMode.ORT_PARALLEL,
+        }[self.execution_mode]
+        level = level or self.graph_optimization
+        if optimized:
+            level = "all" if level == "all" else "disable"
+        options.graph_optimization_level = {
+            "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+            "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+            "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+            "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+        }[level]
+        options.enable_cpu_mem_arena = self.enable_cpu_mem_arena
+        options.enable_mem_pattern = self.enable_mem_pattern
+        return options
+
+    @property
+    def saved_optimization(self) -> str:
+        """
+        保存到磁盘的优化级别
+
+        "all" 级别包含与 CPU 指令集相关的布局优化, 保存的图换一台机器可能无法使用,
+        因此最多保存 "extended" 级别, 加载时再执行剩余的优化。
+        """
+        return "extended" if self.graph_optimization == "all" else self.graph_optimization
+
+    def optimized_model_path(self, model_path: str, provider: str) -> Optional[str]:
+        """
+        优化后模型的保存路径: <模型名>.<后端>.<优化级别>.optimized.onnx
+
+        优化结果与执行后端相关, 因此按后端区分; 没有对应 .csv, 不会出现在模型列表中。
+        """
+        if not self.cache_optimized_model or self.graph_optimization == "disable":
+            return None
+        backend = provider.replace("ExecutionProvider", "").lower()
+        return f"{os.path.splitext(model_path)[0]}.{backend}.{self.saved_optimization}.optimized.onnx"
 
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
 
 class AITagger:
-    def __init__(self, models_dir: str = "models"):
+    def __init__(self, models_dir: str = "models", max_cached_models: int = 2, max_cache_bytes: int = None,
+                 result_cache_path: str = None, result_cache_max_bytes: int = DEFAULT_MAX_BYTES,
+                 session_profile: SessionProfile = None):
         """
         Initialize AI image tagger
         
         Args:
             models_dir: Directory to store model files
+            max_cached_models: Maximum number of models kept loaded at once
+            max_cache_bytes: Optional limit on the total .onnx size of loaded models
+            result_cache_path: Optional SQLite file caching probabilities by image content
+            result_cache_max_bytes: Size limit of the result cache
+            session_profile: ONNX Runtime session options (threads, optimization level, arena)
         """
         # Use absolute path for model directory
         self.models_dir = os.path.abspath(models_dir)
         
         # Validate onnxruntime availability early with helpful guidance
-        if ort is None:
-            raise RuntimeError(
-                "Failed to import onnxruntime. Ensure your Python (64-bit) matches the installed onnxruntime, "
-                "and that the Microsoft Visual C++ Redistributable is installed. On Windows, prefer 'onnxruntime' "
-                "for CPU or 'onnxruntime-gpu' for CUDA builds."
-            )
+        ort = _onnxruntime()
         
         # Dynamically detect available providers and prefer GPU/accelerated backends when present
         available = set(ort.get_available_providers())
@@ -42,6 +351,8 @@ class AITagger:
                 f"No ONNX Runtime execution providers are available. Detected: {list(available)}"
             )
         
+        self.session_profile = session_profile or SessionProfile()
+
         # Ensure model directory exists
         if not os.path.exists(self.models_dir):
             os.makedirs(self.models_dir)
@@ -56,62 +367,56 @@ class AITagger:
             "character_threshold": 0.85,
             "replace_underscore": False,
             "trailing_comma": False,
-            "exclude_tags": ""
+            "exclude_tags": "",
+            "precision": "fp32"
         }
 
+        # 已加载的推理会话和标签表, 跨调用复用
+        self.model_cache = ModelCache(max_cached_models, max_cache_bytes)
+        # 级联模式的累计统计
+        self.cascade_stats = CascadeStats()
+        # 按图片内容缓存推理结果, 修改阈值等参数后重新打标签不需要再次推理
+        self.result_cache = TagResultCache(result_cache_path, result_cache_max_bytes) if result_cache_path else None
+
     def get_available_models(self) -> List[str]:
-        """获取可用的模型列表"""
+        """获取可用的模型列表, 量化后的模型以 <模型名称>.int8 / <模型名称>.fp16 列出"""
         models = []
         for f in os.listdir(self.models_dir):
             if f.endswith(".onnx"):
                 model_name = os.path.splitext(f)[0]
-                if os.path.exists(os.path.join(self.models_dir, f"{model_name}.csv")):
+                if os.path.exists(self._labels_path(model_name)):
                     models.append(model_name)
         return models
 
-    def resize_image_if_needed(self, image, max_size=2048):
-        """
-        如果图片太大，将其缩放到合适大小
-        """
-        if max(image.size) > max_size:
-            ratio = max_size / max(image.size)
-            new_size = tuple(int(x * ratio) for x in image.size)
-            return image.resize(new_size, Image.LANCZOS)
-        return image
+    def _labels_path(self, model_name: str) -> str:
+        """量化模型与原模型共用标签表"""
+        return os.path.join(self.models_dir, f"{split_precision(model_name)[0]}.csv")
 
-    def tag_image(self, 
-                 image_path: str,
-                 model_name: str = None,
-                 threshold: float = None,
-                 character_threshold: float = None,
-                 exclude_tags: str = None,
-                 replace_underscore: bool = None,
-                 trailing_comma: bool = None
-                 ) -> Tuple[List[Tuple[str, float]], str]:
-        """
-        为图片打标签
-        
-        Args:
-            image_path: 图片路径
-            model_name: 模型名称,默认使用self.defaults["model"]
-            threshold: 普通标签阈值,默认使用self.defaults["threshold"] 
-            character_threshold: 角色标签阈值,默认使用self.defaults["character_threshold"]
-            exclude_tags: 排除的标签,默认使用self.defaults["exclude_tags"]
-            replace_underscore: 是否替换下划线,默认使用self.defaults["replace_underscore"]
-            trailing_comma: 是否添加尾随逗号,默认使用self.defaults["trailing_comma"]
-            
-        Returns:
-            (tags_with_scores, tags_text): 包含(标签,置信度)的列表和格式化后的标签文本
-        """
-        # 使用默认值
-        model_name = model_name or self.defaults["model"]
-        threshold = threshold or self.defaults["threshold"]
-        character_threshold = character_threshold or self.defaults["character_threshold"]
-        exclude_tags = exclude_tags or self.defaults["exclude_tags"]
-        replace_underscore = replace_underscore if replace_underscore is not None else self.defaults["replace_underscore"]
-        trailing_comma = trailing_comma if trailing_comma is not None else self.defaults["trailing_comma"]
+    def _load_model(self, model_name: str) -> LoadedModel:
+        """加载模型推理会话和标签表, 命中缓存时直接复用"""
+        model_path = os.path.join(self.models_dir, f"{model_name}.onnx")
+        csv_path = self._labels_path(model_name)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"模型文件不存在: {model_path}")
+        onnx_stat = os.stat(model_path)
+        csv_mtime = os.stat(csv_path).st_mtime_ns if os.path.exists(csv_path) else 0
 
-        # Load model
+        def loader():
+            with stage_timing.stage("session"):
+                session = self._create_session(model_name)
+            with stage_timing.stage("labels"):
+                labels = self._load_labels(model_name)
+            return LoadedModel(
+                session=session,
+                labels=labels,
+                onnx_mtime=onnx_stat.st_mtime_ns,
+                csv_mtime=csv_mtime,
+                size_bytes=onnx_stat.st_size,
+            )
+
+        return self.model_cache.get(model_name, onnx_stat.st_mtime_ns, csv_mtime, loader)
+
+    def _create_session(self, model_name: str):
         model_path = os.path.join(self.models_dir, f"{model_name}.onnx")
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"模型文件不存在: {model_path}")
@@ -121,12 +426,15 @@ class AITagger:
             raise ValueError(f"模型文件损坏或为空: {model_path}")
             
         try:
-            model = ort.InferenceSession(model_path, providers=self.providers)
+            return self._build_session(model_path, self.providers)
         except Exception as e:
             # Retry with CPU as a fallback if available and not already used
             try:
-                if "CPUExecutionProvider" in ort.get_available_providers() and self.providers != ["CPUExecutionProvider"]:
-                    model = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+                if "CPUExecutionProvider" in _onnxruntime().get_available_providers() and self.providers != ["CPUExecutionProvider"]:
+                    session = self._build_session(model_path, ["CPUExecutionProvider"])
+                    # 加速后端不可用, 之后加载的模型直接使用 CPU
+                    self.providers = ["CPUExecutionProvider"]
+                    return session
                 else:
                     raise
             except Exception:
@@ -135,31 +443,96 @@ class AITagger:
                     + str(e)
                     + " | 提示: 检查 onnxruntime 安装是否匹配当前环境 (Python 位数/版本), 并确认 GPU 依赖 (如 CUDA/cuDNN 或 DML) 已正确安装。"
                 )
-        
-        # 加载和预处理图片
-        image = Image.open(image_path)
-        image = self.resize_image_if_needed(image)
-        input_name = model.get_inputs()[0].name
-        height = model.get_inputs()[0].shape[1]
-        
-        # 调整图片大小并填充
-        ratio = float(height)/max(image.size)
-        new_size = tuple([int(x*ratio) for x in image.size])
-        image = image.resize(new_size, Image.LANCZOS)
-        square = Image.new("RGB", (height, height), (255, 255, 255))
-        square.paste(image, ((height-new_size[0])//2, (height-new_size[1])//2))
-        
-        # 转换为模型输入格式
-        image = np.array(square).astype(np.float32)
-        image = image[:, :, ::-1]  # RGB -> BGR
-        image = np.expand_dims(image, 0)
 
-        # 读取标签
+    def _build_session(self, model_path: str, providers: List[str]):
+        """
+        按 session_profile 创建推理会话
+
+        优化后的图比原模型新时直接加载, 跳过图优化; 否则优化原模型并把结果写到临时文件,
+        完成后再替换, 避免其它进程读到写了一半的文件。保存失败 (如目录只读) 不影响推理。
+        """
+        ort = _onnxruntime()
+        profile = self.session_profile
+        if profile.shared_weights and providers[0] == "CPUExecutionProvider":
+            session = self._build_shared_session(model_path, providers)
+            if session is not None:
+                return session
+        optimized_path = profile.optimized_model_path(model_path, providers[0])
+        if optimized_path is None:
+            return ort.InferenceSession(model_path, sess_options=profile.session_options(), providers=providers)
+
+        def load_optimized():
+            return ort.InferenceSession(
+                optimized_path, sess_options=profile.session_options(optimized=True), providers=providers
+            )
+
+        if os.path.exists(optimized_path) and os.path.getmtime(optimized_path) >= os.path.getmtime(model_path):
+            try:
+                return load_optimized()
+            except Exception:
+                # 优化结果损坏或与当前 onnxruntime 版本不兼容, 重新生成
+                pass
+
+        options = profile.session_options(level=profile.saved_optimization)
+        temp_path = f"{optimized_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        options.optimized_model_filepath = temp_path
+        try:
+            session = ort.InferenceSession(model_path, sess_options=options, providers=providers)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        try:
+            os.replace(temp_path, optimized_path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return session
+        # 保存的图未包含 "all" 级别的优化, 从保存的图重新创建会话以补上
+        return load_optimized() if profile.graph_optimization == "all" else session
+
+    def _build_shared_session(self, model_path: str, providers: List[str]):
+        """
+        共享权重模式: 首次加载时把优化到 saved_optimization 级别的模型拆成计算图和权重文件, 之后加载计算图,
+        权重从内存映射中取得
+
+        加载时不再做图优化: "all" 级别的布局优化会生成重排后的权重副本, 每个进程各存一份。
+        没有安装 onnx 时返回 None, 按普通方式加载。
+        """
+        import shared_weights
+
+        ort = _onnxruntime()
+        profile = self.session_profile
+        if not shared_weights.is_prepared(model_path):
+            try:
+                import onnx  # noqa: F401
+            except ImportError:
+                print("共享权重需要 onnx 包 (pip install onnx), 按普通方式加载模型", file=sys.stderr)
+                return None
+            level = profile.saved_optimization
+            source_path = model_path
+            if level != "disable":
+                options = profile.session_options(level=level)
+                source_path = f"{model_path}.{os.getpid()}.{threading.get_ident()}.shared.tmp"
+                options.optimized_model_filepath = source_path
+                ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+            try:
+                shared_weights.prepare(model_path, source_path)
+            finally:
+                if source_path != model_path and os.path.exists(source_path):
+                    os.remove(source_path)
+
+        options = profile.session_options(level="disable")
+        graph_path = shared_weights.attach(options, model_path, share_arena=profile.enable_cpu_mem_arena)
+        return ort.InferenceSession(graph_path, sess_options=options, providers=providers)
+
+    def _load_labels(self, model_name: str) -> LabelTable:
+        """读取标签表"""
         tags = []
         general_index = None
         character_index = None
-        
-        with open(os.path.join(self.models_dir, f"{model_name}.csv")) as f:
+
+        with open(self._labels_path(model_name)) as f:
             reader = csv.reader(f)
             next(reader)
             for row in reader:
@@ -167,73 +540,900 @@ class AITagger:
                     general_index = reader.line_num - 2
                 elif character_index is None and row[2] == "4":
                     character_index = reader.line_num - 2
-                if replace_underscore:
-                    tags.append(row[1].replace("_", " "))
-                else:
-                    tags.append(row[1])
+                tags.append(row[1])
+
+        return LabelTable.create(tags, general_index, character_index)
+
+    def resize_image_if_needed(self, image, max_size=2048):
+        """
+        如果图片太大，将其缩放到合适大小
+        """
+        if max(image.size) > max_size:
+            ratio = max_size / max(image.size)
+            new_size = tuple(int(x * ratio) for x in image.size)
+            return image.resize(new_size, Image.LANCZOS)
+        return image
+
+    def _resolve_options(self, model_name, threshold, character_threshold, exclude_tags,
+                         replace_underscore, trailing_comma, precision=None) -> dict:
+        """未指定的参数使用 self.defaults 中的默认值, model_name 转换为对应精度的模型名称"""
+        base_name, name_precision = split_precision(model_name or self.defaults["model"])
+        precision = precision or name_precision or self.defaults["precision"]
+        if precision not in PRECISIONS:
+            raise ValueError(f"未知的模型精度: {precision}, 可选: {', '.join(PRECISIONS)}")
+        return {
+            "model_name": variant_name(base_name, precision),
+            "threshold": threshold or self.defaults["threshold"],
+            "character_threshold": character_threshold or self.defaults["character_threshold"],
+            "exclude_tags": exclude_tags or self.defaults["exclude_tags"],
+            "replace_underscore": replace_underscore if replace_underscore is not None else self.defaults["replace_underscore"],
+            "trailing_comma": trailing_comma if trailing_comma is not None else self.defaults["trailing_comma"],
+        }
+
+    def load_image(self, image_path: str, size: int) -> Image.Image:
+        """
+        读取图片并统一转换为 RGB
+
+        JPEG 通过 draft 按 DCT 缩放直接解码到不小于 size 的尺寸, 不再解码完整分辨率;
+        带透明通道的图片 (RGBA/LA/PA/带透明色的 P) 以白色为背景合成。
+        image_path 也可以是已打开 (或已解码) 的 PIL 图片, 已解码时不再重复解码。
+        """
+        with stage_timing.stage("open"):
+            image = image_path if isinstance(image_path, Image.Image) else Image.open(image_path)
+        stage_timing.annotate(width=image.width, height=image.height, format=image.format, mode=image.mode)
+
+        with stage_timing.stage("decode"):
+            if image.format == "JPEG":
+                image.draft("RGB", (size, size))
+
+            if image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+                image = image.convert("RGBA")
+                background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+                image = Image.alpha_composite(background, image)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            image.load()
+        return image
+
+    def preprocess_image(self, image_path: str, height: int) -> np.ndarray:
+        """读取图片并转换为 (height, height, 3) 的 BGR float32 模型输入"""
+        image = self.load_image(image_path, height)
+
+        with stage_timing.stage("resize"):
+            # 一次缩放到模型尺寸, 大图先用 reduce 整数倍缩小再 LANCZOS
+            ratio = float(height)/max(image.size)
+            new_size = tuple(max(1, int(x*ratio)) for x in image.size)
+            image = image.resize(new_size, Image.LANCZOS, reducing_gap=3.0)
+
+            # 居中填充到白色正方形, 直接写入模型输入数组
+            tensor = np.full((height, height, 3), 255, dtype=np.float32)
+            left = (height - new_size[0]) // 2
+            top = (height - new_size[1]) // 2
+            tensor[top:top + new_size[1], left:left + new_size[0]] = np.asarray(image, dtype=np.float32)
+        return tensor[:, :, ::-1]  # RGB -> BGR
+
+    def _prepare(self, image_path: str, model_name: str, loaded: LoadedModel, height: int):
+        """
+        读取图片, 返回 (内容哈希, 缓存的概率向量, 预处理后的图片)
+
+        启用结果缓存时先按内容哈希查缓存, 命中则不再解码; 未启用或传入 PIL 图片时内容哈希为 None。
+        """
+        if self.result_cache is None or isinstance(image_path, Image.Image):
+            return None, None, self.preprocess_image(image_path, height)
+
+        with stage_timing.stage("read"):
+            with open(image_path, "rb") as f:
+                data = f.read()
+        with stage_timing.stage("cache_lookup"):
+            content_hash = self.result_cache.content_hash(data)
+            probs = self.result_cache.get(content_hash, model_name, loaded.onnx_mtime)
+        if probs is not None:
+            return content_hash, probs, None
+        try:
+            with stage_timing.stage("open"):
+                image = Image.open(io.BytesIO(data))
+        except Image.UnidentifiedImageError as e:
+            # 与直接按路径打开时的错误信息一致, 不显示 BytesIO 对象
+            raise Image.UnidentifiedImageError(f"cannot identify image file {image_path!r}") from e
+        return content_hash, None, self.preprocess_image(image, height)
+
+    def _store(self, content_hash: Optional[str], model_name: str, loaded: LoadedModel, probs: np.ndarray) -> np.ndarray:
+        """保存推理结果到缓存, 返回与缓存命中时精度一致的概率向量"""
+        if content_hash is None:
+            return probs
+        return self.result_cache.put(content_hash, model_name, loaded.onnx_mtime, probs)
+
+    @staticmethod
+    def _fixed_batch_size(session) -> Optional[int]:
+        """模型输入的 batch 维度为固定值时返回该值, 动态维度返回 None"""
+        batch = session.get_inputs()[0].shape[0]
+        return batch if isinstance(batch, int) and batch > 0 else None
+
+    def _run(self, session, images: List[np.ndarray]) -> np.ndarray:
+        """将预处理后的图片堆叠为 (N, H, H, 3) 并推理, 返回 (N, 标签数) 的概率矩阵"""
+        batch = np.stack(images)
+        # 固定 batch 维度的模型需要补齐, 补齐部分的结果丢弃
+        fixed_batch = self._fixed_batch_size(session)
+        if fixed_batch and len(images) < fixed_batch:
+            padding = np.zeros((fixed_batch - len(images),) + batch.shape[1:], dtype=batch.dtype)
+            batch = np.concatenate([batch, padding])
+
+        input_name = session.get_inputs()[0].name
+        label_name = session.get_outputs()[0].name
+        probs = session.run([label_name], {input_name: batch})[0]
+        return probs[:len(images)]
+
+    def postprocess(self, probs: np.ndarray, labels: LabelTable, threshold: float,
+                    character_threshold: float, exclude_tags: str, replace_underscore: bool,
+                    trailing_comma: bool, top_k: int = None) -> Tuple[List[Tuple[str, float]], str]:
+        """
+        将单张图片的概率向量转换为 (标签,置信度) 列表和标签文本
+
+        默认先角色标签后普通标签, 各自按标签表顺序排列; 指定 top_k 时按置信度从高到低取前 top_k 个。
+        """
+        probs = np.asarray(probs)
+        general_ids = labels.general_ids[probs[labels.general_ids] > threshold]
+        character_ids = labels.character_ids[probs[labels.character_ids] > character_threshold]
+        ids = np.concatenate([character_ids, general_ids])
 
-        # 运行推理
-        label_name = model.get_outputs()[0].name
-        probs = model.run([label_name], {input_name: image})[0]
-        
-        # 处理结果
-        result = list(zip(tags, probs[0]))
-        general = [item for item in result[general_index:character_index] if item[1] > threshold]
-        character = [item for item in result[character_index:] if item[1] > character_threshold]
-        
-        all_tags = character + general
-        
         # 排除指定标签
         if exclude_tags:
-            remove = [s.strip() for s in exclude_tags.lower().split(",")]
-            all_tags = [tag for tag in all_tags if tag[0] not in remove]
-            
+            ids = ids[~labels.exclude_mask(exclude_tags, replace_underscore)[ids]]
+
+        if top_k:
+            ids = ids[np.argsort(-probs[ids], kind="stable")[:top_k]]
+
+        tags = labels.get_names(replace_underscore)
+        all_tags = [(tags[i], probs[i]) for i in ids.tolist()]
+
         # 格式化输出文本
         tags_text = ("" if trailing_comma else ", ").join(
             (item[0].replace("(", "\\(").replace(")", "\\)") + 
              (", " if trailing_comma else "") for item in all_tags)
         )
         
-        return all_tags, tags_text 
+        return all_tags, tags_text
+
+    def tag_image(self, 
+                 image_path: str,
+                 model_name: str = None,
+                 threshold: float = None,
+                 character_threshold: float = None,
+                 exclude_tags: str = None,
+                 replace_underscore: bool = None,
+                 trailing_comma: bool = None,
+                 top_k: int = None,
+                 precision: str = None
+                 ) -> Tuple[List[Tuple[str, float]], str]:
+        """
+        为图片打标签
+        
+        Args:
+            image_path: 图片路径, 也可以是 PIL 图片 (不使用结果缓存)
+            model_name: 模型名称,默认使用self.defaults["model"]
+            threshold: 普通标签阈值,默认使用self.defaults["threshold"] 
+            character_threshold: 角色标签阈值,默认使用self.defaults["character_threshold"]
+            exclude_tags: 排除的标签,默认使用self.defaults["exclude_tags"]
+            replace_underscore: 是否替换下划线,默认使用self.defaults["replace_underscore"]
+            trailing_comma: 是否添加尾随逗号,默认使用self.defaults["trailing_comma"]
+            top_k: 只保留置信度最高的 top_k 个标签并按置信度排序,默认不限制
+            precision: 模型精度 "fp32" / "int8" / "fp16", 需先用 quantize_models.py 生成对应模型,
+                       默认使用模型名称中的精度或self.defaults["precision"]
+            
+        Returns:
+            (tags_with_scores, tags_text): 包含(标签,置信度)的列表和格式化后的标签文本
+        """
+        options = self._resolve_options(model_name, threshold, character_threshold, exclude_tags,
+                                        replace_underscore, trailing_comma, precision)
+        model_name = options.pop("model_name")
+        options["top_k"] = top_k
+
+        # 开启分阶段计时 (stage_timing) 时记录每个阶段的耗时和图片尺寸
+        with stage_timing.track("tag_image", image=str(image_path), model=model_name):
+            with stage_timing.stage("model_load"):
+                loaded = self._load_model(model_name)
+            height = loaded.session.get_inputs()[0].shape[1]
+
+            # 加载和预处理图片
+            content_hash, probs, image = self._prepare(image_path, model_name, loaded, height)
+
+            # 运行推理
+            if probs is None:
+                with stage_timing.stage("inference"):
+                    probs = self._run(loaded.session, [image])[0]
+                probs = self._store(content_hash, model_name, loaded, probs)
+
+            # 处理结果
+            with stage_timing.stage("postprocess"):
+                return self.postprocess(probs, loaded.labels, **options)
+
+    def tag_images(self,
+                   image_paths: List[str],
+                   batch_size: int = 8,
+                   model_name: str = None,
+                   threshold: float = None,
+                   character_threshold: float = None,
+                   exclude_tags: str = None,
+                   replace_underscore: bool = None,
+                   trailing_comma: bool = None,
+                   top_k: int = None,
+                   return_probs: bool = False,
+                   precision: str = None
+                   ) -> List[TagResult]:
+        """
+        批量为图片打标签, 每 batch_size 张图片合并为一次推理
+
+        参数含义同 tag_image。模型的 batch 维度固定时按模型要求的大小分批。
+        读取失败的图片只影响自身, 对应结果的 error 字段为异常对象。
+        return_probs 为 True 时结果中附带完整概率向量 (用于相似图片索引等)。
+
+        Returns:
+            与 image_paths 顺序一致的 TagResult 列表
+        """
+        options = self._resolve_options(model_name, threshold, character_threshold, exclude_tags,
+                                        replace_underscore, trailing_comma, precision)
+        model_name = options.pop("model_name")
+        options["top_k"] = top_k
+
+        loaded = self._load_model(model_name)
+        model_input = loaded.session.get_inputs()[0]
+        height = model_input.shape[1]
+
+        fixed_batch = self._fixed_batch_size(loaded.session)
+        if fixed_batch:
+            batch_size = fixed_batch
+        batch_size = max(1, batch_size)
+
+        def finish(i, probs):
+            tags, tags_text = self.postprocess(probs, loaded.labels, **options)
+            results[i] = TagResult(image_paths[i], tags, tags_text, None, probs if return_probs else None)
+
+        results = [None] * len(image_paths)
+        pending = []
+        for i, path in enumerate(image_paths):
+            try:
+                content_hash, probs, image = self._prepare(path, model_name, loaded, height)
+            except Exception as e:
+                results[i] = TagResult(path, [], "", e)
+                continue
+            if probs is not None:
+                finish(i, probs)
+                continue
+
+            pending.append((i, content_hash, image))
+            if len(pending) == batch_size:
+                probs = self._run(loaded.session, [image for _, _, image in pending])
+                for row, (j, content_hash, _) in enumerate(pending):
+                    finish(j, self._store(content_hash, model_name, loaded, probs[row]))
+                pending = []
+
+        if pending:
+            probs = self._run(loaded.session, [image for _, _, image in pending])
+            for row, (j, content_hash, _) in enumerate(pending):
+                finish(j, self._store(content_hash, model_name, loaded, probs[row]))
+
+        return results
+
+    def tag_images_pipeline(self,
+                            image_paths: Iterable[str],
+                            batch_size: int = 8,
+                            decode_workers: int = None,
+                            prefetch: int = None,
+                            model_name: str = None,
+                            threshold: float = None,
+                            character_threshold: float = None,
+                            exclude_tags: str = None,
+                            replace_underscore: bool = None,
+                            trailing_comma: bool = None,
+                            top_k: int = None,
+                            return_probs: bool = False,
+                            precision: str = None
+                            ) -> Iterator[TagResult]:
+        """
+        流水线方式批量打标签: 线程池提前读取并预处理图片, 推理与读取同时进行
+
+        Args:
+            image_paths: 图片路径, 可以是生成器, 按需读取
+            batch_size: 每次推理的图片数量
+            decode_workers: 读取/预处理线程数, 默认 CPU 核数 - 1
+            prefetch: 最多同时持有的已读取或读取中的图片数量 (不含正在推理的一批), 默认 batch_size * 2,
+                      超过后暂停读取, 保证处理大目录时内存有上限
+            其余参数含义同 tag_image, return_probs 同 tag_images
+
+        Yields:
+            TagResult, 按完成顺序返回, 不保证与输入顺序一致
+        """
+        options = self._resolve_options(model_name, threshold, character_threshold, exclude_tags,
+                                        replace_underscore, trailing_comma, precision)
+        model_name = options.pop("model_name")
+        options["top_k"] = top_k
+
+        loaded = self._load_model(model_name)
+        height = loaded.session.get_inputs()[0].shape[1]
+        batch_size = self._fixed_batch_size(loaded.session) or max(1, batch_size)
+        decode_workers = decode_workers or max(1, (os.cpu_count() or 2) - 1)
+        prefetch = max(prefetch or batch_size * 2, batch_size)
+
+        paths = iter(image_paths)
+        pending = {}
+        ready = []
+        exhausted = False
+        executor = ThreadPoolExecutor(max_workers=decode_workers)
+
+        def fill():
+            nonlocal exhausted
+            while not exhausted and len(pending) + len(ready) < prefetch:
+                try:
+                    path = next(paths)
+                except StopIteration:
+                    exhausted = True
+                    return
+                pending[executor.submit(self._prepare, path, model_name, loaded, height)] = path
+
+        try:
+            fill()
+            while pending or ready:
+                # 凑满一批, 或者没有更多图片时处理剩余部分
+                if pending and len(ready) < batch_size:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        path = pending.pop(future)
+                        error = future.exception()
+                        if error is not None:
+                            yield TagResult(path, [], "", error)
+                            continue
+                        content_hash, probs, image = future.result()
+                        if probs is not None:
+                            # 命中结果缓存, 不需要推理
+                            tags, tags_text = self.postprocess(probs, loaded.labels, **options)
+                            yield TagResult(path, tags, tags_text, None, probs if return_probs else None)
+                        else:
+                            ready.append((path, content_hash, image))
+                    fill()
+                    continue
+
+                batch, ready = ready[:batch_size], ready[batch_size:]
+                fill()
+                probs = self._run(loaded.session, [image for _, _, image in batch])
+                for row, (path, content_hash, _) in enumerate(batch):
+                    row_probs = self._store(content_hash, model_name, loaded, probs[row])
+                    tags, tags_text = self.postprocess(row_probs, loaded.labels, **options)
+                    yield TagResult(path, tags, tags_text, None, row_probs if return_probs else None)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def _escalation(probs: np.ndarray, labels: LabelTable, threshold: float, character_threshold: float,
+                    band: float, character_candidate: Optional[float]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        按小模型的概率判断每张图片是否需要大模型, 返回 (阈值附近有标签, 有角色标签候选) 两个布尔数组
+
+        阈值附近: 普通标签概率在 threshold ± band 内, 或角色标签概率在 character_threshold ± band 内。
+        角色候选: 任一角色标签概率超过 character_candidate (None 表示不检查)。
+        """
+        general = probs[:, labels.general_ids]
+        character = probs[:, labels.character_ids]
+        uncertain = (np.abs(general - threshold) < band).any(axis=1) | \
+            (np.abs(character - character_threshold) < band).any(axis=1)
+        if character_candidate is None:
+            candidates = np.zeros(len(probs), dtype=bool)
+        else:
+            candidates = (character > character_candidate).any(axis=1)
+        return uncertain, candidates
+
+    def tag_images_cascade(self,
+                           image_paths: List[str],
+                           fast_model: str,
+                           model_name: str = None,
+                           band: float = 0.05,
+                           character_candidate: Optional[float] = 0.5,
+                           batch_size: int = 8,
+                           threshold: float = None,
+                           character_threshold: float = None,
+                           exclude_tags: str = None,
+                           replace_underscore: bool = None,
+                           trailing_comma: bool = None,
+                           top_k: int = None,
+                           return_probs: bool = False,
+                           precision: str = None
+                           ) -> List[TagResult]:
+        """
+        级联打标签: 先用小模型 fast_model 推理, 只有结果不确定的图片再用大模型 model_name 推理
+
+        需要大模型的图片 (见 _escalation):
+            - 有标签概率落在阈值 ± band 内, 小模型的判断可能与大模型不同
+            - 有角色标签概率超过 character_candidate, 角色标签由大模型确认
+        合并规则: 升级的图片完全采用大模型的概率和标签表, 其余图片采用小模型的结果,
+        不按标签混合两个模型的概率; TagResult.model 为采用的模型名称。
+        两个模型输入尺寸相同时每张图片只解码一次。启用结果缓存时两个模型的概率分别缓存,
+        命中的图片不再推理。累计统计见 self.cascade_stats。
+
+        其余参数含义同 tag_images, model_name (大模型) 默认使用self.defaults["model"], precision 只作用于大模型。
+        """
+        options = self._resolve_options(model_name, threshold, character_threshold, exclude_tags,
+                                        replace_underscore, trailing_comma, precision)
+        heavy_model = options.pop("model_name")
+        fast_model = self._resolve_options(fast_model, None, None, None, None, None)["model_name"]
+        options["top_k"] = top_k
+
+        fast = self._load_model(fast_model)
+        heavy = self._load_model(heavy_model)
+        fast_height = fast.session.get_inputs()[0].shape[1]
+        heavy_height = heavy.session.get_inputs()[0].shape[1]
+        fixed = [size for size in (self._fixed_batch_size(fast.session), self._fixed_batch_size(heavy.session)) if size]
+        batch_size = min(fixed) if fixed else max(1, batch_size)
+
+        def finish(i, probs, loaded, model):
+            tags, tags_text = self.postprocess(probs, loaded.labels, **options)
+            results[i] = TagResult(image_paths[i], tags, tags_text, None, probs if return_probs else None, model)
+
+        results = [None] * len(image_paths)
+        for start in range(0, len(image_paths), batch_size):
+            indices, hashes, rows_probs, images = [], [], [], []
+            for i in range(start, min(start + batch_size, len(image_paths))):
+                try:
+                    content_hash, probs, image = self._prepare(image_paths[i], fast_model, fast, fast_height)
+                except Exception as e:
+                    results[i] = TagResult(image_paths[i], [], "", e)
+                    continue
+                indices.append(i)
+                hashes.append(content_hash)
+                rows_probs.append(probs)
+                images.append(image)
+            if not indices:
+                continue
+
+            # 小模型结果已缓存的图片不再推理
+            fast_seconds = 0.0
+            misses = [row for row, probs in enumerate(rows_probs) if probs is None]
+            if misses:
+                started = time.perf_counter()
+                probs = self._run(fast.session, [images[row] for row in misses])
+                fast_seconds = time.perf_counter() - started
+                for miss, row in enumerate(misses):
+                    rows_probs[row] = self._store(hashes[row], fast_model, fast, probs[miss])
+            fast_probs = np.stack(rows_probs)
+
+            uncertain, candidates = self._escalation(
+                fast_probs, fast.labels, options["threshold"], options["character_threshold"],
+                band, character_candidate,
+            )
+            escalate = uncertain | candidates
+            for row, i in enumerate(indices):
+                if not escalate[row]:
+                    finish(i, fast_probs[row], fast, fast_model)
+
+            heavy_seconds = 0.0
+            rows = np.flatnonzero(escalate)
+            heavy_rows = []
+            for row in rows:
+                probs = None
+                if hashes[row] is not None:
+                    probs = self.result_cache.get(hashes[row], heavy_model, heavy.onnx_mtime)
+                if probs is not None:
+                    finish(indices[row], probs, heavy, heavy_model)
+                else:
+                    heavy_rows.append(row)
+            if heavy_rows:
+                heavy_images = []
+                for row in heavy_rows:
+                    if heavy_height == fast_height and images[row] is not None:
+                        heavy_images.append(images[row])
+                    else:
+                        heavy_images.append(self.preprocess_image(image_paths[indices[row]], heavy_height))
+                started = time.perf_counter()
+                heavy_probs = self._run(heavy.session, heavy_images)
+                heavy_seconds = time.perf_counter() - started
+                for heavy_row, row in enumerate(heavy_rows):
+                    probs = self._store(hashes[row], heavy_model, heavy, heavy_probs[heavy_row])
+                    finish(indices[row], probs, heavy, heavy_model)
+
+            self.cascade_stats.record(len(indices), len(rows), int(uncertain.sum()), int(candidates.sum()),
+                                      fast_seconds, heavy_seconds)
+
+        return results
     
     
+def serve(tagger: AITagger, stdin=None, stdout=None, workers: int = 1):
+    """
+    常驻服务模式: 每行读入一个 JSON 请求, 每行输出一个 JSON 响应
+
+    请求: {"id": 1, "image": "a.png", "model": "...", "threshold": 0.35, ...}
+          {"id": 2, "op": "tag_batch", "images": ["a.png", "b.png"], "batch_size": 8, ...}
+          {"id": 3, "op": "ping"} / {"id": 4, "op": "stats"} / {"op": "shutdown"}
+    响应: {"id": 1, "tags": [[tag, score], ...], "tags_text": "..."}
+          {"id": 2, "results": [{"image": "a.png", "tags": ..., "tags_text": ...}, {"image": "b.png", "error": ...}]}
+          {"id": 1, "error": {"type": "FileNotFoundError", "message": "..."}}
+
+    请求按 id 对应响应, 多个请求可以同时处理, 响应顺序不保证与请求一致。
+    单个请求出错只返回该请求的 error, 不会退出进程。stdin 关闭时处理完剩余请求后退出。
+    """
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    write_lock = threading.Lock()
+
+    def write(message: dict):
+        line = json.dumps(message, ensure_ascii=False)
+        with write_lock:
+            stdout.write(line + "\n")
+            stdout.flush()
+
+    def tag_options(request: dict) -> dict:
+        return {
+            "model_name": request.get("model"),
+            "threshold": request.get("threshold"),
+            "character_threshold": request.get("character_threshold"),
+            "exclude_tags": request.get("exclude_tags"),
+            "replace_underscore": request.get("replace_underscore"),
+            "trailing_comma": request.get("trailing_comma"),
+            "top_k": request.get("top_k"),
+            "precision": request.get("precision"),
+        }
+
+    def handle_batch(request: dict):
+        request_id = request.get("id")
+        try:
+            results = tagger.tag_images(request["images"], batch_size=request.get("batch_size", 8),
+                                        **tag_options(request))
+            write({
+                "id": request_id,
+                "results": [
+                    {"image": r.image_path, "error": error_payload(r.error)} if r.error else
+                    {"image": r.image_path, "tags": [[tag, float(score)] for tag, score in r.tags],
+                     "tags_text": r.tags_text}
+                    for r in results
+                ],
+            })
+        except Exception as e:
+            write({"id": request_id, "error": error_payload(e)})
+
+    def handle(request: dict):
+        request_id = request.get("id")
+        try:
+            response = {"id": request_id}
+            if request.get("fast_model"):
+                # 级联模式: 先用 fast_model, 不确定时再用 model
+                result = tagger.tag_images_cascade(
+                    [request["image"]], request["fast_model"],
+                    band=request.get("band", 0.05),
+                    character_candidate=request.get("character_candidate", 0.5),
+                    **tag_options(request),
+                )[0]
+                if result.error is not None:
+                    raise result.error
+                tags, tags_text = result.tags, result.tags_text
+                response["model"] = result.model
+            else:
+                tags, tags_text = tagger.tag_image(request["image"], **tag_options(request))
+            response.update({
+                "tags": [[tag, float(score)] for tag, score in tags],
+                "tags_text": tags_text,
+            })
+            if stage_timing.enabled():
+                response["timing"] = stage_timing.last_record()
+            write(response)
+        except Exception as e:
+            write({"id": request_id, "error": error_payload(e)})
+
+    write({"event": "ready", "models_dir": tagger.models_dir, "providers": tagger.providers})
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for line in stdin:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("请求必须是 JSON 对象")
+            except ValueError as e:
+                write({"id": None, "error": error_payload(e)})
+                continue
+
+            op = request.get("op", "tag")
+            if op == "shutdown":
+                break
+            if op == "ping":
+                write({"id": request.get("id"), "ok": True})
+            elif op == "stats":
+                write({
+                    "id": request.get("id"),
+                    "cache": tagger.model_cache.stats(),
+                    "result_cache": tagger.result_cache.stats() if tagger.result_cache else None,
+                    "timing": stage_timing.aggregates() if stage_timing.enabled() else None,
+                    "cascade": tagger.cascade_stats.stats(),
+                })
+            elif op == "tag":
+                if not request.get("image"):
+                    write({"id": request.get("id"), "error": error_payload(ValueError("缺少 image 字段"))})
+                    continue
+                executor.submit(handle, request)
+            elif op == "tag_batch":
+                if not isinstance(request.get("images"), list):
+                    write({"id": request.get("id"), "error": error_payload(ValueError("缺少 images 列表"))})
+                    continue
+                executor.submit(handle_batch, request)
+            else:
+                write({"id": request.get("id"), "error": error_payload(ValueError(f"未知操作: {op}"))})
+
+
+def _result_record(result: TagResult) -> dict:
+    """批量模式下单张图片的输出记录"""
+    if result.error is not None:
+        return {"image": result.image_path, "error": error_payload(result.error)}
+    record = {
+        "image": result.image_path,
+        "tags": [[tag, float(score)] for tag, score in result.tags],
+        "tags_text": result.tags_text,
+    }
+    if result.model is not None:
+        record["model"] = result.model
+    return record
+
+
+def open_output(path: Optional[str]):
+    """
+    打开批量模式的输出文件, 返回 (文件对象, 已完成的图片绝对路径集合)
+
+    文件已存在时从中断处继续: 读取已完成的记录, 截掉崩溃时写了一半的最后一行, 之后追加写入。
+    出错的记录不算已完成, 继续时重新处理。未指定路径时输出到 stdout。
+    """
+    if not path:
+        return sys.stdout, set()
+
+    done = set()
+    valid_size = 0
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                    image_path = os.path.abspath(record["image"])
+                except (ValueError, KeyError, TypeError):
+                    break
+                if "error" not in record:
+                    done.add(image_path)
+                valid_size += len(line)
+    output = open(path, "a+b")
+    output.truncate(valid_size)
+    return io.TextIOWrapper(output, encoding="utf-8", write_through=True), done
+
+
+# 多进程批量模式: 每个工作进程在初始化时加载一次模型, 之后处理分到的所有图片
+_worker_tagger = None
+_worker_options = None
+
+
+def _init_bulk_worker(model_dir_path: str, profile: SessionProfile, result_cache_path: Optional[str],
+                      options: dict, cores: Optional[List[List[int]]], worker_ids):
+    global _worker_tagger, _worker_options
+    if cores:
+        # 每个进程绑定到各自的核心, 避免进程在核心之间迁移
+        os.sched_setaffinity(0, cores[worker_ids.get() % len(cores)])
+    with contextlib.redirect_stdout(sys.stderr):
+        _worker_tagger = AITagger(model_dir_path, result_cache_path=result_cache_path, session_profile=profile)
+    _worker_options = options
+    _worker_tagger._load_model(_worker_tagger._resolve_options(
+        options["model_name"], None, None, None, None, None, options["precision"])["model_name"])
+    if options.get("fast_model"):
+        _worker_tagger._load_model(_worker_tagger._resolve_options(
+            options["fast_model"], None, None, None, None, None)["model_name"])
+
+
+def _tag_paths(tagger: AITagger, paths: List[str], options: dict) -> List[TagResult]:
+    """按 options 批量打标签, 包含 fast_model 时使用级联模式"""
+    if options.get("fast_model"):
+        return tagger.tag_images_cascade(paths, **options)
+    return tagger.tag_images(paths, **options)
+
+
+def _tag_chunk(paths: List[str]) -> List[dict]:
+    return [_result_record(result) for result in _tag_paths(_worker_tagger, paths, _worker_options)]
+
+
+def _tag_directory_processes(args, model_dir_path: str, paths: Iterable[str]) -> Iterator[dict]:
+    """
+    多进程批量打标签, 按 chunk_size 张图片为单位分配任务, 每完成一块返回其中所有记录
+
+    未指定 --intra-threads 时把 CPU 核数平均分给各进程; 同时提交的块数有上限, 大目录不会一次性排队。
+    """
+    import multiprocessing
+
+    workers = args.workers
+    cpu_count = os.cpu_count() or 1
+    profile = session_profile_from_args(args)
+    if not profile.intra_op_threads:
+        profile = profile._replace(intra_op_threads=max(1, cpu_count // workers))
+
+    cores = None
+    if args.pin_cores and hasattr(os, "sched_setaffinity"):
+        available = sorted(os.sched_getaffinity(0))
+        per_worker = max(1, len(available) // workers)
+        cores = [available[i * per_worker:(i + 1) * per_worker] or available for i in range(workers)]
+
+    options = cascade_options_from_args(args)
+    context = multiprocessing.get_context("spawn")
+    with contextlib.ExitStack() as stack:
+        # 绑定核心时工作进程从队列领取编号; Manager 进程在处理结束 (或中断) 时关闭
+        worker_ids = None
+        if cores:
+            worker_ids = stack.enter_context(context.Manager()).Queue()
+            for i in range(workers):
+                worker_ids.put(i)
+
+        yield from process_chunks(
+            _tag_chunk, chunks(paths, max(1, args.chunk_size)), workers, mp_context=context,
+            initializer=_init_bulk_worker,
+            initargs=(model_dir_path, profile, args.result_cache, options, cores, worker_ids),
+        )
+
+
+def tag_directory(args, model_dir_path: str):
+    """
+    批量模式: 处理目录下的图片, 每完成一张输出一行 JSON
+
+    --workers 为 1 时单进程流水线处理; 大于 1 时多进程处理。指定 --output 时写入文件,
+    文件已存在则跳过其中已完成的图片, 崩溃后重新运行即可继续。
+    """
+    if not os.path.isdir(args.dir):
+        print(json.dumps({"event": "fatal", "error": error_payload(NotADirectoryError(args.dir))}, ensure_ascii=False))
+        sys.exit(1)
+
+    output, done = open_output(args.output)
+    paths = (path for path in iter_image_files(args.dir) if os.path.abspath(path) not in done)
+
+    if args.workers > 1:
+        records = _tag_directory_processes(args, model_dir_path, paths)
+    elif args.cascade_from:
+        with contextlib.redirect_stdout(sys.stderr):
+            tagger = AITagger(model_dir_path, result_cache_path=args.result_cache,
+                              session_profile=session_profile_from_args(args))
+        options = cascade_options_from_args(args)
+        records = (
+            _result_record(result)
+            for chunk in chunks(paths, max(1, args.chunk_size))
+            for result in _tag_paths(tagger, chunk, options)
+        )
+    else:
+        with contextlib.redirect_stdout(sys.stderr):
+            tagger = AITagger(model_dir_path, result_cache_path=args.result_cache,
+                              session_profile=session_profile_from_args(args))
+        results = tagger.tag_images_pipeline(
+            paths,
+            batch_size=args.batch_size,
+            decode_workers=args.decode_workers,
+            prefetch=args.prefetch,
+            model_name=args.model or args.model_name,
+            precision=args.precision,
+        )
+        records = (_result_record(result) for result in results)
+
+    try:
+        for record in records:
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="WD14 图片标签")
+    parser.add_argument("image_path", nargs="?", help="图片路径")
+    parser.add_argument("model_name", nargs="?", default="wd-v1-4-moat-tagger-v2", help="模型名称")
+    parser.add_argument("model_dir_path", nargs="?", default="models", help="模型目录")
+    parser.add_argument("--serve", action="store_true", help="常驻服务模式, 通过 stdin/stdout 按行收发 JSON")
+    parser.add_argument("--model", help="模型名称 (同第二个位置参数)")
+    parser.add_argument("--models-dir", help="模型目录 (同第三个位置参数)")
+    parser.add_argument("--precision", choices=PRECISIONS, help="模型精度, int8/fp16 需先运行 quantize_models.py")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="服务模式下同时处理的请求数; 批量模式下的进程数")
+    parser.add_argument("--max-cached-models", type=int, default=2, help="同时保留在内存中的模型数量")
+    parser.add_argument("--result-cache", help="推理结果缓存 (SQLite) 文件路径, 按图片内容复用推理结果")
+    parser.add_argument("--dir", help="批量模式: 为目录下所有图片打标签, 每张图片输出一行 JSON")
+    parser.add_argument("--batch-size", type=int, default=8, help="批量模式下每次推理的图片数量")
+    parser.add_argument("--decode-workers", type=int, help="批量模式下读取/预处理图片的线程数")
+    parser.add_argument("--prefetch", type=int, help="批量模式下最多提前读取的图片数量")
+    parser.add_argument("--chunk-size", type=int, default=32, help="多进程批量模式下每次分配给进程的图片数量")
+    parser.add_argument("--pin-cores", action="store_true", help="多进程批量模式下把每个进程绑定到各自的 CPU 核心 (仅 Linux)")
+    parser.add_argument("--output", help="批量模式的输出文件 (NDJSON), 已存在时跳过已完成的图片继续处理")
+    parser.add_argument("--intra-threads", type=int, default=0, help="单个算子使用的线程数, 0 表示使用所有核心")
+    parser.add_argument("--inter-threads", type=int, default=0, help="并行执行模式下算子之间的线程数")
+    parser.add_argument("--execution-mode", choices=SessionProfile.EXECUTION_MODES, default="sequential")
+    parser.add_argument("--graph-opt", choices=SessionProfile.OPTIMIZATION_LEVELS, default="all", help="图优化级别")
+    parser.add_argument("--no-mem-arena", action="store_true", help="关闭 CPU 内存池和内存复用, 降低常驻内存")
+    parser.add_argument("--cascade-from", metavar="FAST_MODEL",
+                        help="级联模式: 先用该小模型推理, 结果不确定的图片再用指定模型")
+    parser.add_argument("--band", type=float, default=0.05, help="级联模式: 标签概率在阈值 ± band 内时使用大模型")
+    parser.add_argument("--character-candidate", type=float, default=0.5,
+                        help="级联模式: 有角色标签概率超过该值时使用大模型")
+    parser.add_argument("--timing", nargs="?", const="stderr",
+                        help="输出分阶段耗时: stderr (默认) 或 JSON Lines 文件路径, 也可用环境变量 IMAGE_MANAGEMENT_TIMING")
+    parser.add_argument("--no-optimized-cache", action="store_true", help="不保存/加载优化后的模型")
+    parser.add_argument("--shared-weights", action="store_true",
+                        help="以内存映射加载模型权重, 同时运行的多个打标签进程共用一份 (需要 onnx 包, 仅 CPU)")
+    return parser.parse_args(argv)
+
+
+def cascade_options_from_args(args) -> dict:
+    """批量模式传给 tag_images / tag_images_cascade 的参数"""
+    options = {
+        "batch_size": args.batch_size,
+        "model_name": args.model or args.model_name,
+        "precision": args.precision,
+    }
+    if args.cascade_from:
+        options.update(fast_model=args.cascade_from, band=args.band, character_candidate=args.character_candidate)
+    return options
+
+
+def session_profile_from_args(args) -> SessionProfile:
+    return SessionProfile(
+        intra_op_threads=args.intra_threads,
+        inter_op_threads=args.inter_threads,
+        execution_mode=args.execution_mode,
+        graph_optimization=args.graph_opt,
+        enable_cpu_mem_arena=not args.no_mem_arena,
+        enable_mem_pattern=not args.no_mem_arena,
+        cache_optimized_model=not args.no_optimized_cache,
+        shared_weights=args.shared_weights,
+    )
+
+
 def main():
-    if len(sys.argv) < 2:
+    # 只在作为脚本运行时设置 stdout 编码, 导入本模块没有副作用
+    sys.stdout.reconfigure(encoding="utf-8")
+    args = parse_args()
+    model_dir_path = args.models_dir or args.model_dir_path
+    stage_timing.configure(args.timing)
+
+    if args.serve:
+        try:
+            # 服务模式下 stdout 只输出协议消息, 其他提示信息写到 stderr
+            with contextlib.redirect_stdout(sys.stderr):
+                tagger = AITagger(model_dir_path, max_cached_models=args.max_cached_models,
+                                  result_cache_path=args.result_cache,
+                                  session_profile=session_profile_from_args(args))
+        except Exception as e:
+            print(json.dumps({"event": "fatal", "error": error_payload(e)}, ensure_ascii=False))
+            sys.exit(1)
+        serve(tagger, workers=args.workers)
+        return
+
+    if args.dir:
+        tag_directory(args, model_dir_path)
+        return
+
+    if not args.image_path:
         print("error:请提供图片路径")
         sys.exit(1)
         
-    image_path = sys.argv[1]
-    model_name = sys.argv[2] if len(sys.argv) > 2 else "wd-v1-4-moat-tagger-v2"
-    model_dir_path = sys.argv[3] if len(sys.argv) > 3 else "models"
+    image_path = args.image_path
+    model_name = args.model or args.model_name
     
+    # 确保图片路径存在 (在加载 onnxruntime 之前检查)
+    if not os.path.exists(image_path):
+        print(f"error:图片不存在: {image_path}")
+        sys.exit(1)
+
     try:
-        tagger = AITagger(model_dir_path)
-        # 确保图片路径存在
-        if not os.path.exists(image_path):
-            print(f"error:图片不存在: {image_path}")
-            sys.exit(1)
-            
+        tagger = AITagger(model_dir_path, session_profile=session_profile_from_args(args))
         print(f"处理图片: {image_path}")
-        tags, tags_text = tagger.tag_image(image_path, model_name=model_name)
+        if args.cascade_from:
+            result = tagger.tag_images_cascade([image_path], args.cascade_from, model_name=model_name,
+                                               band=args.band, character_candidate=args.character_candidate,
+                                               precision=args.precision)[0]
+            if result.error is not None:
+                raise result.error
+            tags_text = result.tags_text
+        else:
+            tags, tags_text = tagger.tag_image(image_path, model_name=model_name, precision=args.precision)
         print(tags_text)
     except Exception as e:
         print(f"error:{str(e)}")
         sys.exit(1)
 
 
-def test_tag_image(image_path):
-    tagger = AITagger('models')
-    tags, tags_text = tagger.tag_image(image_path, "wd-v1-4-moat-tagger-v2")
-    print(tags_text)
-
-def multi_tag_image():
-    dir_path = r"K:\dataset2\animesfw"
-    files = [os.path.join(dir_path, file) for file in os.listdir(dir_path)[:100] if file.endswith(".jpg") or file.endswith(".png")]
-    
-    from multiprocessing import Pool
-    with Pool(processes=10) as pool:
-        pool.map(test_tag_image, files)
-
 if __name__ == "__main__":
-    # multi_tag_image()
     main()
\ No newline at end of file
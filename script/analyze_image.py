@@ -0,0 +1,176 @@
+"""
+组合分析: 每张图片只读取一次文件、解码一次像素, 同时得到标签、主色和生成参数
+
+原来导入一张图片要分别运行 ai_tagger.py、get_main_color.py、read_image_metadata.py,
+文件被三个进程各读取、解码一次。这里:
+1. 一次读取文件内容到内存 (网络盘上只读一次)
+2. 在解码像素之前从文本块 / EXIF 中解析生成参数 (PNG 的文本块可能在图像数据之后, 此时解析会顺带完成解码)
+3. 解码一次像素 (JPEG 按需要的最大尺寸 DCT 缩放解码), 标签的模型输入和主色分析的缩略图都从这张图片得到
+
+每张图片输出一行 JSON, 某一部分失败时只有该部分为 null, 错误写在 errors 中:
+    {"image": "...", "width": 1024, "height": 768, "format": "PNG",
+     "tags": [["1girl", 0.98], ...], "tags_text": "...", "colors": [{"color": "#rrggbb", "percentage": 18.3}, ...],
+     "metadata": {...} | null, "errors": {"colors": {"type": "...", "message": "..."}}}
+读取或识别图片失败时只输出 {"image": "...", "error": {...}}。
+
+用法:
+    python analyze_image.py <图片路径> [<图片路径> ...] [--model wd-v1-4-moat-tagger-v2] [--models-dir models]
+                            [--parts tags colors metadata] [--colors 10] [--engine histogram]
+"""
+import io
+import sys
+import json
+import argparse
+import contextlib
+from typing import Iterable, Iterator, Optional
+
+from PIL import Image
+
+import stage_timing
+from ai_tagger import AITagger, PRECISIONS
+from batch_common import error_payload
+from get_main_color import get_dominant_colors_kmeans, ENGINES, DEFAULT_ENGINE
+from read_image_metadata import read_metadata, _parser_manager_class
+
+PARTS = ("tags", "colors", "metadata")
+# 主色分析把图片缩小到 COLOR_SIZE (get_main_color.resize_image_if_needed), 模型输入为 TAGGER_SIZE,
+# JPEG 按其中较大者 DCT 缩放解码
+COLOR_SIZE = 1024
+TAGGER_SIZE = 448
+
+
+class ImageAnalyzer:
+    """
+    组合分析, 模型和元数据解析器在第一次需要时创建, 之后多张图片复用
+
+    tag_options 为传给 AITagger.tag_image 的参数 (model_name / precision / threshold 等)。
+    """
+
+    def __init__(self, models_dir: str = "models", parts: Iterable[str] = PARTS, num_colors: int = 10,
+                 engine: str = DEFAULT_ENGINE, tag_options: Optional[dict] = None, tagger: Optional[AITagger] = None):
+        self.parts = tuple(part for part in PARTS if part in set(parts))
+        if not self.parts:
+            raise ValueError(f"至少需要一项分析: {', '.join(PARTS)}")
+        if engine not in ENGINES:
+            raise ValueError(f"未知的聚类方式: {engine}")
+        self.models_dir = models_dir
+        self.num_colors = num_colors
+        self.engine = engine
+        self.tag_options = tag_options or {}
+        self._tagger = tagger
+        self._parser_manager = None
+
+    @property
+    def tagger(self) -> AITagger:
+        if self._tagger is None:
+            # AITagger 初始化时的提示信息写到 stderr, stdout 只输出结果
+            with contextlib.redirect_stdout(sys.stderr):
+                self._tagger = AITagger(self.models_dir)
+        return self._tagger
+
+    @property
+    def parser_manager(self):
+        if self._parser_manager is None:
+            self._parser_manager = _parser_manager_class()()
+        return self._parser_manager
+
+    def decode_size(self) -> int:
+        return COLOR_SIZE if "colors" in self.parts else TAGGER_SIZE
+
+    def analyze(self, image_path: str) -> dict:
+        """分析一张图片, 返回输出记录"""
+        with stage_timing.track("analyze_image", image=str(image_path), parts=list(self.parts)):
+            return self._analyze(image_path)
+
+    def _analyze(self, image_path: str) -> dict:
+        record = {"image": image_path}
+        try:
+            with stage_timing.stage("read"):
+                with open(image_path, "rb") as f:
+                    data = f.read()
+            with stage_timing.stage("open"):
+                image = Image.open(io.BytesIO(data))
+        except Exception as e:
+            record["error"] = error_payload(e)
+            return record
+        record.update(width=image.width, height=image.height, format=image.format)
+        stage_timing.annotate(width=image.width, height=image.height, format=image.format, bytes=len(data))
+
+        # draft 必须在解码之前调用; 只改变解码尺寸, 不影响文本块和 EXIF
+        if image.format == "JPEG":
+            image.draft("RGB", (self.decode_size(), self.decode_size()))
+
+        errors = {}
+        if "metadata" in self.parts:
+            try:
+                with stage_timing.stage("metadata"):
+                    record["metadata"] = read_metadata(image, self.parser_manager)
+            except Exception as e:
+                record["metadata"] = None
+                errors["metadata"] = error_payload(e)
+
+        pixel_parts = [part for part in self.parts if part != "metadata"]
+        if pixel_parts:
+            try:
+                with stage_timing.stage("decode"):
+                    image.load()
+            except Exception as e:
+                for part in pixel_parts:
+                    record[part] = None
+                    errors[part] = error_payload(e)
+                pixel_parts = []
+
+        if "tags" in pixel_parts:
+            try:
+                tags, tags_text = self.tagger.tag_image(image, **self.tag_options)
+                record["tags"] = [[tag, float(score)] for tag, score in tags]
+                record["tags_text"] = tags_text
+            except Exception as e:
+                record["tags"] = None
+                errors["tags"] = error_payload(e)
+
+        if "colors" in pixel_parts:
+            try:
+                record["colors"] = get_dominant_colors_kmeans(image, self.num_colors, engine=self.engine)
+            except Exception as e:
+                record["colors"] = None
+                errors["colors"] = error_payload(e)
+
+        if errors:
+            record["errors"] = errors
+        return record
+
+    def analyze_many(self, image_paths: Iterable[str]) -> Iterator[dict]:
+        for image_path in image_paths:
+            yield self.analyze(image_path)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="一次解码同时提取标签、主色和生成参数")
+    parser.add_argument("images", nargs="+", help="图片路径")
+    parser.add_argument("--model", default="wd-v1-4-moat-tagger-v2", help="标签模型名称")
+    parser.add_argument("--models-dir", default="models", help="模型目录")
+    parser.add_argument("--precision", choices=PRECISIONS, help="模型精度, int8/fp16 需先运行 quantize_models.py")
+    parser.add_argument("--parts", nargs="+", choices=PARTS, default=list(PARTS), help="需要的分析项")
+    parser.add_argument("--colors", type=int, default=10, help="主色数量")
+    parser.add_argument("--engine", choices=ENGINES, default=DEFAULT_ENGINE, help="主色聚类方式")
+    parser.add_argument("--timing", nargs="?", const="stderr",
+                        help="输出分阶段耗时: stderr (默认) 或 JSON Lines 文件路径, 也可用环境变量 IMAGE_MANAGEMENT_TIMING")
+    return parser.parse_args(argv)
+
+
+def main():
+    # 只在作为脚本运行时设置 stdout 编码, 导入本模块没有副作用
+    sys.stdout.reconfigure(encoding="utf-8")
+    args = parse_args()
+    stage_timing.configure(args.timing)
+
+    analyzer = ImageAnalyzer(args.models_dir, parts=args.parts, num_colors=args.colors, engine=args.engine,
+                             tag_options={"model_name": args.model, "precision": args.precision})
+    for record in analyzer.analyze_many(args.images):
+        print(json.dumps(record, ensure_ascii=False, default=str))
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+批量处理脚本 (ai_tagger.py / read_image_metadata.py) 共用的工具: 遍历目录、错误记录、分块和多进程执行
+"""
+import os
+from typing import Callable, Iterable, Iterator, List, Tuple, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def iter_image_files(dir_path: str, extensions: Tuple[str, ...] = IMAGE_EXTENSIONS) -> Iterator[str]:
+    """递归遍历目录下的图片文件, 逐个返回, 不一次性列出整个目录"""
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_image_files(entry.path, extensions)
+            elif entry.name.lower().endswith(extensions):
+                yield entry.path
+
+
+def error_payload(error: Exception) -> dict:
+    return {"type": type(error).__name__, "message": str(error)}
+
+
+def chunks(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def process_chunks(func: Callable[[List[T]], List[R]], items: Iterable[List[T]], workers: int,
+                   mp_context=None, initializer=None, initargs=()) -> Iterator[R]:
+    """
+    多进程处理各块, 按完成顺序逐条返回 func 的结果
+
+    同时提交的块数不超过 workers * 2, 大目录不会一次性排队; mp_context 默认为 spawn。
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=mp_context or multiprocessing.get_context("spawn"),
+        initializer=initializer,
+        initargs=initargs,
+    )
+    try:
+        items = iter(items)
+        pending = set()
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < workers * 2:
+                chunk = next(items, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    pending.add(executor.submit(func, chunk))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,179 @@
+"""
+主色相关的性能测试: 主色提取的聚类方式和按颜色搜索的主色索引
+
+用法:
+    python benchmark.py colors [--images <图片目录>]
+    python benchmark.py palette [--images 100000]
+"""
+import os
+import time
+
+import numpy as np
+
+from bench_fixtures import make_corpus
+from bench_common import list_images, summarize, print_table
+
+
+def bench_colors(args) -> dict:
+    """
+    主色提取各聚类方式的耗时、内存和准确度
+
+    以旧实现 (sklearn 逐像素 KMeans, 未安装 sklearn 时为 kmeans 方式的 CPU 版本) 为基准,
+    用 palette_distance (ΔE) 衡量差异, 基准换一个随机种子再运行一次的差异作为噪声水平。
+    peak_mb 为最大的一张图片在聚类时由 NumPy 分配的峰值内存 (tracemalloc, 不含 GPU 内存)。
+    """
+    import tempfile
+    import tracemalloc
+    import warnings
+    import stage_timing
+    from PIL import Image
+    from get_main_color import get_dominant_colors_kmeans, load_backend, palette_distance
+    import get_main_color
+    from tests.legacy import legacy_kmeans_colors
+
+    if args.images:
+        paths = list_images(args.images, args.limit)
+    else:
+        work_dir = args.work_dir or os.path.join(tempfile.gettempdir(), "image-management-bench")
+        paths = [entry["path"] for entry in make_corpus(os.path.join(work_dir, "corpus"), args.count, args.seed)]
+    largest = max(paths, key=lambda path: np.prod(Image.open(path).size))
+
+    engines = {}
+    try:
+        import sklearn  # noqa: F401
+        engines["sklearn (旧实现)"] = lambda path, seed: legacy_kmeans_colors(path, args.colors, seed)
+    except ImportError:
+        pass
+    engines["kmeans (cpu)"] = lambda path, seed: get_dominant_colors_kmeans(path, args.colors, "kmeans", seed, "cpu")
+    load_backend()
+    if get_main_color.USE_GPU:
+        engines["kmeans (gpu)"] = lambda path, seed: get_dominant_colors_kmeans(
+            path, args.colors, "kmeans", seed, "gpu")
+    engines["histogram"] = lambda path, seed: get_dominant_colors_kmeans(path, args.colors, "histogram", seed)
+    baseline = next(iter(engines))
+
+    def run(function, seed=0):
+        palettes, latencies = [], []
+        for path in paths:
+            start = time.perf_counter()
+            palettes.append(function(path, seed))
+            latencies.append(time.perf_counter() - start)
+        return palettes, latencies
+
+    # stage_timing 开启后才有分阶段记录, 用空回调开启
+    sink = lambda record: None  # noqa: E731
+    stage_timing.add_sink(sink)
+    results = {}
+    with warnings.catch_warnings():
+        # sklearn 在不同颜色数少于聚类数时的警告
+        warnings.simplefilter("ignore")
+        try:
+            for name, function in engines.items():
+                palettes, latencies = run(function)
+                tracemalloc.start()
+                function(largest, 0)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                results[name] = (palettes, latencies, peak)
+            rerun = run(engines[baseline], seed=1)[0]
+        finally:
+            stage_timing.remove_sink(sink)
+
+    reference, reference_latencies, _ = results[baseline]
+    rows = []
+    for name, (palettes, latencies, peak) in results.items():
+        delta = [palette_distance(p, r) for p, r in zip(palettes, reference)]
+        rows.append({
+            "engine": name,
+            "mean_ms": summarize(latencies)["mean_ms"],
+            "p95_ms": summarize(latencies)["p95_ms"],
+            "speedup": round(sum(reference_latencies) / sum(latencies), 2),
+            "peak_mb": round(peak / 1024 ** 2, 1),
+            "delta_e_mean": round(float(np.mean(delta)), 3),
+            "delta_e_max": round(float(np.max(delta)), 3),
+        })
+    noise = [palette_distance(p, r) for p, r in zip(rerun, reference)]
+    rows.append({"engine": f"{baseline} 换随机种子", "delta_e_mean": round(float(np.mean(noise)), 3),
+                 "delta_e_max": round(float(np.max(noise)), 3)})
+    if "kmeans (gpu)" in results:
+        # 相同 seed 下 CPU / GPU 的结果应一致
+        gpu = [palette_distance(p, r) for p, r in zip(results["kmeans (gpu)"][0], results["kmeans (cpu)"][0])]
+        rows.append({"engine": "kmeans gpu 与 cpu 的差异", "delta_e_mean": round(float(np.mean(gpu)), 3),
+                     "delta_e_max": round(float(np.max(gpu)), 3)})
+
+    print_table(f"主色提取 ({len(paths)} 张图片, {args.colors} 种颜色, ΔE 以 {baseline} 为基准)", rows,
+                ["engine", "mean_ms", "p95_ms", "speedup", "peak_mb", "delta_e_mean", "delta_e_max"])
+    return {"images": len(paths), "colors": args.colors, "results": rows}
+
+
+def bench_palette(args) -> dict:
+    """主色索引: 合成主色上精确计算与 Lab 网格预筛选的召回率和延迟"""
+    import tempfile
+    from palette_index import PaletteIndex
+
+    rng = np.random.default_rng(0)
+
+    def random_palette():
+        # 每张图片一个主色 (占比高) 加若干接近或随机的颜色
+        base = rng.integers(0, 256, 3)
+        colors = np.clip(base + rng.normal(0, 40, (10, 3)), 0, 255).astype(int)
+        colors[5:] = rng.integers(0, 256, (5, 3))
+        weights = np.sort(rng.dirichlet(np.full(10, 0.5)))[::-1] * 100
+        return [{"color": "#{:02x}{:02x}{:02x}".format(*c), "percentage": round(float(w), 2)}
+                for c, w in zip(colors, weights)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = PaletteIndex(tmp, **({"cell_weight": args.cell_weight} if args.cell_weight else {}))
+        palettes = [random_palette() for _ in range(args.images)]
+        start = time.perf_counter()
+        for i in range(0, args.images, 10000):
+            index.add([str(j) for j in range(i, min(i + 10000, args.images))], palettes[i:i + 10000])
+        insert = time.perf_counter() - start
+
+        queries = {
+            "color": ["#{:02x}{:02x}{:02x}".format(*rng.integers(0, 256, 3)) for _ in range(args.queries)],
+            "palette": [random_palette() for _ in range(args.queries)],
+        }
+        rows = []
+        for kind, targets in queries.items():
+            results = {}
+            for mode, prefilter in (("exact", False), ("prefilter", True)):
+                latencies, found = [], []
+                for target in targets:
+                    start = time.perf_counter()
+                    found.append({image_id for image_id, _ in index.search(target, k=args.k, prefilter=prefilter)})
+                    latencies.append(time.perf_counter() - start)
+                results[mode] = found
+                recall = np.mean([len(a & e) / max(1, len(e)) for a, e in zip(found, results["exact"])])
+                rows.append({"query": kind, "mode": mode, "recall": round(float(recall), 4), **summarize(latencies)})
+
+        start = time.perf_counter()
+        index.remove([str(j) for j in range(0, args.images, 10)])
+        remove = time.perf_counter() - start
+        stats = index.stats()
+
+    print_table(f"主色索引 ({args.images} 张图片, recall@{args.k} 以精确计算为基准)", rows,
+                ["query", "mode", "recall", "mean_ms", "p50_ms", "p95_ms", "p99_ms"])
+    print(f"\n写入 {args.images} 张图片: {insert:.2f} 秒, 删除 10%: {remove:.2f} 秒, 索引 {stats['bytes'] / 1024 ** 2:.1f} MB")
+    return {"images": args.images, "insert_s": round(insert, 3), "remove_s": round(remove, 3),
+            "bytes": stats["bytes"], "results": rows}
+
+
+def add_parsers(subparsers):
+    """注册 colors / palette 子命令"""
+    colors_parser = subparsers.add_parser("colors", help="主色提取各聚类方式的耗时和 ΔE 差异")
+    colors_parser.add_argument("--images", help="图片目录, 默认使用合成图片集")
+    colors_parser.add_argument("--limit", type=int)
+    colors_parser.add_argument("--count", type=int, default=60, help="合成图片数量")
+    colors_parser.add_argument("--seed", type=int, default=0)
+    colors_parser.add_argument("--work-dir", help="合成图片的缓存目录, 默认在系统临时目录下")
+    colors_parser.add_argument("--colors", type=int, default=10, help="主色数量, 与 get_main_color.py 一致")
+    colors_parser.set_defaults(func=bench_colors)
+
+    palette_parser = subparsers.add_parser("palette", help="按颜色搜索的主色索引的召回率与延迟")
+    palette_parser.add_argument("--images", type=int, default=100000, help="合成图片数量")
+    palette_parser.add_argument("--queries", type=int, default=50)
+    palette_parser.add_argument("-k", type=int, default=20)
+    palette_parser.add_argument("--cell-weight", type=float,
+                                help="占比不低于该值的颜色写入预筛选网格, 默认使用索引的默认值")
+    palette_parser.set_defaults(func=bench_palette)
@@ -0,0 +1,99 @@
+"""
+性能测试 (benchmark.py 各子命令) 共用的工具: 图片列表、延迟统计、表格输出和子进程资源测量
+"""
+import os
+import sys
+import time
+import subprocess
+from typing import List
+
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def list_images(dir_path: str, limit: int = None) -> List[str]:
+    files = sorted(
+        os.path.join(dir_path, f) for f in os.listdir(dir_path)
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    return files[:limit] if limit else files
+
+
+def summarize(latencies: List[float]) -> dict:
+    """汇总延迟 (秒), 输出毫秒单位的统计"""
+    values = np.asarray(latencies, dtype=np.float64) * 1000
+    if values.size == 0:
+        return {"count": 0}
+    return {
+        "count": int(values.size),
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+    }
+
+
+def print_table(title: str, rows: List[dict], columns: List[str]):
+    print(f"\n{title}")
+    widths = [max(len(c), *(len(str(r.get(c, ""))) for r in rows)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row.get(c, "")).ljust(w) for c, w in zip(columns, widths)))
+
+
+# 在子进程退出时记录其峰值常驻内存后运行目标脚本。
+# 不使用 wait4/getrusage 的 ru_maxrss: Linux 上 exec 会继承父进程的峰值, 测出的是测试进程本身的内存
+PEAK_RSS_WRAPPER = """
+import atexit, os, runpy, sys
+
+def report():
+    peak = ""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+    except OSError:
+        try:
+            import psutil
+            info = psutil.Process().memory_info()
+            peak = getattr(info, "peak_wset", None) or info.rss
+        except ImportError:
+            pass
+    with open(os.environ["BENCH_PEAK_RSS_FILE"], "w") as f:
+        f.write(str(peak))
+
+atexit.register(report)
+sys.argv = sys.argv[1:]
+sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[0])))
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+
+def run_measured(script_args: List[str], cwd: str):
+    """运行 Python 脚本, 返回 (耗时秒数, 峰值常驻内存 MB); 无法获取内存时为 None"""
+    peak_file = os.path.join(cwd, "peak_rss")
+    env = dict(os.environ, BENCH_PEAK_RSS_FILE=peak_file)
+    command = [sys.executable, "-u", "-c", PEAK_RSS_WRAPPER, *script_args]
+    start = time.perf_counter()
+    process = subprocess.run(command, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        raise SystemExit(f"error:命令执行失败 ({process.returncode}): {' '.join(script_args)}")
+    with open(peak_file) as f:
+        peak = f.read()
+    return elapsed, round(int(peak) / 1024 ** 2, 1) if peak else None
+
+
+def read_bytes():
+    """本进程累计读取的字节数 (/proc/self/io 的 rchar), 不支持时返回 None"""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
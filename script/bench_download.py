@@ -0,0 +1,90 @@
+"""
+模型下载的性能测试 (本地模拟下载源)
+
+用法:
+    python benchmark.py download [--size-mb 64] [--connections 8] [--throttle-mbps 16]
+"""
+import os
+import time
+
+import numpy as np
+
+from bench_common import print_table
+
+
+def bench_download(args) -> dict:
+    """模型下载: 本地模拟下载源上的吞吐、故障重试、中断续传和校验"""
+    import io
+    import tempfile
+    import contextlib
+    from bench_fixtures import ModelServer
+    import download_models
+    from tests.legacy import legacy_download
+
+    rng = np.random.default_rng(args.seed)
+    name = "bench-model"
+    files = {f"{name}.onnx": rng.bytes(args.size_mb * 1024 * 1024), f"{name}.csv": rng.bytes(300 * 1024)}
+    size_mb = sum(len(data) for data in files.values()) / 1024 ** 2
+
+    def intact(models_dir):
+        return all(os.path.exists(os.path.join(models_dir, f)) and
+                   open(os.path.join(models_dir, f), "rb").read() == data for f, data in files.items())
+
+    rows = []
+    with ModelServer(files) as server, tempfile.TemporaryDirectory() as tmp:
+        server.throttle_mbps = args.throttle_mbps
+
+        def run(scenario, connections=args.connections, models_dir=None, expect=True, **faults):
+            models_dir = models_dir or tempfile.mkdtemp(dir=tmp)
+            for key, value in faults.items():
+                setattr(server, key, value)
+            server.requests, server.bytes_sent = 0, 0
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                success = download_models.download_model(name, models_dir, connections, server.host,
+                                                         show_progress=False)
+            seconds = time.perf_counter() - start
+            for key in faults:
+                setattr(server, key, {"ranges": True, "corrupt": False}.get(key, 0))
+            leftovers = [f for f in os.listdir(models_dir) if f.endswith((".part", ".part.json"))]
+            ok = success == expect and (intact(models_dir) if expect else not any(
+                os.path.exists(os.path.join(models_dir, f)) for f in files) and not leftovers)
+            rows.append({"scenario": scenario, "seconds": round(seconds, 2),
+                         "mb_per_s": round(size_mb / seconds, 1) if success else None,
+                         "requests": server.requests, "sent_mb": round(server.bytes_sent / 1024 ** 2, 1), "ok": ok})
+            return models_dir
+
+        legacy_dir = tempfile.mkdtemp(dir=tmp)
+        server.requests, server.bytes_sent = 0, 0
+        start = time.perf_counter()
+        for filename in files:
+            legacy_download(download_models.file_url(server.host, filename), os.path.join(legacy_dir, filename))
+        seconds = time.perf_counter() - start
+        rows.append({"scenario": "legacy (1 connection, 1 KB writes)", "seconds": round(seconds, 2),
+                     "mb_per_s": round(size_mb / seconds, 1), "requests": server.requests,
+                     "sent_mb": round(server.bytes_sent / 1024 ** 2, 1), "ok": intact(legacy_dir)})
+
+        run("1 connection", connections=1)
+        run(f"{args.connections} connections")
+        run("503 every 4th request + cut after 3 MB", fail_every=4, cut_after=3 * 1024 * 1024)
+        chunks = -(-args.size_mb * 1024 * 1024 // download_models.CHUNK_SIZE)
+        interrupted = run("interrupted halfway", expect=False, max_requests=chunks // 2 + 2)
+        rows[-1]["ok"] = rows[-1]["ok"] or os.path.exists(os.path.join(interrupted, f"{name}.onnx.part"))
+        run("resume after interruption", models_dir=interrupted)
+        run("corrupted body (digest mismatch)", expect=False, corrupt=True)
+        run("server without Range support", ranges=False)
+
+    print_table(f"模型下载 ({size_mb:.1f} MB, 每个连接限速 {args.throttle_mbps} MB/s)", rows,
+                ["scenario", "seconds", "mb_per_s", "requests", "sent_mb", "ok"])
+    return {"size_mb": round(size_mb, 1), "throttle_mbps": args.throttle_mbps, "results": rows,
+            "regressed": not all(row["ok"] for row in rows)}
+
+
+def add_parsers(subparsers):
+    """注册 download 子命令"""
+    download_parser = subparsers.add_parser("download", help="模型下载的吞吐、故障重试、续传和校验 (本地模拟下载源)")
+    download_parser.add_argument("--size-mb", type=int, default=64, help="模拟模型文件大小")
+    download_parser.add_argument("--connections", type=int, default=8)
+    download_parser.add_argument("--throttle-mbps", type=float, default=16.0, help="每个连接的限速, 0 表示不限速")
+    download_parser.add_argument("--seed", type=int, default=0)
+    download_parser.set_defaults(func=bench_download)
@@ -0,0 +1,470 @@
+"""
+性能测试用的合成数据
+
+- make_corpus: 按固定随机种子生成图片集, 覆盖不同尺寸、色彩模式和格式,
+  部分 PNG 带 AUTOMATIC1111 / ComfyUI 生成参数
+- make_metadata_corpus: 生成参数的其他写法 (EXIF UserComment、压缩文本块、图像数据之后的文本块等)
+- make_stand_in_model: 生成与 WD14 输入输出格式一致的小型 ONNX 模型和标签表,
+  不联网也能测试 ai_tagger.py
+- ModelServer: 支持 Range 和故障注入的本地模型下载源, 不联网也能测试 download_models.py
+
+同样的参数总是生成同样的文件, 不同版本之间的测试结果可以直接比较。
+"""
+import os
+import re
+import csv
+import json
+import time
+import hashlib
+import threading
+from typing import List
+
+import numpy as np
+
+CORPUS_VERSION = 2
+STAND_IN_MODEL = "bench-tagger"
+
+# (宽, 高, 权重): 以常见的几百万像素以内的图片为主, 少量超大图
+CORPUS_SIZES = [
+    (64, 64, 1),
+    (512, 512, 3),
+    (512, 768, 4),
+    (832, 1216, 3),
+    (1920, 1080, 2),
+    (3000, 2000, 1),
+    (4000, 6000, 1),
+]
+# (格式, 扩展名, 色彩模式)
+CORPUS_FORMATS = [
+    ("JPEG", ".jpg", "RGB"),
+    ("JPEG", ".jpg", "L"),
+    ("PNG", ".png", "RGB"),
+    ("PNG", ".png", "RGBA"),
+    ("PNG", ".png", "P"),
+    ("PNG", ".png", "LA"),
+    ("WEBP", ".webp", "RGB"),
+    ("WEBP", ".webp", "RGBA"),
+    ("BMP", ".bmp", "RGB"),
+]
+
+
+PROMPT_WORDS = [
+    "masterpiece", "best quality", "1girl", "solo", "long hair", "smile", "looking at viewer", "outdoors",
+    "sky", "cloud", "blue eyes", "school uniform", "cherry blossoms", "city", "night", "landscape",
+    "mountain", "river", "cat", "flower", "sunset", "detailed background", "from side", "upper body",
+]
+NEGATIVE_WORDS = ["lowres", "bad anatomy", "bad hands", "text", "error", "worst quality", "jpeg artifacts", "blurry"]
+SAMPLERS = ["Euler a", "DPM++ 2M Karras", "DDIM", "UniPC"]
+CHECKPOINTS = ["anything-v5", "counterfeit-v3", "sd_xl_base_1.0", "animagine-xl-3.1"]
+
+
+def make_photo(width: int, height: int, seed: int):
+    """生成带渐变和噪声的合成照片, 比纯噪声更接近真实 JPEG 的压缩特性"""
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    base = np.stack([x * 200 + y * 40, (1 - x) * 120 + y * 100, np.abs(x - y) * 220], axis=-1)
+    noise = rng.normal(0, 12, (height // 8 + 1, width // 8 + 1, 3)).repeat(8, 0).repeat(8, 1)[:height, :width]
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+
+
+def a1111_parameters(rng: np.random.Generator, width: int, height: int) -> str:
+    """AUTOMATIC1111 写入 PNG "parameters" 文本块的格式"""
+    prompt = ", ".join(rng.choice(PROMPT_WORDS, size=12, replace=False))
+    negative = ", ".join(rng.choice(NEGATIVE_WORDS, size=4, replace=False))
+    return (
+        f"{prompt}\n"
+        f"Negative prompt: {negative}\n"
+        f"Steps: {int(rng.integers(20, 40))}, Sampler: {rng.choice(SAMPLERS)}, CFG scale: 7, "
+        f"Seed: {int(rng.integers(0, 2 ** 31))}, Size: {width}x{height}, Model hash: 6ce0161689, "
+        f"Model: {rng.choice(CHECKPOINTS)}"
+    )
+
+
+def comfyui_graph(rng: np.random.Generator, width: int, height: int) -> dict:
+    """ComfyUI 写入 PNG 的 "prompt" (节点图) 和 "workflow" (编辑器中的连线) 文本块, 默认文生图工作流"""
+    graph = {
+        "3": {"class_type": "KSampler", "inputs": {
+            "seed": int(rng.integers(0, 2 ** 31)), "steps": int(rng.integers(20, 40)), "cfg": 7.0,
+            "sampler_name": "euler", "scheduler": "normal", "denoise": 1.0,
+            "model": ["4", 0], "positive": ["6", 0], "negative": ["7", 0], "latent_image": ["5", 0],
+        }},
+        "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": f"{rng.choice(CHECKPOINTS)}.safetensors"}},
+        "5": {"class_type": "EmptyLatentImage", "inputs": {"width": width, "height": height, "batch_size": 1}},
+        "6": {"class_type": "CLIPTextEncode", "inputs": {
+            "text": ", ".join(rng.choice(PROMPT_WORDS, size=12, replace=False)), "clip": ["4", 1]}},
+        "7": {"class_type": "CLIPTextEncode", "inputs": {
+            "text": ", ".join(rng.choice(NEGATIVE_WORDS, size=4, replace=False)), "clip": ["4", 1]}},
+        "8": {"class_type": "VAEDecode", "inputs": {"samples": ["3", 0], "vae": ["4", 2]}},
+        "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI", "images": ["8", 0]}},
+    }
+    link_types = {"model": "MODEL", "positive": "CONDITIONING", "negative": "CONDITIONING", "latent_image": "LATENT",
+                  "clip": "CLIP", "samples": "LATENT", "vae": "VAE", "images": "IMAGE"}
+    links = []
+    for node_id, node in graph.items():
+        for slot, (name, value) in enumerate(node["inputs"].items()):
+            if isinstance(value, list):
+                links.append([len(links) + 1, int(value[0]), value[1], int(node_id), slot, link_types[name]])
+    return {
+        "prompt": json.dumps(graph),
+        "workflow": json.dumps({"nodes": [{"id": int(k), "type": v["class_type"]} for k, v in graph.items()],
+                                "links": links}),
+    }
+
+
+def _convert(image, mode: str):
+    from PIL import Image
+
+    if mode == "RGBA" or mode == "LA":
+        alpha = Image.linear_gradient("L").resize(image.size)
+        image = image.convert("RGBA")
+        image.putalpha(alpha)
+        return image.convert(mode)
+    if mode == "P":
+        return image.convert("P", palette=Image.ADAPTIVE, colors=64)
+    return image.convert(mode)
+
+
+def make_corpus(dir_path: str, count: int = 60, seed: int = 0) -> List[dict]:
+    """
+    生成合成图片集, 返回每张图片的描述 (path/format/mode/width/height/metadata)
+
+    目录中已有相同参数生成的图片集时直接复用 (manifest.json)。
+    metadata 为 None / "a1111" / "comfyui", 带生成参数的只有 PNG。
+    """
+    from PIL.PngImagePlugin import PngInfo
+
+    os.makedirs(dir_path, exist_ok=True)
+    manifest_path = os.path.join(dir_path, "manifest.json")
+    key = {"version": CORPUS_VERSION, "count": count, "seed": seed}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("key") == key and all(os.path.exists(e["path"]) for e in manifest["entries"]):
+            return manifest["entries"]
+
+    rng = np.random.default_rng(seed)
+    weights = np.array([w for _, _, w in CORPUS_SIZES], dtype=np.float64)
+    entries = []
+    for i in range(count):
+        width, height, _ = CORPUS_SIZES[rng.choice(len(CORPUS_SIZES), p=weights / weights.sum())]
+        image_format, ext, mode = CORPUS_FORMATS[i % len(CORPUS_FORMATS)]
+        image = _convert(make_photo(width, height, seed * 100003 + i), mode)
+
+        metadata = None
+        save_options = {}
+        if image_format == "PNG" and i % 3 != 2:
+            metadata = "a1111" if i % 3 == 0 else "comfyui"
+            info = PngInfo()
+            if metadata == "a1111":
+                info.add_text("parameters", a1111_parameters(rng, width, height))
+            else:
+                for name, value in comfyui_graph(rng, width, height).items():
+                    info.add_text(name, value)
+            save_options["pnginfo"] = info
+        elif image_format == "JPEG":
+            save_options["quality"] = 90
+        elif image_format == "WEBP":
+            save_options["quality"] = 85
+
+        path = os.path.join(dir_path, f"{i:04d}_{width}x{height}_{mode}{ext}")
+        image.save(path, image_format, **save_options)
+        entries.append({
+            "path": path,
+            "format": image_format,
+            "mode": mode,
+            "width": width,
+            "height": height,
+            "metadata": metadata,
+        })
+
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump({"key": key, "entries": entries}, f, ensure_ascii=False, indent=2)
+    return entries
+
+
+def _png_with_trailing_text(path: str, key: str, value: str):
+    """在 IEND 之前插入 tEXt 块, 模拟在图像数据之后写入文本的工具"""
+    import struct
+    import zlib
+
+    with open(path, "rb") as f:
+        data = f.read()
+    body = key.encode("latin-1") + b"\0" + value.encode("latin-1", "replace")
+    chunk = struct.pack(">I", len(body)) + b"tEXt" + body + struct.pack(">I", zlib.crc32(b"tEXt" + body))
+    with open(path, "wb") as f:
+        f.write(data[:-12] + chunk + data[-12:])
+
+
+def make_metadata_corpus(dir_path: str, seed: int = 0) -> List[dict]:
+    """
+    生成参数的各种写法各一张, 返回与 make_corpus 相同格式的描述 (metadata 为写法名称):
+    JPEG / WebP 的 EXIF UserComment、只有相机 EXIF 的 JPEG、iTXt (压缩) / zTXt、图像数据之后的 tEXt、
+    模型路径带反斜杠和非 ASCII 字符的 ComfyUI、NovelAI 格式的文本块
+    """
+    from PIL import Image
+    from PIL.PngImagePlugin import PngInfo
+
+    os.makedirs(dir_path, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    width, height = 1024, 1024
+
+    def user_comment_exif(text: str):
+        exif = Image.Exif()
+        exif.get_ifd(0x8769)[0x9286] = b"UNICODE\0" + text.encode("utf_16_be")
+        return exif
+
+    camera_exif = Image.Exif()
+    camera_exif[0x010F] = "Canon"
+    camera_exif.get_ifd(0x8769)[0x829A] = 1 / 125
+
+    comfyui = comfyui_graph(rng, width, height)
+    graph = json.loads(comfyui["prompt"])
+    graph["4"]["inputs"]["ckpt_name"] = "SDXL\\动漫\\animagine-xl-3.1.safetensors"
+    windows_info = PngInfo()
+    for key, value in {"prompt": json.dumps(graph), "workflow": comfyui["workflow"]}.items():
+        windows_info.add_text(key, value)
+
+    itxt_info = PngInfo()
+    itxt_info.add_itxt("parameters", a1111_parameters(rng, width, height), zip=True)
+    ztxt_info = PngInfo()
+    ztxt_info.add_text("parameters", a1111_parameters(rng, width, height), zip=True)
+    novelai_info = PngInfo()
+    for key, value in {"Software": "NovelAI", "Source": "Stable Diffusion", "Description": "1girl",
+                       "Comment": json.dumps({"steps": 28, "sampler": "k_euler", "seed": 1})}.items():
+        novelai_info.add_text(key, value)
+
+    cases = [
+        ("exif-usercomment", "JPEG", ".jpg", {"exif": user_comment_exif(a1111_parameters(rng, width, height)),
+                                               "quality": 90}),
+        ("webp-usercomment", "WEBP", ".webp", {"exif": user_comment_exif(a1111_parameters(rng, width, height)),
+                                                "quality": 85}),
+        ("camera-exif", "JPEG", ".jpg", {"exif": camera_exif, "quality": 90}),
+        ("itxt", "PNG", ".png", {"pnginfo": itxt_info}),
+        ("ztxt", "PNG", ".png", {"pnginfo": ztxt_info}),
+        ("trailing-text", "PNG", ".png", {}),
+        ("comfyui-windows-path", "PNG", ".png", {"pnginfo": windows_info}),
+        ("novelai", "PNG", ".png", {"pnginfo": novelai_info}),
+    ]
+    entries = []
+    for i, (name, image_format, ext, save_options) in enumerate(cases):
+        path = os.path.join(dir_path, f"{name}{ext}")
+        make_photo(width, height, seed * 100003 + 50000 + i).save(path, image_format, **save_options)
+        if name == "trailing-text":
+            _png_with_trailing_text(path, "parameters", a1111_parameters(rng, width, height))
+        entries.append({"path": path, "format": image_format, "mode": "RGB", "width": width, "height": height,
+                        "metadata": name})
+    return entries
+
+
+def make_stand_in_model(models_dir: str, name: str = STAND_IN_MODEL, size: int = 448, num_tags: int = 1000,
+                        seed: int = 0, hidden: int = 0) -> str:
+    """
+    生成 WD14 格式的小型模型: 输入 NHWC float32 (BGR, 0-255), 输出 predictions_sigmoid,
+    结构为两层步长卷积 + 全局池化 + 全连接, 计算量远小于真实模型, 只用于测试流程和非推理部分的耗时。
+    hidden 大于 0 时在全连接前加一层 hidden × hidden 的隐藏层, 使模型文件大小接近真实模型 (8192 约 300 MB),
+    用于测试内存占用。标签表包含 rating / general / character 三类。已存在时直接返回模型名称。
+    """
+    import onnx
+    from onnx import helper, numpy_helper, TensorProto
+
+    model_path = os.path.join(models_dir, f"{name}.onnx")
+    csv_path = os.path.join(models_dir, f"{name}.csv")
+    if os.path.exists(model_path) and os.path.exists(csv_path):
+        return name
+    os.makedirs(models_dir, exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    weights = {
+        "conv1": rng.normal(0, 0.02, (16, 3, 4, 4)).astype(np.float32),
+        "conv2": rng.normal(0, 0.1, (32, 16, 4, 4)).astype(np.float32),
+        "fc": rng.normal(0, 0.5, (32, num_tags)).astype(np.float32),
+        "bias": rng.normal(-1, 1, num_tags).astype(np.float32),
+    }
+    if hidden:
+        weights["expand"] = rng.normal(0, 0.5, (32, hidden)).astype(np.float32)
+        weights["hidden"] = rng.normal(0, 1 / np.sqrt(hidden), (hidden, hidden)).astype(np.float32)
+        weights["fc"] = rng.normal(0, 0.5 / np.sqrt(hidden / 32), (hidden, num_tags)).astype(np.float32)
+    nodes = [
+        helper.make_node("Transpose", ["input_1"], ["nchw"], perm=[0, 3, 1, 2]),
+        helper.make_node("Conv", ["nchw", "conv1"], ["c1"], strides=[4, 4]),
+        helper.make_node("Relu", ["c1"], ["r1"]),
+        helper.make_node("Conv", ["r1", "conv2"], ["c2"], strides=[4, 4]),
+        helper.make_node("Relu", ["c2"], ["r2"]),
+        helper.make_node("GlobalAveragePool", ["r2"], ["pooled"]),
+        helper.make_node("Flatten", ["pooled"], ["flat"], axis=1),
+        *([
+            helper.make_node("MatMul", ["flat", "expand"], ["expanded"]),
+            helper.make_node("Relu", ["expanded"], ["e1"]),
+            helper.make_node("MatMul", ["e1", "hidden"], ["h"]),
+            helper.make_node("Relu", ["h"], ["features"]),
+        ] if hidden else []),
+        helper.make_node("MatMul", ["features" if hidden else "flat", "fc"], ["logits"]),
+        helper.make_node("Add", ["logits", "bias"], ["biased"]),
+        helper.make_node("Sigmoid", ["biased"], ["predictions_sigmoid"]),
+    ]
+    graph = helper.make_graph(
+        nodes, name,
+        [helper.make_tensor_value_info("input_1", TensorProto.FLOAT, ["batch", size, size, 3])],
+        [helper.make_tensor_value_info("predictions_sigmoid", TensorProto.FLOAT, ["batch", num_tags])],
+        [numpy_helper.from_array(value, key) for key, value in weights.items()],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, model_path)
+
+    # WD14 标签表: 前 4 个为 rating (9), 之后约 80% 为 general (0), 其余为 character (4)
+    general_end = 4 + int((num_tags - 4) * 0.8)
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["tag_id", "name", "category", "count"])
+        for i in range(num_tags):
+            category = "9" if i < 4 else ("0" if i < general_end else "4")
+            writer.writerow([i, f"tag_{i}" if i % 9 else f"tag_{i}_(series)", category, num_tags - i])
+    return name
+
+
+class ModelServer:
+    """
+    本地 HTTP 服务, 模拟模型下载源 (download_models.py 的 --host):
+        /<repo>/resolve/main/<文件名>   与 HuggingFace 相同: LFS 文件以 302 跳转到 /cdn/<文件名>,
+                                        跳转响应带 X-Linked-Etag / X-Linked-Size; 普通文件直接返回, ETag 为 git blob SHA-1
+        /cdn/<文件名>                   支持单个 Range
+        /api/models/<repo>/tree/main    文件列表, 与 HuggingFace 的格式相同
+
+    注入故障 (可随时修改属性):
+        fail_every       每 N 个下载请求返回一次 503
+        cut_after        每个响应最多发送这么多字节后断开连接
+        max_requests     下载请求超过该数量后一律返回 503, 模拟下载中途网络断开
+        ranges           False 时忽略 Range, 总是返回整个文件
+        corrupt          发送的内容中翻转一个字节, 文件列表中的摘要不变
+        throttle_mbps    每个连接的限速 (MB/s), 模拟 CDN 的单连接带宽
+        tree_available   False 时文件列表接口返回 500
+    """
+
+    def __init__(self, files: dict, repo: str = "honmo/wd14-collection", lfs_suffixes=(".onnx",)):
+        self.files = files
+        self.repo = repo
+        self.lfs_suffixes = lfs_suffixes
+        self.fail_every = 0
+        self.cut_after = 0
+        self.max_requests = 0
+        self.ranges = True
+        self.corrupt = False
+        self.throttle_mbps = 0.0
+        self.tree_available = True
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._digests = {
+            name: hashlib.sha256(data).hexdigest() if name.endswith(lfs_suffixes)
+            else hashlib.sha1(f"blob {len(data)}\0".encode() + data).hexdigest()
+            for name, data in files.items()
+        }
+        self._server = None
+
+    def tree(self) -> list:
+        entries = []
+        for name, data in self.files.items():
+            entry = {"type": "file", "path": name, "size": len(data), "oid": self._digests[name]}
+            if name.endswith(self.lfs_suffixes):
+                entry["lfs"] = {"oid": self._digests[name], "size": len(data)}
+            entries.append(entry)
+        return entries
+
+    def __enter__(self) -> "ModelServer":
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def handle(self):
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 客户端放弃连接 (停止下载或重试)
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path == f"/api/models/{server.repo}/tree/main":
+                    if not server.tree_available:
+                        return self._send(500, b"error")
+                    return self._send(200, json.dumps(server.tree()).encode(), {"Content-Type": "application/json"})
+                prefix = f"/{server.repo}/resolve/main/"
+                name = path[len(prefix):] if path.startswith(prefix) else None
+                if name is None and path.startswith("/cdn/"):
+                    name = path[len("/cdn/"):]
+                elif name in server.files and name.endswith(server.lfs_suffixes):
+                    return self._send(302, b"", {"Location": f"/cdn/{name}",
+                                                 "X-Linked-Etag": f'"{server._digests[name]}"',
+                                                 "X-Linked-Size": str(len(server.files[name]))})
+                if name not in server.files:
+                    return self._send(404, b"not found")
+                with server._lock:
+                    server.requests += 1
+                    count = server.requests
+                if (server.max_requests and count > server.max_requests) or (
+                        server.fail_every and count % server.fail_every == 0):
+                    return self._send(503, b"unavailable")
+
+                data = server.files[name]
+                headers = {"Accept-Ranges": "bytes"} if server.ranges else {}
+                if not name.endswith(server.lfs_suffixes):
+                    headers["ETag"] = f'"{server._digests[name]}"'
+                match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+                if server.ranges and match:
+                    start = int(match.group(1))
+                    end = min(int(match.group(2) or len(data) - 1), len(data) - 1)
+                    headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+                    return self._send(206, data, headers, start, end + 1)
+                return self._send(200, data, headers)
+
+            def _send(self, status, data, headers=None, start=0, end=None):
+                end = len(data) if end is None else end
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(end - start))
+                self.end_headers()
+                limit = end - start
+                if server.cut_after and status in (200, 206):
+                    limit = min(limit, server.cut_after)
+                position = start
+                block_size = 64 * 1024
+                try:
+                    while position < start + limit:
+                        block = data[position:min(position + block_size, start + limit)]
+                        if server.corrupt and position <= len(data) // 2 < position + len(block):
+                            block = bytearray(block)
+                            block[len(data) // 2 - position] ^= 0xFF
+                            block = bytes(block)
+                        self.wfile.write(block)
+                        position += len(block)
+                        with server._lock:
+                            server.bytes_sent += len(block)
+                        if server.throttle_mbps:
+                            time.sleep(len(block) / (server.throttle_mbps * 1024 * 1024))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                if limit < end - start:
+                    self.close_connection = True
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def host(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
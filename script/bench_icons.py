@@ -0,0 +1,84 @@
+"""
+图标生成的性能测试
+
+用法:
+    python benchmark.py icons [--font <字体文件>]
+"""
+import os
+import time
+
+import numpy as np
+
+from bench_common import print_table
+
+
+def icon_frames(path: str) -> dict:
+    """图标文件中各尺寸的 RGBA 像素, ICO 文件包含多个尺寸"""
+    from PIL import Image
+
+    with Image.open(path) as image:
+        if image.format == "ICO":
+            return {size: np.asarray(image.ico.getimage(size).convert("RGBA"), dtype=np.int16)
+                    for size in sorted(image.ico.sizes())}
+        return {image.size: np.asarray(image.convert("RGBA"), dtype=np.int16)}
+
+
+def bench_icons(args) -> dict:
+    """图标生成: 逐像素绘制的原实现与向量化 + 单次渲染 + 并行编码的耗时, 以及输出的像素差异"""
+    import tempfile
+    import generate_icons as icons
+    from tests.legacy import legacy_add_shine_effect, legacy_generate_icons, legacy_gradient_background
+
+    sample = icons.create_base_icon(256, font_path=args.font)
+    start = time.perf_counter()
+    legacy_background = legacy_gradient_background(icons.MASTER_SIZE)
+    legacy_shine = legacy_add_shine_effect(sample)
+    legacy_passes = time.perf_counter() - start
+    start = time.perf_counter()
+    background = icons.create_gradient_background(icons.MASTER_SIZE)
+    shine = icons.add_shine_effect(sample)
+    passes = time.perf_counter() - start
+    exact = (np.array_equal(np.asarray(background), np.asarray(legacy_background))
+             and np.array_equal(np.asarray(shine), np.asarray(legacy_shine)))
+
+    cwd = os.getcwd()
+    timings = {}
+    with tempfile.TemporaryDirectory() as legacy_dir, tempfile.TemporaryDirectory() as new_dir:
+        try:
+            os.chdir(legacy_dir)
+            start = time.perf_counter()
+            legacy_generate_icons(args.font)
+            timings["legacy"] = time.perf_counter() - start
+            os.chdir(new_dir)
+            start = time.perf_counter()
+            icons.generate_icons(font_path=args.font)
+            timings["vectorized"] = time.perf_counter() - start
+            start = time.perf_counter()
+            skipped = not icons.generate_icons(font_path=args.font)
+            timings["unchanged (skipped)"] = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+
+        rows = []
+        for path in icons.output_paths():
+            legacy_frames = icon_frames(os.path.join(legacy_dir, path))
+            frames = icon_frames(os.path.join(new_dir, path))
+            for size, legacy_pixels in legacy_frames.items():
+                diff = np.abs(frames[size] - legacy_pixels)
+                rows.append({"file": path, "size": f"{size[0]}x{size[1]}", "max_diff": int(diff.max()),
+                             "mean_diff": round(float(diff.mean()), 3)})
+
+    print(f"渐变背景 ({icons.MASTER_SIZE}px) + 光泽 (256px): 原实现 {legacy_passes * 1000:.0f} ms, "
+          f"向量化 {passes * 1000:.1f} ms, 结果一致: {exact}")
+    print_table("生成全部图标耗时", [{"mode": mode, "seconds": round(seconds, 3)} for mode, seconds in timings.items()],
+                ["mode", "seconds"])
+    print_table("输出与原实现的像素差异 (RGBA 通道绝对差, 0-255)", rows, ["file", "size", "max_diff", "mean_diff"])
+    return {"passes_exact": exact, "skipped_when_unchanged": skipped,
+            "seconds": {mode: round(seconds, 3) for mode, seconds in timings.items()}, "diff": rows}
+
+
+def add_parsers(subparsers):
+    """注册 icons 子命令"""
+    icons_parser = subparsers.add_parser("icons", help="图标生成的耗时和与原实现的像素差异")
+    icons_parser.add_argument("--font", help="字体文件, 默认与 generate_icons.py 相同")
+    icons_parser.set_defaults(func=bench_icons)
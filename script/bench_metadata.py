@@ -0,0 +1,269 @@
+"""
+生成参数相关的性能测试: 单张读取、批量读取和倒排索引
+
+用法:
+    python benchmark.py prompt-index [--images 100000]
+    python benchmark.py metadata [--images <图片目录>]
+    python benchmark.py metadata-batch [--files 5000] [--workers 1 4]
+"""
+import os
+import sys
+import json
+import time
+import subprocess
+from typing import List
+
+import numpy as np
+
+from bench_fixtures import make_corpus, make_metadata_corpus
+from bench_common import SCRIPT_DIR, list_images, summarize, print_table, run_measured, read_bytes
+
+
+def bench_metadata(args) -> dict:
+    """
+    生成参数读取: 只读文件头部的预扫描与旧实现 (每张图片完整交给 sd_parsers) 的对比
+
+    图片集为 make_corpus 加上 make_metadata_corpus 中的各种写法; 按图片是否带生成参数分组统计延迟,
+    read_kb 为每张图片读取的字节数 (/proc/self/io)。输出不同的图片会逐个列出。
+    """
+    import tempfile
+    from read_image_metadata import read_metadata, scan_metadata, comfyui_attributes, parse_prompt_info, GENERATOR_KEYS
+    from tests.legacy import legacy_extract_attributes, legacy_read_metadata
+
+    if args.images:
+        entries = [{"path": path, "metadata": None} for path in list_images(args.images, args.limit)]
+    else:
+        work_dir = args.work_dir or os.path.join(tempfile.gettempdir(), "image-management-bench")
+        entries = (make_corpus(os.path.join(work_dir, "corpus"), args.count, args.seed) +
+                   make_metadata_corpus(os.path.join(work_dir, "metadata"), args.seed))
+    paths = [entry["path"] for entry in entries]
+
+    methods = {"legacy": legacy_read_metadata, "prescan": read_metadata}
+    results = {method: [] for method in methods}
+    latencies = {method: [] for method in methods}
+    read = {method: [] for method in methods}
+    for _ in range(args.repeat):
+        for path in paths:
+            for method, function in methods.items():
+                before, start = read_bytes(), time.perf_counter()
+                result = function(path)
+                latencies[method].append(time.perf_counter() - start)
+                if before is not None:
+                    read[method].append(read_bytes() - before)
+                if len(results[method]) < len(paths):
+                    results[method].append(result)
+
+    rejected = 0
+    for path in paths:
+        scan = scan_metadata(path)
+        if scan is not None and not any(GENERATOR_KEYS.intersection(c) for c in scan.candidates):
+            rejected += 1
+    has_metadata = [results["legacy"][i] is not None for i in range(len(paths))] * args.repeat
+
+    rows = []
+    for method in methods:
+        for group, selected in (("all", None), ("with metadata", True), ("without", False)):
+            indices = [i for i, flag in enumerate(has_metadata) if selected is None or flag == selected]
+            if not indices:
+                continue
+            row = {"method": method, "images": group, **summarize([latencies[method][i] for i in indices])}
+            if read[method]:
+                row["read_kb"] = round(float(np.mean([read[method][i] for i in indices])) / 1024, 1)
+            rows.append(row)
+
+    differences = [
+        {"image": path, "legacy": legacy, "prescan": prescan}
+        for path, legacy, prescan in zip(paths, results["legacy"], results["prescan"])
+        if json.dumps(legacy, sort_keys=True, default=str) != json.dumps(prescan, sort_keys=True, default=str)
+    ]
+    # ComfyUI 的 ckpt_name: 节点图遍历与旧实现的正则结果
+    ckpt_differences = []
+    for path in paths:
+        prompt_info = parse_prompt_info(path)
+        if prompt_info is None or prompt_info.generator.value != "ComfyUI":
+            continue
+        legacy = legacy_extract_attributes(json.dumps(prompt_info.raw_parameters, ensure_ascii=False, default=str),
+                                           ["ckpt_name"])
+        walked = comfyui_attributes(prompt_info.raw_parameters)
+        if legacy != walked:
+            ckpt_differences.append({"image": path, "legacy": legacy, "graph": walked})
+
+    print_table(f"生成参数读取 ({len(paths)} 张图片 × {args.repeat}, {sum(has_metadata) // args.repeat} 张带生成参数, "
+                f"{rejected} 张未调用 sd_parsers)", rows,
+                ["method", "images", "count", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "read_kb"])
+    print(f"\n输出不同: {len(differences)} 张")
+    for item in differences:
+        print(json.dumps(item, ensure_ascii=False, default=str)[:300])
+    print(f"ComfyUI ckpt_name 与旧正则结果不同: {len(ckpt_differences)} 张")
+    for item in ckpt_differences:
+        print(json.dumps(item, ensure_ascii=False))
+    return {"images": len(paths), "rejected": rejected, "results": rows,
+            "differences": len(differences), "ckpt_differences": ckpt_differences}
+
+
+def bench_metadata_batch(args) -> dict:
+    """
+    批量读取生成参数的吞吐: 每张图片启动一次进程 (script.cjs 的方式) 与 --dir 批量模式
+
+    图片集为 make_corpus 和 make_metadata_corpus 的图片以硬链接重复到 --files 张 (BMP 不在批量模式处理范围内);
+    批量模式对每个进程数先完整处理一遍, 再带清单处理一遍 (全部跳过)。
+    """
+    import shutil
+    import tempfile
+
+    work_dir = args.work_dir or os.path.join(tempfile.gettempdir(), "image-management-bench")
+    sources = [entry["path"] for entry in make_corpus(os.path.join(work_dir, "corpus"), args.count, args.seed) +
+               make_metadata_corpus(os.path.join(work_dir, "metadata"), args.seed)]
+    script = os.path.join(SCRIPT_DIR, "read_image_metadata.py")
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        library = os.path.join(tmp, "library")
+        for i in range(args.files):
+            source = sources[i % len(sources)]
+            directory = os.path.join(library, f"{i // 1000:03d}")
+            os.makedirs(directory, exist_ok=True)
+            target = os.path.join(directory, f"{i:06d}{os.path.splitext(source)[1]}")
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copyfile(source, target)
+
+        latencies = []
+        for path in sources[:args.cold_limit]:
+            latencies.append(run_measured([script, path], cwd=tmp)[0])
+        rows.append({"mode": "per-process", "workers": 1, "files": len(latencies),
+                     "files_per_sec": round(len(latencies) / sum(latencies), 1),
+                     "100k_minutes": round(100000 * np.mean(latencies) / 60, 1)})
+
+        for workers in args.workers:
+            manifest = os.path.join(tmp, f"manifest-{workers}.jsonl")
+            for mode in ("batch", "batch (manifest)"):
+                command = [sys.executable, script, "--dir", library, "--workers", str(workers),
+                           "--manifest", manifest, "--output", os.path.join(tmp, f"out-{workers}.ndjson")]
+                start = time.perf_counter()
+                process = subprocess.run(command, cwd=tmp, capture_output=True, text=True, encoding="utf-8")
+                elapsed = time.perf_counter() - start
+                if process.returncode != 0:
+                    raise SystemExit(f"error:批量模式执行失败: {process.stderr.strip()[-500:]}")
+                done = json.loads(process.stderr.strip().splitlines()[-1])
+                files = done["processed"] + done["skipped"]
+                rows.append({"mode": mode, "workers": workers, "files": files,
+                             "files_per_sec": round(files / elapsed, 1),
+                             "100k_minutes": round(100000 * elapsed / files / 60, 2),
+                             "errors": done["errors"]})
+
+    print_table(f"批量读取生成参数 ({args.files} 张图片, files_per_sec 含进程启动)", rows,
+                ["mode", "workers", "files", "files_per_sec", "100k_minutes", "errors"])
+    return {"files": args.files, "cpu_count": os.cpu_count(), "results": rows}
+
+
+def synthetic_metadata(rng: np.random.Generator, count: int, vocabulary: int) -> List[dict]:
+    """
+    合成 read_metadata 结果: 提示词按 Zipf 分布从 vocabulary 个词中抽取, ComfyUI / AUTOMATIC1111 各占一半
+    """
+    from bench_fixtures import PROMPT_WORDS, NEGATIVE_WORDS, SAMPLERS, CHECKPOINTS
+
+    words = PROMPT_WORDS + [f"tag{i}" for i in range(vocabulary - len(PROMPT_WORDS))]
+    negatives = NEGATIVE_WORDS + [f"bad{i}" for i in range(200)]
+    checkpoints = CHECKPOINTS + [f"model-{i}" for i in range(60)]
+    records = []
+    for i in range(count):
+        prompt = [words[j] for j in np.unique(np.minimum(rng.zipf(1.3, 20), vocabulary) - 1)]
+        negative = [negatives[j] for j in np.unique(np.minimum(rng.zipf(1.5, 6), len(negatives)) - 1)]
+        checkpoint = checkpoints[min(int(rng.zipf(1.5)), len(checkpoints)) - 1]
+        sampler = SAMPLERS[int(rng.integers(0, len(SAMPLERS)))]
+        parameters = {"steps": int(rng.integers(20, 40)), "cfg_scale": 7, "seed": int(rng.integers(0, 2 ** 31))}
+        if i % 2:
+            records.append({"generator": "ComfyUI", "positive_prompt": prompt, "negative_prompt": negative,
+                            "model": {"name": f"SDXL\\{checkpoint}.safetensors"},
+                            "samplers": [{"name": "KSampler", "parameters": {**parameters, "sampler_name": sampler}}]})
+        else:
+            records.append({"generator": "AUTOMATIC1111", "positive_prompts": prompt, "negative_prompts": negative,
+                            "model": {"name": checkpoint}, "samplers": {"name": sampler, "parameters": parameters}})
+    return records
+
+
+def bench_prompt_index(args) -> dict:
+    """生成参数倒排索引: 索引大小、写入耗时, 以及查询延迟与逐条检查词项集合的对比"""
+    import tempfile
+    from prompt_index import PromptIndex, metadata_terms, parse_query
+
+    rng = np.random.default_rng(args.seed)
+    records = synthetic_metadata(rng, args.images, args.vocabulary)
+    ids = [f"images/{i:06d}.png" for i in range(args.images)]
+    queries = {
+        "common token": "1girl",
+        "rare token": "tag2500",
+        "ckpt + token": "ckpt:anything-v5 solo",
+        "3 terms + not": "1girl \"long hair\" -negative:lowres",
+        "prefix": "ckpt:model-1*",
+        "or": "\"sampler:euler a|sampler:ddim\" param:steps=28",
+        "param + rare": "param:steps=30 tag90",
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = PromptIndex(tmp)
+        start = time.perf_counter()
+        for i in range(0, args.images, args.batch_size):
+            index.add(ids[i:i + args.batch_size], records[i:i + args.batch_size])
+        insert = time.perf_counter() - start
+        start = time.perf_counter()
+        index = PromptIndex(tmp)
+        reopen = time.perf_counter() - start
+        stats = index.stats()
+
+        # 对照: 对每张图片预先算好的词项集合逐条检查 (不含读取和解析元数据的时间)
+        term_sets = [metadata_terms(record) for record in records]
+        rows = []
+        for name, query in queries.items():
+            clauses = parse_query(query)
+            latencies = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                count, _ = index.search(query, limit=100)
+                latencies.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            expected = sum(all(c.matches(terms) != c.negated for c in clauses) for terms in term_sets)
+            scan = time.perf_counter() - start
+            row = {"query": name, "matches": count, "scan_ms": round(scan * 1000, 1), **summarize(latencies)}
+            row["speedup"] = round(scan * 1000 / row["p50_ms"], 1) if row["p50_ms"] else None
+            row["ok"] = count == expected
+            rows.append(row)
+
+    print_table(f"生成参数倒排索引 ({args.images} 张图片, {args.repeat} 次)", rows,
+                ["query", "matches", "ok", "p50_ms", "p95_ms", "scan_ms", "speedup"])
+    print(f"\n写入: {insert:.2f} 秒 (每次 {args.batch_size} 张), 重新打开: {reopen * 1000:.0f} ms, "
+          f"{stats['segments']} 个分段, {stats['terms']} 个词项, {stats['postings']} 个行号, "
+          f"索引 {stats['bytes'] / 1024 ** 2:.1f} MB")
+    return {"images": args.images, "insert_s": round(insert, 3), "reopen_s": round(reopen, 3), **stats,
+            "results": rows, "regressed": not all(row["ok"] for row in rows)}
+
+
+def add_parsers(subparsers):
+    """注册 metadata / metadata-batch / prompt-index 子命令"""
+    metadata_parser = subparsers.add_parser("metadata", help="生成参数读取: 文件头预扫描与完整解析的对比")
+    metadata_parser.add_argument("--images", help="图片目录, 默认使用合成图片集")
+    metadata_parser.add_argument("--limit", type=int)
+    metadata_parser.add_argument("--count", type=int, default=60, help="合成图片数量")
+    metadata_parser.add_argument("--seed", type=int, default=0)
+    metadata_parser.add_argument("--repeat", type=int, default=3)
+    metadata_parser.add_argument("--work-dir", help="合成图片的缓存目录, 默认在系统临时目录下")
+    metadata_parser.set_defaults(func=bench_metadata)
+
+    batch_metadata_parser = subparsers.add_parser("metadata-batch", help="批量读取生成参数的吞吐")
+    batch_metadata_parser.add_argument("--files", type=int, default=5000, help="图片数量 (合成图片的硬链接)")
+    batch_metadata_parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    batch_metadata_parser.add_argument("--cold-limit", type=int, default=10, help="逐张启动进程测试的图片数量")
+    batch_metadata_parser.add_argument("--count", type=int, default=60, help="合成图片数量")
+    batch_metadata_parser.add_argument("--seed", type=int, default=0)
+    batch_metadata_parser.add_argument("--work-dir", help="合成图片的缓存目录, 默认在系统临时目录下")
+    batch_metadata_parser.set_defaults(func=bench_metadata_batch)
+
+    prompt_parser = subparsers.add_parser("prompt-index", help="生成参数倒排索引的大小与查询延迟")
+    prompt_parser.add_argument("--images", type=int, default=100000, help="合成图片数量")
+    prompt_parser.add_argument("--vocabulary", type=int, default=5000, help="提示词词汇量")
+    prompt_parser.add_argument("--batch-size", type=int, default=5000, help="每次 add 的图片数量")
+    prompt_parser.add_argument("--repeat", type=int, default=50)
+    prompt_parser.add_argument("--seed", type=int, default=0)
+    prompt_parser.set_defaults(func=bench_prompt_index)
@@ -0,0 +1,163 @@
+"""
+推理会话相关的性能测试: 会话创建耗时和多进程共享权重的内存占用
+
+用法:
+    python benchmark.py session --models-dir <模型目录> [--model <模型名称> ...]
+    python benchmark.py shared-weights [--workers 1 2 4] [--hidden 8192]
+"""
+import os
+import sys
+import json
+import time
+import subprocess
+
+import numpy as np
+
+from bench_fixtures import make_photo, make_stand_in_model
+from bench_common import SCRIPT_DIR, print_table
+
+
+def bench_session(args) -> dict:
+    """每个模型冷启动 (图优化并保存) 与热启动 (加载已保存的优化图) 创建会话的耗时"""
+    sys.path.insert(0, SCRIPT_DIR)
+    from ai_tagger import AITagger, SessionProfile
+
+    tagger = AITagger(args.models_dir)
+    models = args.model or sorted(tagger.get_available_models())
+    if not models:
+        raise SystemExit(f"error:目录中没有模型: {args.models_dir}")
+
+    def build(model_name, profile):
+        tagger.session_profile = profile
+        start = time.perf_counter()
+        tagger._create_session(model_name)
+        return time.perf_counter() - start
+
+    rows = []
+    for model_name in models:
+        model_path = os.path.join(tagger.models_dir, f"{model_name}.onnx")
+        profile = SessionProfile(graph_optimization=args.graph_opt, intra_op_threads=args.intra_threads)
+        optimized_path = profile.optimized_model_path(model_path, tagger.providers[0])
+
+        no_cache = [build(model_name, profile._replace(cache_optimized_model=False)) for _ in range(args.repeat)]
+        cold = []
+        for _ in range(args.repeat):
+            if optimized_path and os.path.exists(optimized_path):
+                os.remove(optimized_path)
+            cold.append(build(model_name, profile))
+        warm = [build(model_name, profile) for _ in range(args.repeat)]
+
+        row = {"model": model_name, "size_mb": round(os.path.getsize(model_path) / 1024 ** 2, 1)}
+        for name, values in (("no_cache", no_cache), ("cold", cold), ("warm", warm)):
+            row[f"{name}_ms"] = round(float(np.median(values)) * 1000, 1)
+        row["speedup"] = round(row["cold_ms"] / max(row["warm_ms"], 1e-6), 2)
+        rows.append(row)
+
+    print_table(f"创建推理会话耗时 (中位数, {args.repeat} 次, 优化级别 {args.graph_opt}, 后端 {tagger.providers[0]})",
+                rows, ["model", "size_mb", "no_cache_ms", "cold_ms", "warm_ms", "speedup"])
+    return {"providers": tagger.providers, "graph_opt": args.graph_opt, "results": rows}
+
+
+def bench_shared_weights(args) -> dict:
+    """
+    同时运行 N 个 ai_tagger.py --serve 进程时的内存占用: 普通加载与 --shared-weights 对比
+
+    RSS 包含与其它进程共用的页, PSS 把共用页按进程数平摊, 各进程 PSS 之和接近实际占用的物理内存;
+    USS 是进程独占的内存。system_mb 是启动这些进程前后系统已用内存 (不含页缓存) 的差值。
+    """
+    import tempfile
+    import psutil
+
+    script = os.path.join(SCRIPT_DIR, "ai_tagger.py")
+    rows = []
+    reference = None
+    with tempfile.TemporaryDirectory() as tmp:
+        model = make_stand_in_model(tmp, hidden=args.hidden)
+        model_mb = os.path.getsize(os.path.join(tmp, f"{model}.onnx")) / 1024 ** 2
+        images = []
+        for i in range(args.requests):
+            images.append(os.path.join(tmp, f"image-{i}.jpg"))
+            make_photo(640, 512, seed=i).save(images[-1], quality=90)
+
+        def request(proc, request_id, image):
+            proc.stdin.write(json.dumps({"id": request_id, "image": image, "model": model}) + "\n")
+            proc.stdin.flush()
+            response = json.loads(proc.stdout.readline())
+            if "error" in response:
+                raise SystemExit(f"error:打标签失败: {response['error']}")
+            return response["tags"]
+
+        for shared in (False, True):
+            command = [sys.executable, "-u", script, "--serve", "--models-dir", tmp,
+                       "--intra-threads", str(args.intra_threads)]
+            if shared:
+                command.append("--shared-weights")
+                # 拆分模型只在第一次加载时进行, 不计入内存和延迟
+                proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, text=True, encoding="utf-8")
+                proc.stdout.readline()
+                request(proc, 0, images[0])
+                proc.stdin.close()
+                proc.wait()
+            for workers in args.workers:
+                baseline = psutil.virtual_memory().used
+                procs = [subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                          stderr=subprocess.DEVNULL, text=True, encoding="utf-8")
+                         for _ in range(workers)]
+                try:
+                    for proc in procs:
+                        if json.loads(proc.stdout.readline()).get("event") != "ready":
+                            raise SystemExit("error:服务启动失败")
+                    outputs = [request(proc, 0, images[0]) for proc in procs]
+                    memory = [psutil.Process(proc.pid).memory_full_info() for proc in procs]
+                    system = psutil.virtual_memory().used - baseline
+                    latencies = []
+                    for i, image in enumerate(images):
+                        start = time.perf_counter()
+                        tags = request(procs[i % workers], i, image)
+                        latencies.append(time.perf_counter() - start)
+                        if i == 0:
+                            outputs.append(tags)
+                finally:
+                    for proc in procs:
+                        proc.stdin.close()
+                    for proc in procs:
+                        proc.wait()
+                reference = reference or outputs[0]
+                rows.append({
+                    "mode": "shared" if shared else "normal",
+                    "workers": workers,
+                    "rss_mb": round(sum(m.rss for m in memory) / workers / 1024 ** 2, 1),
+                    "uss_mb": round(sum(m.uss for m in memory) / workers / 1024 ** 2, 1),
+                    "pss_mb": round(sum(m.pss for m in memory) / workers / 1024 ** 2, 1),
+                    "total_pss_mb": round(sum(m.pss for m in memory) / 1024 ** 2, 1),
+                    "system_mb": round(system / 1024 ** 2, 1),
+                    "p50_ms": round(float(np.median(latencies)) * 1000, 1),
+                    "same_tags": all(
+                        [tag for tag, _ in output] == [tag for tag, _ in reference]
+                        and np.allclose([score for _, score in output], [score for _, score in reference], atol=1e-4)
+                        for output in outputs
+                    ),
+                })
+
+    print_table(f"多进程内存占用 (模型 {model_mb:.0f} MB, 每进程平均 RSS/USS/PSS)", rows,
+                ["mode", "workers", "rss_mb", "uss_mb", "pss_mb", "total_pss_mb", "system_mb", "p50_ms", "same_tags"])
+    return {"model_mb": round(model_mb, 1), "results": rows}
+
+
+def add_parsers(subparsers):
+    """注册 session / shared-weights 子命令"""
+    session_parser = subparsers.add_parser("session", help="创建推理会话的冷启动/热启动耗时")
+    session_parser.add_argument("--models-dir", default=os.path.join(SCRIPT_DIR, "..", "models"))
+    session_parser.add_argument("--model", action="append", help="只测试指定模型, 可重复; 默认测试目录下所有模型")
+    session_parser.add_argument("--graph-opt", choices=("basic", "extended", "all"), default="all")
+    session_parser.add_argument("--intra-threads", type=int, default=0)
+    session_parser.add_argument("--repeat", type=int, default=3)
+    session_parser.set_defaults(func=bench_session)
+
+    shared_parser = subparsers.add_parser("shared-weights", help="多个打标签进程的内存占用: 普通加载与共享权重对比")
+    shared_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="同时运行的进程数")
+    shared_parser.add_argument("--hidden", type=int, default=8192, help="替身模型隐藏层宽度, 决定模型文件大小")
+    shared_parser.add_argument("--requests", type=int, default=20, help="测量延迟的请求数")
+    shared_parser.add_argument("--intra-threads", type=int, default=1)
+    shared_parser.set_defaults(func=bench_shared_weights)
@@ -0,0 +1,396 @@
+"""
+各脚本入口的性能测试: 冷/热启动、组合分析和导入耗时预算
+
+用法:
+    python benchmark.py suite [--entries tagger color metadata analyze] [--baseline baseline.json]
+    python benchmark.py analyze [--images <图片目录>]
+    python benchmark.py importtime [--entries ai_tagger ...] [--record]
+"""
+import os
+import sys
+import json
+import time
+import subprocess
+from typing import List
+
+import numpy as np
+
+from bench_fixtures import make_corpus, make_stand_in_model, STAND_IN_MODEL
+from bench_common import SCRIPT_DIR, list_images, summarize, print_table, run_measured, read_bytes
+
+
+# suite: 各脚本入口, 冷启动时的命令行参数与 script.cjs 调用方式一致
+SUITE_ENTRIES = {
+    "tagger": "ai_tagger.py",
+    "color": "get_main_color.py",
+    "metadata": "read_image_metadata.py",
+    "analyze": "analyze_image.py",
+}
+
+
+def suite_command(entry: str, path: str, args) -> List[str]:
+    script = os.path.join(SCRIPT_DIR, SUITE_ENTRIES[entry])
+    if entry == "tagger":
+        return [script, path, args.model, args.models_dir]
+    if entry == "analyze":
+        return [script, path, "--model", args.model, "--models-dir", args.models_dir]
+    return [script, path]
+
+
+def suite_function(entry: str, args):
+    """warm 模式在进程内调用的函数, 模块导入和模型加载算作准备阶段"""
+    import contextlib
+
+    with contextlib.redirect_stdout(sys.stderr):
+        if entry == "tagger":
+            from ai_tagger import AITagger
+            tagger = AITagger(args.models_dir)
+            tagger._load_model(args.model)
+            return lambda path: tagger.tag_image(path, model_name=args.model)
+        if entry == "color":
+            from get_main_color import get_dominant_colors_kmeans
+            return lambda path: get_dominant_colors_kmeans(path, 10)
+        if entry == "analyze":
+            from analyze_image import ImageAnalyzer
+            analyzer = ImageAnalyzer(args.models_dir, tag_options={"model_name": args.model})
+            analyzer.tagger._load_model(args.model)
+            return analyzer.analyze
+        from read_image_metadata import read_metadata
+        from sd_parsers import ParserManager
+        parser_manager = ParserManager()
+        return lambda path: read_metadata(path, parser_manager)
+
+
+def bench_warm_entry(args) -> dict:
+    """suite 内部使用: 在独立进程中运行一个入口的 warm 测试, 结果写入 --result-file"""
+    import contextlib
+
+    with open(args.paths_file, encoding="utf-8") as f:
+        paths = json.load(f)
+    start = time.perf_counter()
+    function = suite_function(args.entry, args)
+    setup = time.perf_counter() - start
+
+    latencies = []
+    with contextlib.redirect_stdout(sys.stderr):
+        for _ in range(args.repeat):
+            for path in paths:
+                start = time.perf_counter()
+                function(path)
+                latencies.append(time.perf_counter() - start)
+
+    result = {"setup_s": round(setup, 3), "latencies": latencies}
+    with open(args.result_file, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+    return result
+
+
+def compare_baseline(rows: List[dict], baseline: dict, tolerance: float) -> List[dict]:
+    """与基准结果比较 p50/p95 延迟和吞吐, 变慢超过 tolerance (百分比) 记为回退"""
+    previous = {(row["entry"], row["mode"]): row for row in baseline.get("results", [])}
+    comparison = []
+    for row in rows:
+        old = previous.get((row["entry"], row["mode"]))
+        if old is None:
+            continue
+        item = {"entry": row["entry"], "mode": row["mode"]}
+        regressed = False
+        for key, higher_is_better in (("images_per_sec", True), ("p50_ms", False), ("p95_ms", False),
+                                      ("peak_rss_mb", False)):
+            if not old.get(key) or row.get(key) is None:
+                continue
+            change = (row[key] - old[key]) / old[key] * 100
+            item[f"{key}_change"] = f"{change:+.1f}%"
+            if (-change if higher_is_better else change) > tolerance:
+                regressed = True
+        item["regressed"] = regressed
+        comparison.append(item)
+    return comparison
+
+
+def bench_suite(args) -> dict:
+    """
+    各脚本入口在合成图片集上的冷启动 (每张图片启动一次进程) 与热启动 (进程内调用) 性能
+
+    未指定 --models-dir 时使用本地生成的小型模型, 不需要联网下载。
+    """
+    import tempfile
+    import platform
+
+    work_dir = args.work_dir or os.path.join(tempfile.gettempdir(), "image-management-bench")
+    corpus = make_corpus(os.path.join(work_dir, "corpus"), args.count, args.seed)
+    if not args.models_dir:
+        args.models_dir = os.path.join(work_dir, "models")
+        args.model = make_stand_in_model(args.models_dir)
+    paths = [entry["path"] for entry in corpus]
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        paths_file = os.path.join(tmp, "paths.json")
+        with open(paths_file, "w", encoding="utf-8") as f:
+            json.dump(paths, f)
+
+        for entry in args.entries:
+            # 冷启动: 与 script.cjs 相同, 每张图片启动一次 Python 进程
+            cold_paths = paths[:args.cold_limit]
+            latencies, peaks = [], []
+            for path in cold_paths:
+                elapsed, peak = run_measured(suite_command(entry, path, args), cwd=tmp)
+                latencies.append(elapsed)
+                peaks.append(peak)
+            rows.append({
+                "entry": entry,
+                "mode": "cold",
+                "images_per_sec": round(len(latencies) / sum(latencies), 2),
+                **summarize(latencies),
+                "peak_rss_mb": max(peaks) if None not in peaks else None,
+            })
+
+            # 热启动: 独立进程中导入模块、加载模型后逐张调用, 峰值内存不受其他入口影响
+            result_file = os.path.join(tmp, f"{entry}.json")
+            command = [os.path.join(SCRIPT_DIR, "benchmark.py"), "warm-entry", "--entry", entry,
+                       "--paths-file", paths_file, "--result-file", result_file, "--repeat", str(args.repeat),
+                       "--model", args.model, "--models-dir", args.models_dir]
+            _, peak = run_measured(command, cwd=tmp)
+            with open(result_file, encoding="utf-8") as f:
+                result = json.load(f)
+            latencies = result["latencies"]
+            rows.append({
+                "entry": entry,
+                "mode": "warm",
+                "images_per_sec": round(len(latencies) / sum(latencies), 2),
+                **summarize(latencies),
+                "peak_rss_mb": peak,
+                "setup_s": result["setup_s"],
+            })
+
+    print_table(f"脚本入口性能 ({len(paths)} 张合成图片, cold 取前 {args.cold_limit} 张)", rows,
+                ["entry", "mode", "count", "images_per_sec", "mean_ms", "p50_ms", "p95_ms", "p99_ms",
+                 "peak_rss_mb", "setup_s"])
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "corpus": {"count": args.count, "seed": args.seed},
+        "model": args.model,
+        "results": rows,
+    }
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            comparison = compare_baseline(rows, json.load(f), args.tolerance)
+        columns = ["entry", "mode", "images_per_sec_change", "p50_ms_change", "p95_ms_change",
+                   "peak_rss_mb_change", "regressed"]
+        print_table(f"与基准 {args.baseline} 对比 (变慢超过 {args.tolerance}% 记为回退)", comparison, columns)
+        report["baseline_comparison"] = comparison
+        if args.fail_on_regression and any(item["regressed"] for item in comparison):
+            report["regressed"] = True
+    return report
+
+
+def bench_analyze(args) -> dict:
+    """
+    组合分析 (analyze_image.py) 与分别调用标签、主色、元数据三个入口的对比
+
+    cold: 与 script.cjs 相同, 分别方式每张图片启动三个进程, 组合方式启动一个;
+    warm: 进程内逐张调用, read_mb 为每张图片读取的字节数 (/proc/self/io, 含 open 和解码时的读取)。
+    一致性以分别调用的结果为基准: 标签集合的 Jaccard 相似度、主色的 palette_distance (ΔE)、元数据是否相同。
+    """
+    import tempfile
+    import contextlib
+    from get_main_color import palette_distance
+
+    work_dir = args.work_dir or os.path.join(tempfile.gettempdir(), "image-management-bench")
+    if args.images:
+        paths = list_images(args.images, args.limit)
+    else:
+        paths = [entry["path"] for entry in make_corpus(os.path.join(work_dir, "corpus"), args.count, args.seed)]
+    if not args.models_dir:
+        args.models_dir = os.path.join(work_dir, "models")
+        args.model = make_stand_in_model(args.models_dir)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        separate, combined = [], []
+        for path in paths[:args.cold_limit]:
+            separate.append(sum(run_measured(suite_command(entry, path, args), cwd=tmp)[0]
+                                for entry in ("tagger", "color", "metadata")))
+            combined.append(run_measured(suite_command("analyze", path, args), cwd=tmp)[0])
+        rows.append({"mode": "cold", "method": "separate (3 进程)", **summarize(separate)})
+        rows.append({"mode": "cold", "method": "combined", **summarize(combined)})
+
+    functions = {entry: suite_function(entry, args) for entry in ("tagger", "color", "metadata", "analyze")}
+    results = {"separate": [], "combined": []}
+    latencies = {"separate": [], "combined": []}
+    read = {"separate": 0, "combined": 0}
+    with contextlib.redirect_stdout(sys.stderr):
+        for path in paths:
+            for method in ("separate", "combined"):
+                before, start = read_bytes(), time.perf_counter()
+                if method == "separate":
+                    (tags, _), colors, metadata = (functions[entry](path) for entry in ("tagger", "color", "metadata"))
+                    result = {"tags": [[tag, float(score)] for tag, score in tags], "colors": colors,
+                              "metadata": metadata}
+                else:
+                    result = functions["analyze"](path)
+                latencies[method].append(time.perf_counter() - start)
+                if before is not None:
+                    read[method] += read_bytes() - before
+                results[method].append(result)
+
+    for method in ("separate", "combined"):
+        row = {"mode": "warm", "method": "separate (进程内)" if method == "separate" else method,
+               **summarize(latencies[method])}
+        if read_bytes() is not None:
+            row["read_mb"] = round(read[method] / len(paths) / 1024 ** 2, 3)
+        rows.append(row)
+
+    def tag_set(result):
+        return {tag for tag, _ in result.get("tags") or []}
+
+    jaccard = [len(tag_set(a) & tag_set(b)) / max(1, len(tag_set(a) | tag_set(b)))
+               for a, b in zip(results["combined"], results["separate"])]
+    delta_e = [palette_distance(a["colors"], b["colors"])
+               for a, b in zip(results["combined"], results["separate"]) if a.get("colors")]
+    agreement = {
+        "tags_jaccard_mean": round(float(np.mean(jaccard)), 4),
+        "tags_identical": sum(j == 1.0 for j in jaccard),
+        "colors_delta_e_mean": round(float(np.mean(delta_e)), 3) if delta_e else None,
+        "colors_delta_e_max": round(float(np.max(delta_e)), 3) if delta_e else None,
+        "metadata_identical": sum(json.dumps(a.get("metadata"), sort_keys=True, default=str) ==
+                                  json.dumps(b.get("metadata"), sort_keys=True, default=str)
+                                  for a, b in zip(results["combined"], results["separate"])),
+        "errors": sum("errors" in result or "error" in result for result in results["combined"]),
+        "images": len(paths),
+    }
+
+    print_table(f"组合分析 ({len(paths)} 张图片, cold 取前 {args.cold_limit} 张)", rows,
+                ["mode", "method", "mean_ms", "p50_ms", "p95_ms", "read_mb"])
+    print(f"\n与分别调用的一致性: {json.dumps(agreement, ensure_ascii=False)}")
+    return {"model": args.model, "results": rows, "agreement": agreement}
+
+
+# importtime: 各入口的导入耗时预算, 以及导入时和出错/--help 时不应加载的依赖
+IMPORT_BUDGET_FILE = os.path.join(SCRIPT_DIR, "import_budget.json")
+
+
+def import_times(command: List[str]):
+    """用 python -X importtime 运行, 返回 ({模块名: 累计导入耗时 ms}, stdout, 退出码)"""
+    process = subprocess.run([sys.executable, "-X", "importtime", *command], cwd=SCRIPT_DIR,
+                             capture_output=True, text=True, encoding="utf-8", errors="replace")
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if cumulative_us.strip().isdigit():
+            times[name.strip()] = int(cumulative_us) / 1000
+    return times, process.stdout, process.returncode
+
+
+def check_import_budget(module: str, budget: dict, repeat: int = 5):
+    """
+    检查一个入口的冷启动开销, 返回 (结果行, 不满足的项)
+
+    - 导入模块的累计耗时 (repeat 次取最小值) 不超过预算 budget_ms
+    - 导入时不加载 lazy 中列出的依赖, 不输出内容, 不替换 sys.stdout
+    - 以 error_args 运行脚本 (参数错误或 --help) 时同样不加载 lazy 中的依赖
+    """
+    probe = f"import sys; stdout = sys.stdout; import {module}; assert sys.stdout is stdout, 'sys.stdout 被替换'"
+    failures = []
+    samples = []
+    for _ in range(repeat):
+        times, stdout, returncode = import_times(["-c", probe])
+        if returncode != 0 or stdout:
+            failures.append(f"{module}: 导入时有输出或出错 (退出码 {returncode}): {stdout.strip()[:200]}")
+        samples.append(times.get(module, 0.0))
+    import_ms = round(min(samples), 1)
+    loaded = sorted({name.split(".")[0] for name in times} & set(budget.get("lazy", [])))
+    error_times, _, _ = import_times([f"{module}.py", *budget.get("error_args", [])])
+    error_loaded = sorted({name.split(".")[0] for name in error_times} & set(budget.get("lazy", [])))
+
+    if import_ms > budget["budget_ms"]:
+        failures.append(f"{module}: 导入耗时 {import_ms} ms 超出预算 {budget['budget_ms']} ms")
+    if loaded:
+        failures.append(f"{module}: 导入时加载了 {', '.join(loaded)}")
+    if error_loaded:
+        failures.append(f"{module}: 以 {' '.join(budget.get('error_args', [])) or '(无参数)'} 运行时加载了 "
+                        f"{', '.join(error_loaded)}")
+    row = {"entry": module, "import_ms": import_ms, "budget_ms": budget["budget_ms"],
+           "loaded_on_import": loaded, "loaded_on_error": error_loaded}
+    return row, failures
+
+
+def bench_importtime(args) -> dict:
+    """检查 import_budget.json 中各入口的冷启动开销, 检查项见 check_import_budget"""
+    with open(args.budget_file, encoding="utf-8") as f:
+        budgets = json.load(f)
+
+    rows, failures = [], []
+    for module, budget in budgets.items():
+        if args.entries and module not in args.entries:
+            continue
+        row, entry_failures = check_import_budget(module, budget, args.repeat)
+        rows.append(row)
+        failures.extend(entry_failures)
+
+    print_table(f"导入耗时 ({args.repeat} 次取最小值)", rows,
+                ["entry", "import_ms", "budget_ms", "loaded_on_import", "loaded_on_error"])
+    if args.record:
+        for row in rows:
+            budgets[row["entry"]]["budget_ms"] = int(row["import_ms"] * args.headroom) + 1
+        with open(args.budget_file, "w", encoding="utf-8") as f:
+            json.dump(budgets, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"\n已按 {args.headroom} 倍余量更新预算: {args.budget_file}")
+        failures = [f for f in failures if "超出预算" not in f]
+    for failure in failures:
+        print(f"error:{failure}")
+    return {"entries": rows, "failures": failures, "regressed": bool(failures)}
+
+
+def add_parsers(subparsers):
+    """注册 suite / warm-entry / analyze / importtime 子命令"""
+    suite_parser = subparsers.add_parser("suite", help="各脚本入口在合成图片集上的冷/热启动性能")
+    suite_parser.add_argument("--entries", nargs="+", choices=list(SUITE_ENTRIES), default=list(SUITE_ENTRIES))
+    suite_parser.add_argument("--count", type=int, default=60, help="合成图片数量")
+    suite_parser.add_argument("--seed", type=int, default=0)
+    suite_parser.add_argument("--cold-limit", type=int, default=10, help="冷启动测试的图片数量")
+    suite_parser.add_argument("--repeat", type=int, default=1, help="热启动测试重复遍历图片集的次数")
+    suite_parser.add_argument("--work-dir", help="合成图片和模型的缓存目录, 默认在系统临时目录下")
+    suite_parser.add_argument("--model", default=STAND_IN_MODEL)
+    suite_parser.add_argument("--models-dir", help="使用已下载的模型, 默认生成本地小型模型")
+    suite_parser.add_argument("--baseline", help="与之前 --output 保存的结果对比")
+    suite_parser.add_argument("--tolerance", type=float, default=10.0, help="允许的变慢百分比")
+    suite_parser.add_argument("--fail-on-regression", action="store_true", help="有回退时以退出码 1 结束")
+    suite_parser.set_defaults(func=bench_suite)
+
+    warm_parser = subparsers.add_parser("warm-entry")
+    warm_parser.add_argument("--entry", choices=list(SUITE_ENTRIES), required=True)
+    warm_parser.add_argument("--paths-file", required=True)
+    warm_parser.add_argument("--result-file", required=True)
+    warm_parser.add_argument("--repeat", type=int, default=1)
+    warm_parser.add_argument("--model", default=STAND_IN_MODEL)
+    warm_parser.add_argument("--models-dir")
+    warm_parser.set_defaults(func=bench_warm_entry)
+
+    analyze_parser = subparsers.add_parser("analyze", help="组合分析与分别调用三个入口的耗时、读取量和一致性")
+    analyze_parser.add_argument("--images", help="图片目录, 默认使用合成图片集")
+    analyze_parser.add_argument("--limit", type=int)
+    analyze_parser.add_argument("--count", type=int, default=60, help="合成图片数量")
+    analyze_parser.add_argument("--seed", type=int, default=0)
+    analyze_parser.add_argument("--cold-limit", type=int, default=5, help="冷启动测试的图片数量")
+    analyze_parser.add_argument("--work-dir", help="合成图片和模型的缓存目录, 默认在系统临时目录下")
+    analyze_parser.add_argument("--model", default=STAND_IN_MODEL)
+    analyze_parser.add_argument("--models-dir", help="使用已下载的模型, 默认生成本地小型模型")
+    analyze_parser.set_defaults(func=bench_analyze)
+
+    import_parser = subparsers.add_parser("importtime", help="各入口的导入耗时预算和延迟加载检查, 不满足时退出码为 1")
+    import_parser.add_argument("--entries", nargs="+", help="只检查指定模块, 默认检查预算文件中的所有入口")
+    import_parser.add_argument("--budget-file", default=IMPORT_BUDGET_FILE)
+    import_parser.add_argument("--repeat", type=int, default=5)
+    import_parser.add_argument("--record", action="store_true", help="按本机测量结果更新预算文件")
+    import_parser.add_argument("--headroom", type=float, default=1.5, help="--record 时预算相对测量值的倍数")
+    import_parser.set_defaults(func=bench_importtime)
@@ -0,0 +1,469 @@
+"""
+打标签相关的性能测试: 常驻服务、批量推理、前后处理、级联、多进程和相似图片索引
+
+用法:
+    python benchmark.py serve --images <图片目录> --model <模型名称> --models-dir <模型目录>
+    python benchmark.py batch --images <图片目录> --model <模型名称> --models-dir <模型目录>
+    python benchmark.py postprocess
+    python benchmark.py preprocess [--images <图片目录> --model <模型名称> --models-dir <模型目录>]
+    python benchmark.py similarity [--vectors 100000]
+    python benchmark.py cascade --images <图片目录> --fast-model <小模型> --model <大模型> --models-dir <模型目录>
+    python benchmark.py workers --images <图片目录> --model <模型名称> --models-dir <模型目录> [--workers 1 2 4]
+"""
+import os
+import sys
+import json
+import time
+import subprocess
+
+import numpy as np
+
+from bench_fixtures import make_photo
+from bench_common import SCRIPT_DIR, list_images, summarize, print_table
+
+
+def bench_serve(args) -> dict:
+    """对比每张图片启动一次进程 与 ai_tagger.py --serve 常驻进程 的延迟"""
+    images = list_images(args.images, args.limit)
+    if not images:
+        raise SystemExit(f"error:目录中没有图片: {args.images}")
+    script = os.path.join(SCRIPT_DIR, "ai_tagger.py")
+
+    # 1. 每张图片一个进程 (script.cjs 原有方式)
+    spawn_latencies = []
+    for path in images:
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-u", script, path, args.model, args.models_dir],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False,
+        )
+        spawn_latencies.append(time.perf_counter() - start)
+
+    # 2. 常驻进程, 逐个请求往返
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-u", script, "--serve", "--models-dir", args.models_dir, "--workers", str(args.workers)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        text=True, encoding="utf-8",
+    )
+    ready = json.loads(proc.stdout.readline())
+    if ready.get("event") != "ready":
+        raise SystemExit(f"error:服务启动失败: {ready}")
+    startup = time.perf_counter() - start
+
+    def request(request_id, path):
+        proc.stdin.write(json.dumps({"id": request_id, "image": path, "model": args.model}) + "\n")
+        proc.stdin.flush()
+
+    serve_latencies = []
+    errors = 0
+    for i, path in enumerate(images):
+        start = time.perf_counter()
+        request(i, path)
+        response = json.loads(proc.stdout.readline())
+        serve_latencies.append(time.perf_counter() - start)
+        errors += "error" in response
+
+    # 3. 常驻进程, 所有请求同时发出
+    start = time.perf_counter()
+    for i, path in enumerate(images):
+        request(i, path)
+    for _ in images:
+        proc.stdout.readline()
+    pipelined = time.perf_counter() - start
+
+    proc.stdin.close()
+    proc.wait()
+
+    report = {
+        "images": len(images),
+        "model": args.model,
+        "per_spawn": summarize(spawn_latencies),
+        "serve_startup_ms": round(startup * 1000, 2),
+        "serve": summarize(serve_latencies),
+        "serve_errors": errors,
+        "serve_pipelined_images_per_sec": round(len(images) / pipelined, 2),
+    }
+    rows = [
+        {"mode": "per-spawn", **report["per_spawn"]},
+        {"mode": "serve", **report["serve"]},
+    ]
+    print_table("ai_tagger 单张延迟", rows, ["mode", "count", "mean_ms", "p50_ms", "p95_ms", "p99_ms"])
+    print(f"\nserve 启动耗时: {report['serve_startup_ms']} ms, "
+          f"并发吞吐: {report['serve_pipelined_images_per_sec']} 张/秒")
+    return report
+
+
+def bench_batch(args) -> dict:
+    """AITagger.tag_images 在不同 batch_size 下的 CPU 吞吐"""
+    sys.path.insert(0, SCRIPT_DIR)
+    from ai_tagger import AITagger
+
+    images = list_images(args.images, args.limit)
+    if not images:
+        raise SystemExit(f"error:目录中没有图片: {args.images}")
+    tagger = AITagger(args.models_dir)
+    tagger.providers = ["CPUExecutionProvider"]
+    loaded = tagger._load_model(args.model)
+    height = loaded.session.get_inputs()[0].shape[1]
+    tensors = [tagger.preprocess_image(path, height) for path in images]
+
+    rows = []
+    for batch_size in args.batch_sizes:
+        # 端到端 (读取 + 预处理 + 推理 + 后处理)
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            tagger.tag_images(images, batch_size=batch_size, model_name=args.model)
+        total = time.perf_counter() - start
+
+        # 仅推理
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for i in range(0, len(tensors), batch_size):
+                tagger._run(loaded.session, tensors[i:i + batch_size])
+        inference = time.perf_counter() - start
+
+        count = len(images) * args.repeat
+        rows.append({
+            "batch_size": batch_size,
+            "images_per_sec": round(count / total, 2),
+            "inference_images_per_sec": round(count / inference, 2),
+        })
+
+    print_table(f"tag_images 吞吐 ({args.model}, CPU, {len(images)} 张 x {args.repeat})",
+                rows, ["batch_size", "images_per_sec", "inference_images_per_sec"])
+    return {"images": len(images), "model": args.model, "repeat": args.repeat, "results": rows}
+
+
+def bench_postprocess(args) -> dict:
+    """标签后处理: 逐标签 Python 实现 与 NumPy 实现 的对比 (合成标签表, 不需要模型)"""
+    sys.path.insert(0, SCRIPT_DIR)
+    from ai_tagger import AITagger, LabelTable
+    from tests.legacy import legacy_postprocess
+
+    rng = np.random.default_rng(0)
+    names = [f"tag_{i}" for i in range(args.labels)]
+    general_index, character_index = 4, int(args.labels * 0.7)
+    labels = LabelTable.create(names, general_index, character_index)
+    # 模拟真实分布: 绝大多数标签概率很低
+    probs = (rng.random((args.samples, args.labels)) ** 8).astype(np.float32)
+    exclude_tags = ", ".join(names[i] for i in range(10, 200, 7))
+    options = {"threshold": 0.35, "character_threshold": 0.85, "exclude_tags": exclude_tags, "trailing_comma": False}
+
+    tagger = AITagger.__new__(AITagger)
+    for row in probs:
+        expected = legacy_postprocess(names, general_index, character_index, row, **options)
+        actual = tagger.postprocess(row, labels, replace_underscore=False, **options)
+        if expected != actual:
+            raise SystemExit("error:新旧后处理结果不一致")
+
+    def timed(fn):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for row in probs:
+                fn(row)
+        return (time.perf_counter() - start) / (args.repeat * len(probs))
+
+    legacy = timed(lambda row: legacy_postprocess(names, general_index, character_index, row, **options))
+    vectorized = timed(lambda row: tagger.postprocess(row, labels, replace_underscore=False, **options))
+    rows = [
+        {"path": "python", "us_per_image": round(legacy * 1e6, 1)},
+        {"path": "numpy", "us_per_image": round(vectorized * 1e6, 1)},
+    ]
+    print_table(f"标签后处理 ({args.labels} 个标签, 结果一致)", rows, ["path", "us_per_image"])
+    return {"labels": args.labels, "results": rows, "speedup": round(legacy / vectorized, 2)}
+
+
+def bench_preprocess(args) -> dict:
+    """图片预处理: 旧实现 与 draft 解码/单次缩放 的每百万像素耗时, 以及标签一致性"""
+    import tempfile
+    sys.path.insert(0, SCRIPT_DIR)
+    from ai_tagger import AITagger
+    from tests.legacy import legacy_preprocess
+
+    tagger = AITagger.__new__(AITagger)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for megapixels in args.megapixels:
+            width = int((megapixels * 1e6 * 1.5) ** 0.5)
+            height = int(width / 1.5)
+            image = make_photo(width, height, seed=megapixels)
+            for ext in ("jpg", "png"):
+                path = os.path.join(tmp, f"{megapixels}.{ext}")
+                image.save(path, quality=90) if ext == "jpg" else image.save(path)
+                timings = {}
+                for name, fn in (("legacy", legacy_preprocess), ("fast", tagger.preprocess_image)):
+                    start = time.perf_counter()
+                    for _ in range(args.repeat):
+                        fn(path, args.size)
+                    timings[name] = (time.perf_counter() - start) / args.repeat
+                mp = width * height / 1e6
+                rows.append({
+                    "format": ext,
+                    "megapixels": round(mp, 1),
+                    "legacy_ms": round(timings["legacy"] * 1000, 1),
+                    "fast_ms": round(timings["fast"] * 1000, 1),
+                    "legacy_ms_per_mp": round(timings["legacy"] * 1000 / mp, 1),
+                    "fast_ms_per_mp": round(timings["fast"] * 1000 / mp, 1),
+                })
+    print_table(f"预处理耗时 (目标尺寸 {args.size})", rows,
+                ["format", "megapixels", "legacy_ms", "fast_ms", "legacy_ms_per_mp", "fast_ms_per_mp"])
+    report = {"size": args.size, "timings": rows}
+
+    if args.images:
+        report["fidelity"] = compare_preprocess_tags(args, legacy_preprocess)
+    return report
+
+
+def compare_preprocess_tags(args, reference_preprocess) -> dict:
+    """用同一模型分别对新旧预处理结果推理, 比较标签集合与概率差异"""
+    from ai_tagger import AITagger
+
+    tagger = AITagger(args.models_dir)
+    loaded = tagger._load_model(args.model)
+    height = loaded.session.get_inputs()[0].shape[1]
+    options = {"threshold": tagger.defaults["threshold"],
+               "character_threshold": tagger.defaults["character_threshold"],
+               "exclude_tags": "", "replace_underscore": False, "trailing_comma": False}
+
+    agree = precision = recall = drift = 0.0
+    images = list_images(args.images, args.limit)
+    for path in images:
+        reference = tagger._run(loaded.session, [reference_preprocess(path, height)])[0]
+        fast = tagger._run(loaded.session, [tagger.preprocess_image(path, height)])[0]
+        expected = {tag for tag, _ in tagger.postprocess(reference, loaded.labels, **options)[0]}
+        actual = {tag for tag, _ in tagger.postprocess(fast, loaded.labels, **options)[0]}
+        agree += expected == actual
+        precision += len(expected & actual) / len(actual) if actual else 1.0
+        recall += len(expected & actual) / len(expected) if expected else 1.0
+        drift += float(np.abs(reference - fast).mean())
+
+    count = max(1, len(images))
+    fidelity = {
+        "images": len(images),
+        "identical_tag_sets": round(agree / count, 4),
+        "precision": round(precision / count, 4),
+        "recall": round(recall / count, 4),
+        "mean_abs_prob_drift": round(drift / count, 6),
+    }
+    print_table("标签一致性 (以旧实现为基准)", [fidelity], list(fidelity.keys()))
+    return fidelity
+
+
+def tag_agreement(results, reference) -> dict:
+    """以 reference 的标签为基准, 计算标签集合的 precision / recall 和完全一致的图片比例"""
+    matched = predicted = expected = exact = 0
+    for result, ref in zip(results, reference):
+        tags = {tag for tag, _ in result.tags}
+        ref_tags = {tag for tag, _ in ref.tags}
+        matched += len(tags & ref_tags)
+        predicted += len(tags)
+        expected += len(ref_tags)
+        exact += tags == ref_tags
+    return {
+        "tag_precision": round(matched / predicted, 4) if predicted else 1.0,
+        "tag_recall": round(matched / expected, 4) if expected else 1.0,
+        "exact_match": round(exact / max(1, len(reference)), 4),
+    }
+
+
+def bench_cascade(args) -> dict:
+    """级联模式: 不同 band 下升级到大模型的比例、相对只用大模型的加速比和标签一致性"""
+    sys.path.insert(0, SCRIPT_DIR)
+    from ai_tagger import AITagger, CascadeStats
+
+    images = list_images(args.images, args.limit)
+    if not images:
+        raise SystemExit(f"error:目录中没有图片: {args.images}")
+    tagger = AITagger(args.models_dir)
+    # 预热两个模型, 避免把会话创建计入耗时
+    tagger.tag_images(images[:1], model_name=args.model)
+    tagger.tag_images(images[:1], model_name=args.fast_model)
+
+    start = time.perf_counter()
+    reference = tagger.tag_images(images, batch_size=args.batch_size, model_name=args.model)
+    heavy_time = time.perf_counter() - start
+
+    rows = [{"mode": f"{args.model} only", "escalation_rate": 1.0, "seconds": round(heavy_time, 3),
+             "speedup": 1.0, **tag_agreement(reference, reference)}]
+    for band in args.bands:
+        tagger.cascade_stats = CascadeStats()
+        start = time.perf_counter()
+        results = tagger.tag_images_cascade(images, args.fast_model, model_name=args.model, band=band,
+                                            character_candidate=args.character_candidate,
+                                            batch_size=args.batch_size)
+        elapsed = time.perf_counter() - start
+        stats = tagger.cascade_stats.stats()
+        rows.append({
+            "mode": f"cascade band={band}",
+            "escalation_rate": stats["escalation_rate"],
+            "uncertain": stats["uncertain"],
+            "character_candidates": stats["character_candidates"],
+            "seconds": round(elapsed, 3),
+            "speedup": round(heavy_time / elapsed, 2),
+            **tag_agreement(results, reference),
+        })
+
+    print_table(f"级联打标签 ({len(images)} 张图片, 小模型 {args.fast_model}, 大模型 {args.model}, "
+                f"角色候选阈值 {args.character_candidate})", rows,
+                ["mode", "escalation_rate", "uncertain", "character_candidates", "seconds", "speedup",
+                 "tag_precision", "tag_recall", "exact_match"])
+    return {"fast_model": args.fast_model, "model": args.model, "images": len(images), "results": rows}
+
+
+def bench_workers(args) -> dict:
+    """ai_tagger.py --dir --workers N 的吞吐随进程数的变化 (包含进程启动和模型加载)"""
+    import tempfile
+
+    images = list(list_images(args.images))
+    if not images:
+        raise SystemExit(f"error:目录中没有图片: {args.images}")
+    cpu_count = os.cpu_count() or 1
+    counts = args.workers or sorted({1, *(n for n in (2, 4, 8, 16, 32) if n < cpu_count), cpu_count})
+    script = os.path.join(SCRIPT_DIR, "ai_tagger.py")
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in counts:
+            output = os.path.join(tmp, f"workers-{workers}.ndjson")
+            command = [sys.executable, script, "--dir", args.images, "--model", args.model,
+                       "--models-dir", args.models_dir, "--workers", str(workers),
+                       "--batch-size", str(args.batch_size), "--output", output]
+            if args.pin_cores:
+                command.append("--pin-cores")
+            start = time.perf_counter()
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            elapsed = time.perf_counter() - start
+            with open(output, encoding="utf-8") as f:
+                count = sum(1 for _ in f)
+            rows.append({
+                "workers": workers,
+                "images": count,
+                "seconds": round(elapsed, 2),
+                "images_per_sec": round(count / elapsed, 2),
+            })
+    for row in rows:
+        row["scaling"] = round(row["images_per_sec"] / rows[0]["images_per_sec"], 2)
+
+    print_table(f"批量打标签吞吐 ({len(images)} 张图片, {cpu_count} 个 CPU 核心)", rows,
+                ["workers", "images", "seconds", "images_per_sec", "scaling"])
+    return {"cpu_count": cpu_count, "results": rows}
+
+
+def bench_similarity(args) -> dict:
+    """相似图片索引: 合成聚类向量上精确搜索与 IVF 近似搜索的召回率和延迟"""
+    import tempfile
+    sys.path.insert(0, SCRIPT_DIR)
+    from similarity_index import SimilarityIndex
+
+    rng = np.random.default_rng(0)
+    # 模拟标签概率: 每张图片属于一个主题, 主题决定一组高概率标签
+    topics = (rng.random((args.topics, args.labels)) ** 12).astype(np.float32)
+    assignment = rng.integers(0, args.topics, args.vectors)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = SimilarityIndex(tmp)
+        start = time.perf_counter()
+        for i in range(0, args.vectors, 10000):
+            rows = assignment[i:i + 10000]
+            probs = np.clip(topics[rows] + rng.normal(0, 0.05, (len(rows), args.labels)).astype(np.float32), 0, 1)
+            index.add([str(j) for j in range(i, i + len(rows))], probs)
+        insert = time.perf_counter() - start
+
+        queries = np.clip(topics[rng.integers(0, args.topics, args.queries)]
+                          + rng.normal(0, 0.05, (args.queries, args.labels)).astype(np.float32), 0, 1)
+
+        def run(nprobe):
+            latencies, results = [], []
+            for query in queries:
+                start = time.perf_counter()
+                results.append({image_id for image_id, _ in index.search(query, k=args.k, nprobe=nprobe)})
+                latencies.append(time.perf_counter() - start)
+            return results, latencies
+
+        exact, exact_latencies = run(None)
+        rows = [{"mode": "exact", "recall": 1.0, **summarize(exact_latencies)}]
+
+        start = time.perf_counter()
+        index.build_ivf()
+        build = time.perf_counter() - start
+        for nprobe in args.nprobe:
+            approx, latencies = run(nprobe)
+            recall = np.mean([len(a & e) / max(1, len(e)) for a, e in zip(approx, exact)])
+            rows.append({"mode": f"ivf nprobe={nprobe}", "recall": round(float(recall), 4), **summarize(latencies)})
+
+        start = time.perf_counter()
+        index.remove([str(j) for j in range(0, args.vectors, 10)])
+        remove = time.perf_counter() - start
+        stats = index.stats()
+
+    print_table(f"相似图片搜索 ({args.vectors} 个向量, recall@{args.k} 以精确搜索为基准)", rows,
+                ["mode", "recall", "mean_ms", "p50_ms", "p95_ms", "p99_ms"])
+    print(f"\n写入 {args.vectors} 个向量: {insert:.2f} 秒, 构建 IVF ({stats['nlist']} 簇): {build:.2f} 秒, "
+          f"删除 10%: {remove:.2f} 秒")
+    return {"vectors": args.vectors, "insert_s": round(insert, 3), "build_ivf_s": round(build, 3),
+            "remove_s": round(remove, 3), "results": rows}
+
+
+def add_parsers(subparsers):
+    """注册 serve / batch / postprocess / preprocess / cascade / workers / similarity 子命令"""
+    serve_parser = subparsers.add_parser("serve", help="对比逐张启动进程与常驻服务的标注延迟")
+    serve_parser.add_argument("--images", required=True, help="图片目录")
+    serve_parser.add_argument("--model", default="wd-v1-4-moat-tagger-v2")
+    serve_parser.add_argument("--models-dir", default=os.path.join(SCRIPT_DIR, "..", "models"))
+    serve_parser.add_argument("--limit", type=int, default=20)
+    serve_parser.add_argument("--workers", type=int, default=2)
+    serve_parser.set_defaults(func=bench_serve)
+
+    batch_parser = subparsers.add_parser("batch", help="tag_images 吞吐与 batch_size 的关系")
+    batch_parser.add_argument("--images", required=True, help="图片目录")
+    batch_parser.add_argument("--model", default="wd-v1-4-moat-tagger-v2")
+    batch_parser.add_argument("--models-dir", default=os.path.join(SCRIPT_DIR, "..", "models"))
+    batch_parser.add_argument("--limit", type=int, default=64)
+    batch_parser.add_argument("--repeat", type=int, default=3)
+    batch_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    batch_parser.set_defaults(func=bench_batch)
+
+    post_parser = subparsers.add_parser("postprocess", help="标签后处理新旧实现对比")
+    post_parser.add_argument("--labels", type=int, default=10000)
+    post_parser.add_argument("--samples", type=int, default=50)
+    post_parser.add_argument("--repeat", type=int, default=5)
+    post_parser.set_defaults(func=bench_postprocess)
+
+    pre_parser = subparsers.add_parser("preprocess", help="图片预处理新旧实现的耗时与标签一致性")
+    pre_parser.add_argument("--size", type=int, default=448, help="模型输入尺寸")
+    pre_parser.add_argument("--megapixels", type=int, nargs="+", default=[1, 4, 12, 24])
+    pre_parser.add_argument("--repeat", type=int, default=3)
+    pre_parser.add_argument("--images", help="可选, 用于标签一致性检查的图片目录")
+    pre_parser.add_argument("--model", default="wd-v1-4-moat-tagger-v2")
+    pre_parser.add_argument("--models-dir", default=os.path.join(SCRIPT_DIR, "..", "models"))
+    pre_parser.add_argument("--limit", type=int, default=200)
+    pre_parser.set_defaults(func=bench_preprocess)
+
+    cascade_parser = subparsers.add_parser("cascade", help="级联打标签的升级比例、加速比和标签一致性")
+    cascade_parser.add_argument("--images", required=True)
+    cascade_parser.add_argument("--fast-model", required=True)
+    cascade_parser.add_argument("--model", default="wd-v1-4-moat-tagger-v2")
+    cascade_parser.add_argument("--models-dir", default=os.path.join(SCRIPT_DIR, "..", "models"))
+    cascade_parser.add_argument("--bands", type=float, nargs="+", default=[0.02, 0.05, 0.1])
+    cascade_parser.add_argument("--character-candidate", type=float, default=0.5)
+    cascade_parser.add_argument("--batch-size", type=int, default=8)
+    cascade_parser.add_argument("--limit", type=int)
+    cascade_parser.set_defaults(func=bench_cascade)
+
+    workers_parser = subparsers.add_parser("workers", help="多进程批量打标签的吞吐随进程数的变化")
+    workers_parser.add_argument("--images", required=True)
+    workers_parser.add_argument("--model", default="wd-v1-4-moat-tagger-v2")
+    workers_parser.add_argument("--models-dir", default=os.path.join(SCRIPT_DIR, "..", "models"))
+    workers_parser.add_argument("--workers", type=int, nargs="+", help="要测试的进程数, 默认 1 到 CPU 核数")
+    workers_parser.add_argument("--batch-size", type=int, default=8)
+    workers_parser.add_argument("--pin-cores", action="store_true")
+    workers_parser.set_defaults(func=bench_workers)
+
+    sim_parser = subparsers.add_parser("similarity", help="相似图片索引的召回率与延迟")
+    sim_parser.add_argument("--vectors", type=int, default=100000)
+    sim_parser.add_argument("--labels", type=int, default=2000, help="合成概率向量的维度")
+    sim_parser.add_argument("--topics", type=int, default=500)
+    sim_parser.add_argument("--queries", type=int, default=100)
+    sim_parser.add_argument("-k", type=int, default=10)
+    sim_parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    sim_parser.set_defaults(func=bench_similarity)
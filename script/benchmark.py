@@ -0,0 +1,69 @@
+"""
+脚本性能测试工具
+
+用法:
+    python benchmark.py serve --images <图片目录> --model <模型名称> --models-dir <模型目录>
+    python benchmark.py batch --images <图片目录> --model <模型名称> --models-dir <模型目录>
+    python benchmark.py postprocess
+    python benchmark.py preprocess [--images <图片目录> --model <模型名称> --models-dir <模型目录>]
+    python benchmark.py similarity [--vectors 100000]
+    python benchmark.py suite [--entries tagger color metadata analyze] [--baseline baseline.json]
+    python benchmark.py cascade --images <图片目录> --fast-model <小模型> --model <大模型> --models-dir <模型目录>
+    python benchmark.py workers --images <图片目录> --model <模型名称> --models-dir <模型目录> [--workers 1 2 4]
+    python benchmark.py session --models-dir <模型目录> [--model <模型名称> ...]
+    python benchmark.py shared-weights [--workers 1 2 4] [--hidden 8192]
+    python benchmark.py colors [--images <图片目录>]
+    python benchmark.py palette [--images 100000]
+    python benchmark.py prompt-index [--images 100000]
+    python benchmark.py download [--size-mb 64] [--connections 8] [--throttle-mbps 16]
+    python benchmark.py icons [--font <字体文件>]
+    python benchmark.py analyze [--images <图片目录>]
+    python benchmark.py metadata [--images <图片目录>]
+    python benchmark.py metadata-batch [--files 5000] [--workers 1 4]
+    python benchmark.py importtime [--entries ai_tagger ...] [--record]
+
+session 对比每个模型创建推理会话的耗时:
+    no-cache  每次都做图优化 (不保存优化结果)
+    cold      第一次加载: 图优化并把结果保存到模型旁边
+    warm      之后加载: 直接读取保存的优化图
+
+importtime 用 python -X importtime 检查 import_budget.json 中各入口的导入耗时,
+以及导入、参数错误和 --help 时没有加载 onnxruntime / sklearn / sd_parsers 等重依赖,
+任一项不满足时退出码为 1, 可作为提交前检查。
+
+各子命令按领域分布在 bench_*.py 中 (打标签 bench_tagger, 推理会话 bench_runtime, 脚本入口 bench_suite,
+主色 bench_colors, 生成参数 bench_metadata, 下载 bench_download, 图标 bench_icons), 本文件只负责分派。
+"""
+import sys
+import json
+import argparse
+
+import bench_colors
+import bench_download
+import bench_icons
+import bench_metadata
+import bench_runtime
+import bench_suite
+import bench_tagger
+
+MODULES = (bench_tagger, bench_runtime, bench_suite, bench_colors, bench_metadata, bench_download, bench_icons)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="脚本性能测试")
+    parser.add_argument("--output", help="将结果写入 JSON 文件")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for module in MODULES:
+        module.add_parsers(subparsers)
+
+    args = parser.parse_args()
+    report = args.func(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if report.get("regressed"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,65 @@
+"""
+下载 WD14 标签模型 (.onnx 和 .csv)
+
+- 每个文件按 CHUNK_SIZE 分块, 用多个连接以 HTTP Range 并发下载到 <文件名>.part,
+  已完成的块记录在 <文件名>.part.json 中, 中断后再次运行只下载缺少的块
+- 下载完成后按清单校验大小和 SHA-256 (LFS 文件) 或 git blob SHA-1 (普通文件), 通过后才重命名为正式文件名,
+  正式文件存在即表示完整
+- 清单依次取自模型目录下的 manifest.json (校验通过的文件会写入)、下载源的文件列表接口、下载响应头
+  (包括跳转响应); 都没有摘要时只校验大小, 只有已知摘要且不一致时才算下载失败
+- 下载源的选择缓存在模型目录下, 不再每次查询 IP 所在地区; 下载失败时换用另一个下载源
+- .onnx 和 .csv 同时下载
+
+用法:
+    python download_models.py [模型名称] [--models-dir models] [--connections 8] [--host <下载源>]
+"""
 import os
+import re
 import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+from typing import Callable, Dict, List, Optional
+
 import requests
-from typing import List, Optional
 from tqdm import tqdm
 from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
 from requests.packages.urllib3.util.retry import Retry
 
+REPO = "honmo/wd14-collection"
+MIRRORS = {
+    "CN": "https://hf-mirror.com",
+    "default": "https://huggingface.co",
+}
+MIRROR_CACHE = ".mirror.json"
+MIRROR_CACHE_SECONDS = 7 * 24 * 3600
+MANIFEST = "manifest.json"
+CHUNK_SIZE = 8 * 1024 * 1024
+BUFFER_SIZE = 1024 * 1024
+# 连接中断时 urllib3 丢弃正在读取的块, 分块下载按较小的块读取, 中断后已收到的数据基本都能保留
+READ_SIZE = 64 * 1024
+DEFAULT_CONNECTIONS = 8
+CHUNK_RETRIES = 5
+TIMEOUT = 30
+
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+_SHA1 = re.compile(r"^[0-9a-f]{40}$")
+# 校验用的响应头; HuggingFace 只在 LFS 文件的 302 跳转响应上给出 X-Linked-*
+CHECKSUM_HEADERS = ("X-Linked-Etag", "X-Linked-Size", "ETag")
+
+
+class DownloadError(Exception):
+    """下载或校验失败, 可以换用其他下载源重试"""
+
+
+class RemoteFileNotFound(Exception):
+    """下载源返回 404, 模型不存在, 换用其他下载源也没有意义"""
+
+
 def get_country_code() -> str:
     """
     获取当前IP所在的国家代码
@@ -19,111 +73,372 @@ def get_country_code() -> str:
         # 如果请求失败，默认返回中国
         return 'CN'
 
-def get_base_url(country_code: str) -> str:
+
+def get_host(country_code: str) -> str:
+    """根据国家代码返回合适的下载源"""
+    return MIRRORS["CN"] if country_code == 'CN' else MIRRORS["default"]
+
+
+def file_url(host: str, filename: str) -> str:
+    return f"{host}/{REPO}/resolve/main/{filename}?download=true"
+
+
+def mirror_order(models_dir: str) -> List[str]:
+    """缓存的下载源在前, 缓存不存在或过期时按 IP 所在地区选择并写入缓存"""
+    preferred = None
+    try:
+        with open(os.path.join(models_dir, MIRROR_CACHE), encoding="utf-8") as f:
+            cached = json.load(f)
+        if time.time() - cached["checked_at"] < MIRROR_CACHE_SECONDS and cached["host"] in MIRRORS.values():
+            preferred = cached["host"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    if preferred is None:
+        country_code = get_country_code()
+        preferred = get_host(country_code)
+        print(f"当前地区: {country_code}")
+        save_mirror(models_dir, preferred)
+    return [preferred] + [host for host in MIRRORS.values() if host != preferred]
+
+
+def save_mirror(models_dir: str, host: str):
+    _write_json(os.path.join(models_dir, MIRROR_CACHE), {"host": host, "checked_at": time.time()})
+
+
+def _write_json(path: str, value):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(value, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def load_manifest(models_dir: str) -> Dict[str, dict]:
+    """本地清单: {文件名: {"size": 字节数, "sha256" 或 "git_sha1": 十六进制摘要}}"""
+    try:
+        with open(os.path.join(models_dir, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def fetch_remote_manifest(session: requests.Session, host: str) -> Dict[str, dict]:
+    """下载源的文件列表: LFS 文件给出 SHA-256, 普通文件给出 git blob SHA-1; 获取失败时返回空字典"""
+    try:
+        response = session.get(f"{host}/api/models/{REPO}/tree/main", timeout=TIMEOUT)
+        response.raise_for_status()
+        entries = response.json()
+    except (requests.RequestException, ValueError):
+        return {}
+    manifest = {}
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict) or entry.get("type") != "file":
+            continue
+        lfs = entry.get("lfs")
+        if lfs:
+            manifest[entry["path"]] = {"size": lfs["size"], "sha256": lfs["oid"]}
+        else:
+            manifest[entry["path"]] = {"size": entry["size"], "git_sha1": entry["oid"]}
+    return manifest
+
+
+def file_digest(path: str, expected: dict) -> str:
+    """按清单中给出的摘要类型计算文件摘要"""
+    if "sha256" in expected:
+        digest = hashlib.sha256()
+    else:
+        # git blob: sha1("blob <大小>\0" + 内容)
+        digest = hashlib.sha1(f"blob {os.path.getsize(path)}\0".encode())
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BUFFER_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_session(connections: int) -> requests.Session:
+    """连接池与并发连接数一致; 只重试建立连接, 读取中断由分块下载自己续传"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(4, connections * 2),
+                          max_retries=Retry(total=3, connect=3, read=0, status=0, backoff_factor=0.5))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class _PartState:
+    """<文件名>.part.json: 文件大小、分块大小和已完成的块, 与 .part 文件一起用于续传"""
+
+    def __init__(self, path: str, size: int, chunk_size: int):
+        self.path = path
+        self.size = size
+        self.chunk_size = chunk_size
+        self.done = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str, part_path: str, size: int, chunk_size: int) -> "_PartState":
+        state = cls(path, size, chunk_size)
+        try:
+            with open(path, encoding="utf-8") as f:
+                saved = json.load(f)
+            if (saved["size"] == size and saved["chunk_size"] == chunk_size
+                    and os.path.getsize(part_path) == size):
+                state.done = set(saved["done"])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return state
+
+    def mark_done(self, chunk: int):
+        with self._lock:
+            self.done.add(chunk)
+            _write_json(self.path, {"size": self.size, "chunk_size": self.chunk_size, "done": sorted(self.done)})
+
+
+def _probe(session: requests.Session, url: str):
     """
-    根据国家代码返回合适的下载基础URL
+    请求第一个字节, 返回 (跟随跳转后的 URL, 文件大小, 是否支持 Range, 校验用的响应头)
+
+    校验用的响应头取跳转链中最先出现的值: X-Linked-Etag 只在跳转响应上, 最终 (CDN) 响应的 ETag 不是文件摘要。
     """
-    if country_code == 'CN':
-        return "https://hf-mirror.com/honmo/wd14-collection/resolve/main"
-    else:
-        return "https://huggingface.co/honmo/wd14-collection/resolve/main"
+    with session.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=TIMEOUT) as response:
+        if response.status_code == 404:
+            raise RemoteFileNotFound(url)
+        response.raise_for_status()
+        headers = CaseInsensitiveDict()
+        for hop in [*response.history, response]:
+            for name in CHECKSUM_HEADERS:
+                if name in hop.headers and name not in headers:
+                    headers[name] = hop.headers[name]
+        match = re.match(r"bytes 0-0/(\d+)", response.headers.get("Content-Range", ""))
+        if response.status_code == 206 and match:
+            return response.url, int(match.group(1)), True, headers
+        return response.url, int(response.headers.get("Content-Length", 0)), False, headers
+
 
-def download_model(model_name: str, models_dir: str = "models") -> bool:
+def _fetch_range(session: requests.Session, url: str, part_path: str, start: int, end: int,
+                 progress: Callable[[int], None], stop: threading.Event):
     """
-    根据地区从HuggingFace或HF-Mirror下载模型文件
-    
+    下载 [start, end] 写入 .part 的对应位置
+
+    连接中断或响应不完整时从已写入的位置继续; 连续 CHUNK_RETRIES 次没有收到任何数据时放弃。
+    """
+    position = start
+    failures = 0
+    while True:
+        attempt_start = position
+        try:
+            with session.get(url, headers={"Range": f"bytes={position}-{end}"}, stream=True,
+                             timeout=TIMEOUT) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise DownloadError(f"下载源不支持分段下载: HTTP {response.status_code}")
+                with open(part_path, "r+b") as f:
+                    f.seek(position)
+                    for block in response.iter_content(READ_SIZE):
+                        if stop.is_set():
+                            return
+                        block = block[:end + 1 - position]
+                        f.write(block)
+                        position += len(block)
+                        progress(len(block))
+                        if position > end:
+                            break
+            if position > end:
+                return
+            error = DownloadError(f"响应不完整: {position - start}/{end + 1 - start} 字节")
+        except (requests.RequestException, OSError) as e:
+            error = e
+        if position > attempt_start:
+            failures = 0
+            continue
+        failures += 1
+        if failures >= CHUNK_RETRIES:
+            raise DownloadError(f"分块 {start}-{end} 下载失败: {error}")
+        if stop.wait(min(0.5 * 2 ** (failures - 1), 8)):
+            return
+
+
+def _fetch_whole(session: requests.Session, url: str, part_path: str, progress: Callable[[int], None]):
+    """下载源不支持 Range 时单连接下载, 不能续传"""
+    with session.get(url, stream=True, timeout=TIMEOUT) as response:
+        response.raise_for_status()
+        with open(part_path, "wb") as f:
+            for block in response.iter_content(BUFFER_SIZE):
+                f.write(block)
+                progress(len(block))
+
+
+def expected_from_headers(headers, size: int) -> dict:
+    """
+    响应头中的校验信息: LFS 文件的 X-Linked-Etag 为 SHA-256, 普通文件的 ETag 为 git blob SHA-1;
+    都没有时只有大小
+    """
+    linked = headers.get("X-Linked-Etag", "").strip('"').lower()
+    if _SHA256.match(linked):
+        return {"size": size, "sha256": linked}
+    etag = headers.get("ETag", "")
+    etag = etag[2:] if etag.startswith("W/") else etag
+    etag = etag.strip('"').lower()
+    if _SHA1.match(etag):
+        return {"size": size, "git_sha1": etag}
+    return {"size": size}
+
+
+def expected_digest(expected: dict) -> Optional[str]:
+    return expected.get("sha256", expected.get("git_sha1"))
+
+
+def download_file(session: requests.Session, url: str, path: str, expected: Optional[dict],
+                  connections: int = DEFAULT_CONNECTIONS, chunk_size: int = CHUNK_SIZE,
+                  show_progress: bool = True) -> dict:
+    """
+    下载并校验一个文件, 成功后原子地重命名为 path, 返回校验用的清单项
+
+    expected 为 None 时使用响应头中的校验信息; 没有摘要时只校验大小。
+    """
+    final_url, size, ranged, headers = _probe(session, url)
+    expected = expected or expected_from_headers(headers, size)
+    if expected_digest(expected) is None:
+        print(f"警告: 没有 {os.path.basename(path)} 的摘要, 只校验大小")
+    if size != expected["size"]:
+        raise DownloadError(f"{os.path.basename(path)} 大小为 {size} 字节, 清单中为 {expected['size']} 字节")
+
+    part_path = path + ".part"
+    state = _PartState.load(part_path + ".json", part_path, size, chunk_size)
+    chunks = [(i, i * chunk_size, min(size, (i + 1) * chunk_size) - 1)
+              for i in range((size + chunk_size - 1) // chunk_size)]
+    remaining = [chunk for chunk in chunks if chunk[0] not in state.done]
+    if ranged and not state.done:
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+
+    initial = size - sum(end + 1 - start for _, start, end in remaining) if ranged else 0
+    progress_bar = tqdm(total=size, initial=initial,
+                        unit='iB', unit_scale=True, desc=os.path.basename(path), ascii=True,
+                        disable=not show_progress)
+    lock = threading.Lock()
+
+    def progress(count: int):
+        with lock:
+            progress_bar.update(count)
+
+    try:
+        if not ranged:
+            _fetch_whole(session, final_url, part_path, progress)
+        elif remaining:
+            stop = threading.Event()
+
+            def fetch(chunk):
+                index, start, end = chunk
+                _fetch_range(session, final_url, part_path, start, end, progress, stop)
+                if not stop.is_set():
+                    state.mark_done(index)
+
+            with ThreadPoolExecutor(max_workers=min(connections, len(remaining))) as executor:
+                futures = [executor.submit(fetch, chunk) for chunk in remaining]
+                done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                if any(future.exception() for future in done):
+                    stop.set()  # 其他分块尽快停止, 已完成的块保留用于续传
+            for future in futures:
+                future.result()
+    finally:
+        progress_bar.close()
+
+    digest = expected_digest(expected)
+    if os.path.getsize(part_path) != size or (digest is not None and file_digest(part_path, expected) != digest):
+        # 内容有误, 续传无意义, 下次从头下载
+        for leftover in (part_path, part_path + ".json"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise DownloadError(f"{os.path.basename(path)} 校验失败")
+    os.replace(part_path, path)
+    if os.path.exists(part_path + ".json"):
+        os.remove(part_path + ".json")
+    return expected
+
+
+def download_model(model_name: str, models_dir: str = "models", connections: int = DEFAULT_CONNECTIONS,
+                   host: str = None, show_progress: bool = True) -> bool:
+    """
+    从HuggingFace或HF-Mirror下载模型文件并校验
+
     Args:
         model_name: 模型名称（不包含扩展名）
         models_dir: 模型存储目录
-            
+        connections: 每个文件的并发连接数
+        host: 指定下载源, 不使用缓存的下载源选择
+
     Returns:
         bool: 下载是否成功
     """
     # 使用绝对路径
     models_dir = os.path.abspath(models_dir)
-    
+
     # 确保模型目录存在
     if not os.path.exists(models_dir):
         os.makedirs(models_dir)
         print(f"创建模型目录: {models_dir}")
-    
+
     print(f"使用模型目录: {models_dir}")
-    
-    # 获取国家代码并选择相应的下载源
-    country_code = get_country_code()
-    base_url = get_base_url(country_code)
-    print(f"当前地区: {country_code}, 使用下载源: {base_url}")
-    
-    files_to_download = [f"{model_name}.onnx", f"{model_name}.csv"]
-    
-    # 配置重试策略
-    session = requests.Session()
-    retries = Retry(total=5, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-    session.mount('https://', HTTPAdapter(max_retries=retries))
-    
-    try:
-        for filename in files_to_download:
-            model_path = os.path.join(models_dir, filename)
-            
-            # 如果文件已存在，跳过下载
-            if os.path.exists(model_path):
-                print(f"文件已存在: {filename}")
-                continue
-            
-            # 下载文件
-            url = f"{base_url}/{filename}?download=true"
-            print(f"下载文件: {filename}")
-            
-            response = session.get(url, stream=True, timeout=30)
-            if response.status_code == 404:
-                print(f"文件不存在: {filename}")
-                return False
-            
-            response.raise_for_status()
-            
-            # 获取文件大小
-            total_size = int(response.headers.get('content-length', 0))
-            block_size = 1024  # 1 KB
-            
-            # 创建进度条
-            progress_bar = tqdm(
-                total=total_size,
-                unit='iB',
-                unit_scale=True,
-                desc=filename,
-                ascii=True  # 使用 ASCII 字符而不是 Unicode 字符
-            )
-            
-            # 保存文件
-            with open(model_path, 'wb') as f:
-                for chunk in response.iter_content(block_size):
-                    progress_bar.update(len(chunk))
-                    f.write(chunk)
-            
-            progress_bar.close()
-            
-            if total_size != 0 and progress_bar.n != total_size:
-                print(f"下载错误: {filename} 文件大小不匹配")
-                return False
-            
+
+    pending = []
+    for filename in (f"{model_name}.onnx", f"{model_name}.csv"):
+        # 正式文件只在校验通过后才会出现
+        if os.path.exists(os.path.join(models_dir, filename)):
+            print(f"文件已存在: {filename}")
+        else:
+            pending.append(filename)
+    if not pending:
+        return True
+
+    hosts = [host.rstrip("/")] if host else mirror_order(models_dir)
+    session = make_session(connections)
+    manifest = load_manifest(models_dir)
+    manifest_lock = threading.Lock()
+
+    for candidate in hosts:
+        print(f"使用下载源: {candidate}")
+        expected = {filename: manifest.get(filename) for filename in pending}
+        if not all(expected.values()):
+            remote = fetch_remote_manifest(session, candidate)
+            expected = {filename: value or remote.get(filename) for filename, value in expected.items()}
+
+        def fetch(filename):
+            verified = download_file(session, file_url(candidate, filename), os.path.join(models_dir, filename),
+                                     expected[filename], connections, show_progress=show_progress)
+            with manifest_lock:
+                manifest[filename] = verified
+                _write_json(os.path.join(models_dir, MANIFEST), manifest)
             print(f"成功下载: {filename}")
-        
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                for future in [executor.submit(fetch, filename) for filename in pending]:
+                    future.result()
+        except RemoteFileNotFound:
+            print(f"文件不存在: {model_name}")
+            return False
+        except (DownloadError, requests.RequestException, OSError) as e:
+            print(f"下载失败: {str(e)}")
+            pending = [f for f in pending if not os.path.exists(os.path.join(models_dir, f))]
+            continue
+        if not host and candidate != hosts[0]:
+            save_mirror(models_dir, candidate)
         return True
-        
-    except Exception as e:
-        print(f"下载失败: {str(e)}")
-        return False
+    return False
+
 
 def main():
+    parser = argparse.ArgumentParser(description="下载 WD14 标签模型")
     # 默认模型
-    default_model = "wd-v1-4-moat-tagger-v2"
-    
-    # 如果提供了命令行参数，使用第一个参数作为模型名称
-    model_name = sys.argv[1] if len(sys.argv) > 1 else default_model
-    
-    print(f"开始下载模型: {model_name}")
-    success = download_model(model_name)
-    
+    parser.add_argument("model_name", nargs="?", default="wd-v1-4-moat-tagger-v2")
+    parser.add_argument("--models-dir", default="models")
+    parser.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS, help="每个文件的并发连接数")
+    parser.add_argument("--host", help="指定下载源, 如 https://hf-mirror.com")
+    args = parser.parse_args()
+
+    print(f"开始下载模型: {args.model_name}")
+    success = download_model(args.model_name, args.models_dir, args.connections, args.host)
+
     if success:
         print("模型下载完成!")
     else:
@@ -131,4 +446,4 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -1,155 +1,233 @@
 from PIL import Image, ImageDraw, ImageFont
+import numpy as np
 import os
-from math import sin, cos, pi
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# 只渲染一次最大尺寸的图标, 其它尺寸都由它缩小得到 (不加光泽的小尺寸 ICO 图标除外)
+MASTER_SIZE = 1024
+ICO_SIZES = [16, 32, 48, 64, 128, 256]
+MAC_SIZES = [16, 32, 64, 128, 256, 512, 1024]
+LINUX_SIZES = [16, 32, 48, 64, 128, 256, 512]
+# 小于该尺寸的 ICO 图标不加光泽, 并按原尺寸渲染: 从大图缩小会让文字和圆角变模糊
+SHINE_MIN_SIZE = 64
+# 记录上次生成时的输入, 输入不变时跳过生成
+STAMP_PATH = "build/.icons.json"
+
 
 def create_gradient_background(size):
     # 创建渐变背景
-    image = Image.new('RGBA', (size, size), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(image)
-    
     # 使用更现代的配色方案
-    color1 = (88, 86, 214)  # 深紫色
-    color2 = (45, 149, 214)  # 天蓝色
-    
-    # 创建对角线渐变
-    for y in range(size):
-        for x in range(size):
-            # 计算渐变比例
-            ratio = (x + y) / (size * 2)
-            # 计算当前位置的颜色
-            r = int(color1[0] * (1 - ratio) + color2[0] * ratio)
-            g = int(color1[1] * (1 - ratio) + color2[1] * ratio)
-            b = int(color1[2] * (1 - ratio) + color2[2] * ratio)
-            draw.point((x, y), fill=(r, g, b, 255))
-    
-    return image
-
-def create_base_icon(size, text="迹"):
+    color1 = np.array([88, 86, 214], dtype=np.float64)  # 深紫色
+    color2 = np.array([45, 149, 214], dtype=np.float64)  # 天蓝色
+
+    # 创建对角线渐变: 每个像素的渐变比例为 (x + y) / (size * 2), 颜色按比例插值后取整
+    coords = np.arange(size)
+    ratio = ((coords[:, None] + coords[None, :]) / (size * 2))[..., None]
+    pixels = np.empty((size, size, 4), dtype=np.uint8)
+    pixels[..., :3] = (color1 * (1 - ratio) + color2 * ratio).astype(np.uint8)
+    pixels[..., 3] = 255
+    return Image.fromarray(pixels, "RGBA")
+
+
+def load_font(font_size, font_path=None):
+    # 尝试使用系统字体，如果失败则使用默认字体
+    for name in ([font_path] if font_path else ["msyh.ttc", "PingFang.ttc"]):  # Windows 微软雅黑, macOS 苹方
+        try:
+            return ImageFont.truetype(name, font_size)
+        except OSError:
+            pass
+    return ImageFont.load_default()
+
+
+def create_base_icon(size, text="迹", font_path=None):
     # 创建基础图像
     image = create_gradient_background(size)
     draw = ImageDraw.Draw(image)
-    
+
     # 计算字体大小（图像大小的50%）
-    font_size = int(size * 0.5)
-    
-    try:
-        # 尝试使用系统字体，如果失败则使用默认字体
-        font = ImageFont.truetype("msyh.ttc", font_size)  # Windows 微软雅黑
-    except:
-        try:
-            font = ImageFont.truetype("PingFang.ttc", font_size)  # macOS 苹方
-        except:
-            font = ImageFont.load_default()
-    
+    font = load_font(int(size * 0.5), font_path)
+
     # 获取文本大小
     text_bbox = draw.textbbox((0, 0), text, font=font)
     text_width = text_bbox[2] - text_bbox[0]
     text_height = text_bbox[3] - text_bbox[1]
-    
+
     # 计算文本位置，使其居中
     x = (size - text_width) / 2
     y = (size - text_height) / 2
-    
+
     # 添加白色阴影效果
     shadow_offset = max(1, int(size * 0.01))
     draw.text((x + shadow_offset, y + shadow_offset), text, fill=(255, 255, 255, 100), font=font)
-    
+
     # 绘制主文本（使用白色）
     draw.text((x, y), text, fill=(255, 255, 255, 255), font=font)
-    
+
     # 添加圆角
     mask = Image.new('L', (size, size), 0)
     mask_draw = ImageDraw.Draw(mask)
     radius = int(size * 0.2)  # 圆角半径
     mask_draw.rounded_rectangle([(0, 0), (size-1, size-1)], radius, fill=255)
-    
+
     # 应用圆角
     output = Image.new('RGBA', (size, size), (0, 0, 0, 0))
     output.paste(image, mask=mask)
-    
+
     return output
 
+
 def add_shine_effect(image):
-    # 添加光泽效果
+    # 添加光泽效果: 上半部分叠加一层白色, 透明度随到图标中心的距离线性减小
     size = image.size[0]
-    shine = Image.new('RGBA', (size, size), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(shine)
-    
-    # 创建一个从左上到右下的渐变透明效果
-    for y in range(size):
-        for x in range(size):
-            # 计算距离图标中心的距离
-            dx = (x - size/2) / (size/2)
-            dy = (y - size/2) / (size/2)
-            distance = (dx*dx + dy*dy) ** 0.5
-            
-            # 创建光泽效果
-            alpha = int(max(0, min(255, 255 * (1 - distance))))
-            if y < size/2:  # 只在上半部分添加光泽
-                draw.point((x, y), fill=(255, 255, 255, alpha//4))
-    
+    half = size / 2
+    rows = (size + 1) // 2  # y < size / 2 的行数
+    dy = (np.arange(rows) - half) / half
+    dx = (np.arange(size) - half) / half
+    distance = (dx[None, :] ** 2 + dy[:, None] ** 2) ** 0.5
+    alpha = np.clip(255 * (1 - distance), 0, 255).astype(np.uint8) // 4
+
+    shine = np.zeros((size, size, 4), dtype=np.uint8)
+    shine[:rows, :, :3] = 255
+    shine[:rows, :, 3] = alpha
+
     # 将光泽效果叠加到原图上
-    return Image.alpha_composite(image, shine)
-
-def create_windows_ico():
-    # 创建 ICO 文件需要的尺寸
-    sizes = [16, 32, 48, 64, 128, 256]
-    icons = []
-    
-    for size in sizes:
-        icon = create_base_icon(size)
-        if size >= 64:  # 只对较大尺寸添加光泽效果
-            icon = add_shine_effect(icon)
-        icons.append(icon)
-    
+    return Image.alpha_composite(image, Image.fromarray(shine, "RGBA"))
+
+
+def render_master(text="迹", font_path=None):
+    """渲染最大尺寸的带光泽图标"""
+    return add_shine_effect(create_base_icon(MASTER_SIZE, text, font_path))
+
+
+def input_fingerprint(text="迹", font_path=None):
+    """影响生成结果的输入: 本脚本、文字、字体文件和 Pillow / NumPy 版本"""
+    import PIL
+
+    digest = hashlib.sha256()
+    with open(os.path.abspath(__file__), "rb") as f:
+        digest.update(f.read())
+    font = load_font(int(MASTER_SIZE * 0.5), font_path)
+    font_file = getattr(font, "path", None)
+    if isinstance(font_file, str) and os.path.exists(font_file):
+        stat = os.stat(font_file)
+        font_file = [os.path.abspath(font_file), stat.st_size, stat.st_mtime_ns]
+    else:
+        font_file = "default"
+    digest.update(json.dumps([text, font_file, PIL.__version__, np.__version__]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def output_paths():
+    paths = ["build/favicon.ico", "public/favicon.ico"]
+    for size in MAC_SIZES:
+        paths.append(f"build/icon.iconset/icon_{size}x{size}.png")
+        if size <= 512:
+            paths.append(f"build/icon.iconset/icon_{size}x{size}@2x.png")
+    paths.extend(f"build/icons/{size}x{size}.png" for size in LINUX_SIZES)
+    return paths
+
+
+def is_up_to_date(fingerprint):
+    try:
+        with open(STAMP_PATH, encoding="utf-8") as f:
+            stamp = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return stamp.get("fingerprint") == fingerprint and all(os.path.exists(p) for p in output_paths())
+
+
+def resized(master, size):
+    return master if size == master.size[0] else master.resize((size, size), Image.Resampling.LANCZOS)
+
+
+def create_windows_ico(master, pool, text="迹", font_path=None):
+    # 创建 ICO 文件需要的尺寸, 只对较大尺寸添加光泽效果
+    def icon(size):
+        return resized(master, size) if size >= SHINE_MIN_SIZE else create_base_icon(size, text, font_path)
+
+    icons = list(pool.map(icon, ICO_SIZES))
+
     # 确保 build 目录存在
     os.makedirs("build", exist_ok=True)
-    
-    # 保存为 ICO 文件
-    icons[0].save("build/favicon.ico", format="ICO", sizes=[(s, s) for s in sizes], append_images=icons[1:])
+
+    # 保存为 ICO 文件: Pillow 会丢弃比第一张图大的尺寸, 因此以最大尺寸为第一张
+    icons[-1].save("build/favicon.ico", format="ICO", sizes=[(s, s) for s in ICO_SIZES], append_images=icons[:-1])
     # 同时保存到 public 目录
     os.makedirs("public", exist_ok=True)
-    icons[0].save("public/favicon.ico", format="ICO", sizes=[(s, s) for s in sizes], append_images=icons[1:])
+    shutil.copyfile("build/favicon.ico", "public/favicon.ico")
+
+
+def save_pngs(master, targets, pool):
+    """targets 为 [(尺寸, 路径)], 同一尺寸只缩放一次, 各尺寸并行缩放和编码"""
+    by_size = {}
+    for size, path in targets:
+        by_size.setdefault(size, []).append(path)
 
-def create_mac_icns():
-    # 创建 1024x1024 的图标
-    icon = create_base_icon(1024)
-    icon = add_shine_effect(icon)
-    
+    def encode(size):
+        icon = resized(master, size)
+        for path in by_size[size]:
+            icon.save(path)
+
+    list(pool.map(encode, by_size))
+
+
+def create_mac_icns(master, pool):
     # 保存为 PNG，然后可以使用 iconutil 转换为 icns
     os.makedirs("build/icon.iconset", exist_ok=True)
-    
+
     # 创建不同尺寸的图标
-    scales = [16, 32, 64, 128, 256, 512, 1024]
-    for size in scales:
-        resized = icon.resize((size, size), Image.Resampling.LANCZOS)
-        resized.save(f"build/icon.iconset/icon_{size}x{size}.png")
+    targets = []
+    for size in MAC_SIZES:
+        targets.append((size, f"build/icon.iconset/icon_{size}x{size}.png"))
         # 对于 @2x 版本
         if size <= 512:
-            resized = icon.resize((size * 2, size * 2), Image.Resampling.LANCZOS)
-            resized.save(f"build/icon.iconset/icon_{size}x{size}@2x.png")
+            targets.append((size * 2, f"build/icon.iconset/icon_{size}x{size}@2x.png"))
+    save_pngs(master, targets, pool)
 
-def create_linux_icons():
-    # Linux 需要的尺寸
-    sizes = [16, 32, 48, 64, 128, 256, 512]
-    
+
+def create_linux_icons(master, pool):
     # 创建 icons 目录
     os.makedirs("build/icons", exist_ok=True)
-    
+
     # 为每个尺寸创建 PNG 文件
-    icon = create_base_icon(512)
-    icon = add_shine_effect(icon)
-    
-    for size in sizes:
-        resized = icon.resize((size, size), Image.Resampling.LANCZOS)
-        resized.save(f"build/icons/{size}x{size}.png")
+    save_pngs(master, [(size, f"build/icons/{size}x{size}.png") for size in LINUX_SIZES], pool)
+
+
+def generate_icons(text="迹", font_path=None, force=False):
+    """生成所有平台的图标, 输入未变化且输出都存在时跳过, 返回是否重新生成"""
+    fingerprint = input_fingerprint(text, font_path)
+    if not force and is_up_to_date(fingerprint):
+        return False
+
+    master = render_master(text, font_path)
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        create_windows_ico(master, pool, text, font_path)
+        create_mac_icns(master, pool)
+        create_linux_icons(master, pool)
+
+    # 所有文件写完后再记录输入
+    with open(STAMP_PATH, "w", encoding="utf-8") as f:
+        json.dump({"fingerprint": fingerprint}, f)
+    return True
+
 
 def main():
-    # 创建所有平台的图标
-    create_windows_ico()
-    create_mac_icns()
-    create_linux_icons()
-    
+    sys.stdout.reconfigure(encoding="utf-8")
+    parser = argparse.ArgumentParser(description="生成 Windows / macOS / Linux 图标")
+    parser.add_argument("--text", default="迹", help="图标上的文字")
+    parser.add_argument("--font", help="字体文件, 默认依次尝试微软雅黑、苹方")
+    parser.add_argument("--force", action="store_true", help="输入未变化时也重新生成")
+    args = parser.parse_args()
+
+    if not generate_icons(args.text, args.font, args.force):
+        print("图标输入未变化, 跳过生成 (使用 --force 强制重新生成)")
+        return
+
     print("图标文件生成完成！")
     print("Windows: build/favicon.ico 和 public/favicon.ico")
     print("macOS: build/icon.iconset/")
@@ -158,4 +236,4 @@ def main():
     print("iconutil -c icns build/icon.iconset")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
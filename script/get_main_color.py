@@ -3,15 +3,45 @@ import sys
 from PIL import Image
 import numpy as np
 import time
-try:
-    import cupy as cp
-    from cupy.cuda import runtime
-    USE_GPU = True
-    print(f"GPU模式已启用 - CUDA版本: {runtime.runtimeGetVersion()}")
-except ImportError:
-    from sklearn.cluster import KMeans
-    USE_GPU = False
-    print("警告: GPU加速库未安装，将使用CPU模式运行,如需GPU加速，请安装对应CUDA版本的cupy-cuda, pip install cupy-cuda12x")
+import stage_timing
+
+# GPU 后端在第一次使用时才检测 (见 load_backend), 导入本模块不加载 cupy, 也不输出任何内容
+cp = None
+USE_GPU = None
+_backend_message = None
+
+
+def load_backend():
+    """
+    检测 GPU 后端, 返回提示信息: 安装了 cupy 时 KMeans 在 GPU 上计算, 否则用 NumPy
+    只在第一次调用时导入
+    """
+    global cp, USE_GPU, _backend_message
+    if USE_GPU is None:
+        try:
+            import cupy
+            from cupy.cuda import runtime
+            cp = cupy
+            USE_GPU = True
+            _backend_message = f"GPU模式已启用 - CUDA版本: {runtime.runtimeGetVersion()}"
+        except ImportError:
+            USE_GPU = False
+            _backend_message = "警告: GPU加速库未安装，将使用CPU模式运行,如需GPU加速，请安装对应CUDA版本的cupy-cuda, pip install cupy-cuda12x"
+    return _backend_message
+
+
+def array_module(device="auto"):
+    """KMeans 使用的数组模块: "cpu" 为 numpy, "gpu" 为 cupy, "auto" 在安装了 cupy 时使用 GPU"""
+    if device not in DEVICES:
+        raise ValueError(f"未知的设备: {device}")
+    if device == "cpu":
+        return np
+    load_backend()
+    if USE_GPU:
+        return cp
+    if device == "gpu":
+        raise RuntimeError("未安装 cupy, 无法使用 GPU")
+    return np
 
 
 def resize_image_if_needed(image, max_size=1024):
@@ -24,59 +54,239 @@ def resize_image_if_needed(image, max_size=1024):
         return image.resize(new_size, Image.LANCZOS)
     return image
 
-def get_dominant_colors_kmeans(image_path, num_colors=5):
+# 聚类方式:
+#   kmeans     对所有像素做 KMeans, 安装了 cupy 时在 GPU 上计算 (默认)
+#   histogram  先按每通道 HISTOGRAM_BITS 位统计颜色直方图, 再对非空格子做加权 KMeans (CPU), 更快,
+#              主色与 kmeans 略有差异, 需通过 --engine histogram 显式选择
+# 两者使用同一个 kmeans 实现, 不依赖 sklearn
+ENGINES = ("kmeans", "histogram")
+DEFAULT_ENGINE = "kmeans"
+DEVICES = ("auto", "cpu", "gpu")
+HISTOGRAM_BITS = 5
+# 按块计算距离, 每块的临时数组为 KMEANS_CHUNK_SIZE × 颜色数
+KMEANS_CHUNK_SIZE = 16384
+
+
+def get_dominant_colors_kmeans(image_path, num_colors=5, engine=DEFAULT_ENGINE, seed=0, device="auto"):
+    """
+    提取主色, 返回按占比排序的 [{'color': '#rrggbb', 'percentage': xx.xx}]
+
+    image_path 也可以是已打开 (或已解码) 的 PIL 图片。engine 见 ENGINES; device 只对 kmeans 方式有效, 见 array_module。seed 相同时结果相同。
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"未知的聚类方式: {engine}")
+    xp = array_module(device) if engine == "kmeans" else np
+    # 开启分阶段计时 (环境变量 IMAGE_MANAGEMENT_TIMING) 时记录每个阶段的耗时和图片尺寸
+    with stage_timing.track("get_dominant_colors_kmeans", image=str(image_path), num_colors=num_colors,
+                            engine=engine, backend="cpu" if xp is np else "gpu"):
+        return _get_dominant_colors_kmeans(image_path, num_colors, engine, seed, xp)
+
+
+def _get_dominant_colors_kmeans(image_path, num_colors, engine=DEFAULT_ENGINE, seed=0, xp=np):
     # 打开图片
-    img = Image.open(image_path)
-    img = img.convert('RGB')
+    with stage_timing.stage("open"):
+        img = image_path if isinstance(image_path, Image.Image) else Image.open(image_path)
+    stage_timing.annotate(width=img.width, height=img.height, format=img.format, mode=img.mode)
+    with stage_timing.stage("decode"):
+        img = img.convert('RGB')
     
     # 缩放大图
-    img = resize_image_if_needed(img)
+    with stage_timing.stage("resize"):
+        img = resize_image_if_needed(img)
     
     # 转换为numpy数组
     img_array = np.array(img)
     pixels = img_array.reshape(-1, 3)
+    stage_timing.annotate(pixels=len(pixels))
     
-    if USE_GPU:
-        # GPU模式 - 使用CuPy实现KMeans
-        pixels_gpu = cp.asarray(pixels, dtype=cp.float32)
-        
-        # 随机初始化聚类中心
-        centroids = kmeans_plusplus_init(pixels_gpu, num_colors)
-        
-        # KMeans迭代
-        for _ in range(20):  # 最大迭代次数
-            # 计算每个像素到聚类中心的距离
-            distances = cp.sum((pixels_gpu[:, cp.newaxis] - centroids) ** 2, axis=2)
-            labels = cp.argmin(distances, axis=1)
-            
-            # 更新聚类中心
-            new_centroids = cp.zeros_like(centroids)
-            for k in range(num_colors):
-                mask = labels == k
-                if cp.any(mask):
-                    new_centroids[k] = cp.mean(pixels_gpu[mask], axis=0)
-            
-            # 如果聚类中心基本不变，则停止迭代
-            if cp.allclose(centroids, new_centroids):
-                break
-            centroids = new_centroids
-            
-        # 转回CPU
-        colors = cp.asnumpy(centroids)
-        labels = cp.asnumpy(labels)
+    if engine == "histogram":
+        with stage_timing.stage("histogram"):
+            points, weights = color_histogram(pixels)
+        stage_timing.annotate(bins=len(points))
+        with stage_timing.stage("kmeans"):
+            colors, labels = kmeans(points, num_colors, weights=weights, seed=seed, n_init=3)
+        counts = np.bincount(labels, weights=weights, minlength=num_colors)
     else:
-        # CPU模式
-        kmeans = KMeans(n_clusters=num_colors, init='k-means++')
-        kmeans.fit(pixels)
-        colors = kmeans.cluster_centers_
-        labels = kmeans.labels_
-    
+        with stage_timing.stage("kmeans"):
+            colors, labels = kmeans(pixels, num_colors, seed=seed, xp=xp)
+        counts = np.bincount(labels, minlength=num_colors)
+
+    with stage_timing.stage("postprocess"):
+        return _summarize_colors(colors, counts, len(pixels))
+
+
+def color_histogram(pixels, bits=HISTOGRAM_BITS):
+    """
+    把 uint8 RGB 像素按每通道 bits 位分格, 返回非空格子的 (格内平均颜色, 像素数)
+
+    用格内平均颜色而不是格子中心, 聚类结果更接近直接对像素聚类。
+    """
+    pixels = np.asarray(pixels, dtype=np.uint8)
+    shift = 8 - bits
+    index = ((pixels[:, 0].astype(np.int32) >> shift) << (2 * bits)
+             | (pixels[:, 1].astype(np.int32) >> shift) << bits
+             | (pixels[:, 2].astype(np.int32) >> shift))
+    size = 1 << (3 * bits)
+    counts = np.bincount(index, minlength=size)
+    occupied = np.flatnonzero(counts)
+    sums = np.stack([np.bincount(index, weights=pixels[:, c], minlength=size)[occupied] for c in range(3)], axis=1)
+    weights = counts[occupied].astype(np.float64)
+    return sums / weights[:, None], weights
+
+
+def kmeans(points, num_colors, weights=None, seed=0, n_init=1, max_iter=50, tol=1e-4,
+           chunk_size=KMEANS_CHUNK_SIZE, xp=np):
+    """
+    加权 KMeans (k-means++ 初始化), 返回 NumPy 数组 (聚类中心, 每个点所属的类别)
+
+    - xp 为 numpy 或 cupy, 计算都在 xp 上进行; 随机数由 seed 在 CPU 上生成, 两种后端的结果一致
+    - 距离按 |x|^2 - 2x·c + |c|^2 分块计算, 临时内存不超过 chunk_size × num_colors,
+      中心用 bincount 更新, 不生成 N×K×3 的临时数组
+    - 点坐标以 float32 保存 (0-255 的颜色值没有误差), 中心和累加使用 float64
+    - 空簇移到离所属中心最远的点上; 点数少于 num_colors 时多出的中心重复, 其占比为 0
+    - 与 sklearn 相同, 中心移动距离的平方和小于 tol * 数据方差时停止迭代, 运行 n_init 次取误差最小的结果
+    """
+    points = xp.asarray(points, dtype=xp.float32)
+    if weights is not None:
+        weights = xp.asarray(weights, dtype=xp.float64)
+    rng = np.random.default_rng(seed)
+    squared_norms = xp.einsum("ij,ij->i", points, points, dtype=xp.float64)
+    if weights is None:
+        total_weight = float(len(points))
+        mean = points.mean(axis=0, dtype=xp.float64)
+        variance = float(squared_norms.mean()) - float(mean @ mean)
+    else:
+        total_weight = float(weights.sum())
+        mean = (weights @ points) / total_weight
+        variance = float(weights @ squared_norms) / total_weight - float(mean @ mean)
+    tol = tol * max(variance, 0.0) / points.shape[1]
+
+    best = None
+    for _ in range(n_init):
+        centers = _kmeans_plusplus(points, squared_norms, weights, num_colors, rng, xp)
+        for _ in range(max_iter):
+            _, distances, totals, sums = _assign(points, squared_norms, weights, centers, chunk_size, xp)
+            new_centers = xp.where(totals[:, None] > 0, sums / xp.maximum(totals, 1e-12)[:, None], centers)
+            _relocate_empty_clusters(new_centers, totals, points, distances, xp)
+            shift = float(xp.square(new_centers - centers).sum())
+            centers = new_centers
+            if shift <= tol:
+                break
+        labels, distances, _, _ = _assign(points, squared_norms, weights, centers, chunk_size, xp)
+        inertia = float(distances.sum() if weights is None else weights @ distances)
+        if best is None or inertia < best[0]:
+            best = (inertia, centers, labels)
+    return _to_numpy(best[1], xp), _to_numpy(best[2], xp)
+
+
+def _kmeans_plusplus(points, squared_norms, weights, num_colors, rng, xp):
+    """按 weight 选第一个中心, 之后按 weight * 到最近中心距离的平方选下一个"""
+    centers = xp.empty((num_colors, points.shape[1]), dtype=xp.float64)
+    uniform = xp.ones(len(points)) if weights is None else weights
+    centers[0] = points[_sample(uniform, rng, xp)]
+    closest = _squared_distances(points, squared_norms, centers[0], xp)
+    for i in range(1, num_colors):
+        scores = closest if weights is None else weights * closest
+        # 所有点都已与某个中心重合时按 weight 选
+        centers[i] = points[_sample(scores if float(scores.sum()) > 0 else uniform, rng, xp)]
+        closest = xp.minimum(closest, _squared_distances(points, squared_norms, centers[i], xp))
+    return centers
+
+
+def _sample(scores, rng, xp) -> int:
+    """按 scores 的比例抽取一个下标, 随机数在 CPU 上生成"""
+    cumulative = xp.cumsum(scores)
+    index = int(xp.searchsorted(cumulative, rng.random() * float(cumulative[-1]), side="right"))
+    return min(index, len(scores) - 1)
+
+
+def _squared_distances(points, squared_norms, center, xp):
+    return xp.maximum(squared_norms - 2 * (points @ center.astype(xp.float32)) + float(center @ center), 0)
+
+
+def _assign(points, squared_norms, weights, centers, chunk_size, xp):
+    """
+    按块把每个点分到最近的中心, 返回 (类别, 距离的平方, 各簇权重和, 各簇加权坐标和)
+
+    |x|^2 与中心无关, 比较时省略, 只加到最近的距离上。
+    """
+    count, dims = points.shape
+    num_colors = len(centers)
+    labels = xp.empty(count, dtype=xp.int64)
+    distances = xp.empty(count, dtype=xp.float64)
+    totals = xp.zeros(num_colors, dtype=xp.float64)
+    sums = xp.zeros((num_colors, dims), dtype=xp.float64)
+    center_norms = xp.square(centers).sum(axis=1).astype(xp.float32)
+    centers_t = (-2 * centers.T).astype(xp.float32)
+    for start in range(0, count, chunk_size):
+        chunk = points[start:start + chunk_size]
+        scores = chunk @ centers_t
+        scores += center_norms
+        chunk_labels = scores.argmin(axis=1)
+        labels[start:start + len(chunk)] = chunk_labels
+        nearest = xp.take_along_axis(scores, chunk_labels[:, None], axis=1)[:, 0]
+        distances[start:start + len(chunk)] = xp.maximum(nearest + squared_norms[start:start + len(chunk)], 0)
+        if weights is None:
+            totals += xp.bincount(chunk_labels, minlength=num_colors)
+            for c in range(dims):
+                sums[:, c] += xp.bincount(chunk_labels, weights=chunk[:, c], minlength=num_colors)
+        else:
+            chunk_weights = weights[start:start + len(chunk)]
+            totals += xp.bincount(chunk_labels, weights=chunk_weights, minlength=num_colors)
+            for c in range(dims):
+                sums[:, c] += xp.bincount(chunk_labels, weights=chunk_weights * chunk[:, c], minlength=num_colors)
+    return labels, distances, totals, sums
+
+
+def _relocate_empty_clusters(centers, totals, points, distances, xp):
+    """把空簇的中心移到离所属中心最远的点上 (原地修改 centers); 所有点都与中心重合时不移动"""
+    empty = np.flatnonzero(_to_numpy(totals, xp) == 0)
+    if len(empty) == 0:
+        return
+    farthest = xp.argsort(distances)[::-1][:len(empty)]
+    farthest = farthest[distances[farthest] > 0]
+    if len(farthest):
+        centers[xp.asarray(empty[:len(farthest)])] = points[farthest]
+
+
+def _to_numpy(array, xp):
+    return xp.asnumpy(array) if hasattr(xp, "asnumpy") else array
+
+
+def rgb_to_lab(colors):
+    """sRGB (0-255) 转 CIELAB (D65), colors 形状为 (..., 3)"""
+    rgb = np.asarray(colors, dtype=np.float64) / 255.0
+    rgb = np.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92)
+    xyz = rgb @ np.array([[0.4124564, 0.2126729, 0.0193339],
+                          [0.3575761, 0.7151522, 0.1191920],
+                          [0.1804375, 0.0721750, 0.9503041]])
+    xyz = xyz / np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+def palette_distance(palette, reference):
+    """
+    两组主色的差异: 双向按占比加权的最近颜色 ΔE (CIE76) 的平均值
+    palette / reference 为 get_dominant_colors_kmeans 的返回值
+    """
+    def unpack(entries):
+        rgb = [[int(e["color"][i:i + 2], 16) for i in (1, 3, 5)] for e in entries]
+        weights = np.array([float(e["percentage"]) for e in entries])
+        return rgb_to_lab(rgb), weights / max(weights.sum(), 1e-12)
+
+    lab_a, weights_a = unpack(palette)
+    lab_b, weights_b = unpack(reference)
+    delta = np.sqrt(np.square(lab_a[:, None, :] - lab_b[None, :, :]).sum(axis=2))
+    return float((np.dot(weights_a, delta.min(axis=1)) + np.dot(weights_b, delta.min(axis=0))) / 2)
+
+
+def _summarize_colors(colors, counts, total_pixels):
+    """按占比排序, 转换为 [{'color': '#rrggbb', 'percentage': xx.xx}], counts 为每个颜色的像素数"""
     # 计算每个颜色的占比
-    total_pixels = len(pixels)
     color_percentages = []
     
-    for i in range(num_colors):
-        count = np.sum(labels == i)
+    for count in counts:
         percentage = (count / total_pixels) * 100
         color_percentages.append(percentage)
     
@@ -99,17 +309,6 @@ def get_dominant_colors_kmeans(image_path, num_colors=5):
     
     return result
 
-def kmeans_plusplus_init(pixels, num_colors):
-    centroids = cp.zeros((num_colors, 3), dtype=cp.float32)
-    centroids[0] = pixels[cp.random.choice(len(pixels), size=1)]
-    
-    for i in range(1, num_colors):
-        distances = cp.min(cp.sum((pixels[:, cp.newaxis] - centroids[:i]) ** 2, axis=2), axis=1)
-        probabilities = distances / cp.sum(distances)
-        centroids[i] = pixels[cp.random.choice(len(pixels), size=1, p=probabilities)]
-        
-    return centroids
-
 def main():
     try:
         if len(sys.argv) < 2:
@@ -117,38 +316,30 @@ def main():
             sys.exit(1)
         
         image_path = sys.argv[1]
+        # 可选 --engine <聚类方式>, 默认 kmeans
+        engine = DEFAULT_ENGINE
+        if len(sys.argv) > 2:
+            if sys.argv[2] != "--engine" or len(sys.argv) != 4:
+                print(f"error:用法: get_main_color.py <图片路径> [--engine {'|'.join(ENGINES)}]")
+                sys.exit(1)
+            engine = sys.argv[3]
+        if engine not in ENGINES:
+            print(f"error:未知的聚类方式: {engine}, 可选 {', '.join(ENGINES)}")
+            sys.exit(1)
 
         # 确保图片路径存在
         if not os.path.exists(image_path):
             print(f"error:图片不存在: {image_path}")
             sys.exit(1)
         
-        colors = get_dominant_colors_kmeans(image_path, 10)
+        # script.cjs 读取第二行, 第一行为聚类方式提示
+        print(load_backend() if engine == "kmeans" else "直方图聚类模式 (CPU)")
+        colors = get_dominant_colors_kmeans(image_path, 10, engine=engine)
         print(colors)
     except Exception as e:
         print(f"error:{str(e)}")
         sys.exit(1)
 
-def test_get_main_color(image_path):
-    colors = get_dominant_colors_kmeans(image_path, 10)
-    print(colors)
-
-def multi_get_main_color():
-    dir_path = r"K:\dataset2\animesfw"
-    files = [os.path.join(dir_path, file) for file in os.listdir(dir_path)[:50] if file.endswith(".jpg") or file.endswith(".png")]
-    
-    from multiprocessing import Pool
-    with Pool(processes=10) as pool:
-        pool.map(test_get_main_color, files)
-
 
 if __name__ == "__main__":
     main()
-    # 计算时间
-    # start_time = time.time()
-    # multi_get_main_color()
-    # end_time = time.time()
-    # print(f"运行时间: {end_time - start_time} 秒")
-
-# colors = get_dominant_colors_kmeans("C:\\Users\\jzj\\Pictures\\姿势\\甘雨.png")
-# print(colors)
@@ -0,0 +1,359 @@
+"""
+按颜色搜索图片的主色索引
+
+将 get_main_color.py 提取的主色 (按占比加权) 转换为 CIELAB, 追加写入磁盘文件, 查询时通过内存映射读取:
+- 排序: 目标颜色 (或一组颜色) 与每张图片主色的加权距离, 与 get_main_color.palette_distance 相同
+  (双向按占比加权的最近颜色 ΔE), "大部分是青色" 的图片距离最小
+- 预筛选: 每张图片记录占比不低于 cell_weight 的颜色落在哪些 Lab 网格中 (位图),
+  查询时只对与目标颜色相距 radius 以内的网格有交集的图片计算距离, 候选不足 k 个时扩大范围
+- 增量添加/删除: 新图片追加写入, 删除只写墓碑标记, 删除较多时自动压缩
+
+用法:
+    python palette_index.py add --index <索引目录> --images <图片目录> [--skip-existing]
+    python palette_index.py add --index <索引目录> --image <图片路径> [--palette '<主色 JSON>']
+    python palette_index.py query --index <索引目录> (--color "#1fa3a3" | --palette '<主色 JSON>' | --image <图片路径>)
+                                  [-k 20] [--exact]
+    python palette_index.py remove --index <索引目录> <图片路径> ...
+
+主色 JSON 格式与 get_main_color.get_dominant_colors_kmeans 的返回值相同: [{"color": "#rrggbb", "percentage": 18.3}, ...]
+"""
+import os
+import sys
+import json
+import argparse
+from typing import Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from get_main_color import rgb_to_lab
+from row_store import RowStore, read_meta, smallest_k, write_meta
+
+DEFAULT_SLOTS = 10
+# Lab 网格: 每个轴 GRID_SIZE 格, L 取 0-100, a / b 取 -128-128
+GRID_SIZE = 8
+GRID_BYTES = GRID_SIZE ** 3 // 8
+DEFAULT_CELL_WEIGHT = 0.15
+PREFILTER_DELTA_E = 20.0
+SEARCH_CHUNK_ROWS = 16384
+
+Palette = Union[str, List[dict]]
+
+
+def _parse_palette(palette: Palette, slots: int = None) -> Tuple[List[List[int]], np.ndarray]:
+    """
+    解析主色, 返回 (RGB 颜色列表, 归一化的占比), 按占比从高到低排列
+
+    palette 为 "#rrggbb" (单一颜色) 或 [{"color": "#rrggbb", "percentage": x}, ...];
+    指定 slots 时只保留占比最高的 slots 个颜色。
+    """
+    if isinstance(palette, str):
+        palette = [{"color": palette, "percentage": 100}]
+    entries = sorted(palette, key=lambda e: -float(e["percentage"]))[:slots]
+    rgb = []
+    for entry in entries:
+        color = entry["color"].lstrip("#")
+        if len(color) != 6:
+            raise ValueError(f"无效的颜色: {entry['color']}")
+        rgb.append([int(color[i:i + 2], 16) for i in (0, 2, 4)])
+    weights = np.array([float(e["percentage"]) for e in entries], dtype=np.float64)
+    if len(entries) == 0 or weights.sum() <= 0:
+        raise ValueError("主色为空")
+    return rgb, weights / weights.sum()
+
+
+def palette_to_lab(palette: Palette, slots: int = None) -> Tuple[np.ndarray, np.ndarray]:
+    """把主色转换为 (Lab 颜色 (S, 3), 归一化的占比 (S,)), 按占比从高到低排列"""
+    rgb, weights = _parse_palette(palette, slots)
+    return rgb_to_lab(rgb), weights
+
+
+def _axis_cells(lab: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Lab 颜色在三个轴上的网格下标, 超出范围的归入边缘的格子"""
+    lab = np.asarray(lab, dtype=np.float64)
+    l = np.clip(np.floor(lab[..., 0] / 100 * GRID_SIZE), 0, GRID_SIZE - 1).astype(int)
+    a = np.clip(np.floor((lab[..., 1] + 128) / 256 * GRID_SIZE), 0, GRID_SIZE - 1).astype(int)
+    b = np.clip(np.floor((lab[..., 2] + 128) / 256 * GRID_SIZE), 0, GRID_SIZE - 1).astype(int)
+    return l, a, b
+
+
+def lab_cells(lab: np.ndarray) -> np.ndarray:
+    """Lab 颜色所在的网格编号"""
+    l, a, b = _axis_cells(lab)
+    return (l * GRID_SIZE + a) * GRID_SIZE + b
+
+
+def cells_near(lab: np.ndarray, radius: float) -> np.ndarray:
+    """与各 Lab 颜色距离 radius 以内的点可能落入的网格 (以 ±radius 的立方体覆盖), 返回位图 (GRID_BYTES,)"""
+    mask = np.zeros(GRID_SIZE ** 3, dtype=bool)
+    for color in np.atleast_2d(lab):
+        low, high = _axis_cells(color - radius), _axis_cells(color + radius)
+        l, a, b = np.meshgrid(*(np.arange(lo, hi + 1) for lo, hi in zip(low, high)), indexing="ij")
+        mask[((l * GRID_SIZE + a) * GRID_SIZE + b).ravel()] = True
+    return np.packbits(mask, bitorder="little")
+
+
+def palette_distances(palettes: np.ndarray, lab: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    (M, S, 4) 的 [L, a, b, 占比] 与目标颜色的加权距离, 返回 (M,)
+
+    距离 = (Σ目标占比 × 目标到图片最近颜色的 ΔE + Σ图片占比 × 图片颜色到最近目标的 ΔE) / 2,
+    占比为 0 的槽位不参与; 没有颜色的图片距离为 inf。
+    """
+    colors = palettes[..., :3].astype(np.float32)
+    slot_weights = palettes[..., 3].astype(np.float32)
+    lab = lab.astype(np.float32)
+    # |x - y|² = |x|² - 2x·y + |y|², 比逐维相减少一个 (M, S, T, 3) 的中间数组
+    delta = colors @ (-2 * lab.T)
+    delta += np.einsum("msc,msc->ms", colors, colors)[..., None]
+    delta += np.einsum("tc,tc->t", lab, lab)
+    np.sqrt(np.maximum(delta, 0, out=delta), out=delta)
+    to_target = (slot_weights * delta.min(axis=2)).sum(axis=1)
+    delta[slot_weights <= 0] = np.inf
+    to_image = delta.min(axis=1) @ weights.astype(np.float32)
+    return (to_target + to_image) / 2
+
+
+class PaletteIndex:
+    """
+    磁盘上的主色索引, 目录结构 (ids / alive / 压缩的处理见 row_store.py):
+        meta.json     槽位数、预筛选参数
+        palettes.f16  (N, slots, 4) float16, 每个颜色为 [L, a, b, 占比], 空槽位占比为 0
+        cells.u8      (N, GRID_BYTES) 每张图片主要颜色所在 Lab 网格的位图
+        ids.jsonl     每行一个 JSON 字符串, 第 i 行对应第 i 张图片
+        alive.u8      每张图片一个字节, 0 表示已删除
+    """
+
+    def __init__(self, index_dir: str, slots: int = DEFAULT_SLOTS, cell_weight: float = DEFAULT_CELL_WEIGHT):
+        self.index_dir = os.path.abspath(index_dir)
+        os.makedirs(self.index_dir, exist_ok=True)
+
+        self._meta = read_meta(self.index_dir)
+        if self._meta is None:
+            self._meta = {"version": 1, "slots": slots, "grid": GRID_SIZE, "cell_weight": cell_weight}
+            write_meta(self.index_dir, self._meta)
+        self.slots = self._meta["slots"]
+        self.cell_weight = self._meta["cell_weight"]
+
+        self._store = RowStore(self.index_dir, {"palettes.f16": self.slots * 4 * 2, "cells.u8": GRID_BYTES})
+        self._palettes = None
+        self._cells = None
+        self._store.load(self._meta.get("generation", 0))
+
+    def _palette_rows(self) -> np.ndarray:
+        """以内存映射方式读取主色, 追加写入后重新映射"""
+        count = len(self._store.ids)
+        if self._palettes is None or len(self._palettes) != count:
+            self._palettes = None
+            if count == 0:
+                return np.zeros((0, self.slots, 4), dtype=np.float16)
+            self._palettes = np.memmap(self._store.path("palettes.f16"), dtype=np.float16, mode="r",
+                                       shape=(count, self.slots, 4))
+        return self._palettes
+
+    def _cell_rows(self) -> np.ndarray:
+        count = len(self._store.ids)
+        if self._cells is None or len(self._cells) != count:
+            self._cells = None
+            if count == 0:
+                return np.zeros((0, GRID_BYTES), dtype=np.uint8)
+            self._cells = np.memmap(self._store.path("cells.u8"), dtype=np.uint8, mode="r",
+                                    shape=(count, GRID_BYTES))
+        return self._cells
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def __contains__(self, image_id: str) -> bool:
+        return image_id in self._store.rows
+
+    def _encode(self, palettes: List[Palette]) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 (N, slots, 4) 的 [L, a, b, 占比] 和 (N, GRID_BYTES) 的网格位图, Lab 转换一次完成"""
+        rgb = np.zeros((len(palettes), self.slots, 3), dtype=np.float64)
+        weights = np.zeros((len(palettes), self.slots), dtype=np.float64)
+        for i, palette in enumerate(palettes):
+            colors, shares = _parse_palette(palette, self.slots)
+            rgb[i, :len(colors)] = colors
+            weights[i, :len(colors)] = shares
+        lab = rgb_to_lab(rgb)
+        rows = np.concatenate([lab, weights[..., None]], axis=2).astype(np.float16)
+
+        # 占比最高的颜色总是记录, 其余颜色占比不低于 cell_weight 时记录
+        main = weights >= self.cell_weight
+        main[:, 0] = True
+        mask = np.zeros((len(palettes), GRID_SIZE ** 3), dtype=bool)
+        image_rows, slots = np.nonzero(main)
+        mask[image_rows, lab_cells(lab[image_rows, slots])] = True
+        return rows, np.packbits(mask, axis=1, bitorder="little")
+
+    def add(self, ids: List[str], palettes: List[Palette]):
+        """添加或更新图片主色, palettes 为 get_dominant_colors_kmeans 的返回值 (或 "#rrggbb")"""
+        if len(ids) == 0:
+            return
+        rows, cells = self._encode(palettes)
+        self._store.mark_deleted(ids)
+        self._store.append(ids, {"palettes.f16": rows.tobytes(), "cells.u8": cells.tobytes()})
+
+    def remove(self, ids: Iterable[str]) -> int:
+        """删除图片, 返回实际删除的数量"""
+        removed = self._store.mark_deleted(ids)
+        if self._store.needs_compaction():
+            self.compact()
+        return removed
+
+    def compact(self):
+        """重写索引文件, 去掉已删除的图片"""
+        rows = np.flatnonzero(self._store.alive)
+        columns = {
+            "palettes.f16": np.array(self._palette_rows()[rows]) if len(rows)
+            else np.zeros((0, self.slots, 4), np.float16),
+            "cells.u8": np.array(self._cell_rows()[rows]) if len(rows) else np.zeros((0, GRID_BYTES), np.uint8),
+        }
+        # 释放内存映射, Windows 下否则无法删除文件
+        self._palettes = None
+        self._cells = None
+        self._meta["generation"] = self._store.generation + 1
+        self._store.rewrite(columns, lambda: write_meta(self.index_dir, self._meta))
+
+    def search(self, palette: Palette, k: int = 20, prefilter: bool = True, radius: float = PREFILTER_DELTA_E,
+               exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        """
+        按与目标颜色的加权距离 (越小越接近) 返回最接近的 k 张图片
+
+        Args:
+            palette: 目标颜色 "#rrggbb" 或主色列表
+            prefilter: 先按 Lab 网格筛选候选, 候选不足 k 个时 radius 加倍, 超过整个色域后退回全量计算;
+                       只会漏掉主要颜色 (占比不低于 cell_weight) 都离目标很远的图片
+            exclude: 结果中排除的图片 ID (通常是查询图片本身)
+        """
+        lab, weights = palette_to_lab(palette, self.slots)
+        candidates = self._candidate_rows(lab, weights, k, radius) if prefilter else None
+
+        total = len(self._store.ids) if candidates is None else len(candidates)
+        exclude_row = self._store.rows.get(exclude) if exclude is not None else None
+
+        def chunks():
+            for start in range(0, total, SEARCH_CHUNK_ROWS):
+                if candidates is None:
+                    rows = np.arange(start, min(start + SEARCH_CHUNK_ROWS, total))
+                    palettes = self._palette_rows()[start:start + len(rows)]
+                else:
+                    rows = candidates[start:start + SEARCH_CHUNK_ROWS]
+                    palettes = self._palette_rows()[rows]
+                distances = palette_distances(np.asarray(palettes), lab, weights)
+                distances[~self._store.alive[rows]] = np.inf
+                if exclude_row is not None:
+                    distances[rows == exclude_row] = np.inf
+                yield rows, distances
+
+        return [(self._store.ids[row], distance) for row, distance in smallest_k(chunks(), k)]
+
+    def _candidate_rows(self, lab: np.ndarray, weights: np.ndarray, k: int, radius: float) -> Optional[np.ndarray]:
+        """与目标的主要颜色所在网格有交集的图片行号; 范围扩大到整个色域仍不足 k 个时返回 None (全量计算)"""
+        main = np.flatnonzero((weights >= self.cell_weight) | (np.arange(len(weights)) == 0))
+        cells = self._cell_rows()
+        while radius < 2 * 256:
+            mask = cells_near(lab[main], radius)
+            columns = np.flatnonzero(mask)
+            hits = (cells[:, columns] & mask[columns]).any(axis=1) & self._store.alive
+            rows = np.flatnonzero(hits)
+            if len(rows) >= k:
+                return rows
+            radius *= 2
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "images": len(self._store),
+            "deleted": self._store.deleted,
+            "slots": self.slots,
+            "bytes": len(self._store.ids) * (self.slots * 8 + GRID_BYTES + 1),
+        }
+
+
+def _palette_json(text: str) -> List[dict]:
+    try:
+        palette = json.loads(text)
+    except ValueError as e:
+        raise ValueError(f"主色 JSON 无效: {e}")
+    if not isinstance(palette, list):
+        raise ValueError("主色 JSON 应为 [{\"color\": \"#rrggbb\", \"percentage\": x}, ...]")
+    return palette
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按颜色搜索图片的主色索引")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add", help="提取主色并加入索引")
+    add_parser.add_argument("--index", required=True)
+    source = add_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--images", help="图片目录")
+    source.add_argument("--image", help="单张图片路径")
+    add_parser.add_argument("--palette", help="与 --image 一起使用: 已提取的主色 JSON, 不再重新计算")
+    add_parser.add_argument("--skip-existing", action="store_true", help="跳过索引中已有的图片")
+    add_parser.add_argument("--colors", type=int, default=DEFAULT_SLOTS, help="提取的主色数量")
+
+    query_parser = subparsers.add_parser("query", help="按颜色搜索图片")
+    query_parser.add_argument("--index", required=True)
+    target = query_parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--color", help="目标颜色, 如 #1fa3a3")
+    target.add_argument("--palette", help="目标主色 JSON")
+    target.add_argument("--image", help="搜索与该图片主色接近的图片")
+    query_parser.add_argument("-k", type=int, default=20)
+    query_parser.add_argument("--exact", action="store_true", help="不使用网格预筛选, 计算所有图片")
+
+    remove_parser = subparsers.add_parser("remove", help="从索引中删除图片")
+    remove_parser.add_argument("--index", required=True)
+    remove_parser.add_argument("ids", nargs="+")
+
+    args = parser.parse_args()
+
+    try:
+        index = PaletteIndex(args.index)
+        if args.command == "add":
+            from get_main_color import get_dominant_colors_kmeans
+
+            if args.image:
+                palette = _palette_json(args.palette) if args.palette else get_dominant_colors_kmeans(
+                    args.image, args.colors)
+                index.add([args.image], [palette])
+            else:
+                from batch_common import iter_image_files
+
+                batch_ids, batch_palettes, errors = [], [], 0
+                for path in iter_image_files(args.images):
+                    if args.skip_existing and path in index:
+                        continue
+                    try:
+                        batch_palettes.append(get_dominant_colors_kmeans(path, args.colors))
+                        batch_ids.append(path)
+                    except Exception as e:
+                        errors += 1
+                        print(json.dumps({"image": path, "error": str(e)}, ensure_ascii=False))
+                    if len(batch_ids) >= 256:
+                        index.add(batch_ids, batch_palettes)
+                        batch_ids, batch_palettes = [], []
+                if batch_ids:
+                    index.add(batch_ids, batch_palettes)
+                print(json.dumps({"event": "done", "errors": errors, **index.stats()}, ensure_ascii=False))
+        elif args.command == "query":
+            exclude = None
+            if args.image:
+                from get_main_color import get_dominant_colors_kmeans
+
+                target_palette = get_dominant_colors_kmeans(args.image, index.slots)
+                exclude = args.image
+            else:
+                target_palette = args.color or _palette_json(args.palette)
+            matches = index.search(target_palette, k=args.k, prefilter=not args.exact, exclude=exclude)
+            print(json.dumps([{"image": image_id, "distance": round(distance, 3)} for image_id, distance in matches],
+                             ensure_ascii=False))
+        elif args.command == "remove":
+            print(json.dumps({"removed": index.remove(args.ids)}, ensure_ascii=False))
+    except Exception as e:
+        print(json.dumps({"error": str(e)}, ensure_ascii=False))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
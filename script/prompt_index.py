@@ -0,0 +1,567 @@
+"""
+按生成参数搜索图片的倒排索引
+
+将 read_image_metadata.py 读取的生成参数转换为词项, 每个词项对应一个升序的图片行号列表 (uint32),
+查询时对这些有序列表求交集/并集/差集:
+- 词项: prompt:<正向提示词> negative:<反向提示词> ckpt:<模型> lora:<LoRA> sampler:<采样器>
+  generator:<生成器> param:<参数名>=<值>
+- 规范化: 小写, 下划线视为空格, 去掉权重语法 "(word:1.2)" 的括号和权重; 模型名去掉目录和扩展名
+- 增量添加: 每次 add 写入一个分段 (有序词表 + 行号列表), 分段按大小两两合并;
+  删除只写墓碑标记, 删除较多时自动压缩
+
+查询语法: 空格分隔的条件全部满足, "a|b" 满足其一, "-a" 排除, 值以 "*" 结尾时按前缀匹配,
+没有字段名时按正向提示词匹配; 带空格的值加引号。例如:
+    ckpt:animagine* "blue hair" -negative:lowres "sampler:euler a|sampler:ddim" param:steps=28
+
+用法:
+    python prompt_index.py add --index <索引目录> (--ndjson <结果.ndjson | -> | --images <图片目录>)
+    python prompt_index.py query --index <索引目录> '<查询>' [--limit 100]
+    python prompt_index.py remove --index <索引目录> <图片路径> ...
+    python prompt_index.py stats --index <索引目录>
+
+--ndjson 读取 read_image_metadata.py 批量模式的输出, 可以边解析边写入:
+    python read_image_metadata.py --dir <图片目录> | python prompt_index.py add --index <索引目录> --ndjson -
+"""
+import os
+import re
+import sys
+import json
+import time
+import bisect
+import shlex
+import argparse
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from row_store import ALIVE, IDS, RowStore, read_meta, write_meta
+
+FIELDS = ("prompt", "negative", "ckpt", "lora", "sampler", "generator", "param")
+FIELD_ALIASES = {"p": "prompt", "positive": "prompt", "n": "negative", "model": "ckpt", "checkpoint": "ckpt"}
+MODEL_EXTENSIONS = (".safetensors", ".ckpt", ".pt", ".pth", ".bin", ".gguf")
+# 超过该长度的参数值 (如嵌入的 JSON) 不建索引
+MAX_PARAM_VALUE = 100
+# --ndjson / --images 时每个分段的图片数量
+ADD_BATCH = 5000
+
+_WEIGHT = re.compile(r":\s*-?\d+(?:\.\d+)?\s*$")
+_LORA = re.compile(r"<\s*(?:lora|lyco)\s*:\s*([^:>]+)[^>]*>", re.IGNORECASE)
+_PROMPT_SEPARATOR = re.compile(r"[,\n]|\bBREAK\b")
+_MODEL_REPR_NAME = re.compile(r"\bname='([^']*)'")
+
+
+def normalize_token(text: str) -> str:
+    """提示词规范化: "(Blue_Hair:1.2)" -> "blue hair" """
+    text = text.replace("\\", "").replace("_", " ").lower().strip(" ()[]{}")
+    text = _WEIGHT.sub("", text).strip(" ()[]{}")
+    return " ".join(text.split())
+
+
+def normalize_model(name: str) -> str:
+    """模型名规范化: "SDXL\\Anime\\Animagine-XL-3.1.safetensors" -> "animagine-xl-3.1" """
+    name = name.replace("\\", "/").rsplit("/", 1)[-1].strip()
+    if name.lower().endswith(MODEL_EXTENSIONS):
+        name = name.rsplit(".", 1)[0]
+    return name.lower()
+
+
+def normalize_value(field: str, value: str) -> str:
+    """按字段规范化词项的值, 索引和查询使用相同的规则"""
+    if field in ("prompt", "negative"):
+        return normalize_token(value)
+    if field in ("ckpt", "lora"):
+        return normalize_model(value)
+    if field == "param":
+        key, _, value = value.partition("=")
+        return f"{_param_key(key)}={value.strip().lower()}" if _ else _param_key(key)
+    return " ".join(value.lower().split())
+
+
+def _param_key(key: str) -> str:
+    return "_".join(key.strip().lower().split())
+
+
+def _param_value(value) -> Optional[str]:
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, (int, float, str)):
+        text = str(value).strip().lower()
+        return text if 0 < len(text) <= MAX_PARAM_VALUE else None
+    return None
+
+
+def _model_name(value) -> Optional[str]:
+    """model 字段可能是 {"name": ...}、字符串、sd_parsers 的 Model 对象或其 repr (批量模式以 str 序列化)"""
+    if isinstance(value, dict):
+        value = value.get("name") or value.get("model")
+    elif value is not None and not isinstance(value, str):
+        value = getattr(value, "name", None)
+    if isinstance(value, str) and value.startswith("Model("):
+        match = _MODEL_REPR_NAME.search(value)
+        value = match.group(1) if match else None
+    return value if isinstance(value, str) and value.strip() else None
+
+
+def _prompt_terms(field: str, items, terms: Set[str]):
+    if isinstance(items, str):
+        items = [items]
+    for item in items or []:
+        if not isinstance(item, str):
+            continue
+        for lora in _LORA.findall(item):
+            terms.add("lora:" + normalize_model(lora))
+        for token in _PROMPT_SEPARATOR.split(_LORA.sub(",", item)):
+            token = normalize_token(token)
+            if token:
+                terms.add(f"{field}:{token}")
+
+
+def metadata_terms(metadata: dict) -> Set[str]:
+    """
+    read_metadata 的结果 (ComfyUI / AUTOMATIC1111 两种结构) 转换为词项集合
+
+    没有生成参数 (None) 时返回空集合。
+    """
+    terms: Set[str] = set()
+    if not isinstance(metadata, dict):
+        return terms
+    if isinstance(metadata.get("generator"), str):
+        terms.add("generator:" + normalize_value("generator", metadata["generator"]))
+    # ComfyUI 为 positive_prompt / negative_prompt, AUTOMATIC1111 为 positive_prompts / negative_prompts
+    _prompt_terms("prompt", metadata.get("positive_prompt") or metadata.get("positive_prompts"), terms)
+    _prompt_terms("negative", metadata.get("negative_prompt") or metadata.get("negative_prompts"), terms)
+
+    models = [metadata.get("model"), metadata.get("ckpt_name")]
+    models += [m.get("model") for m in metadata.get("models") or [] if isinstance(m, dict)]
+    for model in models:
+        name = _model_name(model)
+        if name:
+            terms.add("ckpt:" + normalize_model(name))
+
+    samplers = metadata.get("samplers") or []
+    for sampler in [samplers] if isinstance(samplers, dict) else samplers:
+        if not isinstance(sampler, dict):
+            continue
+        if isinstance(sampler.get("name"), str) and sampler["name"].strip():
+            terms.add("sampler:" + normalize_value("sampler", sampler["name"]))
+        parameters = sampler.get("parameters")
+        for key, value in (parameters.items() if isinstance(parameters, dict) else ()):
+            value = _param_value(value)
+            if value is not None:
+                terms.add(f"param:{_param_key(str(key))}={value}")
+    return terms
+
+
+class Clause:
+    """查询中的一个条件: 任一 (词项, 是否前缀匹配) 满足即可, negated 时为排除"""
+
+    def __init__(self, alternatives: List[Tuple[str, bool]], negated: bool = False):
+        self.alternatives = alternatives
+        self.negated = negated
+
+    def matches(self, terms: Set[str]) -> bool:
+        """逐条检查词项集合, 用于全量扫描对照"""
+        return any(
+            any(t.startswith(term) for t in terms) if prefix else term in terms
+            for term, prefix in self.alternatives
+        )
+
+
+def parse_query(query: str) -> List[Clause]:
+    """解析查询字符串, 语法见模块说明; 不是已知字段名的 "x:y" 按提示词处理, 条件为空时抛出 ValueError"""
+    clauses = []
+    for part in shlex.split(query):
+        negated = part.startswith("-")
+        alternatives = []
+        for alternative in (part[1:] if negated else part).split("|"):
+            field, sep, value = alternative.partition(":")
+            field = FIELD_ALIASES.get(field.lower(), field.lower())
+            if not sep or field not in FIELDS:
+                field, value = "prompt", alternative
+            prefix = value.endswith("*")
+            value = normalize_value(field, value.rstrip("*"))
+            if not value and not prefix:
+                raise ValueError(f"空的查询条件: {alternative}")
+            alternatives.append((f"{field}:{value}", prefix))
+        clauses.append(Clause(alternatives, negated))
+    if not clauses:
+        raise ValueError("查询为空")
+    return clauses
+
+
+def intersect(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """两个升序无重复数组的交集; 长度相差较大时对短数组二分查找, 不排序长数组"""
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) == 0:
+        return a
+    if len(a) * 16 < len(b):
+        found = np.searchsorted(b, a)
+        found[found == len(b)] = len(b) - 1
+        return a[b[found] == a]
+    return np.intersect1d(a, b, assume_unique=True)
+
+
+def difference(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """a 中不在 b 里的元素, a / b 升序无重复"""
+    if len(a) == 0 or len(b) == 0:
+        return a
+    found = np.searchsorted(b, a)
+    found[found == len(b)] = len(b) - 1
+    return a[b[found] != a]
+
+
+def union(arrays: List[np.ndarray]) -> np.ndarray:
+    arrays = [a for a in arrays if len(a)]
+    if not arrays:
+        return np.zeros(0, dtype=np.uint32)
+    if len(arrays) == 1:
+        return arrays[0]
+    return np.unique(np.concatenate(arrays))
+
+
+class _Segment:
+    """
+    一个分段, 包含行号 [start, end) 内的图片:
+        <name>.terms.json   升序词表
+        <name>.offsets.i64  每个词项在行号列表中的起止位置 (词项数 + 1)
+        <name>.postings.u32 按词表顺序拼接的升序行号
+    """
+
+    def __init__(self, index_dir: str, name: str, start: int, end: int):
+        self.name, self.start, self.end = name, start, end
+        prefix = os.path.join(index_dir, name)
+        with open(prefix + ".terms.json", encoding="utf-8") as f:
+            self.terms: List[str] = json.load(f)
+        self.offsets = np.fromfile(prefix + ".offsets.i64", dtype=np.int64)
+        size = int(self.offsets[-1])
+        self.postings = (np.memmap(prefix + ".postings.u32", dtype=np.uint32, mode="r", shape=(size,))
+                         if size else np.zeros(0, dtype=np.uint32))
+
+    def get(self, term: str) -> np.ndarray:
+        i = bisect.bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return self.postings[self.offsets[i]:self.offsets[i + 1]]
+        return self.postings[:0]
+
+    def prefix(self, prefix: str) -> Iterator[Tuple[str, np.ndarray]]:
+        i = bisect.bisect_left(self.terms, prefix)
+        while i < len(self.terms) and self.terms[i].startswith(prefix):
+            yield self.terms[i], self.postings[self.offsets[i]:self.offsets[i + 1]]
+            i += 1
+
+    def items(self) -> Iterator[Tuple[str, np.ndarray]]:
+        for i, term in enumerate(self.terms):
+            yield term, self.postings[self.offsets[i]:self.offsets[i + 1]]
+
+
+class PromptIndex:
+    """
+    磁盘上的倒排索引, 目录结构 (ids / alive / 压缩的处理见 row_store.py):
+        meta.json   已提交的图片行数和分段列表, 以替换文件的方式原子更新
+        ids.jsonl   每行一个 JSON 字符串, 第 i 行对应行号 i 的图片
+        alive.u8    每张图片一个字节, 0 表示已删除
+        seg-*.*     分段文件, 见 _Segment
+    """
+
+    def __init__(self, index_dir: str):
+        self.index_dir = os.path.abspath(index_dir)
+        os.makedirs(self.index_dir, exist_ok=True)
+
+        self._store = RowStore(self.index_dir)
+        self._segments: List[_Segment] = []
+        self._next_segment = 0
+        self._load()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    def _load(self):
+        meta = read_meta(self.index_dir) or {"rows": 0, "segments": [], "next_segment": 0}
+        # 写入中断时 ids / alive 可能多出没有提交的行, 分段目录中可能留下没有提交的文件
+        self._store.load(meta.get("generation", 0), count=meta["rows"])
+        self._segments = [_Segment(self.index_dir, s["name"], s["start"], s["end"]) for s in meta["segments"]]
+        self._next_segment = meta["next_segment"]
+        self._remove_orphans()
+
+    def _remove_orphans(self):
+        names = {segment.name for segment in self._segments}
+        for file_name in os.listdir(self.index_dir):
+            if file_name.startswith("seg-") and file_name.split(".", 1)[0] not in names:
+                os.remove(self._path(file_name))
+
+    def _commit(self):
+        write_meta(self.index_dir, {
+            "version": 1,
+            "rows": len(self._store.ids),
+            "generation": self._store.generation,
+            "segments": [{"name": s.name, "start": s.start, "end": s.end} for s in self._segments],
+            "next_segment": self._next_segment,
+        })
+
+    def _write_segment(self, postings: Dict[str, np.ndarray], start: int, end: int) -> _Segment:
+        name = f"seg-{self._next_segment:06d}"
+        self._next_segment += 1
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(postings[term]) for term in terms], out=offsets[1:])
+        rows = (np.concatenate([postings[term] for term in terms]).astype(np.uint32)
+                if terms else np.zeros(0, dtype=np.uint32))
+        with open(self._path(name + ".terms.json"), "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+        offsets.tofile(self._path(name + ".offsets.i64"))
+        rows.tofile(self._path(name + ".postings.u32"))
+        return _Segment(self.index_dir, name, start, end)
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def __contains__(self, image_id: str) -> bool:
+        return image_id in self._store.rows
+
+    def add(self, ids: List[str], records: List[Optional[dict]]):
+        """
+        添加或更新图片, records 为 read_metadata 的结果
+
+        没有生成参数 (None) 的图片不加入索引, 已在索引中时删除。
+        """
+        latest = dict(zip(ids, records))  # 同一批中重复的图片以最后一次为准
+        replaced = {image_id: self._store.rows[image_id] for image_id in latest if image_id in self._store.rows}
+        start = len(self._store.ids)
+        new_ids, postings = [], defaultdict(list)
+        for image_id, metadata in latest.items():
+            terms = metadata_terms(metadata)
+            if not terms:
+                continue
+            row = start + len(new_ids)
+            new_ids.append(image_id)
+            for term in terms:
+                postings[term].append(row)
+
+        if new_ids:
+            self._store.append(new_ids)
+            self._segments.append(self._write_segment(postings, start, start + len(new_ids)))
+            self._commit()
+        # 新行提交之后再删除旧行, 中断时旧结果仍然可查
+        for image_id in replaced.keys() - set(new_ids):
+            del self._store.rows[image_id]
+        self._store.delete_rows(list(replaced.values()))
+        self._merge_segments()
+
+    def remove(self, ids: Iterable[str]) -> int:
+        """删除图片, 返回实际删除的数量"""
+        removed = self._store.mark_deleted(ids)
+        if self._store.needs_compaction():
+            self.compact()
+        return removed
+
+    def _merge_segments(self):
+        """最后一个分段不小于前一个时合并两者, 分段数量约为 log2(图片数 / 每次添加的数量)"""
+        while len(self._segments) > 1 and (
+                self._segments[-2].end - self._segments[-2].start <= self._segments[-1].end - self._segments[-1].start):
+            older, newer = self._segments[-2], self._segments[-1]
+            merged = defaultdict(list)
+            for segment in (older, newer):
+                for term, rows in segment.items():
+                    merged[term].append(rows)
+            # 两个分段的行号不重叠且 older 在前, 直接拼接仍是升序
+            segment = self._write_segment({term: np.concatenate(parts) for term, parts in merged.items()},
+                                          older.start, newer.end)
+            self._segments[-2:] = [segment]
+            self._commit()
+            for old in (older, newer):
+                old.postings = None  # 释放内存映射, Windows 下否则无法删除文件
+                self._delete_segment_files(old.name)
+
+    def _delete_segment_files(self, name: str):
+        for suffix in (".terms.json", ".offsets.i64", ".postings.u32"):
+            if os.path.exists(self._path(name + suffix)):
+                os.remove(self._path(name + suffix))
+
+    def compact(self):
+        """重写索引, 去掉已删除的图片并重新编号, 所有分段合并为一个"""
+        alive = self._store.alive
+        new_row = np.cumsum(alive, dtype=np.int64) - 1
+        merged = defaultdict(list)
+        for segment in self._segments:
+            for term, rows in segment.items():
+                rows = rows[alive[rows]]
+                if len(rows):
+                    merged[term].append(new_row[rows])
+
+        # 新分段在 meta.json 提交前不会被使用, 中断时作为孤立文件删除
+        old_segments = self._segments
+        count = int(alive.sum())
+        postings = {term: np.concatenate(parts) for term, parts in merged.items()}
+        self._segments = [self._write_segment(postings, 0, count)] if count else []
+        self._store.rewrite({}, self._commit)
+        for segment in old_segments:
+            segment.postings = None  # 释放内存映射, Windows 下否则无法删除文件
+            self._delete_segment_files(segment.name)
+
+    def _postings(self, term: str, prefix: bool) -> np.ndarray:
+        """词项 (或前缀) 在所有分段中的行号, 升序"""
+        parts = []
+        for segment in self._segments:
+            if prefix:
+                parts.append(union([rows for _, rows in segment.prefix(term)]))
+            else:
+                parts.append(segment.get(term))
+        # 各分段行号范围不重叠且按顺序排列, 拼接后仍是升序
+        parts = [np.asarray(p) for p in parts if len(p)]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.uint32)
+
+    def match(self, query) -> np.ndarray:
+        """
+        满足查询的行号 (升序)
+
+        各条件的行号按长度从短到长求交集, 交集为空时提前结束; 只有排除条件时从所有图片开始。
+        """
+        clauses = parse_query(query) if isinstance(query, str) else query
+        included, excluded = [], []
+        for clause in clauses:
+            rows = union([self._postings(term, prefix) for term, prefix in clause.alternatives])
+            (excluded if clause.negated else included).append(rows)
+
+        if included:
+            included.sort(key=len)
+            result = included[0]
+            for rows in included[1:]:
+                if len(result) == 0:
+                    break
+                result = intersect(result, rows)
+        else:
+            result = np.flatnonzero(self._store.alive).astype(np.uint32)
+        for rows in excluded:
+            result = difference(result, rows)
+        return result[self._store.alive[result]] if len(result) else result
+
+    def search(self, query, limit: int = None) -> Tuple[int, List[str]]:
+        """返回 (匹配数量, 图片 ID 列表), 按加入索引的顺序, 最多 limit 个"""
+        rows = self.match(query)
+        return len(rows), [self._store.ids[row] for row in rows[:limit]]
+
+    def terms(self, prefix: str = "") -> Dict[str, int]:
+        """以 prefix 开头的词项及其图片数量 (不扣除已删除的图片), 用于补全和查看字段取值"""
+        counts = defaultdict(int)
+        for segment in self._segments:
+            for term, rows in segment.prefix(prefix):
+                counts[term] += len(rows)
+        return dict(counts)
+
+    def stats(self) -> dict:
+        names = {segment.name for segment in self._segments}
+        files = {"meta.json", *(os.path.basename(self._store.path(name)) for name in (IDS, ALIVE))}
+        size = sum(os.path.getsize(self._path(f)) for f in os.listdir(self.index_dir)
+                   if f.split(".", 1)[0] in names or f in files)
+        return {
+            "images": len(self._store),
+            "deleted": self._store.deleted,
+            "segments": len(self._segments),
+            "terms": len(set().union(*(segment.terms for segment in self._segments))),
+            "postings": int(sum(int(segment.offsets[-1]) for segment in self._segments)),
+            "bytes": size,
+        }
+
+
+def iter_ndjson_records(stream) -> Iterator[Tuple[str, Optional[dict]]]:
+    """读取 read_image_metadata.py 批量模式的输出, 跳过出错的图片和无法解析的行"""
+    for line in stream:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict) and "image" in record and "error" not in record:
+            yield record["image"], record.get("metadata")
+
+
+def iter_image_records(dir_path: str) -> Iterator[Tuple[str, Optional[dict]]]:
+    from read_image_metadata import iter_image_files, read_metadata
+
+    for path in iter_image_files(dir_path):
+        try:
+            yield path, read_metadata(path)
+        except Exception as e:
+            print(json.dumps({"image": path, "error": str(e)}, ensure_ascii=False))
+
+
+def add_records(index: PromptIndex, records: Iterable[Tuple[str, Optional[dict]]], batch_size: int = ADD_BATCH) -> int:
+    """每 batch_size 张图片写入一个分段, 返回读取的图片数量"""
+    ids, batch, total = [], [], 0
+    for image_id, metadata in records:
+        ids.append(image_id)
+        batch.append(metadata)
+        total += 1
+        if len(ids) >= batch_size:
+            index.add(ids, batch)
+            ids, batch = [], []
+    if ids:
+        index.add(ids, batch)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按生成参数搜索图片的倒排索引")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add", help="加入或更新图片的生成参数")
+    add_parser.add_argument("--index", required=True)
+    source = add_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--ndjson", help="read_image_metadata.py 批量模式的输出文件, - 表示 stdin")
+    source.add_argument("--images", help="图片目录")
+    add_parser.add_argument("--batch-size", type=int, default=ADD_BATCH, help="每个分段的图片数量")
+
+    query_parser = subparsers.add_parser("query", help="按提示词、模型、采样器等搜索图片")
+    query_parser.add_argument("--index", required=True)
+    query_parser.add_argument("query")
+    query_parser.add_argument("--limit", type=int, default=100)
+
+    terms_parser = subparsers.add_parser("terms", help="列出以指定前缀开头的词项及图片数量")
+    terms_parser.add_argument("--index", required=True)
+    terms_parser.add_argument("prefix", nargs="?", default="")
+    terms_parser.add_argument("--limit", type=int, default=100)
+
+    remove_parser = subparsers.add_parser("remove", help="从索引中删除图片")
+    remove_parser.add_argument("--index", required=True)
+    remove_parser.add_argument("ids", nargs="+")
+
+    stats_parser = subparsers.add_parser("stats", help="索引大小")
+    stats_parser.add_argument("--index", required=True)
+
+    args = parser.parse_args()
+
+    try:
+        index = PromptIndex(args.index)
+        if args.command == "add":
+            start = time.perf_counter()
+            if args.images:
+                total = add_records(index, iter_image_records(args.images), args.batch_size)
+            elif args.ndjson == "-":
+                total = add_records(index, iter_ndjson_records(sys.stdin), args.batch_size)
+            else:
+                with open(args.ndjson, encoding="utf-8") as f:
+                    total = add_records(index, iter_ndjson_records(f), args.batch_size)
+            print(json.dumps({"event": "done", "read": total, "seconds": round(time.perf_counter() - start, 3),
+                              **index.stats()}, ensure_ascii=False))
+        elif args.command == "query":
+            start = time.perf_counter()
+            count, images = index.search(args.query, limit=args.limit)
+            print(json.dumps({"count": count, "images": images,
+                              "ms": round((time.perf_counter() - start) * 1000, 3)}, ensure_ascii=False))
+        elif args.command == "terms":
+            counts = sorted(index.terms(args.prefix).items(), key=lambda item: -item[1])[:args.limit]
+            print(json.dumps([{"term": term, "images": count} for term, count in counts], ensure_ascii=False))
+        elif args.command == "remove":
+            print(json.dumps({"removed": index.remove(args.ids)}, ensure_ascii=False))
+        elif args.command == "stats":
+            print(json.dumps(index.stats(), ensure_ascii=False))
+    except Exception as e:
+        print(json.dumps({"error": str(e)}, ensure_ascii=False))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
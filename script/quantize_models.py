@@ -0,0 +1,280 @@
+"""
+生成量化模型并与 fp32 模型对比
+
+    int8: onnxruntime 动态量化 (权重 int8, 激活值推理时量化), 主要用于 CPU。
+          默认只量化 MatMul / Gemm: 动态量化的卷积 (ConvInteger) 在 CPU 上比 fp32 卷积慢得多
+    fp16: 权重和计算转换为 float16, 输入输出保持 float32, 只在 CUDA / DirectML 上有加速效果
+
+生成的模型与原模型放在同一目录: <模型名称>.int8.onnx / <模型名称>.fp16.onnx,
+与原模型共用 <模型名称>.csv 标签表, AITagger.get_available_models 会列出这些模型,
+tag_image(..., precision="int8") 或 model_name="<模型名称>.int8" 即可使用。
+
+用法:
+    python quantize_models.py [模型名称] [--models-dir models] [--precision int8 fp16]
+    python quantize_models.py [模型名称] --images <图片目录> [--limit 200] [--output report.json]
+
+指定 --images 时输出对比报告: 各精度在当前阈值下的标签集合 precision / recall、
+概率平均绝对误差、推理速度和内存占用。
+"""
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import tempfile
+from typing import List, Optional
+
+import numpy as np
+
+from ai_tagger import AITagger, PRECISIONS, variant_name
+from batch_common import iter_image_files
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+INT8_OP_TYPES = ["MatMul", "Gemm"]
+
+
+def quantize_int8(model_path: str, output_path: str, op_types: List[str] = None):
+    """动态量化为 int8, 先做形状推理和图优化预处理, 失败时直接量化原模型"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(output_path)) as tmp:
+        source = os.path.join(tmp, "preprocessed.onnx")
+        try:
+            quant_pre_process(model_path, source, skip_symbolic_shape=True)
+        except Exception as e:
+            print(f"预处理失败, 直接量化原模型: {e}")
+            source = model_path
+        quantize_dynamic(source, output_path, weight_type=QuantType.QInt8,
+                         op_types_to_quantize=op_types or INT8_OP_TYPES)
+
+
+def convert_fp16(model_path: str, output_path: str):
+    """转换为 float16, 输入输出保持 float32, 调用方不需要修改预处理"""
+    import onnx
+    from onnxruntime.transformers.float16 import convert_float_to_float16
+
+    model = onnx.load(model_path)
+    onnx.save(convert_float_to_float16(model, keep_io_types=True), output_path)
+
+
+def build_variant(model_name: str, models_dir: str, precision: str, force: bool = False,
+                  op_types: List[str] = None) -> str:
+    """生成指定精度的模型, 已存在且比原模型新时跳过; 先写临时文件, 完成后再替换"""
+    model_path = os.path.join(models_dir, f"{model_name}.onnx")
+    output_path = os.path.join(models_dir, f"{variant_name(model_name, precision)}.onnx")
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"模型文件不存在: {model_path}")
+    if not force and os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(model_path):
+        print(f"文件已存在: {os.path.basename(output_path)}")
+        return output_path
+
+    print(f"生成 {precision} 模型: {os.path.basename(output_path)}")
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    start = time.perf_counter()
+    try:
+        if precision == "int8":
+            quantize_int8(model_path, temp_path, op_types)
+        else:
+            convert_fp16(model_path, temp_path)
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    print(f"完成: {os.path.getsize(model_path) / 1024 ** 2:.1f} MB -> "
+          f"{os.path.getsize(output_path) / 1024 ** 2:.1f} MB, 耗时 {time.perf_counter() - start:.1f} 秒")
+    return output_path
+
+
+def default_precisions(providers: List[str]) -> List[str]:
+    """int8 总是生成; fp16 只在有 GPU 后端时生成, CPU 上 fp16 没有加速"""
+    gpu = {"CUDAExecutionProvider", "DmlExecutionProvider"} & set(providers)
+    return ["int8", "fp16"] if gpu else ["int8"]
+
+
+def rss_bytes() -> Optional[int]:
+    """当前进程常驻内存, 没有 psutil 且不是 Linux 时返回 None"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def measure_variant(tagger: AITagger, model_name: str, images: List[str], batch_size: int, repeat: int) -> dict:
+    """
+    加载模型并推理所有图片, 返回概率矩阵、速度和内存
+
+    无法读取的图片跳过, 记录在 skipped 中; 概率矩阵只包含 images 中 (成功读取) 的图片。
+    """
+    tagger.model_cache.clear()
+    gc.collect()
+    rss_before = rss_bytes()
+
+    start = time.perf_counter()
+    loaded = tagger._load_model(model_name)
+    load_time = time.perf_counter() - start
+
+    height = loaded.session.get_inputs()[0].shape[1]
+    tensors, readable, skipped = [], [], []
+    for path in images:
+        try:
+            tensors.append(tagger.preprocess_image(path, height))
+            readable.append(path)
+        except Exception as e:
+            skipped.append((path, str(e)))
+    if not tensors:
+        raise ValueError(f"没有可读取的图片 (共 {len(images)} 张)")
+    batches = [tensors[i:i + batch_size] for i in range(0, len(tensors), batch_size)]
+    probs = np.concatenate([tagger._run(loaded.session, batch) for batch in batches])
+    rss_after = rss_bytes()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for batch in batches:
+            tagger._run(loaded.session, batch)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "images": readable,
+        "skipped": skipped,
+        "probs": probs,
+        "labels": loaded.labels,
+        "file_mb": round(loaded.size_bytes / 1024 ** 2, 1),
+        "load_ms": round(load_time * 1000, 1),
+        "rss_mb": round((rss_after - rss_before) / 1024 ** 2, 1) if rss_before is not None else None,
+        "ms_per_image": round(elapsed * 1000 / (len(readable) * repeat), 2),
+        "images_per_sec": round(len(readable) * repeat / elapsed, 2),
+    }
+
+
+def tag_sets(probs: np.ndarray, labels, threshold: float, character_threshold: float) -> list:
+    """按阈值得到每张图片的标签集合 (标签下标)"""
+    sets = []
+    for row in probs:
+        general = labels.general_ids[row[labels.general_ids] > threshold]
+        character = labels.character_ids[row[labels.character_ids] > character_threshold]
+        sets.append(set(general.tolist()) | set(character.tolist()))
+    return sets
+
+
+def agreement_report(tagger: AITagger, model_name: str, precisions: List[str], images: List[str],
+                     threshold: float, character_threshold: float, batch_size: int = 8, repeat: int = 1) -> dict:
+    """
+    以 fp32 为基准对比各精度模型
+
+    precision / recall 按所有图片的标签合计计算 (micro), exact_match 为标签集合完全一致的图片比例。
+    无法读取的图片跳过, 各精度只对比 fp32 成功读取的图片。
+    """
+    reference = measure_variant(tagger, model_name, images, batch_size, repeat)
+    images = reference["images"]
+    reference_sets = tag_sets(reference["probs"], reference["labels"], threshold, character_threshold)
+
+    rows = []
+    for precision in ["fp32"] + precisions:
+        name = variant_name(model_name, precision)
+        result = reference if precision == "fp32" else measure_variant(tagger, name, images, batch_size, repeat)
+        sets = tag_sets(result["probs"], result["labels"], threshold, character_threshold)
+
+        matched = sum(len(a & b) for a, b in zip(sets, reference_sets))
+        predicted = sum(len(s) for s in sets)
+        expected = sum(len(s) for s in reference_sets)
+        drift = np.abs(result["probs"] - reference["probs"])
+        rows.append({
+            "precision": precision,
+            "tag_precision": round(matched / predicted, 4) if predicted else 1.0,
+            "tag_recall": round(matched / expected, 4) if expected else 1.0,
+            "exact_match": round(float(np.mean([a == b for a, b in zip(sets, reference_sets)])), 4),
+            "mean_abs_drift": round(float(drift.mean()), 6),
+            "max_abs_drift": round(float(drift.max()), 6),
+            "speedup": round(reference["ms_per_image"] / result["ms_per_image"], 2),
+            **{key: result[key] for key in ("file_mb", "rss_mb", "load_ms", "ms_per_image", "images_per_sec")},
+        })
+
+    return {
+        "model": model_name,
+        "images": len(images),
+        "skipped": len(reference["skipped"]),
+        "threshold": threshold,
+        "character_threshold": character_threshold,
+        "providers": tagger.providers,
+        "results": rows,
+    }
+
+
+def print_report(report: dict):
+    columns = ["precision", "tag_precision", "tag_recall", "exact_match", "mean_abs_drift", "max_abs_drift",
+               "file_mb", "rss_mb", "load_ms", "ms_per_image", "speedup"]
+    rows = report["results"]
+    print(f"\n{report['model']}: {report['images']} 张图片, 阈值 {report['threshold']} / "
+          f"角色阈值 {report['character_threshold']}, 后端 {report['providers'][0]}")
+    if report.get("skipped"):
+        print(f"跳过 {report['skipped']} 张无法读取的图片")
+    widths = [max(len(c), *(len(str(r.get(c, ""))) for r in rows)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row.get(c, "")).ljust(w) for c, w in zip(columns, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成 int8 / fp16 量化模型并与 fp32 对比")
+    parser.add_argument("model_name", nargs="?", default="wd-v1-4-moat-tagger-v2", help="模型名称")
+    parser.add_argument("--models-dir", default="models", help="模型目录")
+    parser.add_argument("--precision", nargs="+", choices=PRECISIONS[1:],
+                        help="要生成的精度, 默认 int8, 有 GPU 后端时同时生成 fp16")
+    parser.add_argument("--force", action="store_true", help="重新生成已存在的模型")
+    parser.add_argument("--int8-ops", nargs="+", help=f"int8 量化的算子类型, 默认 {' '.join(INT8_OP_TYPES)}")
+    parser.add_argument("--images", help="对比用的图片目录, 不指定则只生成模型")
+    parser.add_argument("--limit", type=int, default=200, help="最多使用的图片数量")
+    parser.add_argument("--threshold", type=float, help="普通标签阈值, 默认使用 AITagger 默认值")
+    parser.add_argument("--character-threshold", type=float, help="角色标签阈值, 默认使用 AITagger 默认值")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=1, help="测速时重复推理的次数")
+    parser.add_argument("--output", help="把对比报告写入 JSON 文件")
+    args = parser.parse_args()
+
+    try:
+        tagger = AITagger(args.models_dir)
+        precisions = args.precision or default_precisions(tagger.providers)
+        for precision in precisions:
+            build_variant(args.model_name, tagger.models_dir, precision, args.force, args.int8_ops)
+
+        if not args.images:
+            return
+
+        images = []
+        for path in iter_image_files(args.images):
+            images.append(path)
+            if len(images) >= args.limit:
+                break
+        if not images:
+            print(f"error:目录中没有图片: {args.images}")
+            sys.exit(1)
+
+        report = agreement_report(
+            tagger, args.model_name, precisions, sorted(images),
+            threshold=args.threshold or tagger.defaults["threshold"],
+            character_threshold=args.character_threshold or tagger.defaults["character_threshold"],
+            batch_size=args.batch_size,
+            repeat=args.repeat,
+        )
+    except Exception as e:
+        print(f"error:{str(e)}")
+        sys.exit(1)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,137 +1,246 @@
+"""
+读取图片中的生成参数 (AUTOMATIC1111 / ComfyUI), 输出 JSON
+
+用法:
+    python read_image_metadata.py <图片路径>
+    python read_image_metadata.py --dir <图片目录> [--workers N] [--output 结果.ndjson] [--manifest 清单.jsonl]
+    python read_image_metadata.py --stdin [...] < 路径列表.txt
+
+批量模式每处理完一张图片输出一行 {"image": "...", "metadata": {...} | null} (失败时为 "error"),
+按完成顺序输出; 指定 --manifest 时记录每张图片的 mtime/size, 再次运行时跳过没有变化的图片。
+结束时向 stderr 输出处理数量和每秒处理的图片数。
+"""
 import os
 import sys
 import json
-import io
+import time
+import zlib
+import struct
+import argparse
+import itertools
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import batch_common
+from batch_common import chunks, error_payload, process_chunks
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_TEXT_CHUNKS = (b"tEXt", b"zTXt", b"iTXt")
+# 图像数据之后的文本块只在文件末尾 PNG_TAIL_BYTES 字节内查找
+PNG_TAIL_BYTES = 64 * 1024
+# 与 Pillow 相同的文本块解压上限
+MAX_TEXT_CHUNK = 1024 * 1024
+EXIF_IFD_TAG = 0x8769
+USER_COMMENT_TAG = 0x9286
+# sd_parsers 各解析器读取的键 (见 sd_parsers.parsers), 一个都没有时不可能解析出生成参数
+GENERATOR_KEYS = {"parameters", "prompt", "workflow", "invokeai_metadata", "sd-metadata", "Dream",
+                  "Description", "Software", "Source", "Comment"}
+# JPEG / WebP 的 EXIF UserComment 只交给这两个解析器 (sd_parsers 的 jpeg_usercomment)
+USER_COMMENT_GENERATORS = ("AUTOMATIC1111", "Fooocus")
+COMFYUI_ATTRIBUTES = ["ckpt_name"]
+# 批量模式只处理可能带生成参数的格式
+METADATA_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
 
-# 设置标准输出编码为 UTF-8
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+_shared_parser_manager = None
 
-try:
+
+def _parser_manager_class():
+    """首次解析时才导入 sd_parsers, 导入本模块和参数错误时不加载"""
     from sd_parsers import ParserManager
-    from sd_parsers.data import PromptInfo, Sampler
-except ImportError as e:
-    print(json.dumps({"error": f"Failed to import sd_parsers: {str(e)}. Please install it with: pip install sd-parsers"}))
-    sys.exit(1)
+    return ParserManager
+
+
+def shared_parser_manager():
+    """进程内共用的 ParserManager, 第一次调用时创建"""
+    global _shared_parser_manager
+    if _shared_parser_manager is None:
+        _shared_parser_manager = _parser_manager_class()()
+    return _shared_parser_manager
+
+
+def iter_image_files(dir_path: str) -> Iterator[str]:
+    """递归遍历目录下可能带生成参数的图片文件"""
+    return batch_common.iter_image_files(dir_path, METADATA_EXTENSIONS)
+
+
+def iter_stdin_paths(stdin=None) -> Iterator[str]:
+    """从 stdin 按行读取图片路径, 忽略空行"""
+    for line in stdin or sys.stdin:
+        path = line.rstrip("\r\n")
+        if path.strip():
+            yield path
+
+
+class Manifest:
+    """
+    已处理图片的 mtime/size 清单, JSON Lines 格式, 每行 [绝对路径, mtime_ns, size]
+
+    只追加写入, 同一路径以最后一行为准; 崩溃时写了一半的最后一行在下次打开时截掉。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: Dict[str, Tuple[int, int]] = {}
+        valid_size = 0
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        image_path, mtime_ns, size = json.loads(line)
+                    except ValueError:
+                        break
+                    self._entries[image_path] = (mtime_ns, size)
+                    valid_size += len(line)
+        self._file = open(path, "a+b")
+        self._file.truncate(valid_size)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def unchanged(self, image_path: str, stat: os.stat_result) -> bool:
+        return self._entries.get(os.path.abspath(image_path)) == (stat.st_mtime_ns, stat.st_size)
+
+    def record(self, image_path: str, stat: os.stat_result):
+        image_path = os.path.abspath(image_path)
+        self._entries[image_path] = (stat.st_mtime_ns, stat.st_size)
+        line = json.dumps([image_path, stat.st_mtime_ns, stat.st_size], ensure_ascii=False) + "\n"
+        self._file.write(line.encode("utf-8"))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def _metadata_chunk(items: List[Tuple[int, str]]) -> List[Tuple[int, bool, str]]:
+    """
+    解析一组 (序号, 路径), 返回 (序号, 是否成功, JSON 记录)
+
+    在工作进程中序列化, 主进程只负责写出。序号由主进程分配, 同一路径出现多次时也能对应到各自的提交。
+    """
+    results = []
+    for token, image_path in items:
+        try:
+            record, ok = {"image": image_path, "metadata": read_metadata(image_path)}, True
+        except Exception as e:
+            record, ok = {"image": image_path, "error": error_payload(e)}, False
+        results.append((token, ok, json.dumps(record, ensure_ascii=False, default=str)))
+    return results
+
+
+def _process_chunks(items: Iterable[Tuple[int, str]], workers: int,
+                    chunk_size: int) -> Iterator[Tuple[int, bool, str]]:
+    """workers 为 1 时在本进程中处理, 否则多进程处理; 按完成顺序返回"""
+    item_chunks = chunks(items, max(1, chunk_size))
+    if workers <= 1:
+        for chunk in item_chunks:
+            yield from _metadata_chunk(chunk)
+        return
+    yield from process_chunks(_metadata_chunk, item_chunks, workers)
+
+
+def read_metadata_batch(paths: Iterable[str], output, manifest: Optional[Manifest] = None, workers: int = 1,
+                        chunk_size: int = 64) -> dict:
+    """
+    批量读取生成参数, 每张图片向 output 写一行 JSON, 返回统计
+
+    指定 manifest 时跳过 mtime/size 没有变化的图片, 成功解析 (包括没有生成参数) 的图片写入清单,
+    出错的图片下次仍会重新处理。
+    """
+    # 按提交序号记录 stat, 同一路径出现多次时各自对应
+    stats: Dict[int, Tuple[str, os.stat_result]] = {}
+    tokens = itertools.count()
+    counts = {"processed": 0, "skipped": 0, "errors": 0}
+
+    def pending_paths():
+        for image_path in paths:
+            try:
+                stat = os.stat(image_path)
+            except OSError as e:
+                counts["processed"] += 1
+                counts["errors"] += 1
+                output.write(json.dumps({"image": image_path, "error": error_payload(e)}, ensure_ascii=False) + "\n")
+                continue
+            if manifest is not None and manifest.unchanged(image_path, stat):
+                counts["skipped"] += 1
+                continue
+            token = next(tokens)
+            stats[token] = (image_path, stat)
+            yield token, image_path
+
+    start = time.perf_counter()
+    for token, ok, line in _process_chunks(pending_paths(), workers, chunk_size):
+        output.write(line + "\n")
+        output.flush()
+        counts["processed"] += 1
+        image_path, stat = stats.pop(token)
+        if not ok:
+            counts["errors"] += 1
+        elif manifest is not None:
+            manifest.record(image_path, stat)
+    seconds = time.perf_counter() - start
+    return {**counts, "seconds": round(seconds, 3),
+            "files_per_sec": round(counts["processed"] / seconds, 1) if seconds > 0 else None}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="读取图片中的生成参数")
+    parser.add_argument("image_path", nargs="?", help="图片路径")
+    parser.add_argument("--dir", help="批量模式: 处理目录下所有图片, 每张图片输出一行 JSON")
+    parser.add_argument("--stdin", action="store_true", help="批量模式: 从 stdin 按行读取图片路径")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="批量模式下的进程数")
+    parser.add_argument("--chunk-size", type=int, default=64, help="批量模式下每次分配给进程的图片数量")
+    parser.add_argument("--output", help="批量模式的输出文件 (NDJSON, 追加写入), 默认输出到 stdout")
+    parser.add_argument("--manifest", help="批量模式的 mtime/size 清单, 跳过上次处理后没有变化的图片")
+    return parser.parse_args(argv)
+
+
+def run_batch(args):
+    if args.dir and not os.path.isdir(args.dir):
+        print(json.dumps({"event": "fatal", "error": error_payload(NotADirectoryError(args.dir))}, ensure_ascii=False))
+        sys.exit(1)
+    paths = iter_image_files(args.dir) if args.dir else iter_stdin_paths()
+
+    output = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    manifest = Manifest(args.manifest) if args.manifest else None
+    try:
+        stats = read_metadata_batch(paths, output, manifest, workers=args.workers, chunk_size=args.chunk_size)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if manifest is not None:
+            manifest.close()
+    sys.stderr.write(json.dumps({"event": "done", **stats}, ensure_ascii=False) + "\n")
 
 
 def main():
-    if len(sys.argv) < 2:
+    # 设置标准输出编码为 UTF-8 (只在作为脚本运行时设置, 导入本模块没有副作用)
+    sys.stdout.reconfigure(encoding="utf-8")
+    args = parse_args()
+
+    if args.dir or args.stdin:
+        run_batch(args)
+        return
+
+    if not args.image_path:
         print(json.dumps({"error": "请提供图片路径"}))
         sys.exit(1)
     
-    image_path = sys.argv[1]
+    image_path = args.image_path
     
     try:
         # 检查文件是否存在
         if not os.path.exists(image_path):
             print(json.dumps({"error": f"图片不存在: {image_path}"}))
             sys.exit(1)
-        
-        # 创建解析器管理器
-        parser_manager = ParserManager()
-        
-        # 解析图片元数据
-        prompt_info = parser_manager.parse(image_path)
-        raw_parameters = prompt_info.raw_parameters
-        json_string = json.dumps(raw_parameters, ensure_ascii=False, default=str)
-        attributes = extract_attributes(json_string, ["ckpt_name"])
-        generator = getattr(prompt_info, "generator", None).value
-        if prompt_info and generator == "ComfyUI":
-            # 将 PromptInfo 对象转换为字典
-            try:
-                model_info = {}
-                if attributes.get("ckpt_name"):
-                    model_info["name"] = attributes["ckpt_name"]
-
-                positive_prompt = getattr(prompt_info, "prompts", [])[0]
-                positive_prompt_array = getattr(positive_prompt, "value", "").split(',')
-                negative_prompt = getattr(prompt_info, "prompts", [])[1]
-                negative_prompt_array = getattr(negative_prompt, "value", "").split(',')
-                result = {
-                    # 1. 生成器信息
-                    "generator": generator,
-
-                    # 2. 汇总提示词
-                    "positive_prompt": positive_prompt_array,
-                    "negative_prompt": negative_prompt_array,
-                    "model": model_info or {},
-                    # # 5. 采样器详细信息
-                    "samplers": [
-                        {
-                            "name": getattr(s, "name", None),
-                            "parameters": getattr(s, "parameters", {}) or {},
-                        }
-                        for s in getattr(prompt_info, "samplers", [])
-                    ],                   
-                }
-                result.update(attributes)
-                try:
-                    models = getattr(prompt_info, "models", None)
-                except Exception:
-                    models = None  # 访问失败就当没有
-
-                if models:
-                    # 如果访问成功，再按你需要的结构塞进 result
-                    result["models"] = [
-                        {
-                            "model": getattr(m, "model", None),
-                            "parameters": getattr(m, "parameters", {}) or {},
-                        }
-                        for m in models
-                    ]
-
-                with open('result.json', 'w') as f:
-                    f.write(json.dumps(result, ensure_ascii=False, default=str))
-                print(json.dumps(result, ensure_ascii=False, default=str))
-            except Exception:
-                # 如果转换失败，返回 null
-                print(json.dumps(None))
-        elif generator == "AUTOMATIC1111":
-            try:
-                positive_prompts = getattr(prompt_info, "prompts", []) or []
-                positive_prompt_value = (
-                    getattr(positive_prompts[0], "value", "") if positive_prompts else ""
-                )
-                positive_prompt_array = [
-                    item.strip() for item in positive_prompt_value.split(",") if item.strip()
-                ]
-
-                negative_prompts_attr = getattr(prompt_info, "negative_prompts", []) or []
-                if negative_prompts_attr:
-                    negative_prompt_value = getattr(negative_prompts_attr[0], "value", "")
-                elif len(positive_prompts) > 1:
-                    negative_prompt_value = getattr(positive_prompts[1], "value", "")
-                else:
-                    negative_prompt_value = ""
-                negative_prompt_array = [
-                    item.strip() for item in negative_prompt_value.split(",") if item.strip()
-                ]
 
-                samplers_list = getattr(prompt_info, "samplers", []) or []
-                sampler = samplers_list[0] if samplers_list else None
-                sampler_name = getattr(sampler, "name", None) if sampler else None
-                sampler_params = getattr(sampler, "parameters", {}) or {}
-                model_info = getattr(sampler, "model", None) if sampler else None
-
-                result = {
-                    "generator": generator,
-                    "model": model_info or {},
-                    "samplers": {
-                        "name": sampler_name,
-                        "parameters": sampler_params,
-                    },
-                    "positive_prompts": positive_prompt_array,
-                    "negative_prompts": negative_prompt_array,
-                }
-
-                with open('result.json', 'w') as f:
-                    f.write(json.dumps(result, ensure_ascii=False, default=str))
-                print(json.dumps(result, ensure_ascii=False, default=str))
-            except Exception:
-                print(json.dumps(None))
-        else:
-            # 如果没有找到元数据，返回 null
-            print(json.dumps(None))
+        # 先预扫描文件头, 有生成参数时才导入 sd_parsers, 没有元数据的图片不加载
+        try:
+            result = read_metadata(image_path)
+        except ImportError as e:
+            print(json.dumps({"error": f"Failed to import sd_parsers: {str(e)}. Please install it with: pip install sd-parsers"}))
+            sys.exit(1)
+        print(json.dumps(result, ensure_ascii=False, default=str))
             
     except Exception as e:
         # 如果解析失败，返回 null 而不是抛出错误
@@ -139,23 +248,373 @@ def main():
         print(json.dumps(None))
 
 
-# 根据json string提取属性, regex 匹配 key: value 格式
-import re
+class MetadataScan(NamedTuple):
+    """
+    只读取文件头部得到的元数据
+
+    candidates 与 sd_parsers 依次尝试的参数字典相同: PNG 为图像数据之前的文本块 (Image.info)、
+    全部文本块 (Image.text); JPEG / WebP 为 {"parameters": EXIF UserComment}, 没有时为空列表。
+    图像数据之前的文本块已有 GENERATOR_KEYS 时不再读取文件末尾, complete 为 False。
+    """
+    format: str
+    candidates: List[Dict[str, str]]
+    complete: bool = True
 
-def extract_attributes(json_string, keys: list[str]):
-    """Extract the first level of given keys using a non-greedy pattern."""
-    attributes: dict[str, str] = {}
-    if not keys:
-        return attributes
 
-    pattern = r'\\"({})\\":\s*\\"(.*?)\\"'.format('|'.join(map(re.escape, keys)))
-    matches = re.findall(pattern, json_string)
-    for key, value in matches:
-        # Handle double-escaped unicode sequences like \\uXXXX
-        cleaned = value.replace("\\\\u", "\\u")
-        attributes[key] = cleaned.encode("utf-8").decode("unicode_escape")
+class _ScanError(Exception):
+    """文件结构不符合预期, 交给 sd_parsers 按原方式处理"""
+
+
+def scan_metadata(image_path) -> Optional[MetadataScan]:
+    """
+    不解码像素, 只读取 PNG 文本块 (到 IDAT 为止, 另外检查文件末尾)、JPEG APP1 段和 WebP EXIF 块
+
+    不是 PNG / JPEG / WebP 或文件结构异常时返回 None。
+    """
+    with open(image_path, "rb") as f:
+        header = f.read(12)
+        try:
+            if header.startswith(PNG_SIGNATURE):
+                return _scan_png(f)
+            if header.startswith(b"\xff\xd8"):
+                return _scan_jpeg(f)
+            if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+                return _scan_webp(f)
+        except (_ScanError, struct.error, zlib.error, ValueError):
+            return None
+    return None
+
+
+def _scan_png(f) -> MetadataScan:
+    f.seek(len(PNG_SIGNATURE))
+    info: Dict[str, str] = {}
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise _ScanError("PNG 文件不完整")
+        length, chunk_type = struct.unpack(">I4s", header)
+        if chunk_type in (b"IDAT", b"IEND"):
+            break
+        if chunk_type in PNG_TEXT_CHUNKS:
+            data = f.read(length)
+            if zlib.crc32(chunk_type + data) != struct.unpack(">I", f.read(4))[0]:
+                raise _ScanError("PNG 文本块校验失败")
+            _png_text(chunk_type, data, info)
+        else:
+            f.seek(length + 4, 1)
+
+    if GENERATOR_KEYS.intersection(info):
+        return MetadataScan("PNG", [info], complete=False)
+
+    # 图像数据之后的文本块: 在文件末尾按块类型查找, 以 CRC 确认是完整的块
+    text = dict(info)
+    if chunk_type == b"IDAT":
+        start = f.tell()
+        f.seek(0, 2)
+        f.seek(max(start, f.tell() - PNG_TAIL_BYTES))
+        tail = f.read()
+        position = 4
+        while True:
+            found = [tail.find(chunk, position) for chunk in PNG_TEXT_CHUNKS]
+            found = [p for p in found if p >= 4]
+            if not found:
+                break
+            position = min(found)
+            length = struct.unpack(">I", tail[position - 4:position])[0]
+            end = position + 4 + length
+            if end + 4 <= len(tail) and zlib.crc32(tail[position:end]) == struct.unpack(">I", tail[end:end + 4])[0]:
+                _png_text(tail[position:position + 4], tail[position + 4:end], text)
+                position = end + 4
+            else:
+                position += 4
+    return MetadataScan("PNG", [info, text] if text != info else [info])
+
+
+def _png_text(chunk_type: bytes, data: bytes, text: Dict[str, str]):
+    """按 Pillow 的规则解码 tEXt / zTXt / iTXt"""
+    key, _, value = data.partition(b"\0")
+    if chunk_type == b"iTXt":
+        if len(value) < 2:
+            return
+        compressed, method, rest = value[0], value[1], value[2:]
+        parts = rest.split(b"\0", 2)
+        if len(parts) < 3:
+            return
+        value = parts[2]
+        if compressed:
+            if method != 0:
+                return
+            value = _decompress(value)
+        try:
+            text[key.decode("latin-1")] = value.decode("utf-8")
+        except UnicodeError:
+            pass
+        return
+    if chunk_type == b"zTXt":
+        if value and value[0] != 0:
+            raise _ScanError("未知的 zTXt 压缩方式")
+        value = _decompress(value[1:])
+    if key:
+        text[key.decode("latin-1")] = value.decode("latin-1", "replace")
+
+
+def _decompress(data: bytes) -> bytes:
+    decompressor = zlib.decompressobj()
+    value = decompressor.decompress(data, MAX_TEXT_CHUNK)
+    if decompressor.unconsumed_tail:
+        raise _ScanError("文本块过大")
+    return value
+
+
+def _scan_jpeg(f) -> MetadataScan:
+    """依次读取标记段直到图像数据 (SOS), 只读取第一个 Exif APP1 段的内容"""
+    f.seek(2)
+    exif = None
+    while True:
+        byte = f.read(1)
+        if not byte:
+            raise _ScanError("JPEG 文件不完整")
+        if byte != b"\xff":
+            continue
+        marker = f.read(1)
+        while marker == b"\xff":
+            marker = f.read(1)
+        if not marker:
+            raise _ScanError("JPEG 文件不完整")
+        marker = marker[0]
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            continue
+        if marker in (0xDA, 0xD9):
+            break
+        length = struct.unpack(">H", f.read(2))[0]
+        if marker == 0xE1 and exif is None:
+            data = f.read(length - 2)
+            if data.startswith(b"Exif\0\0"):
+                exif = data
+        else:
+            f.seek(length - 2, 1)
+    return MetadataScan("JPEG", _user_comment_candidates(exif))
+
+
+def _scan_webp(f) -> MetadataScan:
+    """依次读取 RIFF 块头, 跳过图像数据, 只读取 EXIF 块"""
+    exif = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        chunk_type, length = struct.unpack("<4sI", header)
+        if chunk_type == b"EXIF" and exif is None:
+            exif = f.read(length)
+            f.seek(length & 1, 1)
+        else:
+            f.seek(length + (length & 1), 1)
+    return MetadataScan("WEBP", _user_comment_candidates(exif))
+
+
+def _user_comment_candidates(exif: Optional[bytes]) -> List[Dict[str, str]]:
+    """与 sd_parsers 相同: UserComment 去掉 8 字节的编码标记后按 UTF-16 BE 解码, 失败时视为没有"""
+    value = _exif_user_comment(exif) if exif else None
+    if value is None or len(value) <= 8:
+        return []
+    try:
+        return [{"parameters": value[8:].decode("utf_16_be")}]
+    except UnicodeError:
+        return []
+
+
+def _exif_user_comment(exif: bytes) -> Optional[bytes]:
+    """在 TIFF 格式的 EXIF 中找到 Exif IFD 的 UserComment"""
+    if exif.startswith(b"Exif\0\0"):
+        exif = exif[6:]
+    order = {b"II": "<", b"MM": ">"}.get(exif[:2])
+    if order is None:
+        raise _ScanError("EXIF 字节序无效")
+
+    def find(ifd_offset: int, tag: int):
+        count = struct.unpack(order + "H", exif[ifd_offset:ifd_offset + 2])[0]
+        for i in range(count):
+            entry = ifd_offset + 2 + i * 12
+            entry_tag, entry_type, entry_count = struct.unpack(order + "HHI", exif[entry:entry + 8])
+            if entry_tag == tag:
+                return entry_type, entry_count, entry + 8
+        return None
+
+    pointer = find(struct.unpack(order + "I", exif[4:8])[0], EXIF_IFD_TAG)
+    if pointer is None:
+        return None
+    comment = find(struct.unpack(order + "I", exif[pointer[2]:pointer[2] + 4])[0], USER_COMMENT_TAG)
+    if comment is None:
+        return None
+    _, count, value_position = comment
+    if count > 4:
+        value_position = struct.unpack(order + "I", exif[value_position:value_position + 4])[0]
+    value = exif[value_position:value_position + count]
+    if len(value) < count:
+        raise _ScanError("EXIF 不完整")
+    return value
+
+
+def parse_prompt_info(image_path, parser_manager=None):
+    """
+    解析生成参数, 返回 sd_parsers 的 PromptInfo, 没有时返回 None
+
+    image_path 为文件路径时先用 scan_metadata 只读取文件头部: 没有任何 GENERATOR_KEYS 时直接返回 None,
+    否则把读取到的参数依次交给各解析器, 结果与 ParserManager.parse 相同。其他情况, 以及没有读取文件末尾
+    且各解析器都失败时交给 ParserManager.parse。
+    """
+    scan = scan_metadata(image_path) if isinstance(image_path, (str, os.PathLike)) else None
+    if scan is None:
+        return (parser_manager or shared_parser_manager()).parse(image_path)
+
+    candidates = [parameters for parameters in scan.candidates if GENERATOR_KEYS.intersection(parameters)]
+    if not candidates:
+        return None
+    from sd_parsers.exceptions import ParserError
+
+    parser_manager = parser_manager or shared_parser_manager()
+    for parameters in candidates:
+        for parser in parser_manager.managed_parsers:
+            if scan.format != "PNG" and parser.generator.value not in USER_COMMENT_GENERATORS:
+                continue
+            try:
+                return parser.parse(parameters)
+            except ParserError:
+                pass
+    return None if scan.complete else parser_manager.parse(image_path)
+
+
+def comfyui_attributes(raw_parameters, keys: List[str] = COMFYUI_ATTRIBUTES) -> Dict[str, str]:
+    """从 ComfyUI 的 prompt 节点图中取节点输入里的字符串字段 (如 ckpt_name), 多个节点都有时以最后一个为准"""
+    prompt = raw_parameters.get("prompt") if isinstance(raw_parameters, dict) else None
+    if isinstance(prompt, (str, bytes)):
+        try:
+            prompt = json.loads(prompt)
+        except ValueError:
+            return {}
+    attributes: Dict[str, str] = {}
+    if not isinstance(prompt, dict):
+        return attributes
+    for node in prompt.values():
+        inputs = node.get("inputs") if isinstance(node, dict) else None
+        if not isinstance(inputs, dict):
+            continue
+        for key in keys:
+            if isinstance(inputs.get(key), str):
+                attributes[key] = inputs[key]
     return attributes
 
+
+def read_metadata(image_path, parser_manager=None):
+    """
+    解析图片中的生成参数 (ComfyUI / AUTOMATIC1111)
+
+    没有元数据或转换失败时返回 None; 读取图片失败时抛出异常。
+    image_path 也可以是已打开的 PIL 图片 (只读取文本块和 EXIF); 未传入 parser_manager 时使用进程内共用的实例。
+    """
+    prompt_info = parse_prompt_info(image_path, parser_manager)
+    if prompt_info is None:
+        return None
+    generator = getattr(prompt_info, "generator", None).value
+    attributes = comfyui_attributes(prompt_info.raw_parameters) if generator == "ComfyUI" else {}
+    return prompt_info_to_result(prompt_info, attributes)
+
+
+def prompt_info_to_result(prompt_info, attributes: Dict[str, str]):
+    """把 PromptInfo 转换为输出的字典, attributes 为从 ComfyUI 节点图中取出的字段"""
+    generator = getattr(prompt_info, "generator", None).value
+    if prompt_info and generator == "ComfyUI":
+        # 将 PromptInfo 对象转换为字典
+        try:
+            model_info = {}
+            if attributes.get("ckpt_name"):
+                model_info["name"] = attributes["ckpt_name"]
+
+            positive_prompt = getattr(prompt_info, "prompts", [])[0]
+            positive_prompt_array = getattr(positive_prompt, "value", "").split(',')
+            negative_prompt = getattr(prompt_info, "prompts", [])[1]
+            negative_prompt_array = getattr(negative_prompt, "value", "").split(',')
+            result = {
+                # 1. 生成器信息
+                "generator": generator,
+
+                # 2. 汇总提示词
+                "positive_prompt": positive_prompt_array,
+                "negative_prompt": negative_prompt_array,
+                "model": model_info or {},
+                # # 5. 采样器详细信息
+                "samplers": [
+                    {
+                        "name": getattr(s, "name", None),
+                        "parameters": getattr(s, "parameters", {}) or {},
+                    }
+                    for s in getattr(prompt_info, "samplers", [])
+                ],                   
+            }
+            result.update(attributes)
+            try:
+                models = getattr(prompt_info, "models", None)
+            except Exception:
+                models = None  # 访问失败就当没有
+
+            if models:
+                # 如果访问成功，再按你需要的结构塞进 result
+                result["models"] = [
+                    {
+                        "model": getattr(m, "model", None),
+                        "parameters": getattr(m, "parameters", {}) or {},
+                    }
+                    for m in models
+                ]
+            return result
+        except Exception:
+            # 如果转换失败，返回 null
+            return None
+    elif generator == "AUTOMATIC1111":
+        try:
+            positive_prompts = getattr(prompt_info, "prompts", []) or []
+            positive_prompt_value = (
+                getattr(positive_prompts[0], "value", "") if positive_prompts else ""
+            )
+            positive_prompt_array = [
+                item.strip() for item in positive_prompt_value.split(",") if item.strip()
+            ]
+
+            negative_prompts_attr = getattr(prompt_info, "negative_prompts", []) or []
+            if negative_prompts_attr:
+                negative_prompt_value = getattr(negative_prompts_attr[0], "value", "")
+            elif len(positive_prompts) > 1:
+                negative_prompt_value = getattr(positive_prompts[1], "value", "")
+            else:
+                negative_prompt_value = ""
+            negative_prompt_array = [
+                item.strip() for item in negative_prompt_value.split(",") if item.strip()
+            ]
+
+            samplers_list = getattr(prompt_info, "samplers", []) or []
+            sampler = samplers_list[0] if samplers_list else None
+            sampler_name = getattr(sampler, "name", None) if sampler else None
+            sampler_params = getattr(sampler, "parameters", {}) or {}
+            model_info = getattr(sampler, "model", None) if sampler else None
+
+            result = {
+                "generator": generator,
+                "model": model_info or {},
+                "samplers": {
+                    "name": sampler_name,
+                    "parameters": sampler_params,
+                },
+                "positive_prompts": positive_prompt_array,
+                "negative_prompts": negative_prompt_array,
+            }
+            return result
+        except Exception:
+            return None
+    else:
+        # 如果没有找到元数据，返回 null
+        return None
+
+
 if __name__ == "__main__":
     main()
 
@@ -0,0 +1,207 @@
+"""
+索引共用的追加写入行存储 (similarity_index / palette_index / prompt_index)
+
+目录中的文件:
+    meta.json   索引参数和当前的文件代数, 以替换文件的方式原子更新
+    ids.jsonl   每行一个 JSON 字符串, 第 i 行对应行号 i
+    alive.u8    每行一个字节, 0 表示已删除
+    <列文件>    每行固定字节数的二进制文件 (如向量), 由使用方指定
+
+- 添加: 先追加列文件和 alive.u8, ids.jsonl 最后写入; 打开时以最短的文件 (或 meta.json 中提交的行数) 为准截断
+- 删除: 只把 alive.u8 中对应的字节写为 0, 删除的行较多时由使用方调用压缩
+- 压缩: 保留的行写入新一代文件 (如 ids.2.jsonl), meta.json 记录新的代数后才删除旧文件,
+  中断时仍使用旧文件, 多出的新文件在下次打开时删除
+"""
+import os
+import re
+import json
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+IDS = "ids.jsonl"
+ALIVE = "alive.u8"
+
+
+def read_meta(index_dir: str) -> Optional[dict]:
+    path = os.path.join(index_dir, "meta.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_meta(index_dir: str, meta: dict):
+    path = os.path.join(index_dir, "meta.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(path + ".tmp", path)
+
+
+def smallest_k(chunks: Iterable[Tuple[np.ndarray, np.ndarray]], k: int) -> List[Tuple[int, float]]:
+    """
+    分块计算的 (行号, 分数) 中分数最小的 k 个, 按分数升序返回 [(行号, 分数)]
+
+    每块合并后只保留 k 个, 内存占用与总行数无关; 分数为 inf 的行 (已删除、排除) 不返回。
+    """
+    best_rows = np.zeros(0, dtype=np.int64)
+    best_scores = np.zeros(0, dtype=np.float32)
+    for rows, scores in chunks:
+        best_rows = np.concatenate([best_rows, rows])
+        best_scores = np.concatenate([best_scores, scores])
+        if len(best_scores) > k:
+            top = np.argpartition(best_scores, k)[:k]
+            best_rows, best_scores = best_rows[top], best_scores[top]
+    order = np.argsort(best_scores, kind="stable")
+    return [(int(best_rows[i]), float(best_scores[i])) for i in order[:k] if np.isfinite(best_scores[i])]
+
+
+class RowStore:
+    """
+    Args:
+        index_dir: 索引目录
+        columns: {文件名: 每行字节数}, 与 ids 行数一致的列文件
+        optional: {文件名: 每行字节数}, 可以缺失或行数较少的列文件 (如 IVF 簇分配), 只截掉多出的行
+    """
+
+    def __init__(self, index_dir: str, columns: Dict[str, int] = None, optional: Dict[str, int] = None):
+        self.index_dir = index_dir
+        self.columns = dict(columns or {})
+        self.optional = dict(optional or {})
+        self.generation = 0
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.alive = np.zeros(0, dtype=bool)
+
+    def path(self, name: str, generation: int = None) -> str:
+        """当前代 (或指定代) 的文件路径: 第 0 代为 name 本身, 之后为 <主名>.<代数>.<扩展名>"""
+        generation = self.generation if generation is None else generation
+        if generation:
+            stem, ext = name.split(".", 1)
+            name = f"{stem}.{generation}.{ext}"
+        return os.path.join(self.index_dir, name)
+
+    def _files(self) -> Dict[str, int]:
+        return {ALIVE: 1, **self.columns, **self.optional}
+
+    def load(self, generation: int = 0, count: int = None):
+        """
+        读取 ids 和 alive, 截掉写入中断留下的多余行
+
+        count 为 meta.json 中提交的行数时, 文件行数不足说明索引已损坏, 抛出 ValueError;
+        为 None 时以最短的文件为准。
+        """
+        self.generation = generation
+        ids = []
+        if os.path.exists(self.path(IDS)):
+            with open(self.path(IDS), encoding="utf-8") as f:
+                for line in f:
+                    if len(ids) == count or not line.endswith("\n"):
+                        break
+                    try:
+                        ids.append(json.loads(line))
+                    except ValueError:
+                        break  # 写入中断留下的不完整行
+        lengths = [os.path.getsize(self.path(name)) // row_bytes if os.path.exists(self.path(name)) else 0
+                   for name, row_bytes in {ALIVE: 1, **self.columns}.items()]
+        if count is None:
+            count = min(len(ids), *lengths)
+        elif len(ids) < count or min(lengths) < count:
+            raise ValueError(f"索引文件不完整: {self.index_dir}")
+        self._truncate(count)
+
+        self.ids = ids[:count]
+        self.alive = np.fromfile(self.path(ALIVE), dtype=np.uint8).astype(bool) if count else np.zeros(0, bool)
+        self.rows = {image_id: row for row, image_id in enumerate(self.ids) if self.alive[row]}
+        self._remove_other_generations()
+
+    def _truncate(self, count: int):
+        if os.path.exists(self.path(IDS)):
+            with open(self.path(IDS), "rb") as f:
+                size = sum(len(line) for line, _ in zip(f, range(count)))
+            with open(self.path(IDS), "r+b") as f:
+                f.truncate(size)
+        for name, row_bytes in self._files().items():
+            if os.path.exists(self.path(name)) and os.path.getsize(self.path(name)) > count * row_bytes:
+                with open(self.path(name), "r+b") as f:
+                    f.truncate(count * row_bytes)
+
+    def _remove_other_generations(self):
+        """删除不属于当前代的文件 (压缩中断留下的新文件, 或提交后没来得及删除的旧文件)"""
+        current = {os.path.basename(self.path(name)) for name in [IDS, *self._files()]}
+        patterns = []
+        for name in [IDS, *self._files()]:
+            stem, ext = name.split(".", 1)
+            patterns.append(re.compile(rf"{re.escape(stem)}(\.\d+)?\.{re.escape(ext)}(\.tmp)?"))
+        for file_name in os.listdir(self.index_dir):
+            if file_name not in current and any(p.fullmatch(file_name) for p in patterns):
+                os.remove(os.path.join(self.index_dir, file_name))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def deleted(self) -> int:
+        return len(self.ids) - len(self.rows)
+
+    def needs_compaction(self) -> bool:
+        return self.deleted > max(1000, len(self.ids) // 4)
+
+    def append(self, ids: List[str], columns: Dict[str, bytes] = None) -> int:
+        """追加行, columns 为 {文件名: 这些行的字节}, 返回第一行的行号; 不处理已存在的 ID"""
+        start = len(self.ids)
+        for name, data in (columns or {}).items():
+            with open(self.path(name), "ab") as f:
+                f.write(data)
+        with open(self.path(ALIVE), "ab") as f:
+            f.write(b"\x01" * len(ids))
+        # ids 最后写入, 中断时以 ids 行数为准截断其他文件
+        with open(self.path(IDS), "a", encoding="utf-8") as f:
+            for image_id in ids:
+                f.write(json.dumps(image_id, ensure_ascii=False) + "\n")
+
+        self.ids.extend(ids)
+        self.alive = np.concatenate([self.alive, np.ones(len(ids), dtype=bool)])
+        for offset, image_id in enumerate(ids):
+            self.rows[image_id] = start + offset
+        return start
+
+    def mark_deleted(self, ids: Iterable[str]) -> int:
+        """写墓碑标记, 返回实际删除的数量 (不在索引中的 ID 忽略)"""
+        rows = [self.rows.pop(image_id) for image_id in dict.fromkeys(ids) if image_id in self.rows]
+        self.delete_rows(rows)
+        return len(rows)
+
+    def delete_rows(self, rows: List[int]):
+        """按行号写墓碑标记, 不修改 self.rows (由调用方维护)"""
+        if not rows:
+            return
+        with open(self.path(ALIVE), "r+b") as f:
+            for row in rows:
+                self.alive[row] = False
+                f.seek(row)
+                f.write(b"\x00")
+
+    def rewrite(self, columns: Dict[str, np.ndarray], commit: Callable[[], None]):
+        """
+        压缩: 只保留未删除的行, 写入下一代文件
+
+        columns 为 {文件名: 保留的行}, 调用前使用方需释放对当前文件的内存映射 (Windows 下否则无法删除)。
+        写完后切换到新一代并调用 commit 写入 meta.json (其中应包含 self.generation), 之后才删除旧文件。
+        """
+        rows = np.flatnonzero(self.alive)
+        ids = [self.ids[row] for row in rows]
+        generation = self.generation + 1
+        for name, data in columns.items():
+            np.ascontiguousarray(data).tofile(self.path(name, generation))
+        np.ones(len(ids), dtype=np.uint8).tofile(self.path(ALIVE, generation))
+        with open(self.path(IDS, generation), "w", encoding="utf-8") as f:
+            for image_id in ids:
+                f.write(json.dumps(image_id, ensure_ascii=False) + "\n")
+
+        self.generation = generation
+        self.ids = ids
+        self.alive = np.ones(len(ids), dtype=bool)
+        self.rows = {image_id: row for row, image_id in enumerate(ids)}
+        commit()
+        self._remove_other_generations()
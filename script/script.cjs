@@ -30,21 +30,134 @@ const normalizeImagePath = (inputPath) => {
     }
     return inputPath;
 };
-async function tagImage(imagePath, modelName) {
+const getTaggerPaths = () => {
     const model_dir_path = isDev ? path.join(__dirname, '../models') : path.join(process.resourcesPath, 'models');
     const tag_path = isDev ? path.join(__dirname, './ai_tagger.py') : path.join(process.resourcesPath, 'script', 'ai_tagger.py');
+    return { model_dir_path, tag_path };
+};
+// 常驻的 ai_tagger.py --serve 进程, 模型会话在多次请求间复用
+const TAGGER_WORKER_CONCURRENCY = 2;
+// 每个并发请求分到的推理线程数, 避免多个请求同时占满所有核心
+const TAGGER_INTRA_THREADS = Math.max(1, Math.floor(require('os').cpus().length / TAGGER_WORKER_CONCURRENCY));
+// { shell, pending }: pending 为该进程上未完成的请求, 进程退出时只拒绝这些请求
+let taggerWorker = null;
+let nextTaggerRequestId = 1;
+function getTaggerWorker() {
+    if (taggerWorker) {
+        return taggerWorker;
+    }
+    const { model_dir_path, tag_path } = getTaggerPaths();
+    const shell = new PythonShell(path.basename(tag_path), {
+        mode: 'text',
+        pythonPath: pythonPath,
+        pythonOptions: ['-u'],
+        scriptPath: path.dirname(tag_path),
+        args: [
+            '--serve', '--models-dir', model_dir_path,
+            '--workers', String(TAGGER_WORKER_CONCURRENCY),
+            '--intra-threads', String(TAGGER_INTRA_THREADS)
+        ]
+    });
+    const worker = { shell, pending: new Map() };
+    shell.on('message', (line) => {
+        let message;
+        try {
+            message = JSON.parse(line);
+        }
+        catch (err) {
+            console.log('tagger worker:', line);
+            return;
+        }
+        if (message.event) {
+            if (message.event === 'fatal') {
+                console.error('AI标注进程启动失败:', message.error);
+            }
+            return;
+        }
+        const pending = worker.pending.get(message.id);
+        if (!pending) {
+            return;
+        }
+        worker.pending.delete(message.id);
+        if (message.error) {
+            const error = new Error(message.error.message);
+            // 单个请求的错误, 进程本身仍可用
+            error.isTaggerRequestError = true;
+            pending.reject(error);
+        }
+        else {
+            pending.resolve(message);
+        }
+    });
+    shell.on('stderr', (line) => {
+        console.log('tagger worker:', line);
+    });
+    const onExit = (err) => {
+        if (taggerWorker === worker) {
+            taggerWorker = null;
+        }
+        const error = err || new Error('AI标注进程已退出');
+        for (const pending of worker.pending.values()) {
+            pending.reject(error);
+        }
+        worker.pending.clear();
+    };
+    shell.on('pythonError', onExit);
+    shell.on('error', onExit);
+    shell.on('close', () => onExit());
+    taggerWorker = worker;
+    return worker;
+}
+function requestTagger(request) {
+    const worker = getTaggerWorker();
+    const id = nextTaggerRequestId++;
+    return new Promise((resolve, reject) => {
+        worker.pending.set(id, { resolve, reject });
+        try {
+            worker.shell.send(JSON.stringify({ id, ...request }));
+        }
+        catch (err) {
+            worker.pending.delete(id);
+            reject(err);
+        }
+    });
+}
+function stopTaggerWorker() {
+    if (taggerWorker) {
+        // 关闭 stdin 后服务进程会处理完剩余请求再退出
+        taggerWorker.shell.end(() => { });
+        taggerWorker = null;
+    }
+}
+// 每张图片单独启动一次 Python 进程, 常驻进程不可用时作为兜底
+async function tagImageOnce(imagePath, modelName) {
+    const { model_dir_path, tag_path } = getTaggerPaths();
     options.scriptPath = path.dirname(tag_path);
     options.args = [imagePath, modelName, model_dir_path];
+    const result = await PythonShell.run(path.basename(tag_path), options);
+    // 输出依次为模型目录、处理的图片、标签
+    if (result.length < 3) {
+        return [];
+    }
+    return result[2].split(delimiter);
+}
+async function tagImage(imagePath, modelName) {
     try {
-        const result = await PythonShell.run(path.basename(tag_path), options);
-        if (result.length < 2) {
-            return [];
-        }
-        return result[2].split(delimiter);
+        const result = await requestTagger({ image: imagePath, model: modelName });
+        return result.tags_text.split(delimiter);
     }
     catch (err) {
         console.error('AI标注出错:', err);
-        return ['AI标注出错: ' + err.message];
+        if (err.isTaggerRequestError) {
+            return ['AI标注出错: ' + err.message];
+        }
+        try {
+            return await tagImageOnce(imagePath, modelName);
+        }
+        catch (fallbackErr) {
+            console.error('AI标注出错:', fallbackErr);
+            return ['AI标注出错: ' + fallbackErr.message];
+        }
     }
 }
 async function getMainColor(imagePath) {
@@ -291,10 +404,38 @@ async function readImageMetadata(imagePath) {
         return null;
     }
 }
+// 一次读取、解码同时得到标签、主色和生成参数, 返回 { tags, colors, metadata, errors }
+// tags / colors / metadata 与 tagImage / getMainColor / readImageMetadata 的返回格式相同, 某一项失败时为 null
+async function analyzeImage(imagePath, modelName) {
+    const { model_dir_path } = getTaggerPaths();
+    const analyze_path = isDev ? path.join(__dirname, './analyze_image.py') : path.join(process.resourcesPath, 'script', 'analyze_image.py');
+    const normalizedPath = normalizeImagePath(imagePath);
+    const result = await PythonShell.run(path.basename(analyze_path), {
+        ...options,
+        scriptPath: path.dirname(analyze_path),
+        args: [normalizedPath, '--models-dir', model_dir_path, ...(modelName ? ['--model', modelName] : [])],
+    });
+    const record = JSON.parse(result[result.length - 1]);
+    if (record.error) {
+        throw new Error(record.error.message);
+    }
+    const errors = record.errors || {};
+    for (const [part, error] of Object.entries(errors)) {
+        console.error(`图片分析出错 (${part}):`, error.message);
+    }
+    return {
+        tags: record.tags ? (record.tags_text ? record.tags_text.split(delimiter) : []) : null,
+        colors: record.colors,
+        metadata: record.metadata ?? null,
+        errors,
+    };
+}
 module.exports = {
     tagImage,
+    stopTaggerWorker,
     getMainColor,
     installEnvironment,
     checkEnvironment,
-    readImageMetadata
+    readImageMetadata,
+    analyzeImage
 };
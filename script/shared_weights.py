@@ -0,0 +1,185 @@
+"""
+多个打标签进程共用模型权重
+
+模型首次以共享模式加载时, 把 (已做过图优化的) 模型拆成三个文件, 放在原模型旁边:
+    <模型名>.shared.onnx     只有计算图, 权重以外部数据的形式指向 .shared.weights
+    <模型名>.shared.weights  权重的原始字节, 按 64 字节对齐连续存放
+    <模型名>.shared.json     每个权重的名称、类型、形状和偏移, 以及原模型的大小和修改时间
+
+加载时以只读内存映射打开 .shared.weights, 通过 SessionOptions.add_initializer 把映射区直接交给 ONNX Runtime,
+不复制权重:
+- 多个进程映射同一个文件, 权重只在页缓存中存一份; 这些页是文件页, 内存紧张时直接丢弃, 不会写入交换区
+- 同一进程内同一个模型的多个会话共用同一组 OrtValue; CPU 内存池注册为进程级分配器, 各会话共用
+- 关闭 prepacking: 预打包会为每个会话生成一份重排后的权重副本, 抵消共享的效果
+
+只对 CPU 有效; 使用 GPU 时权重仍会复制到显存, 但不影响正确性。拆分模型需要 onnx 包。
+"""
+import os
+import json
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+ALIGNMENT = 64
+# 小于该大小的权重保留在计算图中
+MIN_SHARED_BYTES = 1024
+FORMAT_VERSION = 1
+
+_lock = threading.Lock()
+_mapped: Dict[str, "MappedWeights"] = {}
+_env_allocator_registered = False
+
+
+class MappedWeights(NamedTuple):
+    """一个模型的权重映射: 进程内按 .shared.weights 路径缓存, 会话共用"""
+    source_stat: Tuple[int, int]
+    buffer: np.memmap
+    values: Dict[str, object]
+
+
+def shared_paths(model_path: str) -> Tuple[str, str, str]:
+    """(计算图, 权重, 索引) 的路径"""
+    base = os.path.splitext(model_path)[0]
+    return f"{base}.shared.onnx", f"{base}.shared.weights", f"{base}.shared.json"
+
+
+def _source_stat(model_path: str) -> Tuple[int, int]:
+    stat = os.stat(model_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _read_index(model_path: str) -> Optional[dict]:
+    """索引存在且对应当前的原模型时返回索引内容"""
+    graph_path, weights_path, index_path = shared_paths(model_path)
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (index.get("version") != FORMAT_VERSION or tuple(index.get("source", ())) != _source_stat(model_path)
+            or not os.path.exists(graph_path) or os.path.getsize(weights_path) != index.get("weights_bytes")):
+        return None
+    return index
+
+
+def is_prepared(model_path: str) -> bool:
+    try:
+        return _read_index(model_path) is not None
+    except OSError:
+        return False
+
+
+def prepare(model_path: str, source_path: str = None):
+    """
+    拆分模型, source_path 为实际拆分的模型文件 (通常是图优化后的模型), 默认为 model_path 本身
+
+    各文件先写到临时文件再替换, 索引最后写入; 多个进程同时拆分时以最后完成的为准。
+    """
+    import onnx
+    from onnx import numpy_helper, TensorProto
+
+    graph_path, weights_path, index_path = shared_paths(model_path)
+    source_stat = _source_stat(model_path)
+    model = onnx.load(source_path or model_path)
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+
+    shareable = {TensorProto.FLOAT, TensorProto.FLOAT16, TensorProto.DOUBLE, TensorProto.INT8, TensorProto.UINT8,
+                 TensorProto.INT16, TensorProto.UINT16, TensorProto.INT32, TensorProto.INT64, TensorProto.BOOL}
+    tensors: List[list] = []
+    offset = 0
+    try:
+        with open(weights_path + suffix, "wb") as f:
+            for initializer in model.graph.initializer:
+                if initializer.data_type not in shareable:
+                    continue
+                array = np.ascontiguousarray(numpy_helper.to_array(initializer))
+                if array.nbytes < MIN_SHARED_BYTES:
+                    continue
+                padding = -offset % ALIGNMENT
+                f.write(b"\0" * padding)
+                offset += padding
+                f.write(array.tobytes())
+                tensors.append([initializer.name, array.dtype.str, list(array.shape), offset])
+
+                # 计算图中改为指向权重文件的外部数据, 单独用 onnxruntime 打开 .shared.onnx 也能运行
+                initializer.ClearField("raw_data")
+                for field in ("float_data", "int32_data", "int64_data", "double_data", "uint64_data"):
+                    initializer.ClearField(field)
+                initializer.data_location = TensorProto.EXTERNAL
+                del initializer.external_data[:]
+                for key, value in (("location", os.path.basename(weights_path)), ("offset", str(offset)),
+                                   ("length", str(array.nbytes))):
+                    entry = initializer.external_data.add()
+                    entry.key, entry.value = key, value
+                offset += array.nbytes
+        onnx.save(model, graph_path + suffix)
+        with open(index_path + suffix, "w", encoding="utf-8") as f:
+            json.dump({"version": FORMAT_VERSION, "source": list(source_stat), "weights_bytes": offset,
+                       "tensors": tensors}, f)
+        os.replace(weights_path + suffix, weights_path)
+        os.replace(graph_path + suffix, graph_path)
+        os.replace(index_path + suffix, index_path)
+    finally:
+        for path in (weights_path, graph_path, index_path):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def mapped_weights(model_path: str) -> MappedWeights:
+    """以只读内存映射打开权重, 同一进程内复用; 原模型变化后重新映射"""
+    ort = _onnxruntime()
+    _, weights_path, _ = shared_paths(model_path)
+    with _lock:
+        source_stat = _source_stat(model_path)
+        entry = _mapped.get(weights_path)
+        if entry is not None and entry.source_stat == source_stat:
+            return entry
+        index = _read_index(model_path)
+        if index is None:
+            raise FileNotFoundError(f"共享权重文件不存在或已过期: {weights_path}")
+        buffer = np.memmap(weights_path, dtype=np.uint8, mode="r") if index["weights_bytes"] else np.zeros(0, np.uint8)
+        values = {}
+        for name, dtype, shape, offset in index["tensors"]:
+            array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=buffer, offset=offset)
+            values[name] = ort.OrtValue.ortvalue_from_numpy(array)
+        # 旧映射由使用它的会话继续持有, 这里只替换缓存
+        entry = MappedWeights(source_stat, buffer, values)
+        _mapped[weights_path] = entry
+        return entry
+
+
+def attach(options, model_path: str, share_arena: bool = True) -> str:
+    """
+    把共享权重加入 SessionOptions, 返回应加载的计算图路径
+
+    options 需在会话存续期间保持引用 (onnxruntime 不复制 add_initializer 的数据, 映射由进程内缓存持有)。
+    """
+    weights = mapped_weights(model_path)
+    for name, value in weights.values.items():
+        options.add_initializer(name, value)
+    options.add_session_config_entry("session.disable_prepacking", "1")
+    if share_arena and _register_env_allocator():
+        options.add_session_config_entry("session.use_env_allocators", "1")
+    return shared_paths(model_path)[0]
+
+
+def _register_env_allocator() -> bool:
+    """注册进程级 CPU 内存池 (只注册一次), 失败时各会话仍使用自己的内存池"""
+    global _env_allocator_registered
+    with _lock:
+        if not _env_allocator_registered:
+            ort = _onnxruntime()
+            try:
+                memory_info = ort.OrtMemoryInfo("Cpu", ort.OrtAllocatorType.ORT_ARENA_ALLOCATOR, 0,
+                                                ort.OrtMemType.DEFAULT)
+                ort.create_and_register_allocator(memory_info, None)
+                _env_allocator_registered = True
+            except Exception:
+                return False
+        return True
+
+
+def _onnxruntime():
+    from ai_tagger import _onnxruntime as load
+    return load()
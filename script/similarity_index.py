@@ -0,0 +1,354 @@
+"""
+相似图片搜索索引
+
+将 AITagger 输出的概率向量经固定随机投影压缩为低维单位向量 (float16), 追加写入磁盘文件,
+查询时通过内存映射读取, 支持:
+- 精确搜索: 分块向量化内积
+- 近似搜索 (IVF): k-means 粗聚类后只扫描与查询最接近的 nprobe 个簇
+- 增量添加/删除: 新图片追加写入并分配到已有的簇, 删除只写墓碑标记, 删除较多时自动压缩
+
+用法:
+    python similarity_index.py add --index <索引目录> --images <图片目录> [--model <模型名称> --models-dir <模型目录>]
+    python similarity_index.py build-ivf --index <索引目录> [--nlist 256]
+    python similarity_index.py query --index <索引目录> --image <图片路径> [-k 20] [--nprobe 8]
+    python similarity_index.py remove --index <索引目录> <图片路径> ...
+"""
+import os
+import sys
+import json
+import argparse
+import contextlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from row_store import RowStore, read_meta, smallest_k, write_meta
+
+DEFAULT_DIM = 256
+SEARCH_CHUNK_ROWS = 65536
+
+
+class VectorProjector:
+    """
+    将高维概率向量投影为 dim 维单位向量
+
+    投影矩阵由 (输入维度, dim, seed) 确定, 同一索引内的向量始终可比。
+    """
+
+    def __init__(self, dim: int = DEFAULT_DIM, seed: int = 0):
+        self.dim = dim
+        self.seed = seed
+        self._matrices = {}
+
+    def _matrix(self, input_dim: int) -> np.ndarray:
+        matrix = self._matrices.get(input_dim)
+        if matrix is None:
+            rng = np.random.default_rng([self.seed, input_dim, self.dim])
+            matrix = rng.standard_normal((input_dim, self.dim), dtype=np.float32) / np.sqrt(self.dim)
+            self._matrices[input_dim] = matrix
+        return matrix
+
+    def project(self, probs: np.ndarray) -> np.ndarray:
+        """probs: (D,) 或 (N, D), 返回 float32 单位向量 (dim,) 或 (N, dim)"""
+        probs = np.asarray(probs, dtype=np.float32)
+        vectors = probs @ self._matrix(probs.shape[-1]) if probs.shape[-1] != self.dim else probs
+        return normalize(vectors)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def spherical_kmeans(vectors: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """对单位向量做 k-means (按内积分配), 返回 (k, dim) 的单位向量中心"""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        counts = np.bincount(labels, minlength=k)
+        # 空簇重新随机选一个点
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+class SimilarityIndex:
+    """
+    磁盘上的向量索引, 目录结构 (ids / alive / 压缩的处理见 row_store.py):
+        meta.json     维度、投影参数
+        vectors.f16   (N, dim) float16 向量, 追加写入, 内存映射读取
+        ids.jsonl     每行一个 JSON 字符串, 第 i 行对应第 i 个向量
+        alive.u8      每个向量一个字节, 0 表示已删除
+        centroids.npy IVF 簇中心 (可选)
+        lists.i32     每个向量所属的簇 (可选, 与 centroids.npy 同时存在)
+    """
+
+    def __init__(self, index_dir: str, dim: int = DEFAULT_DIM, seed: int = 0):
+        self.index_dir = os.path.abspath(index_dir)
+        os.makedirs(self.index_dir, exist_ok=True)
+
+        self._meta = read_meta(self.index_dir)
+        if self._meta is None:
+            self._meta = {"version": 1, "dim": dim, "seed": seed}
+            write_meta(self.index_dir, self._meta)
+        self.dim = self._meta["dim"]
+        self.projector = VectorProjector(self.dim, self._meta["seed"])
+
+        self._store = RowStore(self.index_dir, {"vectors.f16": self.dim * 2}, optional={"lists.i32": 4})
+        self._vectors = None
+        self._centroids = None
+        self._lists = None
+        self._list_order = None
+        self._load()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    def _load(self):
+        self._store.load(self._meta.get("generation", 0))
+        count = len(self._store.ids)
+        lists_path = self._store.path("lists.i32")
+        if os.path.exists(self._path("centroids.npy")) and os.path.exists(lists_path):
+            self._centroids = np.load(self._path("centroids.npy"))
+            self._lists = np.fromfile(lists_path, dtype=np.int32)
+            if len(self._lists) < count:
+                # 簇分配缺失时补算
+                missing = self._assign(self._vector_rows(len(self._lists), count))
+                with open(lists_path, "ab") as f:
+                    f.write(missing.tobytes())
+                self._lists = np.concatenate([self._lists, missing])
+
+    def _vector_rows(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """以内存映射方式读取向量, 追加写入后重新映射"""
+        count = len(self._store.ids)
+        if self._vectors is None or len(self._vectors) != count:
+            self._vectors = None
+            if count == 0:
+                return np.zeros((0, self.dim), dtype=np.float16)
+            self._vectors = np.memmap(self._store.path("vectors.f16"), dtype=np.float16, mode="r",
+                                      shape=(count, self.dim))
+        return self._vectors[start:stop]
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        if len(vectors) == 0:
+            return np.zeros(0, dtype=np.int32)
+        return np.argmax(np.asarray(vectors, dtype=np.float32) @ self._centroids.T, axis=1).astype(np.int32)
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def __contains__(self, image_id: str) -> bool:
+        return image_id in self._store.rows
+
+    def add(self, ids: List[str], probs: np.ndarray):
+        """添加或更新图片向量, probs 为 (N, D) 概率向量 (或已是 dim 维的向量)"""
+        if len(ids) == 0:
+            return
+        latest = {image_id: row for row, image_id in enumerate(ids)}  # 同一批中重复的图片以最后一次为准
+        if len(latest) < len(ids):
+            probs = np.asarray(probs)[list(latest.values())]
+            ids = list(latest)
+        vectors = self.projector.project(np.asarray(probs)).astype(np.float16)
+        self._store.mark_deleted(ids)
+        columns = {"vectors.f16": vectors.tobytes()}
+        if self._lists is not None:
+            lists = self._assign(vectors)
+            columns["lists.i32"] = lists.tobytes()
+            self._lists = np.concatenate([self._lists, lists])
+            self._list_order = None
+        self._store.append(ids, columns)
+
+    def remove(self, ids: Iterable[str]) -> int:
+        """删除图片, 返回实际删除的数量"""
+        removed = self._store.mark_deleted(ids)
+        if self._store.needs_compaction():
+            self.compact()
+        return removed
+
+    def compact(self):
+        """重写索引文件, 去掉已删除的向量"""
+        rows = np.flatnonzero(self._store.alive)
+        columns = {"vectors.f16": np.array(self._vector_rows()[rows]) if len(rows)
+                   else np.zeros((0, self.dim), np.float16)}
+        lists = self._lists[rows] if self._lists is not None else None
+        if lists is not None:
+            columns["lists.i32"] = lists
+        self._vectors = None  # 释放内存映射, Windows 下否则无法删除文件
+        self._meta["generation"] = self._store.generation + 1
+        self._store.rewrite(columns, lambda: write_meta(self.index_dir, self._meta))
+        self._lists = lists
+        self._list_order = None
+
+    def build_ivf(self, nlist: int = None, iterations: int = 10, sample_size: int = 50000, seed: int = 0):
+        """训练 IVF 簇中心并为所有向量分配簇, nlist 默认约为 sqrt(N)"""
+        rows = np.flatnonzero(self._store.alive)
+        if len(rows) == 0:
+            raise ValueError("索引为空, 无法构建 IVF")
+        nlist = nlist or int(np.clip(np.sqrt(len(rows)), 1, 4096))
+        rng = np.random.default_rng(seed)
+        sample = rows if len(rows) <= sample_size else np.sort(rng.choice(rows, size=sample_size, replace=False))
+        centroids = spherical_kmeans(np.asarray(self._vector_rows()[sample], dtype=np.float32), nlist, iterations, seed)
+
+        self._centroids = centroids
+        lists = np.concatenate([
+            self._assign(self._vector_rows(start, start + SEARCH_CHUNK_ROWS))
+            for start in range(0, len(self._store.ids), SEARCH_CHUNK_ROWS)
+        ])
+
+        # 先写临时文件再替换; 替换前删除旧的簇中心, 两次替换之间中断时退回精确搜索, 不会混用新旧文件
+        centroids_path = self._path("centroids.npy")
+        lists_path = self._store.path("lists.i32")
+        with open(centroids_path + ".tmp", "wb") as f:
+            np.save(f, centroids)
+        lists.tofile(lists_path + ".tmp")
+        if os.path.exists(centroids_path):
+            os.remove(centroids_path)
+        os.replace(lists_path + ".tmp", lists_path)
+        os.replace(centroids_path + ".tmp", centroids_path)
+        self._lists = lists
+        self._list_order = None
+
+    def search(self, probs: np.ndarray, k: int = 20, nprobe: int = None,
+               exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        """
+        按余弦相似度搜索最相似的 k 张图片
+
+        Args:
+            probs: 查询图片的概率向量 (或已是 dim 维的向量)
+            nprobe: 近似搜索时扫描的簇数量; None 或未构建 IVF 时为精确搜索
+            exclude: 结果中排除的图片 ID (通常是查询图片本身)
+        """
+        query = self.projector.project(np.asarray(probs)).astype(np.float32)
+        candidates = self._candidate_rows(query, nprobe) if nprobe and self._lists is not None else None
+        total = len(self._store.ids) if candidates is None else len(candidates)
+        exclude_row = self._store.rows.get(exclude) if exclude is not None else None
+
+        def chunks():
+            for start in range(0, total, SEARCH_CHUNK_ROWS):
+                if candidates is None:
+                    rows = np.arange(start, min(start + SEARCH_CHUNK_ROWS, total))
+                    vectors = self._vector_rows(start, start + len(rows))
+                else:
+                    rows = candidates[start:start + SEARCH_CHUNK_ROWS]
+                    vectors = self._vector_rows()[rows]
+                # 按负的内积取最小的 k 个
+                scores = np.asarray(vectors, dtype=np.float32) @ -query
+                scores[~self._store.alive[rows]] = np.inf
+                if exclude_row is not None:
+                    scores[rows == exclude_row] = np.inf
+                yield rows, scores
+
+        return [(self._store.ids[row], -score) for row, score in smallest_k(chunks(), k)]
+
+    def _candidate_rows(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        if self._list_order is None:
+            self._list_order = np.argsort(self._lists, kind="stable")
+            self._list_offsets = np.searchsorted(self._lists[self._list_order], np.arange(len(self._centroids) + 1))
+        probes = np.argsort(-(self._centroids @ query))[:nprobe]
+        parts = [self._list_order[self._list_offsets[p]:self._list_offsets[p + 1]] for p in probes]
+        return np.sort(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+    def stats(self) -> dict:
+        return {
+            "vectors": len(self._store),
+            "deleted": self._store.deleted,
+            "dim": self.dim,
+            "nlist": None if self._centroids is None else len(self._centroids),
+            "bytes": len(self._store.ids) * self.dim * 2,
+        }
+
+
+def _create_tagger(args):
+    from ai_tagger import AITagger
+
+    with contextlib.redirect_stdout(sys.stderr):
+        return AITagger(args.models_dir, result_cache_path=args.result_cache)
+
+
+def _image_probs(tagger, paths: Iterable[str], args):
+    return tagger.tag_images_pipeline(paths, batch_size=args.batch_size, model_name=args.model, return_probs=True)
+
+
+def main():
+    from batch_common import iter_image_files
+
+    parser = argparse.ArgumentParser(description="相似图片搜索索引")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_tagger_args(p):
+        p.add_argument("--model", default="wd-v1-4-moat-tagger-v2")
+        p.add_argument("--models-dir", default="models")
+        p.add_argument("--result-cache", help="推理结果缓存文件路径")
+        p.add_argument("--batch-size", type=int, default=8)
+
+    add_parser = subparsers.add_parser("add", help="为目录下的图片计算向量并加入索引")
+    add_parser.add_argument("--index", required=True)
+    add_parser.add_argument("--images", required=True)
+    add_parser.add_argument("--skip-existing", action="store_true", help="跳过索引中已有的图片")
+    add_tagger_args(add_parser)
+
+    ivf_parser = subparsers.add_parser("build-ivf", help="构建近似搜索用的 IVF 簇")
+    ivf_parser.add_argument("--index", required=True)
+    ivf_parser.add_argument("--nlist", type=int)
+
+    query_parser = subparsers.add_parser("query", help="搜索与指定图片相似的图片")
+    query_parser.add_argument("--index", required=True)
+    query_parser.add_argument("--image", required=True)
+    query_parser.add_argument("-k", type=int, default=20)
+    query_parser.add_argument("--nprobe", type=int, help="近似搜索扫描的簇数量, 不指定时精确搜索")
+    add_tagger_args(query_parser)
+
+    remove_parser = subparsers.add_parser("remove", help="从索引中删除图片")
+    remove_parser.add_argument("--index", required=True)
+    remove_parser.add_argument("ids", nargs="+")
+
+    args = parser.parse_args()
+    index = SimilarityIndex(args.index)
+
+    if args.command == "add":
+        tagger = _create_tagger(args)
+        # 图片 ID 统一为绝对路径, 以不同的工作目录或相对路径添加同一张图片时不会重复
+        paths = (path for path in map(os.path.abspath, iter_image_files(args.images))
+                 if not (args.skip_existing and path in index))
+        batch_ids, batch_probs, errors = [], [], 0
+        for result in _image_probs(tagger, paths, args):
+            if result.error is not None:
+                errors += 1
+                print(json.dumps({"image": result.image_path, "error": str(result.error)}, ensure_ascii=False))
+                continue
+            batch_ids.append(result.image_path)
+            batch_probs.append(result.probs)
+            if len(batch_ids) >= 256:
+                index.add(batch_ids, np.stack(batch_probs))
+                batch_ids, batch_probs = [], []
+        if batch_ids:
+            index.add(batch_ids, np.stack(batch_probs))
+        print(json.dumps({"event": "done", "errors": errors, **index.stats()}, ensure_ascii=False))
+    elif args.command == "build-ivf":
+        index.build_ivf(args.nlist)
+        print(json.dumps(index.stats(), ensure_ascii=False))
+    elif args.command == "query":
+        image_path = os.path.abspath(args.image)
+        tagger = _create_tagger(args)
+        result = next(_image_probs(tagger, [args.image], args))
+        if result.error is not None:
+            print(json.dumps({"error": str(result.error)}, ensure_ascii=False))
+            sys.exit(1)
+        # 查询图片本身可能已在索引中, 多取一个再去掉
+        matches = index.search(result.probs, k=args.k + 1, nprobe=args.nprobe)
+        matches = [m for m in matches if os.path.abspath(m[0]) != image_path][:args.k]
+        print(json.dumps([{"image": image_id, "score": round(score, 4)} for image_id, score in matches],
+                         ensure_ascii=False))
+    elif args.command == "remove":
+        print(json.dumps({"removed": index.remove(map(os.path.abspath, args.ids))}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
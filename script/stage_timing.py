@@ -0,0 +1,200 @@
+"""
+分阶段耗时统计 (默认关闭)
+
+通过环境变量 IMAGE_MANAGEMENT_TIMING 或命令行 --timing 开启:
+    stderr / 1          每次调用输出一行 JSON 到 stderr
+    file:<路径> / <路径>  追加写入 JSON Lines 文件
+也可以在代码中 add_sink(callback) 注册回调, 回调参数为记录字典。
+
+记录格式:
+    {"operation": "tag_image", "total_ms": 35.2, "stages": {"decode": 12.1, "inference": 18.3, ...},
+     "image": "...", "width": 1024, "height": 768, ...}
+
+开启后同时按 (operation, stage) 保留最近 1000 次耗时, aggregates() 返回各阶段的均值和分位数。
+关闭时 track / stage 返回同一个空上下文, 几乎没有额外开销。
+"""
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+TIMING_ENV = "IMAGE_MANAGEMENT_TIMING"
+AGGREGATE_WINDOW = 1000
+
+_NULL = contextlib.nullcontext()
+_local = threading.local()
+_lock = threading.Lock()
+_sinks: List[Callable[[dict], None]] = []
+# configure 添加的输出, 再次 configure 时替换 (环境变量和 --timing 同时指定时只输出一次)
+_configured: Optional[Callable[[dict], None]] = None
+_aggregates: Dict[str, Dict[str, deque]] = {}
+
+
+class FileSink:
+    """把记录追加写入 JSON Lines 文件, 多线程共用同一个文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def stderr_sink(record: dict):
+    sys.stderr.write(json.dumps(record, ensure_ascii=False) + "\n")
+    sys.stderr.flush()
+
+
+def configure(spec: Optional[str]):
+    """
+    按 stderr / file:<路径> / <路径> 设置输出, 替换之前 configure 设置的输出 (add_sink 注册的回调不受影响)
+
+    None 表示不改变当前设置; 空字符串、"0"、"false"、"off" 关闭之前 configure 设置的输出。
+    """
+    global _configured
+    if spec is None:
+        return
+    sink = None
+    if spec and spec.lower() not in ("0", "false", "off"):
+        if spec.lower() in ("1", "true", "on", "stderr"):
+            sink = stderr_sink
+        else:
+            sink = FileSink(spec[len("file:"):] if spec.startswith("file:") else spec)
+    if _configured is not None:
+        remove_sink(_configured)
+    _configured = sink
+    if sink is not None:
+        add_sink(sink)
+
+
+def add_sink(sink: Callable[[dict], None]):
+    with _lock:
+        _sinks.append(sink)
+
+
+def remove_sink(sink: Callable[[dict], None]):
+    with _lock:
+        if sink in _sinks:
+            _sinks.remove(sink)
+
+
+def enabled() -> bool:
+    return bool(_sinks)
+
+
+class Timer:
+    """一次调用的计时, 作为上下文使用时成为当前线程的计时器, 退出时输出记录"""
+
+    def __init__(self, operation: str, fields: dict):
+        self.operation = operation
+        self.fields = fields
+        self.stages: Dict[str, float] = {}
+        self._start = 0.0
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            # 同名阶段多次出现时累加
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def __enter__(self):
+        self._parent = getattr(_local, "timer", None)
+        _local.timer = self
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        total = (time.perf_counter() - self._start) * 1000
+        _local.timer = self._parent
+        record = {
+            "operation": self.operation,
+            "total_ms": round(total, 3),
+            "stages": {name: round(value, 3) for name, value in self.stages.items()},
+            **self.fields,
+        }
+        if exc is not None:
+            record["error"] = f"{exc_type.__name__}: {exc}"
+        _local.last_record = record
+        _aggregate(self.operation, dict(self.stages, total=total))
+        for sink in list(_sinks):
+            try:
+                sink(record)
+            except Exception as e:
+                sys.stderr.write(f"timing sink error: {e}\n")
+        return False
+
+
+def track(operation: str, **fields):
+    """开始一次调用的计时; 未开启时返回空上下文"""
+    if not _sinks:
+        return _NULL
+    return Timer(operation, fields)
+
+
+def stage(name: str):
+    """当前线程正在计时时记录一个阶段, 否则返回空上下文"""
+    timer = getattr(_local, "timer", None)
+    if timer is None:
+        return _NULL
+    return timer.stage(name)
+
+
+def annotate(**fields):
+    """给当前记录附加字段 (如图片尺寸)"""
+    timer = getattr(_local, "timer", None)
+    if timer is not None:
+        timer.fields.update(fields)
+
+
+def last_record() -> Optional[dict]:
+    """当前线程最近一次完成的记录"""
+    return getattr(_local, "last_record", None)
+
+
+def _aggregate(operation: str, stages: Dict[str, float]):
+    with _lock:
+        operation_stats = _aggregates.setdefault(operation, {})
+        for name, value in stages.items():
+            window = operation_stats.get(name)
+            if window is None:
+                window = operation_stats[name] = deque(maxlen=AGGREGATE_WINDOW)
+            window.append(value)
+
+
+def aggregates() -> dict:
+    """各操作各阶段最近 AGGREGATE_WINDOW 次的耗时统计 (毫秒)"""
+    import numpy as np
+
+    with _lock:
+        snapshot = {op: {name: list(values) for name, values in stages.items()} for op, stages in _aggregates.items()}
+    result = {}
+    for operation, stages in snapshot.items():
+        result[operation] = {}
+        for name, values in stages.items():
+            values = np.asarray(values)
+            result[operation][name] = {
+                "count": int(values.size),
+                "mean_ms": round(float(values.mean()), 3),
+                "p50_ms": round(float(np.percentile(values, 50)), 3),
+                "p95_ms": round(float(np.percentile(values, 95)), 3),
+                "max_ms": round(float(values.max()), 3),
+            }
+    return result
+
+
+def reset_aggregates():
+    with _lock:
+        _aggregates.clear()
+
+
+configure(os.environ.get(TIMING_ENV))
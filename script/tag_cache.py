@@ -0,0 +1,177 @@
+"""
+标签推理结果缓存
+
+以图片内容哈希 + 模型名称为键, 在 SQLite 中保存完整的概率向量 (float16)。
+修改 threshold / character_threshold / exclude_tags / replace_underscore 后重新打标签
+只需查表和后处理, 不需要再次推理。
+"""
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from typing import Optional
+
+import numpy as np
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# 命中时只在内存中记录访问时间, 攒够 TOUCH_BATCH 条、距上次写回超过 TOUCH_INTERVAL 秒或写入、关闭时再一次写回;
+# 进程退出时没有写回的访问时间只影响淘汰顺序
+TOUCH_BATCH = 256
+TOUCH_INTERVAL = 5.0
+
+
+class TagResultCache:
+    """
+    基于 SQLite 的概率向量缓存
+
+    - 键: 图片内容的 BLAKE2b 哈希 + 模型名称, 模型文件修改时间不一致时视为未命中
+    - 值: float16 概率向量, 读取时校验长度和 CRC32, 损坏的记录直接删除
+    - 数据库大小 (已用页) 超过 max_bytes 时按最近访问时间淘汰; 大小每次从数据库读取,
+      多个进程共用同一个缓存文件时也按总大小淘汰
+    """
+
+    def __init__(self, db_path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.db_path = os.path.abspath(db_path)
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tag_results (
+                content_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                model_mtime INTEGER NOT NULL,
+                probs BLOB NOT NULL,
+                checksum INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (content_hash, model)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tag_results_access ON tag_results (last_access)")
+        self._conn.commit()
+        self._touched = {}
+        self._touch_flushed = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+        self.corrupted = 0
+        self.evictions = 0
+
+    @staticmethod
+    def content_hash(data: bytes) -> str:
+        return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+    def get(self, content_hash: str, model: str, model_mtime: int) -> Optional[np.ndarray]:
+        """返回 float32 概率向量, 未命中返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT model_mtime, probs, checksum FROM tag_results WHERE content_hash = ? AND model = ?",
+                (content_hash, model),
+            ).fetchone()
+            if row is None or row[0] != model_mtime:
+                self.misses += 1
+                return None
+
+            blob, checksum = row[1], row[2]
+            if len(blob) % 2 or zlib.crc32(blob) != checksum:
+                self.corrupted += 1
+                self.misses += 1
+                self._delete(content_hash, model)
+                self._conn.commit()
+                return None
+
+            self._touched[(content_hash, model)] = time.time()
+            if len(self._touched) >= TOUCH_BATCH or time.monotonic() - self._touch_flushed > TOUCH_INTERVAL:
+                self._flush_touched()
+                self._conn.commit()
+            self.hits += 1
+        return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+
+    def put(self, content_hash: str, model: str, model_mtime: int, probs: np.ndarray) -> np.ndarray:
+        """保存概率向量, 返回按缓存精度 (float16) 取整后的 float32 向量"""
+        stored = np.asarray(probs, dtype=np.float16)
+        blob = stored.tobytes()
+        with self._lock:
+            self._delete(content_hash, model)
+            self._conn.execute(
+                "INSERT INTO tag_results (content_hash, model, model_mtime, probs, checksum, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (content_hash, model, model_mtime, blob, zlib.crc32(blob), len(blob), time.time()),
+            )
+            self._flush_touched()
+            self._evict()
+            self._conn.commit()
+        return stored.astype(np.float32)
+
+    def _delete(self, content_hash: str, model: str):
+        self._conn.execute("DELETE FROM tag_results WHERE content_hash = ? AND model = ?", (content_hash, model))
+        self._touched.pop((content_hash, model), None)
+
+    def _flush_touched(self):
+        """把攒下的访问时间写回 (不提交); 其他进程已删除的记录不受影响"""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE tag_results SET last_access = ? WHERE content_hash = ? AND model = ?",
+                [(last_access, content_hash, model) for (content_hash, model), last_access in self._touched.items()],
+            )
+            self._touched.clear()
+        self._touch_flushed = time.monotonic()
+
+    def _used_bytes(self) -> int:
+        """数据库已用页的大小 (不含空闲页), 包括其他进程已提交的写入"""
+        page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = self._conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist_count = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return (page_count - freelist_count) * page_size
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        used = self._used_bytes()
+        if used <= self.max_bytes:
+            return
+        # 淘汰到 90% 以下, 避免每次写入都触发淘汰; 删除的记录按数据大小估算释放的空间
+        excess = used - int(self.max_bytes * 0.9)
+        rows = self._conn.execute(
+            "SELECT content_hash, model, size FROM tag_results ORDER BY last_access"
+        )
+        evicted = []
+        for content_hash, model, size in rows:
+            if excess <= 0:
+                break
+            evicted.append((content_hash, model))
+            excess -= size
+        self._conn.executemany("DELETE FROM tag_results WHERE content_hash = ? AND model = ?", evicted)
+        self.evictions += len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._touched.clear()
+            self._conn.execute("DELETE FROM tag_results")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+            self._conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tag_results").fetchone()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "corrupted": self.corrupted,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": size,
+            }
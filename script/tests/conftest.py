@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# 脚本之间以顶层模块互相导入 (与直接运行脚本时相同)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def corpus(tmp_path_factory) -> list:
+    """合成图片集 (PNG / JPEG / WebP, 部分带生成参数), 见 bench_fixtures.make_corpus"""
+    from bench_fixtures import make_corpus
+    return make_corpus(str(tmp_path_factory.mktemp("corpus")), count=12)
+
+
+@pytest.fixture(scope="session")
+def models_dir(tmp_path_factory) -> str:
+    """包含小型替身模型的模型目录: bench-tagger (448), bench-tagger-fast (448) 和 bench-tagger-small (224)"""
+    from bench_fixtures import make_stand_in_model
+    path = str(tmp_path_factory.mktemp("models"))
+    make_stand_in_model(path)
+    make_stand_in_model(path, "bench-tagger-fast", seed=1)
+    make_stand_in_model(path, "bench-tagger-small", size=224, seed=2)
+    return path
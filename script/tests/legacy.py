@@ -0,0 +1,155 @@
+"""
+优化之前的参考实现, 用于测试新实现的结果是否一致, benchmark.py 也以这些实现为基准对比耗时
+
+各函数保留原实现的写法 (包括逐元素循环等慢的部分), 不要优化。
+"""
+import os
+import json
+from typing import List
+
+import numpy as np
+
+
+def legacy_postprocess(tags, general_index, character_index, probs, threshold, character_threshold,
+                       exclude_tags, trailing_comma):
+    """改为 NumPy 实现之前的标签后处理, 用于对比"""
+    result = list(zip(tags, probs))
+    general = [item for item in result[general_index:character_index] if item[1] > threshold]
+    character = [item for item in result[character_index:] if item[1] > character_threshold]
+    all_tags = character + general
+    if exclude_tags:
+        remove = [s.strip() for s in exclude_tags.lower().split(",")]
+        all_tags = [tag for tag in all_tags if tag[0] not in remove]
+    tags_text = ("" if trailing_comma else ", ").join(
+        (item[0].replace("(", "\\(").replace(")", "\\)") +
+         (", " if trailing_comma else "") for item in all_tags)
+    )
+    return all_tags, tags_text
+
+
+def legacy_preprocess(image_path: str, height: int) -> np.ndarray:
+    """改为 draft 解码/单次缩放之前的预处理, 用于对比"""
+    from PIL import Image
+
+    image = Image.open(image_path)
+    if max(image.size) > 2048:
+        ratio = 2048 / max(image.size)
+        image = image.resize(tuple(int(x * ratio) for x in image.size), Image.LANCZOS)
+    ratio = float(height) / max(image.size)
+    new_size = tuple([int(x * ratio) for x in image.size])
+    image = image.resize(new_size, Image.LANCZOS)
+    square = Image.new("RGB", (height, height), (255, 255, 255))
+    square.paste(image, ((height - new_size[0]) // 2, (height - new_size[1]) // 2))
+    return np.array(square).astype(np.float32)[:, :, ::-1]
+
+
+def legacy_kmeans_colors(image_path: str, num_colors: int, seed: int = None) -> list:
+    """旧实现: 对所有像素运行 sklearn KMeans"""
+    from PIL import Image
+    from sklearn.cluster import KMeans
+    from get_main_color import resize_image_if_needed, _summarize_colors
+
+    pixels = np.array(resize_image_if_needed(Image.open(image_path).convert("RGB"))).reshape(-1, 3)
+    kmeans = KMeans(n_clusters=num_colors, init="k-means++", random_state=seed).fit(pixels)
+    return _summarize_colors(kmeans.cluster_centers_, np.bincount(kmeans.labels_, minlength=num_colors),
+                             len(pixels))
+
+
+def legacy_extract_attributes(json_string: str, keys: List[str]) -> dict:
+    """旧实现: 在序列化后的 raw_parameters 中用正则查找字段"""
+    import re
+
+    attributes = {}
+    pattern = r'\\"({})\\":\s*\\"(.*?)\\"'.format('|'.join(map(re.escape, keys)))
+    for key, value in re.findall(pattern, json_string):
+        cleaned = value.replace("\\\\u", "\\u")
+        attributes[key] = cleaned.encode("utf-8").decode("unicode_escape")
+    return attributes
+
+
+def legacy_read_metadata(image_path: str):
+    """旧实现: 每次新建 ParserManager 解析整张图片, 再序列化 raw_parameters 查找 ckpt_name"""
+    from sd_parsers import ParserManager
+    from read_image_metadata import prompt_info_to_result
+
+    prompt_info = ParserManager().parse(image_path)
+    if prompt_info is None:
+        return None
+    json_string = json.dumps(prompt_info.raw_parameters, ensure_ascii=False, default=str)
+    return prompt_info_to_result(prompt_info, legacy_extract_attributes(json_string, ["ckpt_name"]))
+
+
+def legacy_download(url: str, path: str):
+    """原 download_model 的写法: 单连接, 1 KB 分块直接写入目标文件"""
+    import requests
+
+    response = requests.get(url, stream=True, timeout=30)
+    response.raise_for_status()
+    with open(path, "wb") as f:
+        for chunk in response.iter_content(1024):
+            f.write(chunk)
+
+
+def legacy_gradient_background(size: int):
+    """原 generate_icons.create_gradient_background: 逐像素 draw.point"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    color1, color2 = (88, 86, 214), (45, 149, 214)
+    for y in range(size):
+        for x in range(size):
+            ratio = (x + y) / (size * 2)
+            draw.point((x, y), fill=tuple(int(c1 * (1 - ratio) + c2 * ratio) for c1, c2 in zip(color1, color2)) + (255,))
+    return image
+
+
+def legacy_add_shine_effect(image):
+    """原 generate_icons.add_shine_effect: 逐像素 draw.point"""
+    from PIL import Image, ImageDraw
+
+    size = image.size[0]
+    shine = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(shine)
+    for y in range(size):
+        for x in range(size):
+            dx = (x - size / 2) / (size / 2)
+            dy = (y - size / 2) / (size / 2)
+            distance = (dx * dx + dy * dy) ** 0.5
+            alpha = int(max(0, min(255, 255 * (1 - distance))))
+            if y < size / 2:
+                draw.point((x, y), fill=(255, 255, 255, alpha // 4))
+    return Image.alpha_composite(image, shine)
+
+
+def legacy_generate_icons(font_path: str = None):
+    """原 generate_icons.main 的流程: ICO 每个尺寸单独渲染, macOS 渲染 1024, Linux 渲染 512, 每个文件依次编码"""
+    from unittest import mock
+    from PIL import Image
+    import generate_icons as icons
+
+    def base_icon(size):
+        with mock.patch.object(icons, "create_gradient_background", legacy_gradient_background):
+            return icons.create_base_icon(size, font_path=font_path)
+
+    images = []
+    for size in icons.ICO_SIZES:
+        icon = base_icon(size)
+        images.append(legacy_add_shine_effect(icon) if size >= 64 else icon)
+    os.makedirs("build", exist_ok=True)
+    os.makedirs("public", exist_ok=True)
+    for path in ("build/favicon.ico", "public/favicon.ico"):
+        images[0].save(path, format="ICO", sizes=[(s, s) for s in icons.ICO_SIZES], append_images=images[1:])
+
+    icon = legacy_add_shine_effect(base_icon(1024))
+    os.makedirs("build/icon.iconset", exist_ok=True)
+    for size in icons.MAC_SIZES:
+        icon.resize((size, size), Image.Resampling.LANCZOS).save(f"build/icon.iconset/icon_{size}x{size}.png")
+        if size <= 512:
+            icon.resize((size * 2, size * 2), Image.Resampling.LANCZOS).save(
+                f"build/icon.iconset/icon_{size}x{size}@2x.png")
+
+    icon = legacy_add_shine_effect(base_icon(512))
+    os.makedirs("build/icons", exist_ok=True)
+    for size in icons.LINUX_SIZES:
+        icon.resize((size, size), Image.Resampling.LANCZOS).save(f"build/icons/{size}x{size}.png")
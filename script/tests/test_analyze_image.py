@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from ai_tagger import AITagger
+from analyze_image import ImageAnalyzer
+from get_main_color import get_dominant_colors_kmeans, palette_distance
+
+
+@pytest.fixture(scope="module")
+def tagger(models_dir):
+    return AITagger(models_dir)
+
+
+def _analyzer(tagger, parts=("tags", "colors")):
+    # histogram 方式较快, 一次解码的效果与 kmeans 方式相同
+    return ImageAnalyzer(parts=parts, num_colors=5, engine="histogram", tag_options={"model_name": "bench-tagger"},
+                         tagger=tagger)
+
+
+def test_matches_separate_scripts(tagger, corpus):
+    """
+    一次解码得到的标签和主色与分别调用 tag_image / get_dominant_colors_kmeans 一致
+
+    JPEG 按主色分析的尺寸 DCT 缩放解码, 与单独打标签时不同, 只比较接近程度。
+    """
+    analyzer = _analyzer(tagger)
+    for entry in corpus:
+        record = analyzer.analyze(entry["path"])
+        tags, tags_text = tagger.tag_image(entry["path"], model_name="bench-tagger")
+        colors = get_dominant_colors_kmeans(entry["path"], 5, engine="histogram")
+
+        assert "errors" not in record
+        assert (record["width"], record["height"], record["format"]) == (entry["width"], entry["height"],
+                                                                          entry["format"])
+        if entry["format"] == "JPEG":
+            assert len(set(tag for tag, _ in record["tags"]) ^ set(tag for tag, _ in tags)) <= 2
+            assert palette_distance(record["colors"], colors) < 5
+        else:
+            assert record["tags_text"] == tags_text
+            np.testing.assert_allclose([score for _, score in record["tags"]], [score for _, score in tags],
+                                       atol=1e-5)
+            assert record["colors"] == colors
+
+
+def test_metadata_part(tagger, corpus):
+    """生成参数与 read_image_metadata.read_metadata 一致"""
+    pytest.importorskip("sd_parsers")
+    from read_image_metadata import read_metadata
+
+    analyzer = _analyzer(tagger, parts=("metadata",))
+    for entry in corpus:
+        record = analyzer.analyze(entry["path"])
+        assert record["metadata"] == read_metadata(entry["path"])
+        assert "tags" not in record and "colors" not in record
+
+
+def test_failures_are_reported_per_part(tagger, corpus, tmp_path):
+    """无法识别的文件只输出 error; 像素数据损坏时标签和主色为 null, 错误写在 errors 中"""
+    broken = tmp_path / "broken.png"
+    broken.write_bytes(b"not an image")
+    record = _analyzer(tagger).analyze(str(broken))
+    assert set(record) == {"image", "error"}
+
+    png = next(entry for entry in corpus if entry["format"] == "PNG")
+    with open(png["path"], "rb") as f:
+        data = f.read()
+    truncated = tmp_path / "truncated.png"
+    truncated.write_bytes(data[:len(data) // 2])
+    record = _analyzer(tagger).analyze(str(truncated))
+    assert record["tags"] is None and record["colors"] is None
+    assert set(record["errors"]) == {"tags", "colors"}
+
+
+def test_parts_and_engine_are_validated():
+    """分析项为空或聚类方式未知时报错"""
+    with pytest.raises(ValueError):
+        ImageAnalyzer(parts=[])
+    with pytest.raises(ValueError):
+        ImageAnalyzer(engine="sklearn")
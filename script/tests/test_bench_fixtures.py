@@ -0,0 +1,30 @@
+import os
+
+from PIL import Image
+
+from bench_common import list_images, summarize
+from bench_fixtures import make_corpus
+
+
+def test_corpus_matches_description_and_is_reused(tmp_path):
+    """合成图片与描述一致; 相同参数再次生成时复用已有图片, 参数不同时重新生成"""
+    entries = make_corpus(str(tmp_path), count=6, seed=3)
+    assert list_images(str(tmp_path)) == sorted(entry["path"] for entry in entries)
+    for entry in entries:
+        with Image.open(entry["path"]) as image:
+            assert (image.format, image.mode, image.size) == (entry["format"], entry["mode"],
+                                                              (entry["width"], entry["height"]))
+        if entry["metadata"] is not None:
+            assert entry["format"] == "PNG"
+
+    mtimes = [os.stat(entry["path"]).st_mtime_ns for entry in entries]
+    assert make_corpus(str(tmp_path), count=6, seed=3) == entries
+    assert [os.stat(entry["path"]).st_mtime_ns for entry in entries] == mtimes
+    assert len(make_corpus(str(tmp_path), count=4, seed=3)) == 4
+
+
+def test_summarize_reports_percentiles_in_ms():
+    """延迟统计以毫秒为单位"""
+    stats = summarize([i / 1000 for i in range(1, 101)])
+    assert stats == {"count": 100, "mean_ms": 50.5, "p50_ms": 50.5, "p95_ms": 95.05, "p99_ms": 99.01}
+    assert summarize([]) == {"count": 0}
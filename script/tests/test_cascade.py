@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from ai_tagger import AITagger
+
+
+def _tags(results):
+    return [(result.model, [tag for tag, _ in result.tags]) for result in results]
+
+
+def _count_runs(tagger):
+    """记录每次推理的图片数"""
+    calls = []
+    run = tagger._run
+
+    def counted(session, images):
+        calls.append(len(images))
+        return run(session, images)
+
+    tagger._run = counted
+    return calls
+
+
+def _median_band(tagger, paths, fast_model):
+    """取各图片标签概率到阈值的最小距离的中位数作为 band, 约一半图片升级到大模型"""
+    labels = tagger._load_model(fast_model).labels
+    probs = np.stack([result.probs for result in tagger.tag_images(paths, model_name=fast_model, return_probs=True)])
+    distance = np.minimum(
+        np.abs(probs[:, labels.general_ids] - tagger.defaults["threshold"]).min(axis=1),
+        np.abs(probs[:, labels.character_ids] - tagger.defaults["character_threshold"]).min(axis=1),
+    )
+    return float(np.median(distance))
+
+
+@pytest.mark.parametrize("heavy", ["bench-tagger", "bench-tagger-small"])
+def test_result_cache_covers_both_stages(tmp_path, corpus, models_dir, heavy):
+    """启用结果缓存时小模型和大模型的概率都被缓存, 再次运行不推理且结果不变"""
+    paths = [entry["path"] for entry in corpus]
+    reference = AITagger(models_dir)
+    band = _median_band(reference, paths, "bench-tagger-fast")
+    options = dict(fast_model="bench-tagger-fast", model_name=heavy, band=band, character_candidate=None,
+                   batch_size=4)
+    expected = reference.tag_images_cascade(paths, **options)
+    assert 0 < reference.cascade_stats.escalated < len(paths)
+
+    tagger = AITagger(models_dir, result_cache_path=str(tmp_path / "cache.db"))
+    first = tagger.tag_images_cascade(paths, **options)
+    assert _tags(first) == _tags(expected)
+
+    calls = _count_runs(tagger)
+    second = tagger.tag_images_cascade(paths, **options)
+    assert calls == []
+    assert _tags(second) == _tags(expected)
+
+
+@pytest.mark.parametrize("heavy", ["bench-tagger", "bench-tagger-small"])
+def test_escalated_images_use_heavy_model(corpus, models_dir, heavy):
+    """阈值附近的图片采用大模型的结果, 其余采用小模型的结果, 与各自单独推理一致; 大模型只推理升级的图片"""
+    paths = [entry["path"] for entry in corpus]
+    tagger = AITagger(models_dir)
+    band = _median_band(tagger, paths, "bench-tagger-fast")
+    fast = {result.image_path: result for result in tagger.tag_images(paths, model_name="bench-tagger-fast")}
+    slow = {result.image_path: result for result in tagger.tag_images(paths, model_name=heavy)}
+
+    calls = _count_runs(tagger)
+    results = tagger.tag_images_cascade(paths, "bench-tagger-fast", model_name=heavy, band=band,
+                                        character_candidate=None, batch_size=len(paths))
+
+    escalated = [result.image_path for result in results if result.model == heavy]
+    assert 0 < len(escalated) < len(paths)
+    assert calls == [len(paths), len(escalated)]
+    assert tagger.cascade_stats.stats()["escalated"] == len(escalated)
+    for result in results:
+        expected = (slow if result.model == heavy else fast)[result.image_path]
+        assert result.model in (heavy, "bench-tagger-fast")
+        assert [tag for tag, _ in result.tags] == [tag for tag, _ in expected.tags]
+        assert result.tags_text == expected.tags_text
+
+
+def test_character_candidates_and_failures(corpus, models_dir, tmp_path):
+    """有角色候选的图片升级到大模型; 读取失败的图片只影响自身"""
+    broken = tmp_path / "broken.png"
+    broken.write_bytes(b"not an image")
+    paths = [corpus[0]["path"], str(broken), corpus[1]["path"]]
+    tagger = AITagger(models_dir)
+
+    results = tagger.tag_images_cascade(paths, "bench-tagger-fast", model_name="bench-tagger", band=0,
+                                        character_candidate=0.0)
+    assert results[1].error is not None and results[1].model is None
+    assert [result.model for result in (results[0], results[2])] == ["bench-tagger"] * 2
+
+    results = tagger.tag_images_cascade(paths, "bench-tagger-fast", model_name="bench-tagger", band=0,
+                                        character_candidate=1.0)
+    assert [result.model for result in (results[0], results[2])] == ["bench-tagger-fast"] * 2
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pytest
+
+import download_models
+from bench_fixtures import ModelServer
+from download_models import download_file, download_model, make_session
+
+
+def _files():
+    rng = np.random.default_rng(0)
+    return {"m.onnx": rng.bytes(3 * 1024 * 1024 + 17), "m.csv": b"tag_id,name,category\n" * 500}
+
+
+def test_checksums_come_from_redirect_and_etag_without_tree_api(tmp_path):
+    """文件列表接口不可用时, LFS 文件用 302 上的 X-Linked-Etag, 普通文件用 ETag 校验"""
+    files = _files()
+    with ModelServer(files) as server:
+        server.tree_available = False
+        assert download_model("m", str(tmp_path), connections=4, host=server.host, show_progress=False)
+    for name, data in files.items():
+        with open(tmp_path / name, "rb") as f:
+            assert f.read() == data
+    manifest = download_models.load_manifest(str(tmp_path))
+    assert "sha256" in manifest["m.onnx"] and "git_sha1" in manifest["m.csv"]
+
+
+def test_known_checksum_mismatch_fails(tmp_path):
+    with ModelServer(_files()) as server:
+        server.corrupt = True
+        assert not download_model("m", str(tmp_path), connections=4, host=server.host, show_progress=False)
+    assert not os.path.exists(tmp_path / "m.onnx")
+
+
+def test_missing_checksum_falls_back_to_size(tmp_path, monkeypatch):
+    """响应头和清单都没有摘要时只校验大小, 不让整个下载失败"""
+    data = _files()["m.csv"]
+    with ModelServer({"m.csv": data}) as server:
+        server.tree_available = False
+        session = make_session(1)
+        url = download_models.file_url(server.host, "m.csv")
+        monkeypatch.setattr(download_models, "CHECKSUM_HEADERS", ())
+        expected = download_file(session, url, str(tmp_path / "m.csv"), None, 1, show_progress=False)
+    assert expected == {"size": len(data)}
+    assert (tmp_path / "m.csv").read_bytes() == data
+
+
+def test_missing_model_is_not_a_local_file_error(tmp_path):
+    """404 用专门的异常表示, 不与本地文件系统的 FileNotFoundError 混淆"""
+    assert not issubclass(download_models.RemoteFileNotFound, OSError)
+    with ModelServer(_files()) as server:
+        assert not download_model("other", str(tmp_path), host=server.host, show_progress=False)
+
+
+def _download(server, tmp_path, name="m.onnx", connections=4, chunk_size=256 * 1024):
+    return download_file(make_session(connections), download_models.file_url(server.host, name),
+                         str(tmp_path / name), None, connections, chunk_size, show_progress=False)
+
+
+def test_resume_after_interruption(tmp_path, monkeypatch):
+    """中断后保留已完成的分块, 再次下载只请求剩余的部分"""
+    monkeypatch.setattr(download_models, "CHUNK_RETRIES", 2)
+    data = _files()["m.onnx"]
+    with ModelServer({"m.onnx": data}) as server:
+        server.max_requests = 5  # 探测请求加 4 个分块
+        with pytest.raises(download_models.DownloadError):
+            _download(server, tmp_path, connections=2)
+        with open(tmp_path / "m.onnx.part.json", encoding="utf-8") as f:
+            done = json.load(f)["done"]
+        assert len(done) == 4 and not (tmp_path / "m.onnx").exists()
+
+        server.max_requests, server.requests, server.bytes_sent = 0, 0, 0
+        expected = _download(server, tmp_path, connections=2)
+        assert server.bytes_sent == len(data) - 4 * 256 * 1024 + 1
+    assert expected["sha256"] == hashlib.sha256(data).hexdigest()
+    assert (tmp_path / "m.onnx").read_bytes() == data
+    assert sorted(os.listdir(tmp_path)) == ["m.onnx"]
+
+
+def test_retries_server_errors_and_cut_connections(tmp_path):
+    """503 和中途断开的连接从已写入的位置继续, 最终内容完整"""
+    data = _files()["m.onnx"]
+    with ModelServer({"m.onnx": data}) as server:
+        server.fail_every, server.cut_after = 5, 200 * 1024
+        _download(server, tmp_path, chunk_size=512 * 1024)
+    assert (tmp_path / "m.onnx").read_bytes() == data
+
+
+def test_server_without_range_support(tmp_path):
+    """下载源忽略 Range 时单连接下载整个文件, 仍然校验"""
+    files = _files()
+    with ModelServer(files) as server:
+        server.ranges = False
+        assert download_model("m", str(tmp_path), connections=4, host=server.host, show_progress=False)
+        assert server.requests == 4  # 每个文件一次探测, 一次下载
+    for name, data in files.items():
+        assert (tmp_path / name).read_bytes() == data
+
+
+def test_matches_legacy_download(tmp_path):
+    """与原单连接下载得到的文件相同"""
+    from legacy import legacy_download
+
+    files = _files()
+    with ModelServer(files) as server:
+        for name in files:
+            legacy_download(download_models.file_url(server.host, name), str(tmp_path / f"legacy-{name}"))
+        assert download_model("m", str(tmp_path), host=server.host, show_progress=False)
+    for name in files:
+        assert (tmp_path / name).read_bytes() == (tmp_path / f"legacy-{name}").read_bytes()
@@ -0,0 +1,53 @@
+import os
+from unittest import mock
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import generate_icons as icons
+from bench_icons import icon_frames
+from legacy import legacy_add_shine_effect, legacy_gradient_background
+
+
+def _legacy_icon(size):
+    """原实现按尺寸单独渲染的图标: 逐像素的渐变背景, 大尺寸加逐像素的光泽"""
+    with mock.patch.object(icons, "create_gradient_background", legacy_gradient_background):
+        icon = icons.create_base_icon(size)
+    return legacy_add_shine_effect(icon) if size >= icons.SHINE_MIN_SIZE else icon
+
+
+@pytest.mark.parametrize("size", [16, 63, 64, 255, 256])
+def test_vectorized_passes_match_legacy(size):
+    """向量化的渐变背景和光泽与逐像素绘制的结果逐像素相同 (包括奇数尺寸)"""
+    np.testing.assert_array_equal(np.asarray(icons.create_gradient_background(size)),
+                                  np.asarray(legacy_gradient_background(size)))
+    base = icons.create_base_icon(size)
+    np.testing.assert_array_equal(np.asarray(icons.add_shine_effect(base)), np.asarray(legacy_add_shine_effect(base)))
+
+
+def test_generate_icons(tmp_path, monkeypatch):
+    """
+    生成全部图标; 不加光泽的小尺寸 ICO 图标与原实现相同, 其它尺寸由同一张大图缩小得到;
+    输入未变化且输出都存在时跳过, 缺少输出或 force 时重新生成
+    """
+    monkeypatch.chdir(tmp_path)
+    assert icons.generate_icons()
+    assert all(os.path.exists(path) for path in icons.output_paths())
+
+    frames = icon_frames("build/favicon.ico")
+    assert sorted(frames) == [(size, size) for size in icons.ICO_SIZES]
+    for size in icons.ICO_SIZES:
+        diff = np.abs(frames[(size, size)] - np.asarray(_legacy_icon(size), dtype=np.int16))
+        if size < icons.SHINE_MIN_SIZE:
+            assert diff.max() == 0
+        else:
+            # 缩小得到的图标与按尺寸渲染的只在文字和圆角边缘有差异
+            assert diff.mean() < 4
+    with Image.open(f"build/icon.iconset/icon_{icons.MASTER_SIZE}x{icons.MASTER_SIZE}.png") as image:
+        np.testing.assert_array_equal(np.asarray(image), np.asarray(icons.render_master()))
+
+    assert not icons.generate_icons()
+    os.remove("build/icons/48x48.png")
+    assert icons.generate_icons()
+    assert icons.generate_icons(force=True)
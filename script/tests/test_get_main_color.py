@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from get_main_color import (DEFAULT_ENGINE, array_module, color_histogram, get_dominant_colors_kmeans, kmeans,
+                            palette_distance)
+
+
+def _mean_distance(corpus, engine, reference):
+    # 逐像素聚类较慢, 只用前几张图片 (包含各种颜色模式)
+    return np.mean([palette_distance(get_dominant_colors_kmeans(entry["path"], engine=engine), reference(entry["path"]))
+                    for entry in corpus[:6]])
+
+
+def test_color_histogram_bins():
+    """直方图按每通道位数分格, 格内为平均颜色, 权重为像素数"""
+    pixels = np.array([[0, 0, 0], [7, 7, 7], [8, 0, 0], [255, 255, 255], [250, 251, 252]], dtype=np.uint8)
+    points, weights = color_histogram(pixels, bits=5)
+
+    assert weights.tolist() == [2, 1, 2]
+    np.testing.assert_allclose(points, [[3.5, 3.5, 3.5], [8, 0, 0], [252.5, 253, 253.5]])
+
+
+def test_histogram_engine_close_to_kmeans(corpus):
+    """默认使用 kmeans; histogram 方式的主色与 kmeans 的差异不超过换随机种子的噪声水平"""
+    assert DEFAULT_ENGINE == "kmeans"
+    delta = _mean_distance(corpus, "histogram", get_dominant_colors_kmeans)
+    noise = _mean_distance(corpus, "kmeans", lambda path: get_dominant_colors_kmeans(path, seed=1))
+    assert delta < max(2 * noise, 1.0)
+
+
+@pytest.mark.parametrize("engine", ["kmeans", "histogram"])
+def test_matches_sklearn_reference(corpus, engine):
+    """与原 sklearn KMeans 实现的主色接近"""
+    pytest.importorskip("sklearn")
+    from legacy import legacy_kmeans_colors
+
+    delta = _mean_distance(corpus, engine, lambda path: legacy_kmeans_colors(path, 5, seed=0))
+    noise = np.mean([palette_distance(legacy_kmeans_colors(entry["path"], 5, seed=1),
+                                      legacy_kmeans_colors(entry["path"], 5, seed=0)) for entry in corpus[:6]])
+    assert delta < max(2 * noise, 1.0)
+
+
+def test_percentages_sum_to_100(corpus):
+    """占比按从大到小排序, 合计为 100%"""
+    for engine in ("kmeans", "histogram"):
+        colors = get_dominant_colors_kmeans(corpus[0]["path"], engine=engine)
+        percentages = [entry["percentage"] for entry in colors]
+        assert len(colors) == 5
+        assert percentages == sorted(percentages, reverse=True)
+        assert sum(percentages) == pytest.approx(100, abs=0.05)
+
+
+def _blobs(seed=0):
+    """三个分开的颜色簇, 各 1000 / 600 / 400 个点"""
+    rng = np.random.default_rng(seed)
+    centers = np.array([[200, 30, 30], [30, 200, 30], [30, 30, 200]], dtype=np.float64)
+    points = np.concatenate([rng.normal(center, 5, (count, 3)) for center, count in zip(centers, (1000, 600, 400))])
+    return centers, np.clip(points, 0, 255).round()
+
+
+def test_kmeans_recovers_clusters():
+    """分开的簇被准确找到, 结果只取决于 seed"""
+    centers, points = _blobs()
+    found, labels = kmeans(points, 3, seed=0)
+
+    order = np.argsort(np.bincount(labels))[::-1]
+    np.testing.assert_allclose(found[order], centers, atol=1.0)
+    assert sorted(np.bincount(labels).tolist()) == [400, 600, 1000]
+    again, again_labels = kmeans(points, 3, seed=0)
+    np.testing.assert_array_equal(again, found)
+    np.testing.assert_array_equal(again_labels, labels)
+
+
+def test_chunking_and_weights_do_not_change_results():
+    """分块大小不影响结果; 带权重的点与重复相应次数的点聚类结果相同"""
+    _, points = _blobs(1)
+    found, labels = kmeans(points, 4, seed=3)
+    chunked, chunked_labels = kmeans(points, 4, seed=3, chunk_size=7)
+    np.testing.assert_allclose(chunked, found, atol=1e-6)
+    np.testing.assert_array_equal(chunked_labels, labels)
+
+    unique, counts = np.unique(points, axis=0, return_counts=True)
+    weighted, _ = kmeans(unique, 3, weights=counts, seed=0, n_init=3)
+    expanded, _ = kmeans(np.repeat(unique, counts, axis=0), 3, seed=0, n_init=3)
+    np.testing.assert_allclose(np.sort(weighted, axis=0), np.sort(expanded, axis=0), atol=0.5)
+
+
+def test_fewer_colors_than_clusters(tmp_path):
+    """颜色数少于聚类数时多出的颜色占比为 0, 不报错"""
+    from PIL import Image
+
+    path = str(tmp_path / "two.png")
+    image = Image.new("RGB", (40, 20), (255, 0, 0))
+    image.paste((0, 0, 255), (20, 0, 40, 20))
+    image.save(path)
+    for engine in ("kmeans", "histogram"):
+        colors = get_dominant_colors_kmeans(path, 5, engine=engine)
+        assert [(entry["color"], entry["percentage"]) for entry in colors[:2]] in (
+            [("#ff0000", 50.0), ("#0000ff", 50.0)], [("#0000ff", 50.0), ("#ff0000", 50.0)])
+        assert [entry["percentage"] for entry in colors[2:]] == [0.0] * 3
+
+
+def test_invalid_engine_and_device(corpus):
+    """未知的聚类方式或设备报错"""
+    with pytest.raises(ValueError):
+        get_dominant_colors_kmeans(corpus[0]["path"], engine="sklearn")
+    with pytest.raises(ValueError):
+        array_module("tpu")
+    assert array_module("cpu") is np
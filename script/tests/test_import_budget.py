@@ -0,0 +1,16 @@
+import json
+
+import pytest
+
+from bench_suite import IMPORT_BUDGET_FILE, check_import_budget
+
+with open(IMPORT_BUDGET_FILE, encoding="utf-8") as f:
+    BUDGETS = json.load(f)
+
+
+@pytest.mark.parametrize("module", sorted(BUDGETS))
+def test_entry_within_import_budget(module):
+    """python -X importtime 测得的导入耗时不超过 import_budget.json 的预算, 且不加载延迟依赖"""
+    row, failures = check_import_budget(module, BUDGETS[module], repeat=5)
+    assert not failures, "\n".join(failures)
+    assert row["import_ms"] > 0
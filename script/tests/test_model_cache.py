@@ -0,0 +1,31 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ai_tagger import LoadedModel, ModelCache
+
+
+def _entry(size_bytes=1):
+    return LoadedModel(session=object(), labels=None, onnx_mtime=1, csv_mtime=1, size_bytes=size_bytes)
+
+
+def test_concurrent_get_loads_once_without_blocking_other_models():
+    """同一模型同时请求只加载一次; 一个模型加载时其他模型的请求不被阻塞"""
+    cache = ModelCache(max_models=4)
+    release = threading.Event()
+    calls = []
+
+    def slow_loader():
+        calls.append("a")
+        assert release.wait(5)
+        return _entry()
+
+    with ThreadPoolExecutor(4) as pool:
+        waiting = [pool.submit(cache.get, "a", 1, 1, slow_loader) for _ in range(3)]
+        # "a" 仍在加载, "b" 应能立即加载完成
+        assert cache.get("b", 1, 1, _entry) is not None
+        release.set()
+        results = [future.result(timeout=5) for future in waiting]
+
+    assert calls == ["a"]
+    assert all(result is results[0] for result in results)
+    assert sorted(cache.stats()["models"]) == ["a", "b"]
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from get_main_color import palette_distance
+from palette_index import PaletteIndex
+
+
+def _random_palettes(count, seed=0):
+    """每张图片一个占比高的主色加若干接近或随机的颜色"""
+    rng = np.random.default_rng(seed)
+    palettes = []
+    for _ in range(count):
+        base = rng.integers(0, 256, 3)
+        colors = np.clip(base + rng.normal(0, 40, (10, 3)), 0, 255).astype(int)
+        colors[5:] = rng.integers(0, 256, (5, 3))
+        # 索引不记录占比为 0 的颜色, 生成的占比至少为 0.01
+        shares = np.sort(rng.dirichlet(np.ones(10) * 0.5))[::-1] * 100
+        palettes.append([{"color": "#{:02x}{:02x}{:02x}".format(*color),
+                          "percentage": max(round(float(share), 2), 0.01)} for color, share in zip(colors, shares)])
+    return palettes
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = PaletteIndex(str(tmp_path / "index"))
+    palettes = _random_palettes(500)
+    index.add([f"img_{i}" for i in range(len(palettes))], palettes)
+    return index, palettes
+
+
+@pytest.mark.parametrize("target", ["#1fa3a3", [{"color": "#e0e0e0", "percentage": 60},
+                                                {"color": "#d02020", "percentage": 40}]])
+def test_exact_search_matches_palette_distance(index, target):
+    """全量计算的排序与 get_main_color.palette_distance 一致 (float16 存储误差以内)"""
+    index, palettes = index
+    target_palette = [{"color": target, "percentage": 100}] if isinstance(target, str) else target
+    expected = sorted((palette_distance(palette, target_palette), f"img_{i}") for i, palette in enumerate(palettes))
+
+    results = index.search(target, k=10, prefilter=False)
+    for (image_id, distance), (reference, _) in zip(results, expected[:10]):
+        assert distance == pytest.approx(palette_distance(palettes[int(image_id[4:])], target_palette), abs=0.1)
+        assert distance == pytest.approx(reference, abs=0.1)
+
+
+def test_prefilter_recall(index):
+    """预筛选的结果与全量计算基本一致"""
+    index, palettes = index
+    hits = total = 0
+    for target in _random_palettes(20, seed=1):
+        exact = {image_id for image_id, _ in index.search(target, k=10, prefilter=False)}
+        found = {image_id for image_id, _ in index.search(target, k=10)}
+        hits += len(exact & found)
+        total += len(exact)
+    assert hits / total >= 0.9
+
+
+def test_mostly_teal_image_ranks_first(tmp_path):
+    """以青色为主的图片排在只有少量青色的图片之前"""
+    index = PaletteIndex(str(tmp_path / "index"))
+    index.add(["teal", "some_teal", "red"], [
+        [{"color": "#20a0a0", "percentage": 80}, {"color": "#ffffff", "percentage": 20}],
+        [{"color": "#ffffff", "percentage": 70}, {"color": "#20a0a0", "percentage": 30}],
+        [{"color": "#d02020", "percentage": 100}],
+    ])
+    assert [image_id for image_id, _ in index.search("#1fa3a3", k=3)] == ["teal", "some_teal", "red"]
+    assert [image_id for image_id, _ in index.search("#1fa3a3", k=3, exclude="teal")] == ["some_teal", "red"]
+
+
+def test_update_remove_and_reopen(index, tmp_path):
+    """重复添加以最后一次为准; 删除和压缩后重新打开索引结果不变"""
+    index, _ = index
+    index.add(["img_3"], ["#1fa3a3"])
+    assert index.search("#1fa3a3", k=1, prefilter=False)[0] == ("img_3", pytest.approx(0, abs=0.1))
+
+    assert index.remove(["img_3", "missing"]) == 1
+    index.compact()
+    expected = index.search("#1fa3a3", k=5, prefilter=False)
+    reopened = PaletteIndex(index.index_dir)
+    assert len(reopened) == 499 and "img_3" not in reopened
+    assert reopened.search("#1fa3a3", k=5, prefilter=False) == expected
+
+
+def test_invalid_palette(tmp_path):
+    """颜色格式错误或主色为空时报错"""
+    index = PaletteIndex(str(tmp_path / "index"))
+    with pytest.raises(ValueError):
+        index.add(["bad"], ["#12345"])
+    with pytest.raises(ValueError):
+        index.search([])
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from ai_tagger import AITagger, LabelTable
+from legacy import legacy_postprocess
+
+NAMES = [f"tag_{i}" if i % 9 else f"tag_{i}_(series)" for i in range(2000)]
+GENERAL_INDEX, CHARACTER_INDEX = 4, 1400
+
+
+@pytest.fixture(scope="module")
+def labels():
+    return LabelTable.create(NAMES, GENERAL_INDEX, CHARACTER_INDEX)
+
+
+@pytest.mark.parametrize("trailing_comma", [False, True])
+@pytest.mark.parametrize("exclude_tags", ["", "tag_10, TAG_27 ,tag_1500,tag_9_(series)"])
+def test_matches_legacy_postprocess(labels, trailing_comma, exclude_tags):
+    """NumPy 实现与原逐标签实现的标签、置信度和文本一致"""
+    tagger = AITagger.__new__(AITagger)
+    rng = np.random.default_rng(0)
+    options = {"threshold": 0.35, "character_threshold": 0.85, "exclude_tags": exclude_tags,
+               "trailing_comma": trailing_comma}
+    for probs in (rng.random((20, len(NAMES))) ** 4).astype(np.float32):
+        expected = legacy_postprocess(NAMES, GENERAL_INDEX, CHARACTER_INDEX, probs, **options)
+        assert tagger.postprocess(probs, labels, replace_underscore=False, **options) == expected
+
+
+def test_top_k_sorts_by_score(labels):
+    """指定 top_k 时按置信度从高到低取前 top_k 个"""
+    tagger = AITagger.__new__(AITagger)
+    probs = np.random.default_rng(1).random(len(NAMES)).astype(np.float32)
+    tags, _ = tagger.postprocess(probs, labels, threshold=0.35, character_threshold=0.85, exclude_tags="",
+                                 replace_underscore=False, trailing_comma=False, top_k=5)
+    everything, _ = tagger.postprocess(probs, labels, threshold=0.35, character_threshold=0.85, exclude_tags="",
+                                       replace_underscore=False, trailing_comma=False)
+
+    assert tags == sorted(everything, key=lambda item: -item[1])[:5]
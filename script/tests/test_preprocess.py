@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from ai_tagger import AITagger
+from bench_fixtures import make_photo
+from legacy import legacy_preprocess
+
+
+def _opaque(entries):
+    return [entry for entry in entries if entry["mode"] not in ("RGBA", "LA")]
+
+
+@pytest.fixture(scope="module")
+def large_jpegs(tmp_path_factory):
+    """draft 解码只作用于大尺寸 JPEG"""
+    tmp = tmp_path_factory.mktemp("large")
+    paths = []
+    for width, height in ((3000, 2000), (1200, 4000)):
+        paths.append(str(tmp / f"{width}x{height}.jpg"))
+        make_photo(width, height, seed=width).save(paths[-1], quality=90)
+    return paths
+
+
+def test_matches_legacy_preprocess(corpus, large_jpegs):
+    """不透明图片与原预处理 (2048 预缩放 + 二次缩放 + paste) 的像素差异很小"""
+    tagger = AITagger.__new__(AITagger)
+    for path in [entry["path"] for entry in _opaque(corpus)] + large_jpegs:
+        expected = legacy_preprocess(path, 448)
+        actual = tagger.preprocess_image(path, 448)
+        assert actual.shape == expected.shape == (448, 448, 3)
+        assert actual.dtype == np.float32
+        assert np.abs(actual - expected).mean() < 1.0, os.path.basename(path)
+
+
+def test_same_tags_as_legacy_preprocess(corpus, large_jpegs, models_dir):
+    """不透明图片用新旧预处理推理得到相同的标签"""
+    tagger = AITagger(models_dir)
+    loaded = tagger._load_model("bench-tagger")
+    options = {"threshold": 0.35, "character_threshold": 0.85, "exclude_tags": "", "replace_underscore": False,
+               "trailing_comma": False}
+    for path in [entry["path"] for entry in _opaque(corpus)] + large_jpegs:
+        probs = tagger._run(loaded.session, [legacy_preprocess(path, 448), tagger.preprocess_image(path, 448)])
+        expected, actual = (tagger.postprocess(p, loaded.labels, **options)[0] for p in probs)
+        assert [tag for tag, _ in actual] == [tag for tag, _ in expected]
+
+
+@pytest.mark.parametrize("mode", ["RGBA", "LA", "P"])
+def test_transparent_pixels_become_white(tmp_path, mode):
+    """透明区域以白色为背景合成, 不显示透明像素下的颜色"""
+    image = Image.new("RGBA", (300, 200), (10, 200, 30, 0))
+    image.paste((10, 200, 30, 255), (0, 0, 150, 200))
+    path = str(tmp_path / "alpha.png")
+    if mode == "P":
+        image = image.quantize(method=Image.Quantize.FASTOCTREE)  # 带透明色的调色板图片
+    elif mode != "RGBA":
+        image = image.convert(mode)
+    image.save(path)
+
+    tensor = AITagger.__new__(AITagger).preprocess_image(path, 64)
+    # 左半边不透明, 右半边透明
+    assert np.all(tensor[:, 56:] == 255)
+    assert tensor[32, 8].tolist() != [255, 255, 255]
@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+import prompt_index
+from prompt_index import PromptIndex, metadata_terms, parse_query
+
+
+def _records(n, word):
+    return [f"{word}{i}" for i in range(n)], [{"positive_prompt": f"{word}, {word}{i}"} for i in range(n)]
+
+
+def test_interrupted_compaction_keeps_old_index(tmp_path, monkeypatch):
+    """压缩在 meta.json 提交前中断时, 重新打开仍使用压缩前的文件"""
+    index = PromptIndex(str(tmp_path))
+    index.add(*_records(20, "cat"))
+    index.remove([f"cat{i}" for i in range(10)])
+
+    def crash(*args, **kwargs):
+        raise OSError("crash")
+
+    monkeypatch.setattr(prompt_index, "write_meta", crash)
+    with pytest.raises(OSError):
+        index.compact()
+    monkeypatch.undo()
+
+    index = PromptIndex(str(tmp_path))
+    assert len(index) == 10
+    assert index.search("cat")[0] == 10
+    assert sorted(index.search("cat")[1]) == sorted(f"cat{i}" for i in range(10, 20))
+
+    index.compact()
+    index.add(*_records(5, "dog"))
+    index = PromptIndex(str(tmp_path))
+    assert index.search("cat")[0] == 10 and index.search("dog")[0] == 5
+
+
+QUERIES = [
+    "1girl",
+    "tag250",
+    "ckpt:anything-v5 solo",
+    "1girl \"long hair\" -negative:lowres",
+    "ckpt:model-1*",
+    "\"sampler:euler a|sampler:ddim\" param:steps=28",
+    "-prompt:1girl",
+    "p:Long_Hair model:animagine-xl-3.1.safetensors",
+]
+
+
+@pytest.fixture(scope="module")
+def indexed(tmp_path_factory):
+    """合成生成参数分多次加入索引 (多个分段), 删除和更新一部分"""
+    from bench_metadata import synthetic_metadata
+
+    records = synthetic_metadata(np.random.default_rng(0), 3000, 500)
+    ids = [f"images/{i:05d}.png" for i in range(len(records))]
+    index = PromptIndex(str(tmp_path_factory.mktemp("prompt-index")))
+    for start in range(0, len(records), 700):
+        index.add(ids[start:start + 700], records[start:start + 700])
+    index.remove(ids[::7])
+    updated = synthetic_metadata(np.random.default_rng(1), 200, 500)
+    index.add(ids[:400:2], updated)
+
+    expected = dict(zip(ids, records))
+    for image_id in ids[::7]:
+        del expected[image_id]
+    expected.update(zip(ids[:400:2], updated))
+    return index, expected
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_search_matches_full_scan(indexed, query):
+    """查询结果与逐条检查词项集合相同"""
+    index, records = indexed
+    clauses = parse_query(query)
+    expected = {image_id for image_id, metadata in records.items()
+                if all(clause.matches(metadata_terms(metadata)) != clause.negated for clause in clauses)}
+
+    count, found = index.search(query)
+    assert count == len(found) == len(expected)
+    assert set(found) == expected
+    reopened = PromptIndex(index.index_dir)
+    assert reopened.search(query) == (count, found)
+
+
+def test_metadata_terms_normalization():
+    """权重语法、下划线、LoRA、模型路径和扩展名的规范化; ComfyUI 与 AUTOMATIC1111 两种结构"""
+    comfyui = {"generator": "ComfyUI", "positive_prompt": ["(Blue_Hair:1.2)", " <lora:Detail-Tweaker:0.5> smile"],
+               "negative_prompt": ["lowres"], "model": {"name": "SDXL\\Anime\\Animagine-XL-3.1.safetensors"},
+               "samplers": [{"name": "KSampler", "parameters": {"steps": 28.0, "cfg": 7.5, "denoise": True}}]}
+    assert metadata_terms(comfyui) == {
+        "generator:comfyui", "prompt:blue hair", "prompt:smile", "lora:detail-tweaker", "negative:lowres",
+        "ckpt:animagine-xl-3.1", "sampler:ksampler", "param:steps=28", "param:cfg=7.5", "param:denoise=true",
+    }
+    a1111 = {"generator": "AUTOMATIC1111", "positive_prompts": "1girl, [solo]\nBREAK outdoors",
+             "model": "Model(name='anything-v5.ckpt', hash=None)", "samplers": {"name": "Euler a", "parameters": {}}}
+    assert metadata_terms(a1111) == {"generator:automatic1111", "prompt:1girl", "prompt:solo", "prompt:outdoors",
+                                     "ckpt:anything-v5", "sampler:euler a"}
+    assert metadata_terms(None) == set()
+
+
+def test_records_without_metadata_are_removed(tmp_path):
+    """没有生成参数的图片不加入索引, 已在索引中时删除; 空查询报错"""
+    index = PromptIndex(str(tmp_path))
+    index.add(*_records(3, "cat"))
+    index.add(["cat0"], [None])
+    assert "cat0" not in index and index.search("cat") == (2, ["cat1", "cat2"])
+    with pytest.raises(ValueError):
+        index.search("")
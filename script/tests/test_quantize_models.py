@@ -0,0 +1,58 @@
+import os
+import shutil
+
+import pytest
+
+from ai_tagger import AITagger
+from quantize_models import agreement_report, build_variant
+
+
+@pytest.fixture(scope="module")
+def models(tmp_path_factory, models_dir):
+    """复制一份替身模型并生成 int8 / fp16 版本"""
+    path = tmp_path_factory.mktemp("quantized")
+    for suffix in (".onnx", ".csv"):
+        shutil.copy(os.path.join(models_dir, "bench-tagger" + suffix), path / ("bench-tagger" + suffix))
+    for precision in ("int8", "fp16"):
+        build_variant("bench-tagger", str(path), precision)
+    return str(path)
+
+
+def test_variants_share_labels_and_are_listed(models, corpus):
+    """量化模型与原模型共用标签表; 按名称后缀或 precision 参数选择的结果相同"""
+    tagger = AITagger(models)
+    assert sorted(tagger.get_available_models()) == ["bench-tagger", "bench-tagger.fp16", "bench-tagger.int8"]
+    path = corpus[0]["path"]
+    for precision in ("int8", "fp16"):
+        assert (tagger.tag_image(path, model_name="bench-tagger", precision=precision)
+                == tagger.tag_image(path, model_name=f"bench-tagger.{precision}"))
+
+
+@pytest.mark.parametrize("precision", ["int8", "fp16"])
+def test_quantized_probabilities_agree_with_fp32(models, corpus, precision):
+    """量化模型的概率与 fp32 接近, 标签集合基本一致"""
+    tagger = AITagger(models)
+    paths = [entry["path"] for entry in corpus]
+    report = agreement_report(tagger, "bench-tagger", [precision], paths, threshold=0.35, character_threshold=0.85)
+
+    fp32, quantized = report["results"]
+    assert report["images"] == len(paths)
+    assert (fp32["precision"], fp32["exact_match"], fp32["max_abs_drift"]) == ("fp32", 1.0, 0.0)
+    assert quantized["precision"] == precision
+    assert quantized["mean_abs_drift"] < 0.01
+    assert quantized["tag_precision"] > 0.99 and quantized["tag_recall"] > 0.99
+
+
+def test_build_variant_skips_up_to_date_models(models):
+    """已生成且比原模型新的版本不重新生成, 原模型更新后重新生成"""
+    output = os.path.join(models, "bench-tagger.int8.onnx")
+    mtime = os.stat(output).st_mtime_ns
+    assert build_variant("bench-tagger", models, "int8") == output
+    assert os.stat(output).st_mtime_ns == mtime
+
+    source = os.path.join(models, "bench-tagger.onnx")
+    os.utime(source, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+    build_variant("bench-tagger", models, "int8")
+    assert os.stat(output).st_mtime_ns != mtime
+    assert not [name for name in os.listdir(models) if name.endswith(".tmp")]
+    assert AITagger(models).get_available_models().count("bench-tagger.int8") == 1
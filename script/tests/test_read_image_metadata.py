@@ -0,0 +1,172 @@
+import io
+import json
+import sys
+
+import pytest
+from PIL import Image
+
+from bench_fixtures import make_metadata_corpus
+from legacy import legacy_extract_attributes
+from read_image_metadata import (Manifest, comfyui_attributes, read_metadata, read_metadata_batch, scan_metadata,
+                                 GENERATOR_KEYS)
+
+
+def make_png(path):
+    Image.new("RGB", (8, 8)).save(path)
+    return str(path)
+
+
+def test_batch_duplicate_paths(tmp_path):
+    """同一路径出现多次时每次都输出一行, 不因按路径记录的 stat 被提前取走而出错"""
+    path = make_png(tmp_path / "1.png")
+    output = io.StringIO()
+    manifest = Manifest(str(tmp_path / "manifest.jsonl"))
+    try:
+        stats = read_metadata_batch([path, path, str(tmp_path / "missing.png"), path], output, manifest)
+    finally:
+        manifest.close()
+
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [record["image"] for record in records if "metadata" in record] == [path] * 3
+    assert [record for record in records if "error" in record][0]["image"].endswith("missing.png")
+    assert stats["processed"] == 4 and stats["errors"] == 1
+
+
+@pytest.fixture(scope="module")
+def metadata_corpus(tmp_path_factory, corpus):
+    """make_corpus 加上 make_metadata_corpus 中生成参数的各种写法"""
+    return corpus + make_metadata_corpus(str(tmp_path_factory.mktemp("metadata")))
+
+
+def _pillow_candidates(path):
+    """原方式 (sd_parsers 通过 Pillow) 读取到的参数字典"""
+    with Image.open(path) as image:
+        if image.format == "PNG":
+            info = {key: value for key, value in image.info.items() if isinstance(value, str)}
+            return [info, dict(image.text)]
+        comment = image.getexif().get_ifd(0x8769).get(0x9286)
+    return [{"parameters": comment[8:].decode("utf_16_be")}] if comment else []
+
+
+def test_scan_matches_pillow(metadata_corpus):
+    """只读文件头部得到的文本块 / EXIF UserComment 与 Pillow 解码整张图片得到的相同"""
+    for entry in metadata_corpus:
+        if entry["format"] not in ("PNG", "JPEG", "WEBP"):
+            continue
+        scan = scan_metadata(entry["path"])
+        expected = _pillow_candidates(entry["path"])
+        assert scan.format == entry["format"]
+        if entry["format"] != "PNG":
+            assert scan.candidates == expected, entry["path"]
+        elif not scan.complete:
+            # 图像数据之前已有生成参数, 不读取文件末尾
+            assert scan.candidates == expected[:1] and GENERATOR_KEYS.intersection(expected[0])
+        else:
+            assert scan.candidates[0] == expected[0] and scan.candidates[-1] == expected[1], entry["path"]
+
+
+def test_images_without_metadata_skip_sd_parsers(metadata_corpus, monkeypatch):
+    """没有生成参数的图片不导入 sd_parsers 直接返回 None"""
+    monkeypatch.setitem(sys.modules, "sd_parsers", None)
+    for entry in metadata_corpus:
+        if entry["metadata"] in (None, "camera-exif") and entry["format"] != "BMP":
+            assert read_metadata(entry["path"]) is None, entry["path"]
+
+
+def test_unrecognised_files_are_not_scanned(tmp_path, metadata_corpus):
+    """不是 PNG / JPEG / WebP 或文件结构异常时交给 sd_parsers (scan_metadata 返回 None)"""
+    garbage = tmp_path / "garbage.png"
+    garbage.write_bytes(b"not an image")
+    assert scan_metadata(str(garbage)) is None
+
+    jpeg = next(entry for entry in metadata_corpus if entry["metadata"] == "exif-usercomment")
+    with open(jpeg["path"], "rb") as f:
+        data = f.read(100)
+    truncated = tmp_path / "truncated.jpg"
+    truncated.write_bytes(data)
+    assert scan_metadata(str(truncated)) is None
+
+
+def test_comfyui_attributes_match_legacy_regex(metadata_corpus):
+    """从节点图中取出的 ckpt_name 与原正则一致; 路径带反斜杠时保留原样 (原正则会多一层转义)"""
+    for entry in metadata_corpus:
+        if entry["format"] != "PNG":
+            continue
+        parameters = scan_metadata(entry["path"]).candidates[0]
+        if "prompt" not in parameters:
+            continue
+        expected = {"ckpt_name": json.loads(parameters["prompt"])["4"]["inputs"]["ckpt_name"]}
+        assert comfyui_attributes(parameters) == expected
+        if "\\" not in expected["ckpt_name"]:
+            assert legacy_extract_attributes(json.dumps(parameters, ensure_ascii=False), ["ckpt_name"]) == expected
+
+
+def test_matches_legacy_read_metadata(metadata_corpus):
+    """预扫描的结果与原实现 (每张图片完整交给 sd_parsers) 相同, ComfyUI 的模型路径不再多一层转义"""
+    pytest.importorskip("sd_parsers")
+    from legacy import legacy_read_metadata
+
+    for entry in metadata_corpus:
+        result, expected = read_metadata(entry["path"]), legacy_read_metadata(entry["path"])
+        if entry["metadata"] == "comfyui-windows-path":
+            assert result.pop("model")["name"] == result.pop("ckpt_name") == "SDXL\\动漫\\animagine-xl-3.1.safetensors"
+            del expected["model"], expected["ckpt_name"]
+        assert json.dumps(result, sort_keys=True, default=str) == json.dumps(expected, sort_keys=True, default=str)
+
+
+def _batch(paths, manifest_path, **options):
+    output = io.StringIO()
+    manifest = Manifest(str(manifest_path))
+    try:
+        stats = read_metadata_batch(paths, output, manifest, **options)
+    finally:
+        manifest.close()
+    return [json.loads(line) for line in output.getvalue().splitlines()], stats
+
+
+def test_manifest_skips_unchanged_images(tmp_path, monkeypatch):
+    """清单中 mtime/size 没有变化的图片跳过; 修改过或上次出错的图片重新处理"""
+    import read_image_metadata
+
+    paths = [make_png(tmp_path / f"{i}.png") for i in range(4)]
+    manifest_path = tmp_path / "manifest.jsonl"
+    read = read_image_metadata.read_metadata
+    monkeypatch.setattr(read_image_metadata, "read_metadata",
+                        lambda path: read(path) if path != paths[3] else 1 / 0)
+    records, stats = _batch(paths, manifest_path)
+    assert (stats["processed"], stats["skipped"], stats["errors"]) == (4, 0, 1)
+    assert records[3]["error"]["type"] == "ZeroDivisionError"
+
+    monkeypatch.setattr(read_image_metadata, "read_metadata", read)
+    Image.new("RGB", (16, 16)).save(paths[0])
+    records, stats = _batch(paths, manifest_path)
+    assert sorted(record["image"] for record in records) == [paths[0], paths[3]]
+    assert (stats["processed"], stats["skipped"], stats["errors"]) == (2, 2, 0)
+
+    records, stats = _batch(paths, manifest_path)
+    assert records == [] and stats["skipped"] == 4
+
+
+def test_manifest_truncates_partial_line(tmp_path):
+    """崩溃时写了一半的最后一行在打开时截掉, 之后追加的记录有效"""
+    paths = [make_png(tmp_path / f"{i}.png") for i in range(2)]
+    manifest_path = tmp_path / "manifest.jsonl"
+    _batch(paths[:1], manifest_path)
+    with open(manifest_path, "a", encoding="utf-8") as f:
+        f.write('["' + paths[1])
+
+    records, _ = _batch(paths, manifest_path)
+    assert [record["image"] for record in records] == [paths[1]]
+    manifest = Manifest(str(manifest_path))
+    assert len(manifest) == 2
+    manifest.close()
+
+
+def test_workers_match_single_process(tmp_path):
+    """多进程批量读取的记录与单进程相同 (按完成顺序输出)"""
+    paths = [make_png(tmp_path / f"{i}.png") for i in range(10)]
+    single, _ = _batch(paths, tmp_path / "single.jsonl")
+    multi, stats = _batch(paths, tmp_path / "multi.jsonl", workers=2, chunk_size=3)
+
+    assert stats["processed"] == 10
+    assert sorted(multi, key=lambda record: record["image"]) == sorted(single, key=lambda record: record["image"])
@@ -0,0 +1,67 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from ai_tagger import AITagger, SessionProfile
+
+
+@pytest.fixture
+def models(tmp_path, models_dir):
+    """复制一份替身模型, 测试中会生成和修改优化图"""
+    for suffix in (".onnx", ".csv"):
+        shutil.copy(os.path.join(models_dir, "bench-tagger" + suffix), tmp_path / ("bench-tagger" + suffix))
+    return str(tmp_path)
+
+
+def _optimized_path(models, profile=SessionProfile()):
+    return profile.optimized_model_path(os.path.join(models, "bench-tagger.onnx"), "CPUExecutionProvider")
+
+
+def test_optimized_graph_is_saved_and_reused(models, corpus):
+    """第一次加载保存优化图, 之后直接加载; 结果与不保存时一致, 优化图不出现在模型列表中"""
+    paths = [entry["path"] for entry in corpus[:4]]
+    expected = AITagger(models, session_profile=SessionProfile(cache_optimized_model=False)).tag_images(
+        paths, model_name="bench-tagger", return_probs=True)
+    assert not os.path.exists(_optimized_path(models))
+
+    AITagger(models).tag_images(paths[:1], model_name="bench-tagger")
+    optimized = _optimized_path(models)
+    mtime = os.stat(optimized).st_mtime_ns
+    results = AITagger(models).tag_images(paths, model_name="bench-tagger", return_probs=True)
+
+    assert os.stat(optimized).st_mtime_ns == mtime
+    assert AITagger(models).get_available_models() == ["bench-tagger"]
+    assert not [name for name in os.listdir(models) if name.endswith(".tmp")]
+    for result, reference in zip(results, expected):
+        np.testing.assert_allclose(result.probs, reference.probs, atol=1e-5)
+
+
+def test_stale_or_corrupt_optimized_graph_is_rebuilt(models):
+    """模型比优化图新, 或优化图损坏时重新生成, 不影响加载"""
+    AITagger(models)._create_session("bench-tagger")
+    optimized = _optimized_path(models)
+
+    with open(optimized, "wb") as f:
+        f.write(b"corrupt")
+    AITagger(models)._create_session("bench-tagger")
+    assert os.path.getsize(optimized) > len(b"corrupt")
+
+    # 优化图早于模型文件
+    stale = os.stat(os.path.join(models, "bench-tagger.onnx")).st_mtime_ns - 10 ** 9
+    os.utime(optimized, ns=(stale, stale))
+    AITagger(models)._create_session("bench-tagger")
+    assert os.stat(optimized).st_mtime_ns > stale
+
+
+def test_profile_options():
+    """线程数和优化级别传给 SessionOptions; "all" 级别只保存到 "extended", 不合法的参数报错"""
+    profile = SessionProfile(intra_op_threads=2, inter_op_threads=1, graph_optimization="all")
+    options = profile.session_options()
+    assert (options.intra_op_num_threads, options.inter_op_num_threads) == (2, 1)
+    assert profile.saved_optimization == "extended"
+    assert profile.optimized_model_path("m.onnx", "CUDAExecutionProvider") == "m.cuda.extended.optimized.onnx"
+    assert SessionProfile(graph_optimization="disable").optimized_model_path("m.onnx", "CPUExecutionProvider") is None
+    with pytest.raises(ValueError):
+        SessionProfile(execution_mode="fast").session_options()
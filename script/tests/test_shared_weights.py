@@ -0,0 +1,74 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import shared_weights
+from ai_tagger import AITagger, SessionProfile
+
+pytest.importorskip("onnx")
+
+
+@pytest.fixture
+def models(tmp_path, models_dir):
+    """复制一份替身模型, 测试中会生成共享权重文件"""
+    for suffix in (".onnx", ".csv"):
+        shutil.copy(os.path.join(models_dir, "bench-tagger" + suffix), tmp_path / ("bench-tagger" + suffix))
+    return str(tmp_path)
+
+
+def _shared_tagger(models):
+    return AITagger(models, session_profile=SessionProfile(shared_weights=True))
+
+
+def test_outputs_match_normal_session(models, corpus):
+    """
+    共享权重模式的结果与普通会话一致, 拆分出的文件不出现在模型列表中
+
+    共享模式不做 "all" 级别的布局优化, 浮点误差略大。
+    """
+    paths = [entry["path"] for entry in corpus]
+    expected = AITagger(models).tag_images(paths, model_name="bench-tagger", return_probs=True)
+    results = _shared_tagger(models).tag_images(paths, model_name="bench-tagger", return_probs=True)
+
+    model_path = os.path.join(models, "bench-tagger.onnx")
+    graph_path, weights_path, index_path = shared_weights.shared_paths(model_path)
+    assert shared_weights.is_prepared(model_path)
+    with open(index_path, encoding="utf-8") as f:
+        assert json.load(f)["tensors"]
+    assert os.path.getsize(weights_path) > os.path.getsize(graph_path)
+    assert AITagger(models).get_available_models() == ["bench-tagger"]
+    assert not [name for name in os.listdir(models) if name.endswith(".tmp")]
+    for result, reference in zip(results, expected):
+        assert result.tags_text == reference.tags_text
+        np.testing.assert_allclose(result.probs, reference.probs, atol=1e-4)
+
+
+def test_sessions_share_one_mapping(models, corpus):
+    """同一进程内多个会话共用同一份映射, 不重新拆分"""
+    first = _shared_tagger(models)
+    first.tag_image(corpus[0]["path"], model_name="bench-tagger")
+    model_path = os.path.join(models, "bench-tagger.onnx")
+    weights_path = shared_weights.shared_paths(model_path)[1]
+    mtime = os.stat(weights_path).st_mtime_ns
+    mapping = shared_weights.mapped_weights(model_path)
+
+    second = _shared_tagger(models)
+    assert second.tag_image(corpus[0]["path"], model_name="bench-tagger") == first.tag_image(
+        corpus[0]["path"], model_name="bench-tagger")
+    assert shared_weights.mapped_weights(model_path) is mapping
+    assert os.stat(weights_path).st_mtime_ns == mtime
+
+
+def test_changed_model_is_split_again(models, corpus):
+    """原模型变化后共享文件过期, 下次加载时重新拆分"""
+    _shared_tagger(models).tag_image(corpus[0]["path"], model_name="bench-tagger")
+    model_path = os.path.join(models, "bench-tagger.onnx")
+    stat = os.stat(model_path)
+    os.utime(model_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert not shared_weights.is_prepared(model_path)
+
+    _shared_tagger(models).tag_image(corpus[0]["path"], model_name="bench-tagger")
+    assert shared_weights.is_prepared(model_path)
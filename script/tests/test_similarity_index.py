@@ -0,0 +1,89 @@
+import os
+import sys
+
+import numpy as np
+
+import similarity_index
+from similarity_index import SimilarityIndex
+
+
+def test_load_truncates_interrupted_ivf_lists(tmp_path):
+    """中断的 add 在 lists.i32 留下的多余行要截掉, 否则之后追加的簇分配与向量错位"""
+    rng = np.random.default_rng(0)
+    index = SimilarityIndex(str(tmp_path), dim=16)
+    index.add([f"a{i}" for i in range(200)], rng.random((200, 16)))
+    index.build_ivf(8)
+    with open(tmp_path / "lists.i32", "ab") as f:
+        f.write(np.full(50, 7, dtype=np.int32).tobytes())
+
+    index = SimilarityIndex(str(tmp_path))
+    assert os.path.getsize(tmp_path / "lists.i32") == 200 * 4
+    vectors = rng.random((10, 16))
+    index.add([f"b{i}" for i in range(10)], vectors)
+
+    index = SimilarityIndex(str(tmp_path))
+    for i, vector in enumerate(vectors):
+        assert index.search(vector, k=1, nprobe=1)[0][0] == f"b{i}"
+
+
+def test_duplicate_ids_in_one_batch_keep_last(tmp_path):
+    """同一批中重复的图片只保留最后一次的向量"""
+    rng = np.random.default_rng(0)
+    index = SimilarityIndex(str(tmp_path), dim=16)
+    vectors = rng.random((3, 16))
+    index.add(["a", "b", "a"], vectors)
+
+    assert len(index) == 2
+    assert index.stats()["deleted"] == 0
+    match, score = index.search(vectors[2], k=1)[0]
+    assert match == "a" and score > 0.999
+
+
+def test_build_ivf_replaces_files(tmp_path):
+    """重新构建 IVF 后不留临时文件, 重新打开的索引使用新的簇"""
+    rng = np.random.default_rng(0)
+    index = SimilarityIndex(str(tmp_path), dim=16)
+    index.add([f"a{i}" for i in range(200)], rng.random((200, 16)))
+    index.build_ivf(8)
+    index.build_ivf(4)
+
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+    assert SimilarityIndex(str(tmp_path)).stats()["nlist"] == 4
+
+
+def test_cli_add_uses_absolute_ids(tmp_path, monkeypatch, corpus, models_dir):
+    """以不同的相对路径添加同一目录时图片 ID 相同, 不会重复加入"""
+    images_dir = os.path.dirname(corpus[0]["path"])
+    index_dir = str(tmp_path / "index")
+    for cwd in (os.path.dirname(images_dir), images_dir):
+        monkeypatch.chdir(cwd)
+        images = os.path.relpath(images_dir)
+        monkeypatch.setattr(sys, "argv", ["similarity_index.py", "add", "--index", index_dir, "--images", images,
+                                          "--model", "bench-tagger", "--models-dir", models_dir])
+        similarity_index.main()
+
+    index = SimilarityIndex(index_dir)
+    assert len(index) == len(corpus)
+    assert index.stats()["deleted"] == len(corpus)
+    assert sorted(index._store.rows) == sorted(os.path.abspath(entry["path"]) for entry in corpus)
+
+
+def test_exact_search_matches_brute_force_after_compaction(tmp_path):
+    """删除并压缩后, 精确搜索结果与直接计算余弦相似度一致, 重新打开后不变"""
+    rng = np.random.default_rng(1)
+    index = SimilarityIndex(str(tmp_path), dim=32)
+    probs = rng.random((3000, 32))
+    ids = [f"a{i}" for i in range(3000)]
+    index.add(ids, probs)
+    removed = ids[::2]
+    assert index.remove(removed) == len(removed)  # 删除超过 1/4, 自动压缩
+    assert index.stats()["deleted"] == 0
+
+    kept = np.arange(1, 3000, 2)
+    vectors = index.projector.project(probs[kept]).astype(np.float16).astype(np.float32)
+    query = rng.random(32)
+    scores = vectors @ index.projector.project(query)
+    expected = [ids[kept[i]] for i in np.argsort(-scores)[:10]]
+    for opened in (index, SimilarityIndex(str(tmp_path))):
+        assert [image_id for image_id, _ in opened.search(query, k=10)] == expected
+        assert len(opened) == len(kept)
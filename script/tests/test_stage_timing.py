@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+import stage_timing
+from ai_tagger import AITagger
+from get_main_color import get_dominant_colors_kmeans
+
+
+@pytest.fixture
+def records():
+    """注册一个收集记录的回调, 测试结束后恢复为关闭状态"""
+    collected = []
+    stage_timing.reset_aggregates()
+    stage_timing.add_sink(collected.append)
+    yield collected
+    stage_timing.remove_sink(collected.append)
+    stage_timing.configure("off")
+    stage_timing.reset_aggregates()
+
+
+def test_disabled_by_default():
+    """未开启时 track / stage 返回空上下文, 不产生记录"""
+    assert not stage_timing.enabled()
+    assert stage_timing.track("noop") is stage_timing.stage("noop")
+    with stage_timing.track("noop"), stage_timing.stage("inner"):
+        stage_timing.annotate(ignored=True)
+    assert stage_timing.aggregates() == {}
+
+
+def test_tag_image_stages(records, models_dir, corpus):
+    """tag_image 记录各阶段耗时和图片尺寸, 顶层阶段耗时之和不超过总耗时 (session / labels 在 model_load 之内)"""
+    entry = corpus[0]
+    AITagger(models_dir).tag_image(entry["path"], model_name="bench-tagger")
+
+    record = records[-1]
+    assert record["operation"] == "tag_image" and record["model"] == "bench-tagger"
+    assert (record["width"], record["height"]) == (entry["width"], entry["height"])
+    top_level = {"model_load", "open", "decode", "resize", "inference", "postprocess"}
+    assert top_level <= set(record["stages"])
+    assert sum(record["stages"][name] for name in top_level) <= record["total_ms"] + 0.01
+    assert stage_timing.last_record() == record
+
+
+@pytest.mark.parametrize("engine", ["histogram", "kmeans"])
+def test_dominant_color_stages(records, corpus, engine):
+    """提取主色记录聚类方式、像素数和各阶段耗时"""
+    get_dominant_colors_kmeans(corpus[0]["path"], engine=engine)
+
+    record = records[-1]
+    assert record["operation"] == "get_dominant_colors_kmeans"
+    assert record["engine"] == engine and record["pixels"] > 0
+    assert ("histogram" in record["stages"]) == (engine == "histogram")
+    assert {"open", "decode", "resize", "kmeans", "postprocess"} <= set(record["stages"])
+
+
+def test_errors_repeated_stages_and_aggregates(records):
+    """同名阶段累加; 出错时也输出记录; aggregates 按操作和阶段汇总"""
+    for _ in range(3):
+        with stage_timing.track("op", item=1):
+            with stage_timing.stage("a"):
+                pass
+            with stage_timing.stage("a"):
+                pass
+    with pytest.raises(KeyError):
+        with stage_timing.track("op"):
+            raise KeyError("x")
+
+    assert [list(record["stages"]) for record in records] == [["a"]] * 3 + [[]]
+    assert records[0]["item"] == 1
+    assert records[-1]["error"].startswith("KeyError")
+    summary = stage_timing.aggregates()["op"]
+    assert (summary["a"]["count"], summary["total"]["count"]) == (3, 4)
+
+
+def test_configure_replaces_previous_output(tmp_path):
+    """configure 替换之前的输出, 写入 JSON Lines 文件; off 关闭"""
+    first, second = tmp_path / "first.jsonl", tmp_path / "second.jsonl"
+    try:
+        stage_timing.configure(f"file:{first}")
+        stage_timing.configure(str(second))
+        with stage_timing.track("op"):
+            pass
+        stage_timing.configure("off")
+        assert not stage_timing.enabled()
+    finally:
+        stage_timing.configure("off")
+        stage_timing.reset_aggregates()
+
+    assert not first.exists()
+    assert [json.loads(line)["operation"] for line in second.read_text(encoding="utf-8").splitlines()] == ["op"]
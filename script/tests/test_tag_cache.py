@@ -0,0 +1,67 @@
+import os
+import shutil
+
+import numpy as np
+
+from ai_tagger import AITagger
+from tag_cache import TagResultCache
+
+
+def test_size_limit_is_shared_between_connections(tmp_path):
+    """多个进程 (连接) 写同一个缓存文件时按数据库的总大小淘汰"""
+    path = str(tmp_path / "cache.db")
+    caches = [TagResultCache(path, max_bytes=1_000_000) for _ in range(2)]
+    probs = np.random.default_rng(0).random(10000)
+    for i in range(120):
+        caches[i % 2].put(f"h{i}", "m", 1, probs)
+
+    assert caches[0]._used_bytes() <= 1_000_000
+    assert caches[0].get("h119", "m", 1) is not None
+    for cache in caches:
+        cache.close()
+
+
+def test_model_change_and_corruption_are_misses(tmp_path):
+    """模型修改时间不同视为未命中; 损坏的记录删除后视为未命中"""
+    cache = TagResultCache(str(tmp_path / "cache.db"))
+    probs = np.linspace(0, 1, 100)
+    stored = cache.put("h", "m", 1, probs)
+    np.testing.assert_allclose(stored, probs, atol=1e-3)
+    np.testing.assert_array_equal(cache.get("h", "m", 1), stored)
+    assert cache.get("h", "m", 2) is None
+
+    cache._conn.execute("UPDATE tag_results SET probs = ?", (b"\0" * 200,))
+    assert cache.get("h", "m", 1) is None
+    assert cache.stats()["corrupted"] == 1
+    assert cache.stats()["entries"] == 0
+    cache.close()
+
+
+def test_tagger_reuses_results_by_content(tmp_path, corpus, models_dir):
+    """相同内容的图片 (包括复制到其他路径的) 不再推理; 换阈值只重新后处理, 结果与不使用缓存时一致"""
+    models = tmp_path / "models"
+    models.mkdir()
+    for suffix in (".onnx", ".csv"):
+        shutil.copy(os.path.join(models_dir, "bench-tagger" + suffix), models / ("bench-tagger" + suffix))
+    paths = [entry["path"] for entry in corpus]
+    copy = str(tmp_path / "copy.png")
+    shutil.copy(paths[2], copy)
+
+    tagger = AITagger(str(models), result_cache_path=str(tmp_path / "cache.db"))
+    tagger.tag_images(paths, model_name="bench-tagger")
+    runs = []
+    run = tagger._run
+    tagger._run = lambda session, images: runs.append(len(images)) or run(session, images)
+
+    results = tagger.tag_images(paths + [copy], model_name="bench-tagger", threshold=0.6)
+    assert runs == []
+    expected = AITagger(str(models)).tag_images(paths + [copy], model_name="bench-tagger", threshold=0.6)
+    for result, reference in zip(results, expected):
+        assert [tag for tag, _ in result.tags] == [tag for tag, _ in reference.tags]
+        np.testing.assert_allclose([s for _, s in result.tags], [s for _, s in reference.tags], atol=1e-3)
+
+    # 模型文件更新后重新推理
+    stat = os.stat(models / "bench-tagger.onnx")
+    os.utime(models / "bench-tagger.onnx", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    tagger.tag_images(paths[:3], model_name="bench-tagger")
+    assert runs == [3]
@@ -0,0 +1,52 @@
+import json
+import os
+
+import pytest
+
+from ai_tagger import parse_args, tag_directory
+
+
+def _run(models_dir, directory, output, *options):
+    args = parse_args(["--dir", directory, "--model", "bench-tagger", "--output", str(output), *options])
+    tag_directory(args, models_dir)
+    with open(output, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.fixture(scope="module")
+def single_process(tmp_path_factory, models_dir, corpus):
+    output = tmp_path_factory.mktemp("single") / "tags.ndjson"
+    return _run(models_dir, os.path.dirname(corpus[0]["path"]), output)
+
+
+def test_processes_match_single_process(models_dir, corpus, single_process, tmp_path):
+    """多进程批量模式与单进程的输出记录相同 (顺序可能不同), 每张图片一条"""
+    records = _run(models_dir, os.path.dirname(corpus[0]["path"]), tmp_path / "tags.ndjson",
+                   "--workers", "2", "--chunk-size", "3")
+
+    assert len(records) == len(single_process) == len(corpus)
+    by_image = {record["image"]: record for record in single_process}
+    for record in records:
+        expected = by_image[record["image"]]
+        assert "error" not in record
+        assert [tag for tag, _ in record["tags"]] == [tag for tag, _ in expected["tags"]]
+        assert record["tags_text"] == expected["tags_text"]
+
+
+@pytest.mark.parametrize("workers", ["1", "2"])
+def test_resume_skips_finished_images(models_dir, corpus, single_process, tmp_path, workers):
+    """输出文件已存在时只处理未完成或出错的图片, 截掉写了一半的最后一行"""
+    output = tmp_path / "tags.ndjson"
+    finished = single_process[:4]
+    failed = {"image": single_process[4]["image"], "error": {"type": "OSError", "message": "broken"}}
+    with open(output, "w", encoding="utf-8") as f:
+        for record in finished + [failed]:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.write('{"image": "')
+
+    records = _run(models_dir, os.path.dirname(corpus[0]["path"]), output, "--workers", workers, "--chunk-size", "3")
+
+    assert records[:5] == finished + [failed]
+    retried = [record["image"] for record in records[5:]]
+    assert sorted(retried) == sorted(record["image"] for record in single_process[4:])
+    assert all("error" not in record for record in records[5:])
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from ai_tagger import AITagger
+
+
+@pytest.fixture(scope="module")
+def tagger(models_dir):
+    return AITagger(models_dir)
+
+
+@pytest.mark.parametrize("batch_size", [1, 4, 32])
+def test_batches_match_single_images(tagger, corpus, batch_size):
+    """批量推理与逐张 tag_image 的标签和置信度一致, 结果顺序与输入一致"""
+    paths = [entry["path"] for entry in corpus]
+    results = tagger.tag_images(paths, batch_size=batch_size, model_name="bench-tagger")
+
+    assert [result.image_path for result in results] == paths
+    for path, result in zip(paths, results):
+        tags, tags_text = tagger.tag_image(path, model_name="bench-tagger")
+        assert result.error is None
+        assert [tag for tag, _ in result.tags] == [tag for tag, _ in tags]
+        np.testing.assert_allclose([score for _, score in result.tags], [score for _, score in tags], atol=1e-5)
+        assert result.tags_text == tags_text
+
+
+def test_unreadable_image_only_fails_itself(tagger, corpus, tmp_path):
+    """读取失败的图片只影响自身的结果"""
+    broken = tmp_path / "broken.png"
+    broken.write_bytes(b"not an image")
+    paths = [corpus[0]["path"], str(broken), corpus[1]["path"]]
+    results = tagger.tag_images(paths, batch_size=4, model_name="bench-tagger", return_probs=True)
+
+    assert results[1].error is not None and results[1].tags == []
+    for result in (results[0], results[2]):
+        assert result.error is None and result.tags
+        assert result.probs.shape == (1000,)
+
+
+def test_pipeline_matches_batches(tagger, corpus, tmp_path):
+    """流水线模式的结果与 tag_images 一致 (顺序可能不同), 读取失败的图片返回 error"""
+    broken = tmp_path / "broken.png"
+    broken.write_bytes(b"not an image")
+    paths = [entry["path"] for entry in corpus] + [str(broken)]
+    expected = {result.image_path: result for result in tagger.tag_images(paths, batch_size=4, model_name="bench-tagger")}
+
+    results = list(tagger.tag_images_pipeline(iter(paths), batch_size=4, decode_workers=3, model_name="bench-tagger"))
+    assert sorted(result.image_path for result in results) == sorted(paths)
+    for result in results:
+        reference = expected[result.image_path]
+        assert (result.error is None) == (reference.error is None)
+        assert [tag for tag, _ in result.tags] == [tag for tag, _ in reference.tags]
+        assert result.tags_text == reference.tags_text
+
+
+def test_pipeline_bounds_images_in_flight(tagger, corpus, monkeypatch):
+    """已读取但未返回的图片数量不超过 prefetch 加上正在推理的一批"""
+    paths = [entry["path"] for entry in corpus] * 3
+    prepared = []
+    prepare = tagger._prepare
+    monkeypatch.setattr(tagger, "_prepare", lambda *args: prepared.append(1) or prepare(*args))
+
+    returned = 0
+    for _ in tagger.tag_images_pipeline(paths, batch_size=2, decode_workers=4, prefetch=5, model_name="bench-tagger"):
+        returned += 1
+        assert len(prepared) - returned <= 5 + 2
+    assert returned == len(paths)
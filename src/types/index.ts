@@ -229,6 +229,14 @@ export interface ImageMetadata {
   samplers: Sampler;
 }
 
+// analyzeImage 的结果, 某一项失败时为 null, 错误信息在 errors 中
+export interface ImageAnalysis {
+  tags: string[] | null;
+  colors: ColorInfo[] | null;
+  metadata: ImageMetadata | null;
+  errors: Record<string, { type: string; message: string }>;
+}
+
 
 export interface ipcCategoryAPI {
   // Category Service Methods
@@ -352,6 +360,7 @@ export interface ElectronAPI {
   downloadUrlImage: (url: string) => Promise<DownloadUrlImageResult>;
   showInFolder: (filePath: string) => Promise<{ success: boolean; error?: string }>;
   getMainColor: (imagePath: string) => Promise<string[]>;
+  analyzeImage: (imagePath: string, modelName: string) => Promise<ImageAnalysis>;
   onRemoteImagesDownloaded: (callback: (result: { success: boolean; error?: string }) => void) => void;
   removeRemoteImagesDownloadedListener: (callback: (result: { success: boolean; error?: string }) => void) => void;
   onQueueUpdate: (callback: (status: { tagQueue: number, colorQueue: number }) => void) => void;